@@ -0,0 +1,354 @@
+# archivo.py
+# Archivo en frío del historial de acciones y de los episodios cerrados.
+#
+# Mueve a un archivo SQLite por año (archivo/<bd>_<año>.sqlite) las filas de HistorialAcciones
+# y las consultas cerradas (con su examen físico, evoluciones, órdenes, complementarios,
+# interconsultas, informes y récipes) más antiguas que la antigüedad configurada. Los datos se
+# copian tal cual (siguen cifrados) y el catálogo ArchivoPeriodos/ArchivoPacientes de la BD
+# principal indica qué año contiene qué.
+#
+# Lectura: adjuntar() hace ATTACH de los archivos necesarios y crea vistas TEMP con el mismo
+# nombre que las tablas (main.T UNION ALL archivo_<año>.T). Las vistas temporales tienen
+# prioridad sobre main, así las consultas existentes leen el archivo sin cambiar su SQL;
+# soltar() las borra y hace DETACH antes de devolver la conexión al pool. Los episodios
+# archivados son de solo lectura. El historial (get_log) no usa las vistas para paginar por
+# fecha: como cada año archivado es más antiguo que la principal, lee tramo a tramo.
+#
+# Cada año se archiva en su propia transacción. Con WAL la transacción no es atómica entre los
+# dos archivos: si se interrumpe justo entre ambos commits, volver a ejecutar el script termina
+# el traslado (las copias usan INSERT OR IGNORE).
+#
+# Uso: python archivo.py [--antiguedad-dias 730] [--simular] [--estado] [--vacuum]
+import argparse
+import os
+import re
+import sqlite3
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import database
+
+ARCHIVO_DIR = 'archivo'             # Relativo a la carpeta de la BD principal
+ARCHIVO_ANTIGUEDAD_DIAS = 730       # Edad mínima (egreso / fecha de la acción) para archivar
+MAX_ADJUNTOS = 8                    # SQLite admite 10 BD adjuntas por conexión
+
+# Tablas clínicas que se archivan junto con su consulta, en orden padre -> hijo.
+# Condición de pertenencia a las consultas del lote (tabla temporal _archivo_consultas).
+_EN_LOTE = "consulta_id IN (SELECT id FROM temp._archivo_consultas)"
+TABLAS_EPISODIO = [
+    ('Consultas', "id IN (SELECT id FROM temp._archivo_consultas)"),
+    ('ExamenesFisicos', _EN_LOTE),
+    ('Evoluciones', _EN_LOTE),
+    ('OrdenesMedicas', _EN_LOTE),
+    ('Complementarios', f"{_EN_LOTE} OR orden_medica_id IN (SELECT id FROM main.OrdenesMedicas WHERE {_EN_LOTE})"),
+    ('Interconsultas', f"{_EN_LOTE} OR orden_medica_id IN (SELECT id FROM main.OrdenesMedicas WHERE {_EN_LOTE})"),
+    ('InformesMedicos', _EN_LOTE),
+    ('Recipes', f"{_EN_LOTE} OR evolucion_id IN (SELECT id FROM main.Evoluciones WHERE {_EN_LOTE})"),
+]
+TABLAS_ARCHIVO = [t for t, _ in TABLAS_EPISODIO] + ['HistorialAcciones']
+
+_RE_COMENTARIO = re.compile(r"--[^\n]*")
+_RE_FOREIGN_KEY = re.compile(
+    r",\s*FOREIGN\s+KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)"
+    r"(\s+ON\s+(DELETE|UPDATE)\s+(SET\s+NULL|SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))*",
+    re.IGNORECASE)
+
+def _ahora():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def esquema(periodo):
+    return f"archivo_{periodo}"
+
+def _directorio():
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), ARCHIVO_DIR)
+
+def ruta_archivo(periodo):
+    base = os.path.splitext(os.path.basename(database.DB_NAME))[0]
+    return os.path.join(_directorio(), f"{base}_{periodo}.sqlite")
+
+def _columnas(conn, esquema_bd, tabla):
+    return [row[1] for row in conn.execute(f"PRAGMA {esquema_bd}.table_info({tabla});")]
+
+def _sql_tabla_archivo(conn, tabla, esquema_bd):
+    """CREATE TABLE de la tabla principal, sin claves foráneas (los padres quedan en otra BD)."""
+    sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()[0]
+    sql = _RE_FOREIGN_KEY.sub("", _RE_COMENTARIO.sub("", sql))
+    return re.sub(r"^CREATE TABLE\s+\w+", f"CREATE TABLE IF NOT EXISTS {esquema_bd}.{tabla}", sql, count=1)
+
+def _preparar_esquema(conn, esquema_bd):
+    """Crea (o completa tras ALTER TABLE en la principal) las tablas, índices y FTS del archivo adjunto."""
+    for tabla in TABLAS_ARCHIVO:
+        conn.execute(_sql_tabla_archivo(conn, tabla, esquema_bd))
+        existentes = set(_columnas(conn, esquema_bd, tabla))
+        for _, columna, tipo, *_ in conn.execute(f"PRAGMA main.table_info({tabla});"):
+            if columna not in existentes:
+                conn.execute(f"ALTER TABLE {esquema_bd}.{tabla} ADD COLUMN {columna} {tipo};")
+        for (sql_indice,) in conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (tabla,)).fetchall():
+            conn.execute(re.sub(r"^CREATE (UNIQUE )?INDEX\s+(\w+)", rf"CREATE \1INDEX IF NOT EXISTS {esquema_bd}.\2", sql_indice, count=1))
+    if database.historial_fts_ready():
+        conn.execute(database.SQL_CREATE_HISTORIAL_FTS.replace(
+            "EXISTS HistorialAccionesFTS", f"EXISTS {esquema_bd}.HistorialAccionesFTS"))
+
+# --- Catálogo ---
+def periodos(conn, con_historial=False, con_consultas=False):
+    """Años archivados según el catálogo ([] si aún no se aplicó la migración del catálogo)."""
+    where = []
+    if con_historial: where.append("filas_historial > 0")
+    if con_consultas: where.append("consultas > 0")
+    sql = "SELECT periodo FROM ArchivoPeriodos" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY periodo DESC"
+    try:
+        return [row[0] for row in conn.execute(sql)]
+    except sqlite3.OperationalError:
+        return []
+
+def periodos_historial(desde=None, hasta=None):
+    """
+    Años con acciones archivadas que se solapan con el rango de fechas ('AAAA-MM-DD', ambos opcionales),
+    como [(periodo, actualizado)]: la fecha de actualización sirve de versión para cachear conteos.
+    """
+    conn = database.connect_db()
+    if not conn: return []
+    try:
+        sql = "SELECT periodo, actualizado FROM ArchivoPeriodos WHERE filas_historial > 0"
+        params = []
+        if desde:
+            sql += " AND historial_hasta >= ?"
+            params.append(desde)
+        if hasta:
+            sql += " AND historial_desde <= ?"
+            params.append(hasta + " 23:59:59")
+        return [tuple(row) for row in conn.execute(sql + " ORDER BY periodo DESC", params)]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+def periodos_paciente(conn, paciente_id):
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT periodo FROM ArchivoPacientes WHERE paciente_id = ? ORDER BY periodo DESC", (paciente_id,))]
+    except sqlite3.OperationalError:
+        return []
+
+def union_fts(periodos_adjuntos, columnas="rowid"):
+    """
+    Subconsulta sobre HistorialAccionesFTS de la principal y de cada archivo adjunto.
+    Retorna (sql, número de parámetros MATCH que espera).
+    """
+    partes = [f"SELECT {columnas} FROM HistorialAccionesFTS WHERE HistorialAccionesFTS MATCH ?"]
+    partes += [f"SELECT {columnas} FROM {esquema(p)}.HistorialAccionesFTS WHERE HistorialAccionesFTS MATCH ?"
+               for p in periodos_adjuntos]
+    return " UNION ALL ".join(partes), len(partes)
+
+# --- Lectura transparente ---
+def adjuntar(conn, periodos_pedidos, tablas=None):
+    """
+    Adjunta los archivos de los años indicados y crea las vistas TEMP de 'tablas' (todas por defecto)
+    que los unen a la principal. Retorna la lista de años realmente adjuntados, para pasarla a soltar().
+    """
+    adjuntos = []
+    if not periodos_pedidos: return adjuntos
+    tablas = TABLAS_ARCHIVO if tablas is None else tablas
+    if len(periodos_pedidos) > MAX_ADJUNTOS:
+        print(f"Archivo: se piden {len(periodos_pedidos)} años, solo se adjuntan los {MAX_ADJUNTOS} más recientes.")
+    try:
+        for periodo in sorted(periodos_pedidos, reverse=True)[:MAX_ADJUNTOS]:
+            ruta = ruta_archivo(periodo)
+            if not os.path.exists(ruta):
+                print(f"Archivo: falta {ruta} (año {periodo}); se omite.")
+                continue
+            conn.execute("ATTACH DATABASE ? AS " + esquema(periodo), (ruta,))
+            adjuntos.append(periodo)
+        for tabla in tablas if adjuntos else []:
+            columnas = _columnas(conn, 'main', tabla)
+            partes = [f"SELECT {', '.join(columnas)} FROM main.{tabla}"]
+            for periodo in adjuntos:
+                en_archivo = set(_columnas(conn, esquema(periodo), tabla))
+                cols = ", ".join(c if c in en_archivo else f"NULL AS {c}" for c in columnas)
+                partes.append(f"SELECT {cols} FROM {esquema(periodo)}.{tabla}")
+            conn.execute(f"CREATE TEMP VIEW {tabla} AS " + " UNION ALL ".join(partes))
+        return adjuntos
+    except sqlite3.Error as e:
+        print(f"Error adjuntando archivo: {e}")
+        traceback.print_exc()
+        soltar(conn, adjuntos)
+        return []
+
+def adjuntar_paciente(conn, paciente_id):
+    """Adjunta los años en los que el paciente tiene episodios archivados (ninguno en el caso habitual)."""
+    return adjuntar(conn, periodos_paciente(conn, paciente_id), [t for t, _ in TABLAS_EPISODIO])
+
+def adjuntar_si_falta(conn, tabla, registro_id):
+    """Si el registro no está en la principal, adjunta los años con episodios archivados."""
+    if conn.execute(f"SELECT 1 FROM main.{tabla} WHERE id = ?", (registro_id,)).fetchone():
+        return []
+    return adjuntar(conn, periodos(conn, con_consultas=True), [t for t, _ in TABLAS_EPISODIO])
+
+def soltar(conn, adjuntos):
+    """Borra las vistas TEMP y hace DETACH de los archivos adjuntados por adjuntar()."""
+    if not adjuntos or not conn: return
+    try:
+        if conn.in_transaction:
+            conn.rollback() # DETACH no se permite dentro de una transacción (las lecturas no dejan cambios)
+        for tabla in TABLAS_ARCHIVO:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{tabla}")
+        for periodo in adjuntos:
+            conn.execute(f"DETACH DATABASE {esquema(periodo)}")
+    except sqlite3.Error as e:
+        print(f"Error soltando archivo: {e}")
+        traceback.print_exc()
+
+# --- Traslado ---
+def _consultas_a_archivar(conn, corte):
+    """{año de egreso: [(consulta_id, paciente_id)]} de las consultas cerradas antes del corte."""
+    por_periodo = {}
+    for consulta_id, paciente_id, periodo in conn.execute("""
+            SELECT id, paciente_id, substr(fecha_hora_egreso, 1, 4) FROM Consultas
+            WHERE fecha_hora_egreso IS NOT NULL AND fecha_hora_egreso < ?""", (corte,)):
+        por_periodo.setdefault(periodo, []).append((consulta_id, paciente_id))
+    return por_periodo
+
+def _historial_a_archivar(conn, corte):
+    """{año: número de acciones} anteriores al corte."""
+    return dict(conn.execute("""
+        SELECT substr(fecha_hora, 1, 4), COUNT(*) FROM HistorialAcciones
+        WHERE fecha_hora < ? GROUP BY 1""", (corte,)).fetchall())
+
+def _mover(conn, esquema_bd, tabla, condicion, params=()):
+    columnas = ", ".join(_columnas(conn, 'main', tabla))
+    conn.execute(f"INSERT OR IGNORE INTO {esquema_bd}.{tabla} ({columnas}) SELECT {columnas} FROM main.{tabla} WHERE {condicion}", params)
+
+def _archivar_periodo(conn, periodo, consultas, corte):
+    """Traslada un año completo en una transacción. Retorna (consultas, acciones) trasladadas."""
+    esquema_bd = esquema(periodo)
+    ruta = ruta_archivo(periodo)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS " + esquema_bd, (ruta,))
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            _preparar_esquema(conn, esquema_bd)
+            # Episodios: primero copiar de padres a hijos, luego borrar de hijos a padres
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS _archivo_consultas (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM temp._archivo_consultas")
+            conn.executemany("INSERT INTO temp._archivo_consultas (id) VALUES (?)", [(c,) for c, _ in consultas])
+            for tabla, condicion in TABLAS_EPISODIO:
+                _mover(conn, esquema_bd, tabla, condicion)
+            for tabla, condicion in reversed(TABLAS_EPISODIO):
+                conn.execute(f"DELETE FROM main.{tabla} WHERE {condicion}")
+            conn.executemany("INSERT OR IGNORE INTO ArchivoPacientes (paciente_id, periodo) VALUES (?, ?)",
+                             {(p, periodo) for _, p in consultas})
+
+            # Historial del año anterior al corte (rango sobre idx_historial_fecha)
+            rango = "fecha_hora >= ? AND fecha_hora < ?"
+            params = (f"{periodo}-01-01", min(corte, f"{int(periodo) + 1}-01-01"))
+            _mover(conn, esquema_bd, 'HistorialAcciones', rango, params)
+            if database.historial_fts_ready():
+                conn.execute(f"""INSERT OR IGNORE INTO {esquema_bd}.HistorialAccionesFTS (rowid, descripcion, tipo_accion)
+                                 SELECT id, descripcion, tipo_accion FROM main.HistorialAcciones WHERE {rango}""", params)
+            acciones = conn.execute(f"DELETE FROM main.HistorialAcciones WHERE {rango}", params).rowcount
+
+            desde, hasta, filas = conn.execute(
+                f"SELECT MIN(fecha_hora), MAX(fecha_hora), COUNT(*) FROM {esquema_bd}.HistorialAcciones").fetchone()
+            total_consultas = conn.execute(f"SELECT COUNT(*) FROM {esquema_bd}.Consultas").fetchone()[0]
+            conn.execute("""
+                INSERT OR REPLACE INTO ArchivoPeriodos (periodo, archivo, historial_desde, historial_hasta, filas_historial, consultas, actualizado)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (periodo, os.path.basename(ruta), desde, hasta, filas, total_consultas, _ahora()))
+            conn.commit()
+            return len(consultas), acciones
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp._archivo_consultas")
+        conn.execute(f"DETACH DATABASE {esquema_bd}")
+
+def archivar(antiguedad_dias=ARCHIVO_ANTIGUEDAD_DIAS, simular=False):
+    """Archiva todo lo anterior a hoy - antiguedad_dias. Retorna {año: (consultas, acciones)}."""
+    import historial_acciones # Importación diferida: historial_acciones importa este módulo
+    corte = (datetime.now() - timedelta(days=antiguedad_dias)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = database.connect_db()
+    resultado = {}
+    try:
+        consultas = _consultas_a_archivar(conn, corte)
+        historial = _historial_a_archivar(conn, corte)
+        anios = sorted(set(consultas) | set(historial))
+        print(f"Archivando lo anterior a {corte} en {_directorio()}:")
+        if not anios:
+            print("  Nada que archivar.")
+            return resultado
+        for periodo in anios:
+            n_consultas, n_acciones = len(consultas.get(periodo, [])), historial.get(periodo, 0)
+            if simular:
+                print(f"  {periodo}: {n_consultas} consultas cerradas, {n_acciones} acciones (simulación, sin cambios)")
+                resultado[periodo] = (n_consultas, n_acciones)
+                continue
+            inicio = time.perf_counter()
+            resultado[periodo] = _archivar_periodo(conn, periodo, consultas.get(periodo, []), corte)
+            print(f"  {periodo}: {resultado[periodo][0]} consultas, {resultado[periodo][1]} acciones "
+                  f"-> {os.path.basename(ruta_archivo(periodo))} ({time.perf_counter() - inicio:.1f}s)")
+        if not simular:
+            historial_acciones.invalidar_conteos()
+            conn.execute("PRAGMA optimize;")
+        return resultado
+    finally:
+        conn.close()
+
+def mostrar_estado():
+    conn = database.connect_db()
+    try:
+        try:
+            filas = conn.execute("""SELECT periodo, archivo, filas_historial, consultas, historial_desde, historial_hasta, actualizado
+                                    FROM ArchivoPeriodos ORDER BY periodo""").fetchall()
+        except sqlite3.OperationalError:
+            print("El catálogo de archivo no existe; inicie la aplicación para aplicar las migraciones.")
+            return
+        if not filas:
+            print("No hay nada archivado.")
+            return
+        for periodo, nombre, acciones, consultas, desde, hasta, actualizado in filas:
+            ruta = os.path.join(_directorio(), nombre)
+            tamano = f"{os.path.getsize(ruta) / 1048576:.1f} MB" if os.path.exists(ruta) else "FALTA EL ARCHIVO"
+            print(f"  {periodo}  {nombre:40} acciones {acciones:>8}  consultas {consultas:>6}  "
+                  f"[{desde or '-'} .. {hasta or '-'}]  {tamano}  ({actualizado})")
+    finally:
+        conn.close()
+
+def rutas_archivo(conn):
+    """Rutas de todos los archivos del catálogo que existen en disco (p. ej. para re-cifrarlos)."""
+    return [ruta for ruta in (ruta_archivo(p) for p in periodos(conn)) if os.path.exists(ruta)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo en frío del historial de acciones y de los episodios cerrados")
+    parser.add_argument("--antiguedad-dias", type=int, default=ARCHIVO_ANTIGUEDAD_DIAS,
+                        help=f"Archivar lo anterior a hoy menos N días (por defecto {ARCHIVO_ANTIGUEDAD_DIAS})")
+    parser.add_argument("--simular", action="store_true", help="Solo mostrar qué se archivaría")
+    parser.add_argument("--estado", action="store_true", help="Mostrar el catálogo de archivos y salir")
+    parser.add_argument("--vacuum", action="store_true", help="Compactar la BD principal después de archivar")
+    args = parser.parse_args()
+
+    try:
+        if args.estado:
+            mostrar_estado()
+            return
+        archivar(args.antiguedad_dias, args.simular)
+        if args.vacuum and not args.simular:
+            print("Compactando la BD principal (VACUUM)...")
+            conn = database.connect_db()
+            try:
+                conn.execute("VACUUM;")
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        print("\nArchivo interrumpido. El año en curso se revirtió; vuelva a ejecutar el script para continuar.")
+    except Exception as e:
+        print(f"Error durante el archivo: {e}")
+        traceback.print_exc()
+    finally:
+        database.close_all_connections()
+
+if __name__ == "__main__":
+    main()
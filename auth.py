@@ -2,7 +2,7 @@
 import bcrypt
 import sqlite3
 import traceback # Para errores de log
-from database import connect_db, decrypt_data, encrypt_data, log_action # Importar log_action
+from database import connect_db, get_connection, decrypt_data, encrypt_data, log_action # Importar log_action
 
 SALT_ROUNDS = 12
 
@@ -32,22 +32,22 @@ def verify_password(stored_hash, provided_password):
 
 def verify_user_login(username, password):
     # ... (sin cambios en la lógica de verificación) ...
-    conn = connect_db()
-    if not conn: return None
     user_data = None
-    cursor = None
     try:
-        cursor = conn.cursor()
-        # Usar nombre_usuario (TEXT) para buscar
-        cursor.execute("""
-            SELECT id, nombre_usuario, hash_contrasena, nombre_completo, rol, activo 
-            FROM Usuarios 
-            WHERE nombre_usuario = ? AND activo = 1
-            """, (username,))
-        user_record = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Usar nombre_usuario (TEXT) para buscar
+            cursor.execute("""
+                SELECT id, nombre_usuario, hash_contrasena, nombre_completo, rol, activo 
+                FROM Usuarios 
+                WHERE nombre_usuario = ? AND activo = 1
+                """, (username,))
+            user_record = cursor.fetchone()
+            cursor.close()
 
         if user_record:
             user_id, db_username, stored_hash, nombre_completo_enc, rol, activo = user_record
+            # bcrypt es lento: se verifica después de devolver la conexión al pool
             if verify_password(stored_hash, password):
                 nombre_completo = decrypt_data(nombre_completo_enc) if nombre_completo_enc else None
                 user_data = {
@@ -62,11 +62,18 @@ def verify_user_login(username, password):
         print(f"Error de base de datos al verificar usuario: {e}")
     except Exception as e:
         print(f"Error inesperado al verificar usuario: {e}")
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
     return user_data
 
+def get_user_id(username):
+    """Id del usuario con ese nombre_usuario (activo o no), o None si no existe."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute("SELECT id FROM Usuarios WHERE nombre_usuario = ?", (username,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"Error de base de datos al buscar usuario: {e}")
+        return None
+
 
 # --- MODIFICACIÓN EN create_test_user ---
 def create_test_user():
@@ -118,7 +125,8 @@ def create_test_user():
                     usuario_id=admin_user_id,
                     tipo_accion="SISTEMA_INIT",
                     descripcion=f"Sistema inicializado. Usuario admin '{test_username}' asegurado.",
-                    detalles={'evento': 'inicializacion_post_creacion_admin'}
+                    detalles={'evento': 'inicializacion_post_creacion_admin'},
+                    sincrono=True
                 )
                 print("Evento SISTEMA_INIT registrado.")
             elif init_log_exists:
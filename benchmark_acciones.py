@@ -0,0 +1,227 @@
+# benchmark_acciones.py
+# Benchmark sin Qt de la capa de acciones (PatientActions, HistorialActions, MedicoActions
+# y auth) sobre BD sintéticas de tamaño hospitalario. Mide lo mismo que dispara la interfaz
+# a través de los slots de BackendBridge: listado, ficha completa (estancias cortas y muy
+# largas, secuencial, con secciones en paralelo y reabierta desde la caché), páginas del
+# historial con y sin filtros, y las escrituras más habituales.
+# Las BD se generan con carga_datos.carga_masiva (ver _crear_bd). Los resultados se guardan en
+# JSON para comparar ejecuciones (--comparar).
+# Uso: python benchmark_acciones.py [--tamanos 1000 10000 100000 1000000] [--dir bench_dbs]
+#                                   [--reusar] [--json salida.json] [--comparar anterior.json]
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import database
+import auth
+import benchmark_comun
+from paciente_acciones import PatientActions
+from historial_acciones import HistorialActions
+from medico_acciones import MedicoActions
+from cache_historias import CACHE_HISTORIAS
+
+ESTANCIAS_LARGAS = 5          # Los primeros pacientes: ingreso abierto de un año
+EVOLUCIONES_ESTANCIA_LARGA = 365
+USUARIO_BENCH = "bench_medico" # Usuario del login medido (bcrypt con las rondas de producción)
+CLAVE_BENCH = "benchpass"
+MEDICO_BENCH = "medico_sint_001" # Médico sintético de carga_masiva que firma las escrituras medidas
+
+def _crear_bd(db_path, n_pacientes):
+    """
+    BD de carga_datos.carga_masiva con una consulta por paciente (examen físico, 2-3 evoluciones,
+    órdenes e historial); los ESTANCIAS_LARGAS primeros tienen un ingreso abierto con una
+    evolución y una orden por día. Añade USUARIO_BENCH con el hash de auth.hash_password.
+    """
+    benchmark_comun.crear_bd_sintetica(db_path, n_pacientes, consultas_max=1, evoluciones_max=3,
+                                       estancias_largas=ESTANCIAS_LARGAS, dias_estancia_larga=EVOLUCIONES_ESTANCIA_LARGA)
+    with database.get_connection(db_path) as conn:
+        with conn:
+            conn.execute("INSERT INTO Usuarios (nombre_usuario, hash_contrasena, nombre_completo, rol) VALUES (?, ?, ?, 'medico')",
+                         (USUARIO_BENCH, auth.hash_password(CLAVE_BENCH), database.encrypt_data("Dr. Benchmark")))
+
+def _contexto(db_path):
+    """IDs que usan las operaciones medidas (sirve también para una BD reutilizada)."""
+    with database.get_connection(db_path) as conn:
+        n_pacientes = conn.execute("SELECT MAX(id) FROM Pacientes").fetchone()[0] or 0
+        medico_id = conn.execute("SELECT id FROM Usuarios WHERE nombre_usuario = ?", (MEDICO_BENCH,)).fetchone()[0]
+        total_log = conn.execute("SELECT COUNT(*) FROM HistorialAcciones").fetchone()[0]
+        abiertas = conn.execute(
+            "SELECT paciente_id, id FROM Consultas WHERE fecha_hora_egreso IS NULL AND paciente_id > ? LIMIT 200",
+            (ESTANCIAS_LARGAS,)).fetchall()
+        ingresos = conn.execute(
+            "SELECT c.paciente_id, c.id, ef.id FROM Consultas c JOIN ExamenesFisicos ef ON ef.consulta_id = c.id "
+            "WHERE c.paciente_id > ? ORDER BY c.id LIMIT 200", (ESTANCIAS_LARGAS,)).fetchall()
+        apellidos_muestra = conn.execute("SELECT apellidos FROM Pacientes WHERE id > ? LIMIT 20", (ESTANCIAS_LARGAS,)).fetchall()
+    return {
+        'n_pacientes': n_pacientes,
+        'medico_id': medico_id,
+        'paginas_log': max(1, total_log // 50),
+        'consultas_abiertas': abiertas, # (paciente_id, consulta_id)
+        'ingresos': ingresos, # (paciente_id, consulta_id, examen_fisico_id)
+        'apellidos': [database.decrypt_data(fila[0]).split()[0] for fila in apellidos_muestra],
+    }
+
+def _es_error(resultado):
+    return resultado is None or (isinstance(resultado, tuple) and resultado and resultado[0] is False)
+
+def _medir(funcion, repeticiones, rnd):
+    """
+    Ejecuta funcion(rnd) 'repeticiones' veces con la caché de descifrado y la de historias frías.
+    Si la función tiene el atributo 'preparar', se llama antes de cada medición (fuera del tiempo).
+    """
+    tiempos, errores = [], 0
+    preparar = getattr(funcion, 'preparar', None)
+    for _ in range(repeticiones):
+        database.DECRYPT_CACHE.clear()
+        with redirect_stdout(io.StringIO()):
+            CACHE_HISTORIAS.vaciar()
+            if preparar: preparar(rnd)
+            t0 = time.perf_counter()
+            resultado = funcion(rnd)
+            ms = (time.perf_counter() - t0) * 1000
+        tiempos.append(ms)
+        if _es_error(resultado): errores += 1
+    return {**benchmark_comun.resumen_ms(tiempos), 'repeticiones': repeticiones, 'errores': errores}
+
+def _operaciones(ctx):
+    """{nombre: funcion(rnd)} en el orden del informe."""
+    pacientes, historial, medicos = PatientActions(), HistorialActions(), MedicoActions()
+    n, medico_id = ctx['n_pacientes'], ctx['medico_id']
+    paciente_corto = lambda rnd: rnd.randint(ESTANCIAS_LARGAS + 1, n)
+    contador = iter(range(1, 10 ** 9))
+
+    def nuevo_paciente(rnd):
+        i = next(contador)
+        return pacientes.save_new({
+            'nombres': "Bench", 'apellidos': f"Paciente {i}", 'sexo': 'Femenino', 'fecha_nacimiento': '1985-05-05',
+            'cedula': f"E-{90000000 + rnd.randint(0, 9999999)}", 'telefono_movil': '0414-5550000',
+            'motivo_consulta': 'Dolor abdominal', 'historia_enfermedad_actual': 'Cuadro de 3 días de evolución.',
+            'ef_ta': '120/80', 'ef_fc': 80, 'ef_abdomen': 'Blando, depresible, doloroso en epigastrio.',
+        }, medico_id)
+
+    def actualizar_ingreso(rnd):
+        pid, consulta_id, examen_id = rnd.choice(ctx['ingresos'])
+        return pacientes.update_ingreso_data({
+            'patient_id': str(pid), 'consulta_id': str(consulta_id), 'examen_fisico_id': str(examen_id),
+            'motivo_consulta': 'Dolor abdominal (actualizado)', 'historia_enfermedad_actual': 'Evolución tórpida.',
+            'diagnostico_ingreso': 'Gastritis aguda', 'ap_hta': True, 'ap_hta_detalle': 'Losartán 50 mg',
+            'ef_ta': '130/85', 'ef_abdomen': 'Blando, doloroso en epigastrio.',
+        }, medico_id)
+
+    def nueva_evolucion(rnd):
+        pid, consulta_id = rnd.choice(ctx['consultas_abiertas'] or [(1, 1)])
+        return pacientes.add_new_evolucion({
+            'ev_subjetivo': 'Refiere mejoría del dolor.', 'ev_objetivo': 'Estable, afebril.', 'ev_ta': '120/80',
+            'ev_fc': 78, 'ev_diagnosticos': 'Gastritis aguda', 'ev_tratamiento_plan': 'Omeprazol 40 mg VEV OD.',
+        }, pid, consulta_id, medico_id)
+
+    def reabrir_historia(rnd):
+        return pacientes.get_details(1)
+    reabrir_historia.preparar = reabrir_historia # La primera apertura (sin medir) llena la caché de historias
+
+    return {
+        'login': lambda rnd: auth.verify_user_login(USUARIO_BENCH, CLAVE_BENCH),
+        'get_list': lambda rnd: pacientes.get_list(),
+        'get_list_busqueda': lambda rnd: pacientes.get_list(rnd.choice(ctx['apellidos'] or ["gar"])[:4]),
+        'get_list_ventana': lambda rnd: pacientes.get_list(offset=rnd.randint(0, max(0, n - 50)), limit=50, with_total=False),
+        'get_list_ventana_orden_edad': lambda rnd: pacientes.get_list(offset=0, limit=50, sort_by='edad', sort_dir='asc'),
+        'get_details_estancia_corta': lambda rnd: pacientes.get_details(paciente_corto(rnd)),
+        'get_details_estancia_larga': lambda rnd: pacientes.get_details(rnd.randint(1, min(ESTANCIAS_LARGAS, n))),
+        # Antes/después de repartir las secciones entre hilos de lectura (get_details(parallel=...))
+        'get_details_estancia_larga_secuencial': lambda rnd: pacientes.get_details(rnd.randint(1, min(ESTANCIAS_LARGAS, n)), parallel=False),
+        'get_details_estancia_larga_reapertura': reabrir_historia,
+        'get_header_estancia_larga': lambda rnd: pacientes.get_header(rnd.randint(1, min(ESTANCIAS_LARGAS, n))),
+        'get_section_evoluciones': lambda rnd: pacientes.get_section(rnd.randint(1, min(ESTANCIAS_LARGAS, n)), 'evoluciones'),
+        'get_log_pagina_1': lambda rnd: historial.get_log(1, 50),
+        'get_log_pagina_profunda': lambda rnd: historial.get_log(rnd.randint(ctx['paginas_log'] // 2, ctx['paginas_log']), 50),
+        'get_log_filtro_tipo': lambda rnd: historial.get_log(1, 50, {'tipo_accion': 'CREAR_PACIENTE'}),
+        'get_log_filtro_usuario': lambda rnd: historial.get_log(1, 50, {'usuario_id': medico_id}),
+        'get_log_filtro_texto': lambda rnd: historial.get_log(1, 50, {'search_term': 'H-0001'}),
+        'medicos_get_list': lambda rnd: medicos.get_list(),
+        'save_new': nuevo_paciente,
+        'update_ingreso_data': actualizar_ingreso,
+        'add_new_evolucion': nueva_evolucion,
+    }
+
+def ejecutar(tamanos, directorio, repeticiones=10, reusar=False):
+    os.makedirs(directorio, exist_ok=True)
+    resultados = {}
+    for n in tamanos:
+        db_path = os.path.join(directorio, f"bench_acciones_{n}.sqlite")
+        if not (reusar and os.path.exists(db_path)):
+            print(f"Generando {n} pacientes en {db_path}...")
+            inicio = time.perf_counter()
+            _crear_bd(db_path, n)
+            print(f"  listo en {time.perf_counter() - inicio:.1f}s")
+        database.DB_NAME = db_path
+        database.close_all_connections()
+
+        ctx = _contexto(db_path)
+        rnd = random.Random(n)
+        resultados[str(n)] = {}
+        for nombre, funcion in _operaciones(ctx).items():
+            resultados[str(n)][nombre] = _medir(funcion, repeticiones, rnd)
+            print(f"  {nombre:28} p50 {resultados[str(n)][nombre]['p50_ms']:>9} ms")
+        database.flush_audit_log()
+        database.close_all_connections()
+    return resultados
+
+def _metadatos(repeticiones):
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'formato_cifrado': database.ENCRYPTION_FORMAT,
+        'repeticiones': repeticiones,
+    }
+
+def _comparar(resultados, ruta_anterior):
+    """Imprime el p50 actual frente al de una ejecución anterior guardada con --json."""
+    with open(ruta_anterior, encoding="utf-8") as f:
+        anterior = json.load(f).get('resultados', {})
+    print(f"\nComparación con {ruta_anterior} (p50 ms; <1.00 = más rápido ahora)")
+    for n, por_operacion in resultados.items():
+        if n not in anterior: continue
+        print(f"\n{n} pacientes")
+        print(f"  {'operación':28} {'antes':>10} {'ahora':>10} {'ratio':>7}")
+        for nombre, r in por_operacion.items():
+            previo = anterior[n].get(nombre)
+            if not previo: continue
+            ratio = r['p50_ms'] / previo['p50_ms'] if previo['p50_ms'] else float('inf')
+            print(f"  {nombre:28} {previo['p50_ms']:>10} {r['p50_ms']:>10} {ratio:>7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la capa de acciones sin interfaz")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--dir", default="bench_dbs", help="Directorio para las BD sintéticas")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--reusar", action="store_true", help="Reutilizar las BD ya generadas en --dir")
+    parser.add_argument("--json", help="Guardar resultados en este archivo JSON")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.tamanos, args.dir, args.repeticiones, args.reusar)
+    for n, por_operacion in resultados.items():
+        print(f"\n{n} pacientes (caché de descifrado fría)")
+        print(f"  {'operación':28} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'errores':>8}")
+        for nombre, r in por_operacion.items():
+            print(f"  {nombre:28} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['max_ms']:>9} {r['errores']:>8}")
+    if args.comparar:
+        _comparar(resultados, args.comparar)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'meta': _metadatos(args.repeticiones), 'resultados': resultados}, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+    database.shutdown_audit_writer()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmark_busqueda.py
+# Latencia de la búsqueda de pacientes por nombre (índice de trigramas cifrados)
+# sobre BD sintéticas de distintos tamaños (solo pacientes, generados con carga_datos.carga_masiva).
+# Uso: python benchmark_busqueda.py [--tamanos 10000 100000 1000000] [--dir bench_dbs] [--json salida.json]
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import time
+from contextlib import redirect_stdout
+
+import database
+import benchmark_comun
+from paciente_acciones import PatientActions
+
+def _muestra_nombres(cantidad=200, semilla=1234):
+    """(nombre, apellidos) descifrados de pacientes al azar de la BD activa, para armar las consultas."""
+    with database.get_connection() as conn:
+        max_id = conn.execute("SELECT MAX(id) FROM Pacientes").fetchone()[0] or 0
+        ids = random.Random(semilla).sample(range(1, max_id + 1), min(cantidad, max_id))
+        filas = conn.execute(f"SELECT nombres, apellidos FROM Pacientes WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+    descifrados = database.decrypt_many([valor for fila in filas for valor in fila])
+    return list(zip(descifrados[0::2], descifrados[1::2]))
+
+def _consultas(muestra, rnd):
+    nombre, apellidos = rnd.choice(muestra)
+    apellido = apellidos.split()[0]
+    return {
+        'subcadena_apellido': apellido[1:5],
+        'nombre_y_apellido': f"{nombre} {apellido}",
+        'prefijo_2_letras': apellido[:2],
+        'iniciales': f"{nombre[:1]} {apellido[:1]}",
+        'sin_resultados': "xqzw",
+    }
+
+def ejecutar(tamanos, directorio, repeticiones=20):
+    os.makedirs(directorio, exist_ok=True)
+    acciones = PatientActions()
+    resultados = {}
+    for n in tamanos:
+        db_path = os.path.join(directorio, f"bench_busqueda_{n}.sqlite")
+        print(f"Generando {n} pacientes en {db_path}...")
+        inicio = time.perf_counter()
+        benchmark_comun.crear_bd_sintetica(db_path, n, con_episodios=False)
+        muestra = _muestra_nombres()
+        print(f"  listo en {time.perf_counter() - inicio:.1f}s")
+
+        rnd = random.Random(n)
+        por_tipo = {}
+        for _ in range(repeticiones):
+            for tipo, termino in _consultas(muestra, rnd).items():
+                database.DECRYPT_CACHE.clear()
+                t0 = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    pacientes, total = acciones.search_by_name(termino, limit=50)
+                ms = (time.perf_counter() - t0) * 1000
+                datos = por_tipo.setdefault(tipo, {'ms': [], 'resultados': []})
+                datos['ms'].append(ms)
+                datos['resultados'].append(total)
+        resultados[n] = {
+            tipo: {**benchmark_comun.resumen_ms(d['ms']), 'resultados_medios': round(statistics.mean(d['resultados']), 1)}
+            for tipo, d in por_tipo.items()
+        }
+        database.close_all_connections()
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de búsqueda de pacientes por nombre")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dir", default="bench_dbs", help="Directorio para las BD sintéticas")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--json", help="Guardar resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.tamanos, args.dir, args.repeticiones)
+    for n, por_tipo in resultados.items():
+        print(f"\n{n} pacientes (límite 50 resultados, caché de descifrado fría)")
+        print(f"  {'consulta':22} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'resultados':>11}")
+        for tipo, r in por_tipo.items():
+            print(f"  {tipo:22} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['max_ms']:>8} {r['resultados_medios']:>11}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# benchmark_cifrado.py
+# Compara decrypt_data()/encrypt_data() campo a campo contra decrypt_many()/encrypt_many(),
+# en los dos formatos de almacenamiento (token Fernet y sobre AES-GCM).
+# Con --bd además mide tamaño y tiempo de migración de formato sobre una copia de esa BD.
+# Uso: python benchmark_cifrado.py [--campos 20000] [--repeticiones 3] [--bd gastro_db_encrypted.sqlite] [--json salida.json]
+import argparse
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import database
+import rotacion_claves
+
+# Campos cifrados de una historia típica: datos del paciente + una evolución diaria
+CAMPOS_POR_PACIENTE = 40
+CAMPOS_POR_EVOLUCION = 14
+
+def _valores_de_prueba(n):
+    base = ["Pérez", "Gastritis crónica con reflujo", "120/80", "V-12345678",
+            "Paciente refiere dolor epigástrico de 3 días de evolución, tipo urente, " * 3]
+    return [f"{base[i % len(base)]} {i}" for i in range(n)]
+
+def _medir(func, repeticiones, preparar=None):
+    mejor = None
+    for _ in range(repeticiones):
+        if preparar: preparar()
+        inicio = time.perf_counter()
+        func()
+        transcurrido = time.perf_counter() - inicio
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return mejor
+
+def _ejecutar_formato(planos, repeticiones):
+    n_campos = len(planos)
+    cifrados = [database.encrypt_data(v) for v in planos]
+    assert database.decrypt_many(cifrados) == planos, "decrypt_many no coincide con el texto original"
+    assert [database.decrypt_data(v) for v in cifrados] == planos, "decrypt_data no coincide con el texto original"
+
+    umbral_original = database.CRYPTO_PARALLEL_THRESHOLD
+    cache_fria = database.DECRYPT_CACHE.clear # Cada repetición descifra de verdad
+    resultados = {}
+    try:
+        casos = [
+            ("decrypt_data (uno a uno)", lambda: [database.decrypt_data(v) for v in cifrados], None, cache_fria),
+            ("decrypt_many (serie)", lambda: database.decrypt_many(cifrados), float('inf'), cache_fria),
+            ("decrypt_many (hilos)", lambda: database.decrypt_many(cifrados), 0, cache_fria),
+            ("decrypt_many (caché)", lambda: database.decrypt_many(cifrados), float('inf'), None),
+            ("encrypt_data (uno a uno)", lambda: [database.encrypt_data(v) for v in planos], None, None),
+            ("encrypt_many (serie)", lambda: database.encrypt_many(planos), float('inf'), None),
+            ("encrypt_many (hilos)", lambda: database.encrypt_many(planos), 0, None),
+        ]
+        for nombre, func, umbral, preparar in casos:
+            database.CRYPTO_PARALLEL_THRESHOLD = umbral_original if umbral is None else umbral
+            segundos = _medir(func, repeticiones, preparar)
+            resultados[nombre] = {
+                'segundos': round(segundos, 4),
+                'campos_por_segundo': round(n_campos / segundos),
+                'pacientes_por_segundo': round(n_campos / CAMPOS_POR_PACIENTE / segundos, 1),
+                'evoluciones_por_segundo': round(n_campos / CAMPOS_POR_EVOLUCION / segundos, 1),
+            }
+    finally:
+        database.CRYPTO_PARALLEL_THRESHOLD = umbral_original
+    tamano = {
+        'bytes_por_campo': round(sum(len(c) for c in cifrados) / n_campos, 1),
+        'bytes_texto_plano_por_campo': round(sum(len(v.encode('utf-8')) for v in planos) / n_campos, 1),
+        'bytes_campo_corto': len(database.encrypt_data("Casado(a)")),
+    }
+    return resultados, tamano
+
+def ejecutar(n_campos, repeticiones):
+    planos = _valores_de_prueba(n_campos)
+    formato_original = database.ENCRYPTION_FORMAT
+    por_formato = {}
+    try:
+        for formato in ('fernet', 'aead'):
+            database.set_encryption_format(formato)
+            resultados, tamano = _ejecutar_formato(planos, repeticiones)
+            por_formato[formato] = {'tamano': tamano, 'resultados': resultados}
+    finally:
+        database.set_encryption_format(formato_original)
+    return por_formato
+
+def _bytes_cifrados(db_path):
+    """Bytes ocupados por los valores cifrados de cada formato y tamaño del archivo tras VACUUM."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("VACUUM;")
+        totales = {'fernet': 0, 'aead': 0, 'valores': 0}
+        for tabla, columnas in database.encrypted_columns(conn).items():
+            for col in columnas:
+                for valor, in conn.execute(f"SELECT {col} FROM {tabla} WHERE {col} IS NOT NULL"):
+                    if not isinstance(valor, bytes): continue
+                    totales['aead' if database.is_aead_envelope(valor) else 'fernet'] += len(valor)
+                    totales['valores'] += 1
+    finally:
+        conn.close()
+    totales['archivo'] = os.path.getsize(db_path)
+    return totales
+
+def informe_bd(db_path, formato='aead'):
+    """Migra una copia de la BD al formato indicado y compara tamaños antes y después."""
+    directorio = tempfile.mkdtemp(prefix="bench_formato_")
+    copia = os.path.join(directorio, os.path.basename(db_path))
+    origen = sqlite3.connect(db_path)
+    destino = sqlite3.connect(copia)
+    try:
+        origen.backup(destino) # Copia consistente aunque la aplicación esté abierta (WAL)
+    finally:
+        destino.close(); origen.close()
+
+    db_original, formato_original = database.DB_NAME, database.ENCRYPTION_FORMAT
+    try:
+        antes = _bytes_cifrados(copia)
+        database.DB_NAME = copia
+        database.set_encryption_format(formato)
+        inicio = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            completada = rotacion_claves.migrar_formato()
+        segundos = time.perf_counter() - inicio
+        database.close_all_connections()
+        despues = _bytes_cifrados(copia)
+    finally:
+        database.DB_NAME = db_original
+        database.set_encryption_format(formato_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+    return {
+        'formato_destino': formato, 'migracion_completada': completada,
+        'segundos_migracion': round(segundos, 2),
+        'valores_por_segundo': round(antes['valores'] / segundos) if segundos else None,
+        'antes': antes, 'despues': despues,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de cifrado por lotes")
+    parser.add_argument("--campos", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--bd", help="BD sembrada (p. ej. de carga_datos.py) para el informe de tamaño/migración")
+    parser.add_argument("--json", help="Guardar resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    por_formato = ejecutar(args.campos, args.repeticiones)
+    print(f"{args.campos} campos, mejor de {args.repeticiones} repeticiones, {database.CRYPTO_WORKERS} hilos")
+    for formato, datos in por_formato.items():
+        t = datos['tamano']
+        print(f"\nFormato '{formato}': {t['bytes_por_campo']} bytes/campo de media "
+              f"({t['bytes_texto_plano_por_campo']} en claro), \"Casado(a)\" = {t['bytes_campo_corto']} bytes")
+        print(f"{'caso':28} {'seg':>8} {'campos/s':>10} {'pacientes/s':>12} {'evol/s':>10}")
+        for nombre, r in datos['resultados'].items():
+            print(f"{nombre:28} {r['segundos']:>8} {r['campos_por_segundo']:>10} "
+                  f"{r['pacientes_por_segundo']:>12} {r['evoluciones_por_segundo']:>10}")
+
+    informe = None
+    if args.bd:
+        informe = informe_bd(args.bd)
+        antes, despues = informe['antes'], informe['despues']
+        print(f"\nMigración de {args.bd} (copia) a '{informe['formato_destino']}': "
+              f"{antes['valores']} valores en {informe['segundos_migracion']}s ({informe['valores_por_segundo']} valores/s)")
+        print(f"  {'':10} {'fernet':>12} {'aead':>12} {'archivo':>12}")
+        for etiqueta, d in (("antes", antes), ("después", despues)):
+            print(f"  {etiqueta:10} {d['fernet']:>12} {d['aead']:>12} {d['archivo']:>12}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'campos': args.campos, 'hilos': database.CRYPTO_WORKERS,
+                       'formatos': por_formato, 'migracion_bd': informe}, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
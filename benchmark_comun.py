@@ -0,0 +1,38 @@
+# benchmark_comun.py
+# Utilidades compartidas por los benchmark_*.py: BD sintéticas generadas con el modo masivo de
+# carga_datos (un solo generador de datos para todos) y el resumen de los tiempos medidos.
+import io
+import os
+import statistics
+from contextlib import redirect_stdout
+
+import database
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100.0 * (len(valores) - 1))))]
+
+def resumen_ms(tiempos, decimales=2):
+    """p50, p95, máximo y media de una lista de tiempos en ms."""
+    return {
+        'p50_ms': round(statistics.median(tiempos), decimales),
+        'p95_ms': round(percentil(tiempos, 95), decimales),
+        'max_ms': round(max(tiempos), decimales),
+        'media_ms': round(statistics.mean(tiempos), decimales),
+    }
+
+def crear_bd_sintetica(db_path, n_pacientes, semilla=1234, **opciones):
+    """
+    Borra db_path (y sus -wal/-shm), la deja como BD activa y la llena con
+    carga_datos.carga_masiva(n_pacientes, semilla, **opciones). Retorna las filas por tabla.
+    """
+    import carga_datos # Faker solo hace falta para generar BD (no en benchmark_vistas)
+    database.close_all_connections()
+    for ruta in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    database.DB_NAME = db_path
+    with redirect_stdout(io.StringIO()):
+        totales = carga_datos.carga_masiva(n_pacientes, semilla=semilla, **opciones)
+    database.flush_audit_log() # Entradas de crear_usuarios escritas por el hilo de auditoría
+    return totales
@@ -0,0 +1,54 @@
+# benchmark_vistas.py
+# Navegación en frío (fragmento leído del disco) frente a en caliente (desde CacheVistas)
+# para las vistas que request_view_content sirve desde html_files.
+# Uso: python benchmark_vistas.py [--vistas dashboard pacientes__paciente_detalle] [--repeticiones 200] [--json salida.json]
+import argparse
+import json
+import os
+import time
+
+import benchmark_comun
+import vistas_cache
+
+DIR_HTML = os.path.join(os.path.abspath(os.path.dirname(__file__)), "html_files")
+
+def ejecutar(vistas, repeticiones=200):
+    resultados = {}
+    for vista in vistas:
+        ruta = vistas_cache.ruta_fragmento(DIR_HTML, vista)
+        frio, caliente = [], []
+        for _ in range(repeticiones):
+            cache = vistas_cache.CacheVistas() # Vacía: cada lectura va al disco
+            t0 = time.perf_counter()
+            html = cache.obtener(vista, ruta)
+            frio.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            cache.obtener(vista, ruta)
+            caliente.append((time.perf_counter() - t0) * 1000)
+        if html is None:
+            print(f"Vista '{vista}' no encontrada en {ruta}, se omite.")
+            continue
+        resultados[vista] = {'bytes': len(html.encode('utf-8')),
+                             'frio': benchmark_comun.resumen_ms(frio, 4),
+                             'caliente': benchmark_comun.resumen_ms(caliente, 4)}
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la caché de fragmentos HTML de las vistas")
+    parser.add_argument("--vistas", nargs="+", default=list(vistas_cache.VISTAS_PRECARGA))
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--json", help="Guardar resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.vistas, args.repeticiones)
+    print(f"\n{'vista':34} {'bytes':>8} {'frío p50':>9} {'frío p95':>9} {'cal. p50':>9} {'cal. p95':>9}  (ms)")
+    for vista, r in resultados.items():
+        print(f"{vista:34} {r['bytes']:>8} {r['frio']['p50_ms']:>9} {r['frio']['p95_ms']:>9} "
+              f"{r['caliente']['p50_ms']:>9} {r['caliente']['p95_ms']:>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f"Resultados guardados en {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# cache_historias.py
+# Caché en memoria de las historias ya armadas y descifradas de los pacientes abiertos hace poco.
+#
+# El personal alterna todo el turno entre el listado y las mismas pocas historias; sin caché cada
+# reapertura repite lecturas y descifrado. Cada entrada guarda, para un paciente, las partes que
+# se han pedido (cabecera, secciones completas y páginas de sección) junto con la versión de la
+# historia con la que se leyeron (database.historia_version). Esa versión la suben triggers en
+# cada escritura sobre las tablas de la historia, así que una entrada con otra versión se descarta
+# sin que las rutas de escritura tengan que avisar.
+#
+# Se limita a MAX_HISTORIAS pacientes (se desaloja el usado hace más tiempo) y perform_logout la
+# vacía: la caché deja de referenciar las historias descifradas. No se modifican los objetos, que
+# pueden seguir en uso por quien los recibió (p. ej. un hilo del bridge serializándolos).
+import threading
+from collections import OrderedDict
+
+import database
+
+MAX_HISTORIAS = 32            # Pacientes con historia en caché como máximo
+MAX_PAGINAS_POR_HISTORIA = 64 # Páginas de sección guardadas por paciente (cada cursor es una página)
+
+
+class CacheHistorias:
+    """
+    LRU de historias por (archivo de BD, paciente). Las partes se guardan tal como las retorna
+    PatientActions; quien las recibe obtiene copias del dict/lista exterior y no debe modificar
+    los elementos.
+    """
+    def __init__(self, max_historias=MAX_HISTORIAS):
+        self.max_historias = max_historias
+        self._entradas = OrderedDict() # (db, paciente_id) -> {'version': ..., 'partes': {parte: valor}}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidaciones = 0   # Entradas descartadas porque la historia cambió
+        self.desalojos = 0        # Entradas descartadas por el límite de tamaño
+
+    def _entrada(self, paciente_id, version):
+        """Entrada vigente del paciente (la mueve al final del LRU) o None. Llamar con el lock tomado."""
+        clave = (database.DB_NAME, paciente_id)
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada['version'] != version:
+            del self._entradas[clave]
+            self.invalidaciones += 1
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def obtener(self, paciente_id, version, partes):
+        """{parte: valor} si todas las partes pedidas están en caché con esta versión; si no, None."""
+        if version is None:
+            return None
+        with self._lock:
+            entrada = self._entrada(paciente_id, version)
+            if entrada and all(p in entrada['partes'] for p in partes):
+                self.hits += 1
+                return {p: entrada['partes'][p] for p in partes}
+            self.misses += 1
+            return None
+
+    def obtener_alguna(self, paciente_id, version, partes):
+        """(parte, valor) de la primera de las partes que esté en caché con esta versión, o None."""
+        if version is None:
+            return None
+        with self._lock:
+            entrada = self._entrada(paciente_id, version)
+            for parte in partes if entrada else ():
+                if parte in entrada['partes']:
+                    self.hits += 1
+                    return parte, entrada['partes'][parte]
+            self.misses += 1
+            return None
+
+    def guardar(self, paciente_id, version, partes):
+        """Añade partes a la entrada del paciente (o la crea) para la versión con la que se leyeron."""
+        if version is None or self.max_historias <= 0:
+            return
+        with self._lock:
+            entrada = self._entrada(paciente_id, version)
+            if entrada is None:
+                entrada = {'version': version, 'partes': {}, 'paginas': 0}
+                self._entradas[(database.DB_NAME, paciente_id)] = entrada
+            for parte, valor in partes.items():
+                if isinstance(parte, tuple): # Página de sección: se acota cuántas se guardan
+                    if entrada['paginas'] >= MAX_PAGINAS_POR_HISTORIA: continue
+                    if parte not in entrada['partes']: entrada['paginas'] += 1
+                entrada['partes'][parte] = valor
+            while len(self._entradas) > self.max_historias:
+                self._entradas.popitem(last=False)
+                self.desalojos += 1
+
+    def vaciar(self):
+        """Descarta todas las historias (logout). Solo suelta las referencias de la caché."""
+        with self._lock:
+            descartadas = len(self._entradas)
+            self._entradas.clear()
+        print(f"CacheHistorias: {descartadas} historias descartadas.")
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'historias': len(self._entradas),
+                'max_historias': self.max_historias,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'invalidaciones': self.invalidaciones,
+                'desalojos': self.desalojos,
+            }
+
+
+CACHE_HISTORIAS = CacheHistorias()
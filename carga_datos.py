@@ -91,9 +91,9 @@ def crear_usuarios(conn, cursor):
             cedula_enc = database.encrypt_data(cedula) # Encriptar cédula
 
             cursor.execute("""
-                INSERT INTO Usuarios (nombre_usuario, hash_contrasena, nombre_completo, rol, cedula, mpps, especialidad)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (user, hashed_pwd, nombre_enc, rol, cedula_enc, mpps, especialidad))
+                INSERT INTO Usuarios (nombre_usuario, hash_contrasena, nombre_completo, rol, cedula, cedula_bidx, mpps, especialidad)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user, hashed_pwd, nombre_enc, rol, cedula_enc, database.blind_index('cedula', cedula), mpps, especialidad))
             
             user_id = cursor.lastrowid
             usuarios_creados.append({'id': user_id, 'rol': rol})
@@ -104,9 +104,9 @@ def crear_usuarios(conn, cursor):
 
             # Log de creación (solo para los nuevos)
             if admin_user_id: # Loguear como admin si es posible
-                database.log_action(conn, admin_user_id, 'CREAR_USUARIO', f"Usuario '{user}' creado.", 'Usuarios', user_id)
+                database.log_action(conn, admin_user_id, 'CREAR_USUARIO', f"Usuario '{user}' creado.", 'Usuarios', user_id, sincrono=True)
             else: # Si el admin aún no se ha creado, loguear como el propio usuario (menos ideal)
-                 database.log_action(conn, user_id, 'CREAR_USUARIO', f"Usuario '{user}' creado por sí mismo (carga inicial).", 'Usuarios', user_id)
+                 database.log_action(conn, user_id, 'CREAR_USUARIO', f"Usuario '{user}' creado por sí mismo (carga inicial).", 'Usuarios', user_id, sincrono=True)
 
         except sqlite3.IntegrityError as e:
             print(f"WARN: Error de integridad no esperado al procesar usuario '{user}': {e}")
@@ -149,8 +149,7 @@ def crear_pacientes(conn, cursor, num_pacientes, usuarios, admin_user_id):
                  cedula_num = fake.unique.random_number(digits=random.randint(7, 8), fix_len=False)
                  cedula_str = f"{random.choice(['V', 'E'])}-{cedula_num}"
                  # Verificar si ya existe (aunque unique debería prevenirlo, por si acaso)
-                 cursor.execute("SELECT 1 FROM Pacientes WHERE cedula = ?", (database.encrypt_data(cedula_str),))
-                 if cursor.fetchone() is None:
+                 if not database.find_ids_by_cedula(cursor, 'Pacientes', cedula_str):
                      break # Cédula válida y no existe
             except OverflowError: # Faker a veces puede agotar las combinaciones únicas
                  print("WARN: Faker agotó cédulas únicas, generando aleatoria simple.")
@@ -175,8 +174,10 @@ def crear_pacientes(conn, cursor, num_pacientes, usuarios, admin_user_id):
         lugar_nac_enc = database.encrypt_data(fake.city())
         estado_civil_enc = database.encrypt_data(random.choice(['Soltero/a', 'Casado/a', 'Divorciado/a', 'Viudo/a', 'Concubino/a']))
         tel_hab_enc = database.encrypt_data(fake.phone_number())
-        tel_mov_enc = database.encrypt_data(fake.phone_number())
-        email_enc = database.encrypt_data(fake.email())
+        tel_mov = fake.phone_number()
+        email = fake.email()
+        tel_mov_enc = database.encrypt_data(tel_mov)
+        email_enc = database.encrypt_data(email)
         direccion_enc = database.encrypt_data(fake.address().replace('\n', ', '))
         profesion_enc = database.encrypt_data(fake.job())
         emerg_nombre_enc = database.encrypt_data(fake.name()) # Añadir nombre contacto emergencia
@@ -212,8 +213,9 @@ def crear_pacientes(conn, cursor, num_pacientes, usuarios, admin_user_id):
                     ap_asma, ap_hta, ap_dm, ap_cardiopatia, ap_otros, -- Booleanos añadidos
                     ap_alergias, ap_quirurgicos,
                     af_madre, af_padre, af_hermanos, af_hijos, -- Antecedentes familiares
-                    hab_tabaco, hab_alcohol, hab_drogas, hab_cafe, hab_perdida_peso -- Hábitos añadidos
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    hab_tabaco, hab_alcohol, hab_drogas, hab_cafe, hab_perdida_peso, -- Hábitos añadidos
+                    cedula_bidx, telefono_movil_bidx, email_bidx -- Índices ciegos para búsqueda exacta
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 numero_historia, cedula_enc, nombres_enc, apellidos_enc, sexo, fecha_nac,
                 lugar_nac_enc, estado_civil_enc, tel_hab_enc, tel_mov_enc, email_enc,
@@ -223,14 +225,17 @@ def crear_pacientes(conn, cursor, num_pacientes, usuarios, admin_user_id):
                 ap_asma, ap_hta, ap_dm, ap_cardiopatia, ap_otros, # Booleanos añadidos
                 ap_alergias_enc, ap_quirurgicos_enc,
                 af_madre_enc, af_padre_enc, af_hermanos_enc, af_hijos_enc,
-                hab_tabaco_enc, hab_alcohol_enc, hab_drogas_enc, hab_cafe_enc, hab_perdida_peso_enc # Hábitos añadidos
+                hab_tabaco_enc, hab_alcohol_enc, hab_drogas_enc, hab_cafe_enc, hab_perdida_peso_enc, # Hábitos añadidos
+                database.blind_index('cedula', cedula_str), database.blind_index('telefono_movil', tel_mov),
+                database.blind_index('email', email)
             ))
             paciente_id = cursor.lastrowid
+            database.index_patient_name(cursor, paciente_id, nombres, apellidos)
             pacientes_creados.append({'id': paciente_id, 'numero_historia': numero_historia})
             print(f"  Paciente creado: {nombres} {apellidos} (ID: {paciente_id}, HC: {numero_historia})")
 
             # Log de creación de paciente
-            database.log_action(conn, registrador_log_id, 'CREAR_PACIENTE', f"Paciente '{nombres} {apellidos}' (HC: {numero_historia}) creado.", 'Pacientes', paciente_id, detalles={'registrado_por': usuario_registro['id']})
+            database.log_action(conn, registrador_log_id, 'CREAR_PACIENTE', f"Paciente '{nombres} {apellidos}' (HC: {numero_historia}) creado.", 'Pacientes', paciente_id, detalles={'registrado_por': usuario_registro['id']}, sincrono=True)
 
         except sqlite3.IntegrityError as e:
              print(f"WARN: Error de integridad al crear paciente {nombres} {apellidos} (HC: {numero_historia}, Cedula: {cedula_str}) - {e}. Saltando...")
@@ -307,7 +312,7 @@ def crear_consultas_y_detalles(conn, cursor, pacientes, usuarios, admin_user_id)
                 print(f"    Consulta creada ID: {consulta_id} ({status}) - Ingreso: {fecha_ingreso.strftime('%Y-%m-%d %H:%M')}")
 
                 # Log de creación de consulta (usando database.log_action)
-                database.log_action(conn, registrador_log_id, 'CREAR_CONSULTA', f"Consulta para paciente ID {paciente_id} creada (Status: {status}).", 'Consultas', consulta_id, detalles={'paciente_id': paciente_id, 'usuario_ingreso_id': usuario_ingreso['id'], 'fecha_ingreso': fecha_ingreso.isoformat()})
+                database.log_action(conn, registrador_log_id, 'CREAR_CONSULTA', f"Consulta para paciente ID {paciente_id} creada (Status: {status}).", 'Consultas', consulta_id, detalles={'paciente_id': paciente_id, 'usuario_ingreso_id': usuario_ingreso['id'], 'fecha_ingreso': fecha_ingreso.isoformat()}, sincrono=True)
 
                 poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingreso, fecha_egreso, usuarios, medicos, enfermeria, registrador_log_id, hea_enc, diag_ingreso_enc) # Pasar HEA y Dx
 
@@ -346,7 +351,7 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (consulta_id, ef_fecha, ta_enc, random.randint(12, 28), random.randint(50, 120), random.randint(88, 100), temp_enc, piel_enc, resp_enc, cv_enc, abd_enc, neuro_enc, extrem_enc, otros_hallazgos_ef_enc))
         ef_id = cursor.lastrowid
-        database.log_action(conn, admin_user_id, 'CREAR_EXAMEN_FISICO', f"Examen físico para consulta {consulta_id}", 'ExamenesFisicos', ef_id)
+        database.log_action(conn, admin_user_id, 'CREAR_EXAMEN_FISICO', f"Examen físico para consulta {consulta_id}", 'ExamenesFisicos', ef_id, sincrono=True)
     except sqlite3.IntegrityError: print(f"WARN: EF para consulta {consulta_id} ya existe.")
     except Exception as e: print(f"ERROR creando EF para consulta {consulta_id}: {e}"); traceback.print_exc()
 
@@ -376,7 +381,7 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
             """, (consulta_id, usuario_ev['id'], ev_fecha, dias_hosp, subj_enc, obj_enc, ta_ev_enc, random.randint(55,110), random.randint(14,26), random.randint(90,100), temp_ev_enc, diag_ev_enc, plan_ev_enc, com_ev_enc, ev_fecha, usuario_ev['id']))
             ev_id = cursor.lastrowid
             evoluciones_creadas_ids.append(ev_id)
-            database.log_action(conn, admin_user_id, 'CREAR_EVOLUCION', f"Evolución para consulta {consulta_id}", 'Evoluciones', ev_id)
+            database.log_action(conn, admin_user_id, 'CREAR_EVOLUCION', f"Evolución para consulta {consulta_id}", 'Evoluciones', ev_id, sincrono=True)
         except Exception as e: print(f"ERROR creando Evolución para consulta {consulta_id}: {e}"); traceback.print_exc()
 
 
@@ -399,7 +404,7 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
             cursor.execute("""INSERT INTO OrdenesMedicas (consulta_id, evolucion_id, usuario_id, fecha_hora, orden_json_blob, estado) VALUES (?, ?, ?, ?, ?, ?)""",
                            (consulta_id, evolucion_id_orden, usuario_orden['id'], orden_fecha, orden_json_blob_enc, estado_om))
             orden_id = cursor.lastrowid; ordenes_creadas_ids.append(orden_id)
-            database.log_action(conn, admin_user_id, 'CREAR_ORDEN_MEDICA', f"Orden JSON para consulta {consulta_id}", 'OrdenesMedicas', orden_id)
+            database.log_action(conn, admin_user_id, 'CREAR_ORDEN_MEDICA', f"Orden JSON para consulta {consulta_id}", 'OrdenesMedicas', orden_id, sincrono=True)
         except Exception as e: print(f"ERROR creando Orden Médica JSON para consulta {consulta_id}: {e}"); traceback.print_exc()
 
 
@@ -481,7 +486,7 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
                 ))
                 comp_id = cursor.lastrowid
                 print(f"        OK: Complementario ID {comp_id} ({tipo_comp} - {estado_comp}) creado.")
-                database.log_action(conn, admin_user_id, 'CREAR_COMPLEMENTARIO', f"Complementario ID {comp_id} ({tipo_comp}) para consulta {consulta_id}", 'Complementarios', comp_id)
+                database.log_action(conn, admin_user_id, 'CREAR_COMPLEMENTARIO', f"Complementario ID {comp_id} ({tipo_comp}) para consulta {consulta_id}", 'Complementarios', comp_id, sincrono=True)
             except Exception as e:
                 print(f"ERROR creando Complementario ({tipo_comp}) para consulta {consulta_id}: {e}")
                 traceback.print_exc()
@@ -502,7 +507,7 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
                 cursor.execute("""INSERT INTO Recipes (paciente_id, consulta_id, evolucion_id, usuario_id, fecha_emision, tipo, recipe_texto) VALUES (?, ?, ?, ?, ?, ?, ?)""",
                                (paciente_id, consulta_id, evolucion_id_recipe, usuario_recipe['id'], fecha_emision_recipe, tipo_recipe, recipe_texto_enc))
                 recipe_id = cursor.lastrowid
-                database.log_action(conn, admin_user_id, 'CREAR_RECIPE', f"Recipe ({tipo_recipe}) para consulta {consulta_id}", 'Recipes', recipe_id)
+                database.log_action(conn, admin_user_id, 'CREAR_RECIPE', f"Recipe ({tipo_recipe}) para consulta {consulta_id}", 'Recipes', recipe_id, sincrono=True)
             except Exception as e: print(f"ERROR creando Recipe para consulta {consulta_id}: {e}"); traceback.print_exc()
 
     # --- Informe Médico ---
@@ -533,10 +538,290 @@ def poblar_detalles_consulta(conn, cursor, consulta_id, paciente_id, fecha_ingre
             cursor.execute("""INSERT INTO InformesMedicos (paciente_id, consulta_id, usuario_id, fecha_creacion, tipo_informe, contenido_texto) VALUES (?, ?, ?, ?, ?, ?)""",
                            (paciente_id, consulta_id, usuario_inf['id'], fecha_inf, tipo_inf, contenido_enc))
             informe_id = cursor.lastrowid
-            database.log_action(conn, admin_user_id, 'CREAR_INFORME', f"Informe ({tipo_inf}) para consulta {consulta_id}", 'InformesMedicos', informe_id)
+            database.log_action(conn, admin_user_id, 'CREAR_INFORME', f"Informe ({tipo_inf}) para consulta {consulta_id}", 'InformesMedicos', informe_id, sincrono=True)
         except Exception as e: print(f"ERROR creando Informe Médico para consulta {consulta_id}: {e}"); traceback.print_exc()          
+# --- Modo masivo (generación de datos para pruebas de capacidad) ---
+# Genera pacientes con sus episodios (consulta, examen físico, evoluciones, órdenes) y las
+# entradas de historial que produciría la aplicación. Cada lote de pacientes se genera y
+# cifra en un proceso del pool; el proceso principal solo inserta con executemany, un lote
+# por transacción. Los lotes se consumen como un flujo con pocos lotes en vuelo, así la
+# memoria no crece con el tamaño total. Con la misma semilla y fecha final el resultado es idéntico.
+# Los benchmarks generan sus BD con este modo (benchmark_comun.crear_bd_sintetica).
+LOTE_MASIVO = 2000
+RONDAS_HASH_SINTETICAS = 4      # bcrypt barato para usuarios sintéticos (nunca en producción)
+USUARIOS_SINTETICOS = 20
+PROPORCION_ABIERTAS_MASIVO = 0.05
+AÑOS_HISTORIA_MASIVO = 5
+DIAS_ESTANCIA_LARGA = 365       # Ingreso abierto de los primeros pacientes con estancias_largas
+
+SQL_MASIVO = {
+    'Pacientes': """INSERT INTO Pacientes (id, numero_historia, cedula, cedula_bidx, nombres, apellidos, sexo, fecha_nacimiento,
+        lugar_nacimiento, estado_civil, telefono_movil, telefono_movil_bidx, email, email_bidx, direccion, profesion_oficio,
+        emerg_nombre, emerg_telefono, ap_hta, ap_dm, ap_alergias, hab_tabaco, fecha_registro, usuario_registro_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'PacientesNombreTokens': "INSERT OR IGNORE INTO PacientesNombreTokens (token, paciente_id) VALUES (?, ?)",
+    'Consultas': """INSERT INTO Consultas (id, paciente_id, usuario_id, fecha_hora_ingreso, fecha_hora_egreso, usuario_cierre_id,
+        motivo_consulta, historia_enfermedad_actual, diagnostico_ingreso) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'ExamenesFisicos': """INSERT INTO ExamenesFisicos (id, consulta_id, fecha_hora, ef_ta, ef_fc, ef_temp, ef_piel, ef_cardiovascular,
+        ef_abdomen, ef_neurologico) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'Evoluciones': """INSERT INTO Evoluciones (id, consulta_id, usuario_id, fecha_hora, dias_hospitalizacion, ev_subjetivo, ev_objetivo,
+        ev_ta, ev_fc, ev_temp, ev_diagnosticos, ev_tratamiento_plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'OrdenesMedicas': """INSERT INTO OrdenesMedicas (id, consulta_id, evolucion_id, usuario_id, fecha_hora, orden_json_blob, estado)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    'HistorialAcciones': """INSERT INTO HistorialAcciones (fecha_hora, usuario_id, tipo_accion, tabla_afectada, registro_afectado_id,
+        descripcion, detalles_json) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+}
+# Columnas cifradas (posición en la fila) de cada tabla del modo masivo
+COLUMNAS_CIFRADAS_MASIVO = {
+    'Pacientes': (2, 4, 5, 8, 9, 10, 12, 14, 15, 16, 17, 20, 21),
+    'Consultas': (6, 7, 8),
+    'ExamenesFisicos': (3, 5, 6, 7, 8, 9),
+    'Evoluciones': (5, 6, 7, 9, 10, 11),
+    'OrdenesMedicas': (5,),
+}
+
+_CONFIG_MASIVO = {} # Configuración del proceso trabajador (la fija _iniciar_trabajador)
+
+def _iniciar_trabajador(config):
+    """Inicializador de cada proceso del pool: Faker y textos base deterministas por semilla."""
+    _CONFIG_MASIVO.clear()
+    _CONFIG_MASIVO.update(config)
+    fake_local = Faker('es_ES')
+    fake_local.seed_instance(config['semilla'])
+    _CONFIG_MASIVO['fake'] = fake_local
+    _CONFIG_MASIVO['textos'] = [fake_local.paragraph(nb_sentences=random.Random(i).randint(2, 6)) for i in range(1000)]
+    _CONFIG_MASIVO['frases'] = [fake_local.sentence(nb_words=8) for _ in range(1000)]
+    _CONFIG_MASIVO['ciudades'] = [fake_local.city() for _ in range(300)]
+    _CONFIG_MASIVO['oficios'] = [fake_local.job() for _ in range(300)]
+    _CONFIG_MASIVO['direcciones'] = [fake_local.address().replace('\n', ', ') for _ in range(1000)]
+
+def _fecha_sql(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def _generar_pacientes(rnd, fake_lote, primer_id, cantidad):
+    """Generador de pacientes con sus episodios; cada elemento es independiente de los demás."""
+    cfg = _CONFIG_MASIVO
+    fin_periodo = cfg['fin_periodo']
+    segundos_periodo = AÑOS_HISTORIA_MASIVO * 365 * 86400
+    for paciente_id in range(primer_id, primer_id + cantidad):
+        nombres = fake_lote.first_name()
+        apellidos = f"{fake_lote.last_name()} {fake_lote.last_name()}"
+        cedula = f"{rnd.choice('VVVVE')}-{10000000 + paciente_id}" # Única por construcción
+        telefono = f"04{rnd.choice(('12', '14', '16', '24', '26'))}-{rnd.randint(1000000, 9999999)}"
+        email = f"{(database.normalize_name(nombres).split() or ['p'])[0]}.{paciente_id}@example.com"
+        fecha_registro = fin_periodo - timedelta(seconds=rnd.randrange(segundos_periodo))
+        episodios = []
+        inicio_episodio = fecha_registro
+        estancia_larga = paciente_id - cfg['base_paciente'] < cfg['estancias_largas']
+        num_consultas = rnd.randint(NUM_CONSULTAS_MIN, cfg['consultas_max']) if cfg['con_episodios'] else 0
+        if estancia_larga:
+            # Ingreso abierto de dias_estancia_larga días con una evolución y una orden por día
+            dias = cfg['dias_estancia_larga']
+            fecha_registro = fin_periodo - timedelta(days=dias + 1)
+            episodios.append((fecha_registro, None, dias))
+            num_consultas = 0
+        for n_consulta in range(num_consultas):
+            ingreso = inicio_episodio + timedelta(minutes=rnd.randint(0, 720))
+            if ingreso >= fin_periodo: break
+            ultima = n_consulta == num_consultas - 1
+            abierta = ultima and rnd.random() < PROPORCION_ABIERTAS_MASIVO
+            dias = rnd.randint(NUM_EVOLUCIONES_MIN, cfg['evoluciones_max'])
+            egreso = None if abierta else min(ingreso + timedelta(days=dias, hours=rnd.randint(1, 12)), fin_periodo)
+            episodios.append((ingreso, egreso, dias))
+            inicio_episodio = (egreso or ingreso) + timedelta(days=rnd.randint(30, 400))
+        yield {
+            'id': paciente_id, 'nombres': nombres, 'apellidos': apellidos, 'cedula': cedula,
+            'telefono': telefono, 'email': email, 'fecha_registro': fecha_registro, 'episodios': episodios,
+            'estancia_larga': estancia_larga,
+            'fecha_nacimiento': (fin_periodo - timedelta(days=rnd.randint(5 * 365, 95 * 365))).strftime('%Y-%m-%d'),
+        }
+
+def _generar_lote(indice_lote):
+    """
+    Genera y cifra un lote de pacientes (se ejecuta en un proceso del pool).
+    Los IDs salen de bloques fijos por lote, así los lotes no dependen unos de otros.
+    Retorna (indice_lote, {tabla: filas}).
+    """
+    cfg = _CONFIG_MASIVO
+    rnd = random.Random(f"{cfg['semilla']}-{indice_lote}")
+    fake_lote = cfg['fake']
+    fake_lote.seed_instance(cfg['semilla'] * 1000003 + indice_lote)
+    textos, frases = cfg['textos'], cfg['frases']
+    medicos = cfg['medicos']
+    lote = cfg['lote']
+    primer_indice = indice_lote * lote
+    cantidad = min(lote, cfg['num_pacientes'] - primer_indice)
+    bloque_consultas = lote * cfg['consultas_max']
+    bloque_evoluciones = bloque_consultas * cfg['evoluciones_max'] + cfg['estancias_largas'] * cfg['dias_estancia_larga']
+    proxima_consulta = cfg['base_consulta'] + indice_lote * bloque_consultas
+    proxima_evolucion = cfg['base_evolucion'] + indice_lote * bloque_evoluciones
+    proxima_orden = cfg['base_orden'] + indice_lote * (bloque_consultas + bloque_evoluciones)
+    proximo_examen = cfg['base_examen'] + indice_lote * bloque_consultas
+
+    filas = {tabla: [] for tabla in SQL_MASIVO}
+    for p in _generar_pacientes(rnd, fake_lote, cfg['base_paciente'] + primer_indice, cantidad):
+        pid = p['id']
+        registrador = rnd.choice(medicos)
+        fecha_registro = _fecha_sql(p['fecha_registro'])
+        ap_hta = rnd.random() < 0.25
+        filas['Pacientes'].append([
+            pid, f"H-{pid:06d}", p['cedula'], database.blind_index('cedula', p['cedula']), p['nombres'], p['apellidos'],
+            rnd.choice(('Femenino', 'Masculino')), p['fecha_nacimiento'], rnd.choice(cfg['ciudades']),
+            rnd.choice(('Soltero/a', 'Casado/a', 'Divorciado/a', 'Viudo/a', 'Concubino/a')),
+            p['telefono'], database.blind_index('telefono_movil', p['telefono']), p['email'], database.blind_index('email', p['email']),
+            rnd.choice(cfg['direcciones']), rnd.choice(cfg['oficios']), fake_lote.name(),
+            f"04{rnd.choice(('12', '14', '24'))}-{rnd.randint(1000000, 9999999)}",
+            1 if ap_hta else 0, 1 if rnd.random() < 0.15 else 0,
+            rnd.choice(('Penicilina', 'AINEs', 'Dipirona', 'Niega conocidas')), rnd.choice(('Nunca', 'Ex-fumador', 'Activo leve')),
+            fecha_registro, registrador])
+        filas['PacientesNombreTokens'].extend((token, pid) for token in database.name_index_tokens(p['nombres'], p['apellidos']))
+        filas['HistorialAcciones'].append([fecha_registro, registrador, 'CREAR_PACIENTE', 'Pacientes', pid,
+                                           f"Paciente (HC: H-{pid:06d}) creado.", json.dumps({'registrado_por': registrador})])
+
+        for ingreso, egreso, dias in p['episodios']:
+            consulta_id = proxima_consulta; proxima_consulta += 1
+            medico = rnd.choice(medicos)
+            f_ingreso = _fecha_sql(ingreso)
+            filas['Consultas'].append([consulta_id, pid, medico, f_ingreso, egreso and _fecha_sql(egreso), egreso and medico,
+                                       rnd.choice(("Dolor abdominal", "Vómitos y diarrea", "Sangrado digestivo", "Ictericia", "Control")),
+                                       rnd.choice(textos), rnd.choice(frases)])
+            filas['HistorialAcciones'].append([f_ingreso, medico, 'CREAR_CONSULTA', 'Consultas', consulta_id,
+                                               f"Consulta para paciente ID {pid} creada.", json.dumps({'paciente_id': pid})])
+            filas['ExamenesFisicos'].append([proximo_examen, consulta_id, f_ingreso,
+                                             f"{rnd.randint(90, 180)}/{rnd.randint(50, 110)}", rnd.randint(55, 120),
+                                             f"{rnd.uniform(36.0, 39.0):.1f}", rnd.choice(frases), rnd.choice(frases),
+                                             rnd.choice(textos), rnd.choice(frases)])
+            proximo_examen += 1
+            orden_id = proxima_orden; proxima_orden += 1
+            filas['OrdenesMedicas'].append([orden_id, consulta_id, None, medico, _fecha_sql(ingreso + timedelta(minutes=30)),
+                                            json.dumps({'dieta': {'tipo_inicial': rnd.choice(("Absoluta", "Líquida", "Blanda"))},
+                                                        'medicamentos': {'indicada': True, 'items': [rnd.choice(frases)]}}),
+                                            'Realizada' if egreso else 'Pendiente'])
+            filas['HistorialAcciones'].append([_fecha_sql(ingreso + timedelta(minutes=30)), medico, 'CREAR_ORDEN_MEDICA', 'OrdenesMedicas',
+                                               orden_id, f"Orden para consulta {consulta_id}", json.dumps({'paciente_id': pid, 'consulta_id': consulta_id})])
+            for dia in range(1, dias + 1):
+                fecha_evo = ingreso + timedelta(days=dia, minutes=rnd.randint(0, 600))
+                if (egreso and fecha_evo > egreso) or fecha_evo > cfg['fin_periodo']: break
+                evolucion_id = proxima_evolucion; proxima_evolucion += 1
+                f_evo = _fecha_sql(fecha_evo)
+                filas['Evoluciones'].append([evolucion_id, consulta_id, medico, f_evo, dia, rnd.choice(frases), rnd.choice(frases),
+                                             f"{rnd.randint(90, 170)}/{rnd.randint(50, 100)}", rnd.randint(55, 110),
+                                             f"{rnd.uniform(36.1, 38.0):.1f}", rnd.choice(textos), rnd.choice(frases)])
+                filas['HistorialAcciones'].append([f_evo, medico, 'CREAR_EVOLUCION', 'Evoluciones', evolucion_id,
+                                                   f"Evolución para consulta {consulta_id}",
+                                                   json.dumps({'patient_id': pid, 'consulta_id': consulta_id})])
+                if p['estancia_larga'] or rnd.random() < 0.3:
+                    orden_id = proxima_orden; proxima_orden += 1
+                    filas['OrdenesMedicas'].append([orden_id, consulta_id, evolucion_id, medico, f_evo,
+                                                    json.dumps({'dieta': {'tipo_inicial': "Blanda"}, 'cuidados': rnd.choice(frases)}),
+                                                    'Realizada' if egreso else 'Pendiente'])
+
+    # Cifrar por columnas: una llamada a encrypt_many por columna y tabla
+    for tabla, columnas in COLUMNAS_CIFRADAS_MASIVO.items():
+        filas_tabla = filas[tabla]
+        for col in columnas:
+            for fila, cifrado in zip(filas_tabla, database.encrypt_many([f[col] for f in filas_tabla])):
+                fila[col] = cifrado
+    filas['HistorialAcciones'].sort(key=lambda fila: fila[0]) # Orden cronológico dentro del lote
+    return indice_lote, filas
+
+def _lotes_en_flujo(num_lotes, procesos, config):
+    """Genera los lotes en orden con como mucho 2 x procesos lotes en vuelo (memoria acotada)."""
+    if procesos <= 1:
+        _iniciar_trabajador(config)
+        for indice in range(num_lotes):
+            yield _generar_lote(indice)[1]
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador, initargs=(config,)) as pool:
+        pendientes = deque()
+        siguiente = 0
+        while siguiente < num_lotes or pendientes:
+            while siguiente < num_lotes and len(pendientes) < 2 * procesos:
+                pendientes.append(pool.submit(_generar_lote, siguiente))
+                siguiente += 1
+            yield pendientes.popleft().result()[1]
+
+def crear_usuarios_sinteticos(cursor, cantidad, rondas_hash):
+    """Médicos sintéticos (medico_sint_NNN / clave 'sintetico') con bcrypt de 'rondas_hash' rondas."""
+    ids = []
+    for i in range(1, cantidad + 1):
+        usuario = f"medico_sint_{i:03d}"
+        cursor.execute("SELECT id FROM Usuarios WHERE nombre_usuario = ?", (usuario,))
+        existente = cursor.fetchone()
+        if existente:
+            ids.append(existente[0]); continue
+        hash_clave = bcrypt.hashpw(b"sintetico", bcrypt.gensalt(rounds=rondas_hash)).decode('utf-8')
+        cedula = f"V-{90000000 + i}"
+        cursor.execute("""INSERT INTO Usuarios (nombre_usuario, hash_contrasena, nombre_completo, rol, cedula, cedula_bidx, especialidad)
+                          VALUES (?, ?, ?, 'medico', ?, ?, 'Gastroenterología')""",
+                       (usuario, hash_clave, database.encrypt_data(f"Dr(a). Sintético {i:03d}"), database.encrypt_data(cedula),
+                        database.blind_index('cedula', cedula)))
+        ids.append(cursor.lastrowid)
+    return ids
+
+def carga_masiva(num_pacientes, semilla=1234, procesos=None, lote=LOTE_MASIVO, rondas_hash=RONDAS_HASH_SINTETICAS,
+                 usuarios_sinteticos=USUARIOS_SINTETICOS, consultas_max=NUM_CONSULTAS_MAX, evoluciones_max=NUM_EVOLUCIONES_MAX,
+                 fin_periodo=None, con_episodios=True, estancias_largas=0, dias_estancia_larga=DIAS_ESTANCIA_LARGA):
+    """
+    Carga no interactiva de 'num_pacientes' pacientes con sus episodios, añadiéndolos a los datos existentes.
+    con_episodios=False genera solo los pacientes (benchmark de búsqueda); los 'estancias_largas'
+    primeros pacientes de la carga tienen un ingreso abierto de 'dias_estancia_larga' días.
+    Retorna dict con las filas insertadas por tabla.
+    """
+    global SALT_ROUNDS
+    SALT_ROUNDS = rondas_hash # Los usuarios base (admin, dr_gomez...) también con hash barato
+    procesos = procesos or os.cpu_count() or 1
+    fin_periodo = fin_periodo or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    database.initialize_database()
+    conn = database.connect_db()
+    totales = {tabla: 0 for tabla in SQL_MASIVO}
+    try:
+        cursor = conn.cursor()
+        with conn:
+            usuarios, admin_user_id = crear_usuarios(conn, cursor)
+            medicos = crear_usuarios_sinteticos(cursor, usuarios_sinteticos, rondas_hash)
+        medicos += [u['id'] for u in usuarios if u['rol'] == 'medico']
+
+        def siguiente_id(tabla):
+            return (cursor.execute(f"SELECT MAX(id) FROM {tabla}").fetchone()[0] or 0) + 1
+        config = {
+            'semilla': semilla, 'lote': lote, 'num_pacientes': num_pacientes, 'fin_periodo': fin_periodo,
+            'consultas_max': max(NUM_CONSULTAS_MIN, consultas_max), 'evoluciones_max': max(NUM_EVOLUCIONES_MIN, evoluciones_max),
+            'medicos': medicos, 'con_episodios': con_episodios,
+            'estancias_largas': max(0, min(estancias_largas, num_pacientes)), 'dias_estancia_larga': dias_estancia_larga,
+            'base_paciente': siguiente_id('Pacientes'), 'base_consulta': siguiente_id('Consultas'),
+            'base_examen': siguiente_id('ExamenesFisicos'), 'base_evolucion': siguiente_id('Evoluciones'),
+            'base_orden': siguiente_id('OrdenesMedicas'),
+        }
+        num_lotes = (num_pacientes + lote - 1) // lote
+        print(f"Carga masiva: {num_pacientes} pacientes en {num_lotes} lotes de {lote}, {procesos} procesos, semilla {semilla}.")
+        conn.execute("PRAGMA synchronous=OFF") # Datos regenerables: sin fsync por lote
+        inicio = datetime.now()
+        for n_lote, filas in enumerate(_lotes_en_flujo(num_lotes, procesos, config), start=1):
+            with conn: # Una transacción por lote
+                for tabla, sql in SQL_MASIVO.items():
+                    if filas[tabla]:
+                        cursor.executemany(sql, filas[tabla])
+                        totales[tabla] += len(filas[tabla])
+            if n_lote % 10 == 0 or n_lote == num_lotes:
+                segundos = (datetime.now() - inicio).total_seconds()
+                print(f"  lote {n_lote}/{num_lotes}: {totales['Pacientes']} pacientes, {totales['Evoluciones']} evoluciones "
+                      f"({totales['Pacientes'] / max(segundos, 1e-6):.0f} pacientes/s)")
+        print("Actualizando estadísticas del planificador (ANALYZE)...")
+        conn.execute("ANALYZE;")
+    finally:
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error:
+            pass
+        conn.close()
+    print(f"Carga masiva completada: {totales}")
+    return totales
+
 # --- Función Principal ---
-def main():
+def main(confirmar=True):
     print("Inicializando base de datos (creando tablas si no existen)...")
     database.initialize_database() # CORRECTO
     print("-" * 30)
@@ -552,7 +837,7 @@ def main():
 
         cursor.execute("SELECT COUNT(*) FROM Pacientes")
         count = cursor.fetchone()[0]
-        if count > 0:
+        if count > 0 and confirmar:
             print(f"ADVERTENCIA: Ya existen {count} pacientes en la base de datos.")
             respuesta = input("¿Desea continuar y añadir más datos? (s/N): ").strip().lower()
             if respuesta != 's':
@@ -608,5 +893,25 @@ def main():
 
 if __name__ == "__main__":
     print("--- carga_datos.py: Entering __main__ block ---")
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="Carga de datos de ejemplo")
+    parser.add_argument("--masivo", type=int, metavar="N", help="Modo masivo no interactivo: generar N pacientes")
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--procesos", type=int, help="Procesos generadores (por defecto, uno por CPU)")
+    parser.add_argument("--lote", type=int, default=LOTE_MASIVO, help="Pacientes por lote/transacción")
+    parser.add_argument("--rondas-hash", type=int, default=RONDAS_HASH_SINTETICAS, help="Rondas bcrypt de los usuarios sintéticos")
+    parser.add_argument("--usuarios", type=int, default=USUARIOS_SINTETICOS, help="Médicos sintéticos")
+    parser.add_argument("--consultas-max", type=int, default=NUM_CONSULTAS_MAX)
+    parser.add_argument("--evoluciones-max", type=int, default=NUM_EVOLUCIONES_MAX)
+    parser.add_argument("--hasta", help="Fecha final del periodo generado (AAAA-MM-DD, por defecto hoy)")
+    parser.add_argument("--si", action="store_true", help="No preguntar si ya hay datos (modo normal)")
+    args = parser.parse_args()
+    if args.masivo:
+        carga_masiva(args.masivo, semilla=args.semilla, procesos=args.procesos, lote=args.lote,
+                     rondas_hash=args.rondas_hash, usuarios_sinteticos=args.usuarios,
+                     consultas_max=args.consultas_max, evoluciones_max=args.evoluciones_max,
+                     fin_periodo=datetime.strptime(args.hasta, '%Y-%m-%d') if args.hasta else None)
+        database.shutdown_audit_writer()
+    else:
+        main(confirmar=not args.si)
     print("--- carga_datos.py: main() finished ---")
\ No newline at end of file
@@ -1,14 +1,88 @@
 # database.py
 import sqlite3
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
 import json # Necesario para detalles_json en log_action
 import traceback # Para log_action
+import sys
+import threading
+import queue
+import atexit
+import unicodedata
+import time
+from collections import OrderedDict
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+import metricas
+import perfil_sql
 
 # --- Configuration ---
 DB_NAME = 'gastro_db_encrypted.sqlite'
 KEY_FILE = 'secret.key'
+NEW_KEY_FILE = 'secret.key.new' # Existe solo mientras hay una rotación de clave en curso (rotacion_claves.py)
+KEY_RELOAD_INTERVAL = 5.0       # Segundos entre comprobaciones de cambios en los archivos de clave
+BLIND_INDEX_KEY_FILE = 'blind_index.key' # Clave HMAC de los índices ciegos (independiente de la de cifrado)
+FORMAT_FILE = 'formato_cifrado.cfg' # Formato de escritura elegido con rotacion_claves.py --migrar-formato
+
+# --- Configuración del Pool de Conexiones ---
+POOL_MAX_CONNECTIONS = 8          # Conexiones simultáneas como máximo por archivo de BD
+POOL_ACQUIRE_TIMEOUT = 30.0       # Segundos de espera máxima por una conexión libre
+SQLITE_BUSY_TIMEOUT_MS = 5000     # Espera ante bloqueos de escritura de otra conexión
+SQLITE_CACHE_SIZE_KIB = 20000     # ~20 MB de caché de páginas por conexión
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_STATEMENT_CACHE = 256      # Sentencias preparadas que conserva cada conexión
+POOL_READONLY_MAX_CONNECTIONS = 4 # Conexiones de solo lectura (mode=ro) para lecturas en paralelo
+READ_WORKERS = 4                  # Hilos que reparten lecturas independientes (secciones de la historia)
+
+# --- Configuración del Cifrado por Lotes ---
+CRYPTO_PARALLEL_THRESHOLD = 2000  # A partir de cuántos valores se reparte el lote entre hilos
+CRYPTO_WORKERS = min(4, os.cpu_count() or 1)
+CRYPTO_CHUNK_SIZE = 500
+
+# --- Formato de Almacenamiento de los Campos Cifrados ---
+# 'aead': sobre binario compacto AES-256-GCM (ver _AeadEnvelopeCodec)
+# 'fernet': token Fernet en base64 (formato original)
+# decrypt_data() lee ambos; este valor solo decide cómo se cifran los datos nuevos.
+# Por defecto se sigue escribiendo Fernet, que cualquier versión anterior sabe leer. 'aead' es
+# opcional: se activa con rotacion_claves.py --migrar-formato (escribe FORMAT_FILE) una vez que
+# todas las instancias y herramientas que leen la BD están actualizadas.
+DEFAULT_ENCRYPTION_FORMAT = 'fernet'
+ENCRYPTION_FORMATS = ('fernet', 'aead')
+AEAD_ENVELOPE_VERSION = b"\x01"  # Nunca es el primer byte de un token Fernet (base64, empieza por 'g')
+
+# --- Configuración del Registro de Auditoría Asíncrono ---
+AUDIT_QUEUE_MAX = 10000         # Entradas pendientes como máximo; log_action espera si se llena
+AUDIT_BATCH_SIZE = 500          # Filas de HistorialAcciones por transacción del escritor
+AUDIT_BATCH_LINGER = 0.05       # Segundos que el escritor espera a juntar más filas en un lote
+AUDIT_FLUSH_TIMEOUT = 10.0      # Espera máxima de flush_audit_log()/shutdown_audit_writer()
+
+# --- Configuración de la Caché de Valores Descifrados ---
+DECRYPT_CACHE_MAX_BYTES = 32 * 1024 * 1024   # Techo de memoria estimada de la caché
+DECRYPT_CACHE_MAX_VALUE_BYTES = 4096         # Textos cifrados más grandes (notas largas, JSON) no se cachean
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = 1;",
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB};",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE};",
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS};",
+    "PRAGMA temp_store = MEMORY;",
+)
+# Las conexiones de solo lectura no pueden cambiar el modo de diario ni la sincronización
+# (el archivo ya está en WAL) y además se blindan con query_only.
+READONLY_CONNECTION_PRAGMAS = tuple(
+    p for p in CONNECTION_PRAGMAS if 'journal_mode' not in p and 'synchronous' not in p
+) + ("PRAGMA query_only = ON;",)
 
 # --- Cryptography Setup ---
 
@@ -18,25 +92,163 @@ def generate_key():
     print(f"New encryption key generated and saved to {KEY_FILE}")
     return key
 
+def _read_key_file(path):
+    with open(path, "rb") as key_file: key = key_file.read().strip()
+    if len(base64.urlsafe_b64decode(key)) != 32: raise ValueError("Invalid key format.")
+    return key
+
 def load_key():
     if not os.path.exists(KEY_FILE): return generate_key()
     try:
-        with open(KEY_FILE, "rb") as key_file: key = key_file.read()
-        if len(base64.urlsafe_b64decode(key)) != 32: raise ValueError("Invalid key format.")
-        return key
+        return _read_key_file(KEY_FILE)
     except Exception as e:
         print(f"Error loading key from {KEY_FILE}: {e}. Exiting."); exit(1)
 
-ENCRYPTION_KEY = load_key()
-FERNET_INSTANCE = Fernet(ENCRYPTION_KEY)
+def load_keyring():
+    """
+    Claves vigentes, la primaria (la que cifra) primero. Durante una rotación la nueva
+    clave (NEW_KEY_FILE) pasa a ser la primaria y la anterior se conserva para leer,
+    igual que MultiFernet.
+    """
+    keys = []
+    if os.path.exists(NEW_KEY_FILE):
+        try:
+            keys.append(_read_key_file(NEW_KEY_FILE))
+        except Exception as e:
+            print(f"Error loading key from {NEW_KEY_FILE}: {e}. Exiting."); exit(1)
+    keys.append(load_key())
+    return keys
+
+def load_encryption_format():
+    """Formato de escritura guardado en FORMAT_FILE, o DEFAULT_ENCRYPTION_FORMAT si no existe."""
+    if not os.path.exists(FORMAT_FILE): return DEFAULT_ENCRYPTION_FORMAT
+    try:
+        with open(FORMAT_FILE, "r", encoding="utf-8") as format_file: storage_format = format_file.read().strip()
+    except OSError as e:
+        print(f"Error loading encryption format from {FORMAT_FILE}: {e}. Using '{DEFAULT_ENCRYPTION_FORMAT}'.")
+        return DEFAULT_ENCRYPTION_FORMAT
+    if storage_format not in ENCRYPTION_FORMATS:
+        print(f"Unknown encryption format '{storage_format}' in {FORMAT_FILE}. Using '{DEFAULT_ENCRYPTION_FORMAT}'.")
+        return DEFAULT_ENCRYPTION_FORMAT
+    return storage_format
+
+ENCRYPTION_KEYS = load_keyring()
+ENCRYPTION_KEY = ENCRYPTION_KEYS[0]
+ENCRYPTION_FORMAT = load_encryption_format()
+FERNET_INSTANCE = MultiFernet([Fernet(k) for k in ENCRYPTION_KEYS])
+
+# --- Caché de Valores Descifrados ---
+class DecryptedValueCache:
+    """
+    Caché LRU de texto descifrado indexada por el resumen (BLAKE2b) del texto cifrado.
+    Un mismo token Fernet siempre descifra al mismo valor, así que no hace falta invalidar
+    por escrituras: un valor modificado produce un token nuevo. Se vacía por completo
+    al cerrar sesión o al cambiar de clave (clear()).
+    """
+    _ENTRY_OVERHEAD = 120 # Bytes aproximados por entrada (clave, nodo del OrderedDict)
+
+    def __init__(self, max_bytes=DECRYPT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _digest(ciphertext):
+        return hashlib.blake2b(ciphertext, digest_size=16).digest()
+
+    def get(self, ciphertext):
+        """Devuelve el texto descifrado o None si no está en caché."""
+        if len(ciphertext) > DECRYPT_CACHE_MAX_VALUE_BYTES:
+            return None
+        key = self._digest(ciphertext)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, ciphertext, plaintext):
+        if len(ciphertext) > DECRYPT_CACHE_MAX_VALUE_BYTES or self.max_bytes <= 0:
+            return
+        key = self._digest(ciphertext)
+        cost = sys.getsizeof(plaintext) + self._ENTRY_OVERHEAD
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (plaintext, cost)
+            self._size += cost
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted_cost) = self._entries.popitem(last=False)
+                self._size -= evicted_cost
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted_cost) = self._entries.popitem(last=False)
+                self._size -= evicted_cost
+                self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+DECRYPT_CACHE = DecryptedValueCache()
+
+def clear_decrypted_cache():
+    """Borra todos los valores descifrados en memoria (logout, cambio de clave)."""
+    DECRYPT_CACHE.clear()
+    print("Caché de valores descifrados vaciada.")
+
+def decrypt_cache_stats():
+    return DECRYPT_CACHE.get_stats()
 
 def encrypt_data(data):
     if data is None: return None
+    reload_keys_if_changed()
     # Asegurarse que data es string antes de codificar
+    if ENCRYPTION_FORMAT == 'aead':
+        return BATCH_CODEC.aead.encrypt(str(data).encode('utf-8'))
     return FERNET_INSTANCE.encrypt(str(data).encode('utf-8'))
 
 def decrypt_data(encrypted_data):
+    if metricas.tramo_activo() is None:
+        return _decrypt_value(encrypted_data)
+    start = time.perf_counter()
+    try:
+        return _decrypt_value(encrypted_data)
+    finally:
+        metricas.registrar_descifrado(time.perf_counter() - start)
+
+def _decrypt_value(encrypted_data, _retry_with_reloaded_keys=True):
     if encrypted_data is None: return None
+    is_bytes = type(encrypted_data) is bytes
+    if is_bytes:
+        cached = DECRYPT_CACHE.get(encrypted_data)
+        if cached is not None: return cached
     try:
         # Asegurarse que encrypted_data es bytes
         if isinstance(encrypted_data, str):
@@ -60,7 +272,12 @@ def decrypt_data(encrypted_data):
              print(f"Warning: Received potentially invalid or too short encrypted data.")
              return "[Invalid Data]"
 
-        return FERNET_INSTANCE.decrypt(encrypted_data_bytes).decode('utf-8')
+        if is_aead_envelope(encrypted_data_bytes):
+            plaintext = BATCH_CODEC.aead.decrypt(encrypted_data_bytes)
+        else:
+            plaintext = FERNET_INSTANCE.decrypt(encrypted_data_bytes).decode('utf-8')
+        if is_bytes: DECRYPT_CACHE.put(encrypted_data, plaintext)
+        return plaintext
     except base64.binascii.Error as b64e:
         print(f"Warning: Base64 decoding error during decryption - {b64e}. Data might be corrupted or not encrypted.")
         return "[Decryption/Base64 Error]"
@@ -69,10 +286,426 @@ def decrypt_data(encrypted_data):
         return "[Decryption/Value Error]"
     except Exception as e:
         # Captura cualquier otra excepción de decrypt, como InvalidToken
+        if _retry_with_reloaded_keys and reload_keys_if_changed(force=True):
+            # Otro proceso empezó/terminó una rotación de clave: reintentar con las claves nuevas
+            return _decrypt_value(encrypted_data, _retry_with_reloaded_keys=False)
         print(f"Warning: Decryption failed - {e.__class__.__name__}: {e}. Data might be invalid or use a different key.")
         # traceback.print_exc() # Descomentar para depuración detallada
         return "[Decryption Error]"
 
+# --- Índices Ciegos (HMAC) para Búsquedas Exactas sobre Campos Cifrados ---
+# Fernet usa IV aleatorio, así que el mismo valor cifrado dos veces da BLOBs distintos
+# y no se puede buscar ni exigir UNIQUE sobre la columna cifrada. Junto a cada campo
+# buscable se guarda HMAC(clave, valor_normalizado) en una columna *_bidx indexada.
+
+def load_blind_index_key():
+    if not os.path.exists(BLIND_INDEX_KEY_FILE):
+        key = base64.urlsafe_b64encode(os.urandom(32))
+        with open(BLIND_INDEX_KEY_FILE, "wb") as key_file: key_file.write(key)
+        print(f"New blind index key generated and saved to {BLIND_INDEX_KEY_FILE}")
+    try:
+        with open(BLIND_INDEX_KEY_FILE, "rb") as key_file: key = key_file.read()
+        raw_key = base64.urlsafe_b64decode(key)
+        if len(raw_key) != 32: raise ValueError("Invalid key format.")
+        return raw_key
+    except Exception as e:
+        print(f"Error loading key from {BLIND_INDEX_KEY_FILE}: {e}. Exiting."); exit(1)
+
+BLIND_INDEX_KEY = load_blind_index_key()
+
+def normalize_cedula(value):
+    """'V-12.345.678' -> '12345678'. Se indexan solo los dígitos; la letra se verifica al descifrar."""
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    return digits.lstrip('0') or None
+
+def normalize_telefono(value):
+    """'+58 (414) 123-4567' / '0414-1234567' -> '4141234567'."""
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    if len(digits) == 12 and digits.startswith('58'): digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('0'): digits = digits[1:]
+    return digits or None
+
+def normalize_email(value):
+    email = str(value).strip().lower()
+    return email or None
+
+BLIND_INDEX_NORMALIZERS = {
+    'cedula': normalize_cedula,
+    'telefono_movil': normalize_telefono,
+    'email': normalize_email,
+}
+# Una subclave por campo: el mismo número como cédula y como teléfono no da el mismo índice
+_BLIND_INDEX_SUBKEYS = {
+    field: hmac.new(BLIND_INDEX_KEY, f"bidx:{field}".encode('utf-8'), hashlib.sha256).digest()
+    for field in BLIND_INDEX_NORMALIZERS
+}
+
+def blind_index(field, value):
+    """Índice ciego (16 bytes) del valor para el campo dado, o None si el valor está vacío."""
+    if value is None: return None
+    normalized = BLIND_INDEX_NORMALIZERS[field](value)
+    if not normalized: return None
+    return hmac.new(_BLIND_INDEX_SUBKEYS[field], normalized.encode('utf-8'), hashlib.sha256).digest()[:16]
+
+def same_cedula(a, b):
+    """Compara dos cédulas normalizadas; la letra (V/E) solo cuenta si ambas la traen."""
+    if not a or not b or normalize_cedula(a) != normalize_cedula(b): return False
+    letra_a = next((ch for ch in str(a).upper() if ch.isalpha()), None)
+    letra_b = next((ch for ch in str(b).upper() if ch.isalpha()), None)
+    return letra_a is None or letra_b is None or letra_a == letra_b
+
+# --- Índice de Trigramas (HMAC) para Buscar Pacientes por Nombre ---
+# Por cada palabra del nombre normalizado se guardan los HMAC de sus trigramas, más los de
+# su inicio marcado con '^' ("^an", "^a"). Una búsqueda exige que el paciente tenga todos los
+# tokens del término (una sola consulta indexada) y luego se verifica descifrando solo a los
+# candidatos: los tokens de 8 bytes pueden colisionar, pero nunca se pierde un resultado.
+NAME_TOKEN_BYTES = 8
+_NAME_INDEX_SUBKEY = hmac.new(BLIND_INDEX_KEY, b"bidx:nombre_trigramas", hashlib.sha256).digest()
+
+def normalize_name(value):
+    """Minúsculas, sin acentos y solo letras/dígitos separados por un espacio: 'Núñez-Peña' -> 'nunez pena'."""
+    if not value: return ""
+    decomposed = unicodedata.normalize('NFKD', str(value).lower())
+    chars = [ch if ch.isalnum() else ' ' for ch in decomposed if not unicodedata.combining(ch)]
+    return " ".join("".join(chars).split())
+
+def _name_token(gram):
+    return hmac.new(_NAME_INDEX_SUBKEY, gram.encode('utf-8'), hashlib.sha256).digest()[:NAME_TOKEN_BYTES]
+
+def name_index_tokens(*name_parts):
+    """Tokens a indexar para un paciente (nombres, apellidos)."""
+    grams = set()
+    for word in normalize_name(" ".join(p for p in name_parts if p)).split():
+        marked = "^" + word
+        grams.add(marked[:2])
+        grams.update(marked[i:i + 3] for i in range(len(marked) - 2))
+    return {_name_token(g) for g in grams}
+
+def name_query_tokens(query):
+    """
+    Tokens que debe tener un paciente para coincidir con el término de búsqueda.
+    Palabras de 3+ letras se buscan como subcadena; las de 1-2 letras como inicio de palabra.
+    """
+    grams = set()
+    for word in normalize_name(query).split():
+        if len(word) >= 3:
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+        else:
+            grams.add("^" + word)
+    return {_name_token(g) for g in grams}
+
+def name_matches(query, full_name):
+    """Verificación final sobre el nombre descifrado (mismas reglas que name_query_tokens)."""
+    words = normalize_name(full_name).split()
+    haystack = " ".join(words)
+    for q in normalize_name(query).split():
+        if len(q) >= 3:
+            if q not in haystack: return False
+        elif not any(w.startswith(q) for w in words):
+            return False
+    return True
+
+def index_patient_name(cursor, patient_id, nombres, apellidos):
+    """(Re)escribe los tokens de nombre de un paciente. Llamar dentro de la transacción que guarda el nombre."""
+    cursor.execute("DELETE FROM PacientesNombreTokens WHERE paciente_id = ?", (patient_id,))
+    cursor.executemany("INSERT OR IGNORE INTO PacientesNombreTokens (token, paciente_id) VALUES (?, ?)",
+                       [(token, patient_id) for token in name_index_tokens(nombres, apellidos)])
+
+def name_candidates_sql(query):
+    """
+    Subconsulta (sql, params) con los IDs de pacientes que tienen todos los tokens del término,
+    o None si el término no tiene letras/dígitos.
+    """
+    tokens = list(name_query_tokens(query))
+    if not tokens: return None
+    placeholders = ", ".join("?" * len(tokens))
+    sql = (f"SELECT paciente_id FROM PacientesNombreTokens WHERE token IN ({placeholders}) "
+           f"GROUP BY paciente_id HAVING COUNT(*) = ?")
+    return sql, tokens + [len(tokens)]
+
+def find_ids_by_cedula(cursor, table, cedula, exclude_id=None):
+    """
+    IDs de la tabla (Pacientes o Usuarios) cuya cédula coincide con la dada, usando
+    el índice ciego y verificando la letra (V/E) sobre las filas candidatas descifradas.
+    """
+    token = blind_index('cedula', cedula)
+    if token is None: return []
+    cursor.execute(f"SELECT id, cedula FROM {table} WHERE cedula_bidx = ?", (token,))
+    candidates = [row for row in cursor.fetchall() if row[0] != exclude_id]
+    plain = decrypt_many([row[1] for row in candidates])
+    return [row[0] for row, ced in zip(candidates, plain) if same_cedula(ced, cedula)]
+
+# --- Cifrado / Descifrado por Lotes ---
+class _FernetBatchCodec:
+    """
+    Implementación directa del formato de token Fernet (versión 0x80, HMAC-SHA256 +
+    AES-128-CBC) que deriva las claves una sola vez y evita la validación y
+    conversiones que Fernet repite en cada llamada. Los tokens son idénticos a los
+    de Fernet: lo que cifra uno lo descifra el otro.
+    """
+    def __init__(self, keys):
+        # Como MultiFernet: cifra con la primera clave y descifra con cualquiera
+        self._keys = []
+        for key in keys:
+            raw_key = base64.urlsafe_b64decode(key)
+            self._keys.append((raw_key[:16], algorithms.AES(raw_key[16:])))
+
+    def encrypt(self, plaintext_bytes):
+        signing_key, aes = self._keys[0]
+        iv = os.urandom(16)
+        pad = 16 - (len(plaintext_bytes) % 16)
+        encryptor = Cipher(aes, modes.CBC(iv)).encryptor()
+        ciphertext = encryptor.update(plaintext_bytes + bytes((pad,)) * pad) + encryptor.finalize()
+        basic_parts = b"\x80" + int(time.time()).to_bytes(8, "big") + iv + ciphertext
+        mac = hmac.new(signing_key, basic_parts, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(basic_parts + mac)
+
+    def _verify(self, token):
+        """Devuelve (datos_decodificados, índice_de_clave) o lanza ValueError."""
+        data = base64.urlsafe_b64decode(token)
+        if len(data) < 73 or data[0] != 0x80 or (len(data) - 57) % 16:
+            raise ValueError("Token con formato inválido")
+        signed, received_mac = data[:-32], data[-32:]
+        for index, (signing_key, _) in enumerate(self._keys):
+            if hmac.compare_digest(hmac.new(signing_key, signed, hashlib.sha256).digest(), received_mac):
+                return data, index
+        raise ValueError("Firma HMAC inválida")
+
+    def decrypt(self, token):
+        """Devuelve el texto plano como str o lanza ValueError si el token no es válido."""
+        data, index = self._verify(token)
+        decryptor = Cipher(self._keys[index][1], modes.CBC(data[9:25])).decryptor()
+        padded = decryptor.update(data[25:-32]) + decryptor.finalize()
+        pad = padded[-1]
+        if not 1 <= pad <= 16 or padded[-pad:] != bytes((pad,)) * pad:
+            raise ValueError("Relleno PKCS7 inválido")
+        return padded[:-pad].decode('utf-8')
+
+    def reencrypt(self, token):
+        """
+        Equivalente a MultiFernet.rotate(): devuelve el token cifrado con la clave primaria,
+        o None si ya lo está. Lanza ValueError si ninguna clave lo descifra.
+        """
+        _, index = self._verify(token)
+        if index == 0:
+            return None
+        return self.encrypt(self.decrypt(token).encode('utf-8'))
+
+class _AeadEnvelopeCodec:
+    """
+    Sobre binario AES-256-GCM guardado tal cual en el BLOB (sin base64):
+
+        versión (1) | id de clave (4) | nonce (12) | texto cifrado | etiqueta GCM (16)
+
+    33 bytes fijos frente a los 57 de Fernet más el 33% de base64 (p. ej. "Casado(a)"
+    ocupa 42 bytes en lugar de 100). La clave AES se deriva con HKDF de la misma clave
+    de secret.key, así que la rotación de claves sirve para ambos formatos. La cabecera
+    va como dato autenticado y el id de clave permite elegir la clave sin probarlas todas.
+    A diferencia de Fernet no se guarda la fecha de cifrado (la aplicación no usa TTL).
+    """
+    HEADER_SIZE = 5
+    NONCE_SIZE = 12
+    MIN_SIZE = HEADER_SIZE + NONCE_SIZE + 16
+
+    def __init__(self, keys):
+        self._keys = [] # [(cabecera, AESGCM)], la primaria primero
+        self._by_key_id = {}
+        for key in keys:
+            aead_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                            info=b"hospital-udo campos aead v1").derive(base64.urlsafe_b64decode(key))
+            header = AEAD_ENVELOPE_VERSION + hashlib.sha256(aead_key).digest()[:4]
+            self._keys.append((header, AESGCM(aead_key)))
+            self._by_key_id.setdefault(header, len(self._keys) - 1)
+
+    def encrypt(self, plaintext_bytes):
+        header, aesgcm = self._keys[0]
+        nonce = os.urandom(self.NONCE_SIZE)
+        return header + nonce + aesgcm.encrypt(nonce, plaintext_bytes, header)
+
+    def key_index(self, envelope):
+        """Posición en el llavero de la clave con que se cifró el sobre; lanza InvalidToken si no se conoce."""
+        index = self._by_key_id.get(bytes(envelope[:self.HEADER_SIZE]))
+        if index is None or len(envelope) < self.MIN_SIZE:
+            raise InvalidToken
+        return index
+
+    def decrypt(self, envelope):
+        """Devuelve el texto plano como str o lanza InvalidToken, igual que Fernet."""
+        header, aesgcm = self._keys[self.key_index(envelope)]
+        nonce_end = self.HEADER_SIZE + self.NONCE_SIZE
+        try:
+            return aesgcm.decrypt(envelope[self.HEADER_SIZE:nonce_end], envelope[nonce_end:], header).decode('utf-8')
+        except Exception:
+            raise InvalidToken
+
+def is_aead_envelope(value):
+    return type(value) is bytes and value[:1] == AEAD_ENVELOPE_VERSION
+
+class _StorageCodec:
+    """Cifra en el formato configurado (ENCRYPTION_FORMAT) y descifra cualquiera de los dos."""
+    def __init__(self, keys, storage_format):
+        if storage_format not in ENCRYPTION_FORMATS:
+            raise ValueError(f"Formato de cifrado desconocido: {storage_format}")
+        self.storage_format = storage_format
+        self.fernet = _FernetBatchCodec(keys)
+        self.aead = _AeadEnvelopeCodec(keys)
+        self.encrypt = self.aead.encrypt if storage_format == 'aead' else self.fernet.encrypt
+
+    def decrypt(self, value):
+        if is_aead_envelope(value):
+            return self.aead.decrypt(value)
+        return self.fernet.decrypt(value)
+
+    def reencrypt(self, value):
+        """
+        Devuelve el valor cifrado con la clave primaria y en el formato configurado, o None
+        si ya lo está (rotación de clave y migración de formato). Lanza ValueError o
+        InvalidToken si ninguna clave lo descifra.
+        """
+        if is_aead_envelope(value):
+            if self.storage_format == 'aead' and self.aead.key_index(value) == 0:
+                return None
+            plaintext = self.aead.decrypt(value)
+        else:
+            if self.storage_format == 'fernet' and self.fernet._verify(value)[1] == 0:
+                return None
+            plaintext = self.fernet.decrypt(value)
+        return self.encrypt(plaintext.encode('utf-8'))
+
+BATCH_CODEC = _StorageCodec(ENCRYPTION_KEYS, ENCRYPTION_FORMAT)
+_KEY_FILES_SIGNATURE = None
+_KEY_RELOAD_LOCK = threading.Lock()
+_last_key_check = 0.0
+
+def _key_files_signature():
+    signature = []
+    for path in (KEY_FILE, NEW_KEY_FILE, FORMAT_FILE):
+        try:
+            st = os.stat(path)
+            signature.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+def reload_keys_if_changed(force=False):
+    """
+    Vuelve a leer las claves y el formato de escritura si los archivos cambiaron (inicio o fin
+    de una rotación, o migración de formato, hecha por rotacion_claves.py con la aplicación
+    abierta). Sin 'force' solo mira los archivos cada KEY_RELOAD_INTERVAL segundos.
+    Retorna True si las claves cambiaron.
+    """
+    global _last_key_check, _KEY_FILES_SIGNATURE, ENCRYPTION_KEYS, ENCRYPTION_KEY, FERNET_INSTANCE, BATCH_CODEC, ENCRYPTION_FORMAT
+    now = time.monotonic()
+    if not force and now - _last_key_check < KEY_RELOAD_INTERVAL:
+        return False
+    with _KEY_RELOAD_LOCK:
+        _last_key_check = now
+        signature = _key_files_signature()
+        if signature == _KEY_FILES_SIGNATURE:
+            return False
+        _KEY_FILES_SIGNATURE = signature
+        storage_format = load_encryption_format()
+        if storage_format != ENCRYPTION_FORMAT:
+            BATCH_CODEC = _StorageCodec(ENCRYPTION_KEYS, storage_format)
+            ENCRYPTION_FORMAT = storage_format
+            print(f"Formato de cifrado de los datos nuevos: '{storage_format}'.")
+        keys = load_keyring()
+        if keys == ENCRYPTION_KEYS:
+            return False
+        ENCRYPTION_KEYS = keys
+        ENCRYPTION_KEY = keys[0]
+        FERNET_INSTANCE = MultiFernet([Fernet(k) for k in keys])
+        BATCH_CODEC = _StorageCodec(keys, ENCRYPTION_FORMAT)
+    DECRYPT_CACHE.clear() # Cambio de clave: no conservar nada descifrado con la anterior
+    print(f"Claves de cifrado recargadas ({len(keys)} vigente(s)).")
+    return True
+
+_KEY_FILES_SIGNATURE = _key_files_signature()
+
+def set_encryption_format(storage_format):
+    """Cambia el formato en que este proceso cifra los datos nuevos ('aead' o 'fernet'), sin guardarlo."""
+    global ENCRYPTION_FORMAT, BATCH_CODEC
+    with _KEY_RELOAD_LOCK:
+        BATCH_CODEC = _StorageCodec(ENCRYPTION_KEYS, storage_format)
+        ENCRYPTION_FORMAT = storage_format
+
+def save_encryption_format(storage_format):
+    """
+    Guarda el formato de escritura en FORMAT_FILE y lo aplica. Las instancias abiertas lo toman
+    en su próximo reload_keys_if_changed; las que no lo conocen siguen escribiendo Fernet.
+    """
+    if storage_format not in ENCRYPTION_FORMATS:
+        raise ValueError(f"Formato de cifrado desconocido: {storage_format}")
+    tmp_path = FORMAT_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as format_file: format_file.write(storage_format)
+    os.replace(tmp_path, FORMAT_FILE)
+    set_encryption_format(storage_format)
+_CRYPTO_EXECUTOR = None
+_CRYPTO_EXECUTOR_LOCK = threading.Lock()
+
+def _get_crypto_executor():
+    global _CRYPTO_EXECUTOR
+    with _CRYPTO_EXECUTOR_LOCK:
+        if _CRYPTO_EXECUTOR is None:
+            _CRYPTO_EXECUTOR = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+        return _CRYPTO_EXECUTOR
+
+def _decrypt_chunk(values):
+    codec_decrypt = BATCH_CODEC.decrypt
+    cache_get, cache_put = DECRYPT_CACHE.get, DECRYPT_CACHE.put
+    result = []
+    append = result.append
+    for value in values:
+        if value is None:
+            append(None)
+        elif type(value) is bytes and len(value) >= 20:
+            plaintext = cache_get(value)
+            if plaintext is not None:
+                append(plaintext)
+                continue
+            try:
+                plaintext = codec_decrypt(value)
+                cache_put(value, plaintext)
+                append(plaintext)
+            except Exception:
+                append(_decrypt_value(value)) # Mismo mensaje/marcador de error que la versión individual
+        else:
+            append(_decrypt_value(value))
+    return result
+
+def _encrypt_chunk(values):
+    codec_encrypt = BATCH_CODEC.encrypt
+    return [None if value is None else codec_encrypt(str(value).encode('utf-8')) for value in values]
+
+def _run_batched(func, values):
+    values = values if isinstance(values, list) else list(values)
+    if len(values) < CRYPTO_PARALLEL_THRESHOLD or CRYPTO_WORKERS < 2:
+        return func(values)
+    chunks = [values[i:i + CRYPTO_CHUNK_SIZE] for i in range(0, len(values), CRYPTO_CHUNK_SIZE)]
+    result = []
+    for part in _get_crypto_executor().map(func, chunks):
+        result.extend(part)
+    return result
+
+def decrypt_many(values):
+    """
+    Descifra una secuencia de valores (p. ej. todos los BLOB de un resultado) y
+    devuelve una lista en el mismo orden. Cada elemento se comporta igual que
+    decrypt_data(): None -> None y los valores inválidos dan el mismo marcador de error.
+    """
+    if metricas.tramo_activo() is None:
+        return _run_batched(_decrypt_chunk, values)
+    start = time.perf_counter()
+    try:
+        return _run_batched(_decrypt_chunk, values)
+    finally:
+        metricas.registrar_descifrado(time.perf_counter() - start)
+
+def encrypt_many(values):
+    """Cifra una secuencia de valores; equivalente a [encrypt_data(v) for v in values]."""
+    reload_keys_if_changed()
+    return _run_batched(_encrypt_chunk, values)
+
 # --- SQL Statements for Table Creation ---
 
 # ***** MODIFICACIÓN AQUÍ *****
@@ -88,7 +721,8 @@ CREATE TABLE IF NOT EXISTS Usuarios (
     ruta_foto_perfil TEXT,               -- Ruta a la foto (No encriptado)
     rol TEXT NOT NULL CHECK(rol IN ('medico', 'administrador', 'enfermeria', 'otro')), -- Rol (No encriptado)
     fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-    activo INTEGER DEFAULT 1 CHECK(activo IN (0, 1)) -- Estado (No encriptado)
+    activo INTEGER DEFAULT 1 CHECK(activo IN (0, 1)), -- Estado (No encriptado)
+    cedula_bidx BLOB                     -- Índice ciego HMAC de la cédula (búsqueda exacta)
 );
 """
 # El índice único para nombre_usuario ya está cubierto por UNIQUE en la tabla.
@@ -152,6 +786,9 @@ CREATE TABLE IF NOT EXISTS Pacientes (
     hab_drogas BLOB,
     hab_cafe BLOB,
     hab_perdida_peso BLOB,  -- <<< AÑADIR ESTA LÍNEA AQUÍ
+    cedula_bidx BLOB,           -- Índices ciegos HMAC para búsqueda exacta
+    telefono_movil_bidx BLOB,
+    email_bidx BLOB,
     FOREIGN KEY (usuario_registro_id) REFERENCES Usuarios(id) ON DELETE SET NULL,
     FOREIGN KEY (usuario_ultima_mod_id) REFERENCES Usuarios(id) ON DELETE SET NULL
 );
@@ -209,6 +846,18 @@ CREATE TABLE IF NOT EXISTS Evoluciones (
 );
 """
 
+SQL_CREATE_PACIENTES_NOMBRE_TOKENS = """
+CREATE TABLE IF NOT EXISTS PacientesNombreTokens (
+    token BLOB NOT NULL,             -- HMAC truncado de un trigrama del nombre normalizado
+    paciente_id INTEGER NOT NULL,
+    PRIMARY KEY (token, paciente_id),
+    FOREIGN KEY (paciente_id) REFERENCES Pacientes(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+"""
+SQL_CREATE_PACIENTES_NOMBRE_TOKENS_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_nombre_tokens_paciente ON PacientesNombreTokens(paciente_id);
+"""
+
 SQL_CREATE_HISTORIAL_ACCIONES = """
 CREATE TABLE IF NOT EXISTS HistorialAcciones (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -230,6 +879,152 @@ SQL_CREATE_HISTORIAL_INDEX_TYPE_DATE = """
 CREATE INDEX IF NOT EXISTS idx_historial_tipo_fecha ON HistorialAcciones(tipo_accion, fecha_hora);
 """
 
+# --- Índice de Texto Completo (FTS5) del Historial ---
+# Tabla FTS5 de contenido externo: guarda solo el índice invertido de descripcion y tipo_accion,
+# el texto sigue en HistorialAcciones (rowid = HistorialAcciones.id). Los triggers la mantienen
+# al día; si este SQLite no trae FTS5, la migración no la crea y get_log vuelve a usar LIKE.
+SQL_CREATE_HISTORIAL_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS HistorialAccionesFTS USING fts5(
+    descripcion, tipo_accion,
+    content='HistorialAcciones', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+"""
+SQL_CREATE_HISTORIAL_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS trg_historial_fts_ai AFTER INSERT ON HistorialAcciones BEGIN
+        INSERT INTO HistorialAccionesFTS(rowid, descripcion, tipo_accion) VALUES (new.id, new.descripcion, new.tipo_accion);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_historial_fts_ad AFTER DELETE ON HistorialAcciones BEGIN
+        INSERT INTO HistorialAccionesFTS(HistorialAccionesFTS, rowid, descripcion, tipo_accion) VALUES ('delete', old.id, old.descripcion, old.tipo_accion);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_historial_fts_au AFTER UPDATE OF descripcion, tipo_accion ON HistorialAcciones BEGIN
+        INSERT INTO HistorialAccionesFTS(HistorialAccionesFTS, rowid, descripcion, tipo_accion) VALUES ('delete', old.id, old.descripcion, old.tipo_accion);
+        INSERT INTO HistorialAccionesFTS(rowid, descripcion, tipo_accion) VALUES (new.id, new.descripcion, new.tipo_accion);
+    END;""",
+]
+HISTORIAL_FTS_MAX_TERMS = 8
+_historial_fts_ready = {} # {DB_NAME: bool}, se consulta una vez por BD
+
+def fts5_available(conn):
+    """True si este SQLite tiene el módulo FTS5 compilado."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x);")
+        conn.execute("DROP TABLE temp._fts5_probe;")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _create_historial_fts(conn):
+    if not fts5_available(conn):
+        print("  SQLite sin FTS5: la búsqueda del historial seguirá usando LIKE.")
+        return
+    conn.execute(SQL_CREATE_HISTORIAL_FTS)
+    for statement in SQL_CREATE_HISTORIAL_FTS_TRIGGERS:
+        conn.execute(statement)
+    conn.execute("INSERT INTO HistorialAccionesFTS(HistorialAccionesFTS) VALUES ('rebuild');")
+    total = conn.execute("SELECT COUNT(*) FROM HistorialAcciones").fetchone()[0]
+    print(f"  Índice de texto completo construido para {total} acciones.")
+    _historial_fts_ready.pop(DB_NAME, None)
+
+def historial_fts_ready():
+    """True si la BD actual tiene HistorialAccionesFTS (migración aplicada con FTS5 disponible)."""
+    ready = _historial_fts_ready.get(DB_NAME)
+    if ready is None:
+        conn = connect_db()
+        if not conn: return False
+        try:
+            ready = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'HistorialAccionesFTS'").fetchone() is not None
+        finally:
+            conn.close()
+        _historial_fts_ready[DB_NAME] = ready
+    return ready
+
+def historial_fts_query(term):
+    """
+    Expresión MATCH para un término de búsqueda: cada palabra como prefijo y todas requeridas
+    ('crear pac' -> '"crear"* AND "pac"*'). None si el término no tiene letras/dígitos.
+    """
+    words = normalize_name(term).split()[:HISTORIAL_FTS_MAX_TERMS]
+    if not words: return None
+    return " AND ".join(f'"{w}"*' for w in words)
+
+# --- Catálogo del Archivo en Frío (ver archivo.py) ---
+SQL_CREATE_ARCHIVO_PERIODOS = """
+CREATE TABLE IF NOT EXISTS ArchivoPeriodos (
+    periodo TEXT PRIMARY KEY,          -- Año archivado ('2023'), un archivo SQLite por año
+    archivo TEXT NOT NULL,             -- Nombre del archivo dentro de archivo.ARCHIVO_DIR
+    historial_desde DATETIME,          -- Rango de fecha_hora de las acciones archivadas
+    historial_hasta DATETIME,
+    filas_historial INTEGER NOT NULL DEFAULT 0,
+    consultas INTEGER NOT NULL DEFAULT 0,
+    actualizado DATETIME NOT NULL
+);
+"""
+SQL_CREATE_ARCHIVO_PACIENTES = """
+CREATE TABLE IF NOT EXISTS ArchivoPacientes (
+    paciente_id INTEGER NOT NULL,      -- Paciente con consultas archivadas en ese año
+    periodo TEXT NOT NULL,
+    PRIMARY KEY (paciente_id, periodo)
+) WITHOUT ROWID;
+"""
+
+# --- Versión de la Historia por Paciente (ver cache_historias.py) ---
+# Cada escritura en una tabla que aparece en la historia suma 1 a la versión del paciente
+# mediante triggers, así ninguna ruta de escritura puede olvidarse de invalidar la caché.
+# La fila paciente_id = 0 es global: cambia cuando se renombra un usuario (autor de notas).
+SQL_CREATE_VERSIONES_HISTORIA = """
+CREATE TABLE IF NOT EXISTS VersionesHistoria (
+    paciente_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+# tabla -> expresión del paciente afectado a partir de la fila ({fila} = new / old)
+HISTORIA_VERSION_FUENTES = (
+    ('Pacientes', "{fila}.id"),
+    ('Consultas', "{fila}.paciente_id"),
+    ('ExamenesFisicos', "(SELECT paciente_id FROM Consultas WHERE id = {fila}.consulta_id)"),
+    ('Evoluciones', "(SELECT paciente_id FROM Consultas WHERE id = {fila}.consulta_id)"),
+    ('OrdenesMedicas', "(SELECT paciente_id FROM Consultas WHERE id = {fila}.consulta_id)"),
+    ('Complementarios', "{fila}.paciente_id"),
+    ('Interconsultas', "{fila}.paciente_id"),
+    ('InformesMedicos', "{fila}.paciente_id"),
+    ('Recipes', "{fila}.paciente_id"),
+)
+_SQL_SUBIR_VERSION = """INSERT INTO VersionesHistoria (paciente_id, version)
+        SELECT p, 1 FROM ({pacientes}) WHERE p IS NOT NULL
+        ON CONFLICT(paciente_id) DO UPDATE SET version = version + 1;"""
+
+def _historia_version_triggers():
+    statements = []
+    for table, expr in HISTORIA_VERSION_FUENTES:
+        nuevo, viejo = expr.format(fila='new'), expr.format(fila='old')
+        for sufijo, evento, pacientes in (
+                ('ai', 'INSERT', f"SELECT {nuevo} AS p"),
+                ('au', 'UPDATE', f"SELECT {viejo} AS p UNION SELECT {nuevo}"), # Por si la fila cambia de paciente
+                ('ad', 'DELETE', f"SELECT {viejo} AS p")):
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS trg_version_{table.lower()}_{sufijo} AFTER {evento} ON {table} BEGIN\n"
+                f"        {_SQL_SUBIR_VERSION.format(pacientes=pacientes)}\n    END;")
+    statements.append(
+        "CREATE TRIGGER IF NOT EXISTS trg_version_usuarios_au AFTER UPDATE OF nombre_usuario, nombre_completo ON Usuarios BEGIN\n"
+        f"        {_SQL_SUBIR_VERSION.format(pacientes='SELECT 0 AS p')}\n    END;")
+    return statements
+
+SQL_CREATE_HISTORIA_VERSION_TRIGGERS = _historia_version_triggers()
+
+def historia_version(conn, patient_id):
+    """
+    Versión actual de la historia del paciente como tupla (versión del paciente, versión global),
+    o None si la BD aún no tiene VersionesHistoria (entonces no se debe cachear).
+    """
+    try:
+        row = conn.execute("""SELECT COALESCE(MAX(CASE WHEN paciente_id = ? THEN version END), 0),
+                                     COALESCE(MAX(CASE WHEN paciente_id = 0 THEN version END), 0)
+                              FROM VersionesHistoria WHERE paciente_id IN (0, ?)""", (patient_id, patient_id)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return (row[0], row[1])
+
 SQL_CREATE_EXAMENES_FISICOS = """
 CREATE TABLE IF NOT EXISTS ExamenesFisicos ( id INTEGER PRIMARY KEY AUTOINCREMENT, consulta_id INTEGER UNIQUE NOT NULL, fecha_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, ef_ta BLOB, ef_fr INTEGER, ef_fc INTEGER, ef_sato2 INTEGER, ef_temp BLOB, ef_glic INTEGER, ef_piel BLOB, ef_respiratorio BLOB, ef_cardiovascular BLOB, ef_abdomen BLOB, ef_gastrointestinal BLOB, ef_genitourinario BLOB, ef_extremidades BLOB, ef_neurologico BLOB, ef_otros_hallazgos BLOB, FOREIGN KEY (consulta_id) REFERENCES Consultas(id) ON DELETE CASCADE );
 """
@@ -301,42 +1096,767 @@ ALL_TABLES_SQL = [
     SQL_CREATE_INTERCONSULTAS,
     SQL_CREATE_INFORMES_MEDICOS,
     SQL_CREATE_RECIPES,
+    SQL_CREATE_PACIENTES_NOMBRE_TOKENS,
+    SQL_CREATE_PACIENTES_NOMBRE_TOKENS_INDEX,
     SQL_CREATE_HISTORIAL_ACCIONES,
     SQL_CREATE_HISTORIAL_INDEX_USER_DATE,
     SQL_CREATE_HISTORIAL_INDEX_TYPE_DATE
 ]
 
+# --- Migraciones de Esquema ---
+# Cada migración se aplica una sola vez, en orden, y deja su número en PRAGMA user_version.
+# Los pasos pueden ser sentencias SQL o funciones que reciben la conexión (para backfills).
+# Deben ser idempotentes (IF NOT EXISTS, comprobaciones previas) por si la BD ya trae
+# parte del cambio, p. ej. una BD nueva creada con las sentencias CREATE TABLE actuales.
+MIGRATIONS = [
+    (1, "Índices compuestos por paciente/consulta para las secciones de la historia", [
+        "CREATE INDEX IF NOT EXISTS idx_consultas_paciente_ingreso ON Consultas(paciente_id, fecha_hora_ingreso DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_evoluciones_consulta_fecha ON Evoluciones(consulta_id, fecha_hora DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_ordenes_consulta_fecha ON OrdenesMedicas(consulta_id, fecha_hora DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_complementarios_paciente_fecha ON Complementarios(paciente_id, fecha_registro DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_interconsultas_paciente_fecha ON Interconsultas(paciente_id, fecha_solicitud DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_informes_paciente_fecha ON InformesMedicos(paciente_id, fecha_creacion DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_recipes_paciente_fecha ON Recipes(paciente_id, fecha_emision DESC);",
+    ]),
+    (2, "Índices en claves foráneas recorridas por ON DELETE CASCADE / SET NULL", [
+        "CREATE INDEX IF NOT EXISTS idx_ordenes_evolucion ON OrdenesMedicas(evolucion_id);",
+        "CREATE INDEX IF NOT EXISTS idx_complementarios_consulta ON Complementarios(consulta_id);",
+        "CREATE INDEX IF NOT EXISTS idx_complementarios_orden ON Complementarios(orden_medica_id);",
+        "CREATE INDEX IF NOT EXISTS idx_interconsultas_consulta ON Interconsultas(consulta_id);",
+        "CREATE INDEX IF NOT EXISTS idx_interconsultas_orden ON Interconsultas(orden_medica_id);",
+        "CREATE INDEX IF NOT EXISTS idx_informes_consulta ON InformesMedicos(consulta_id);",
+        "CREATE INDEX IF NOT EXISTS idx_recipes_consulta ON Recipes(consulta_id);",
+        "CREATE INDEX IF NOT EXISTS idx_recipes_evolucion ON Recipes(evolucion_id);",
+    ]),
+    (3, "Índice por fecha para paginar el historial de acciones sin filtros", [
+        "CREATE INDEX IF NOT EXISTS idx_historial_fecha ON HistorialAcciones(fecha_hora);",
+    ]),
+    (4, "Índices ciegos de cédula, teléfono móvil y email", [
+        lambda conn: _add_column_if_missing(conn, 'Pacientes', 'cedula_bidx', 'BLOB'),
+        lambda conn: _add_column_if_missing(conn, 'Pacientes', 'telefono_movil_bidx', 'BLOB'),
+        lambda conn: _add_column_if_missing(conn, 'Pacientes', 'email_bidx', 'BLOB'),
+        lambda conn: _add_column_if_missing(conn, 'Usuarios', 'cedula_bidx', 'BLOB'),
+        lambda conn: _backfill_blind_indexes(conn),
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_cedula_bidx ON Pacientes(cedula_bidx);",
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_telefono_bidx ON Pacientes(telefono_movil_bidx);",
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_email_bidx ON Pacientes(email_bidx);",
+        "CREATE INDEX IF NOT EXISTS idx_usuarios_cedula_bidx ON Usuarios(cedula_bidx);",
+    ]),
+    (5, "Índice de trigramas cifrados para buscar pacientes por nombre", [
+        SQL_CREATE_PACIENTES_NOMBRE_TOKENS,
+        SQL_CREATE_PACIENTES_NOMBRE_TOKENS_INDEX,
+        lambda conn: _backfill_name_index(conn),
+    ]),
+    (6, "Índice de texto completo (FTS5) para buscar en el historial de acciones", [
+        lambda conn: _create_historial_fts(conn),
+    ]),
+    (7, "Catálogo del archivo en frío por año (historial y episodios cerrados)", [
+        SQL_CREATE_ARCHIVO_PERIODOS,
+        SQL_CREATE_ARCHIVO_PACIENTES,
+    ]),
+    (8, "Índices para ordenar el listado paginado de pacientes", [
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_fecha_nacimiento ON Pacientes(fecha_nacimiento);",
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_sexo ON Pacientes(sexo);",
+    ]),
+    (9, "Índice por fecha de modificación para refrescar el directorio de pacientes", [
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_fecha_mod ON Pacientes(fecha_ultima_mod);",
+    ]),
+    (10, "Versión de la historia por paciente mantenida por triggers (caché de historias)", [
+        SQL_CREATE_VERSIONES_HISTORIA,
+        *SQL_CREATE_HISTORIA_VERSION_TRIGGERS,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Consultas representativas de las rutas más usadas, para el informe de planes (dry-run).
+HOT_PATH_QUERIES = {
+    'consulta_mas_reciente': "SELECT id FROM Consultas WHERE paciente_id = ? ORDER BY fecha_hora_ingreso DESC LIMIT 1",
+    'consultas_paciente': "SELECT c.id FROM Consultas c WHERE c.paciente_id = ? ORDER BY c.fecha_hora_ingreso DESC",
+    'evoluciones_paciente': "SELECT e.id FROM Evoluciones e JOIN Consultas c ON e.consulta_id = c.id WHERE c.paciente_id = ? ORDER BY e.fecha_hora DESC",
+    'ordenes_paciente': "SELECT om.id FROM OrdenesMedicas om JOIN Consultas c ON om.consulta_id = c.id WHERE c.paciente_id = ? ORDER BY om.fecha_hora DESC",
+    'complementarios_paciente': "SELECT id FROM Complementarios WHERE paciente_id = ? ORDER BY fecha_registro DESC",
+    'interconsultas_paciente': "SELECT id FROM Interconsultas WHERE paciente_id = ? ORDER BY fecha_solicitud DESC",
+    'informes_paciente': "SELECT id FROM InformesMedicos WHERE paciente_id = ? ORDER BY fecha_creacion DESC",
+    'recipes_paciente': "SELECT id FROM Recipes WHERE paciente_id = ? ORDER BY fecha_emision DESC",
+    'cascada_consulta_complementarios': "SELECT id FROM Complementarios WHERE consulta_id = ?",
+    'cascada_evolucion_recipes': "SELECT id FROM Recipes WHERE evolucion_id = ?",
+    'historial_pagina': "SELECT id FROM HistorialAcciones ORDER BY fecha_hora DESC LIMIT 50",
+    'paciente_por_cedula': "SELECT id FROM Pacientes WHERE cedula_bidx = ?",
+    'historial_busqueda': "SELECT rowid FROM HistorialAccionesFTS WHERE HistorialAccionesFTS MATCH ?",
+    'pacientes_modificados': "SELECT id FROM Pacientes WHERE fecha_ultima_mod >= ?",
+    'listado_pacientes_ventana': "SELECT id FROM Pacientes ORDER BY fecha_nacimiento DESC, id DESC LIMIT 50 OFFSET 500",
+    'version_historia': "SELECT version FROM VersionesHistoria WHERE paciente_id IN (0, ?)",
+}
+
+def _add_column_if_missing(conn, table, column, column_type):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table});")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+
+def _backfill_blind_indexes(conn, chunk_size=2000):
+    """Calcula los índices ciegos de las filas existentes (descifrando por lotes)."""
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, cedula, telefono_movil, email FROM Pacientes WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk_size)).fetchall()
+        if not rows: break
+        plain = decrypt_many([v for row in rows for v in row[1:]])
+        updates = []
+        for i, row in enumerate(rows):
+            cedula, telefono, email = plain[i * 3:i * 3 + 3]
+            updates.append((blind_index('cedula', cedula), blind_index('telefono_movil', telefono),
+                            blind_index('email', email), row[0]))
+        conn.executemany("UPDATE Pacientes SET cedula_bidx = ?, telefono_movil_bidx = ?, email_bidx = ? WHERE id = ?", updates)
+        total += len(rows)
+        last_id = rows[-1][0]
+    rows = conn.execute("SELECT id, cedula FROM Usuarios").fetchall()
+    plain = decrypt_many([row[1] for row in rows])
+    conn.executemany("UPDATE Usuarios SET cedula_bidx = ? WHERE id = ?",
+                     [(blind_index('cedula', ced), row[0]) for ced, row in zip(plain, rows)])
+    print(f"  Índices ciegos calculados para {total} pacientes y {len(rows)} usuarios.")
+
+def _backfill_name_index(conn, chunk_size=2000):
+    """Construye el índice de nombres para los pacientes existentes."""
+    total = 0
+    last_id = 0
+    cursor = conn.cursor()
+    while True:
+        rows = conn.execute("SELECT id, nombres, apellidos FROM Pacientes WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, chunk_size)).fetchall()
+        if not rows: break
+        plain = decrypt_many([v for row in rows for v in row[1:]])
+        tokens = []
+        for i, row in enumerate(rows):
+            tokens.extend((token, row[0]) for token in name_index_tokens(plain[i * 2], plain[i * 2 + 1]))
+        cursor.executemany("INSERT OR IGNORE INTO PacientesNombreTokens (token, paciente_id) VALUES (?, ?)", tokens)
+        total += len(rows)
+        last_id = rows[-1][0]
+    print(f"  Índice de nombres construido para {total} pacientes.")
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def _run_migration_steps(conn, steps):
+    for step in steps:
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(step)
+
+def apply_migrations(conn):
+    """
+    Aplica en orden las migraciones pendientes (versión > PRAGMA user_version).
+    Cada migración corre en su propia transacción junto con el cambio de user_version,
+    así una falla deja la BD en la última versión completa.
+    """
+    current = get_schema_version(conn)
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        print(f"Esquema al día (versión {current}).")
+        return True
+    for version, descripcion, steps in pending:
+        print(f"Aplicando migración {version}: {descripcion}...")
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            _run_migration_steps(conn, steps)
+            conn.execute(f"PRAGMA user_version = {int(version)};")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error aplicando migración {version}: {e}")
+            traceback.print_exc()
+            return False
+    conn.execute("PRAGMA optimize;") # Actualiza estadísticas para los índices nuevos
+    print(f"Esquema migrado a la versión {get_schema_version(conn)}.")
+    return True
+
+def _query_plan(conn, sql):
+    params = [None] * sql.count('?')
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.OperationalError as e:
+        return [f"(no aplicable: {e})"] # p. ej. columna que aún no existe antes de migrar
+    return [row[-1] for row in rows]
+
+def migration_dry_run_report(conn):
+    """
+    Aplica las migraciones pendientes dentro de una transacción que luego se revierte
+    y compara el plan de cada consulta de HOT_PATH_QUERIES antes y después.
+    Devuelve el informe como texto; la BD no queda modificada.
+    """
+    current = get_schema_version(conn)
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    lines = [f"Versión actual del esquema: {current} (última disponible: {SCHEMA_VERSION})"]
+    if not pending:
+        lines.append("No hay migraciones pendientes.")
+        return "\n".join(lines)
+    for version, descripcion, _ in pending:
+        lines.append(f"  Pendiente {version}: {descripcion}")
+
+    before = {name: _query_plan(conn, sql) for name, sql in HOT_PATH_QUERIES.items()}
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        for _, _, steps in pending:
+            _run_migration_steps(conn, steps)
+        after = {name: _query_plan(conn, sql) for name, sql in HOT_PATH_QUERIES.items()}
+    finally:
+        conn.rollback()
+
+    changed = 0
+    for name in HOT_PATH_QUERIES:
+        if before[name] == after[name]:
+            lines.append(f"\n[igual]   {name}: " + " | ".join(before[name]))
+            continue
+        changed += 1
+        lines.append(f"\n[CAMBIA]  {name}")
+        lines.append("    antes:   " + " | ".join(before[name]))
+        lines.append("    después: " + " | ".join(after[name]))
+    lines.append(f"\n{changed} de {len(HOT_PATH_QUERIES)} consultas cambian de plan.")
+    return "\n".join(lines)
+
 # --- Función Helper para Registrar Acción ---
-def log_action(db_conn, usuario_id, tipo_accion, descripcion, tabla=None, registro_id=None, detalles=None):
-    """Inserta un registro en la tabla HistorialAcciones. Asume que se llama dentro de una transacción."""
-    if not db_conn or usuario_id is None: # Verificar ambos
+SQL_INSERT_HISTORIAL = """
+    INSERT INTO HistorialAcciones
+    (fecha_hora, usuario_id, tipo_accion, tabla_afectada, registro_afectado_id, descripcion, detalles_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+class AuditLogWriter:
+    """
+    Escritor en segundo plano de HistorialAcciones. log_action() encola la fila y un único
+    hilo las inserta en orden de llegada, agrupando hasta AUDIT_BATCH_SIZE filas por
+    transacción (un solo commit/fsync por lote). La fecha_hora se fija al encolar, así que
+    el historial refleja el momento de la acción y no el de la escritura.
+    """
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, maxsize=AUDIT_QUEUE_MAX):
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'encoladas': 0, 'escritas': 0, 'descartadas': 0, 'lotes': 0, 'max_pendientes': 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, db_name, row):
+        self._ensure_started()
+        self._queue.put((db_name, row)) # Bloquea si la cola está llena (contrapresión, no se pierden filas)
+        with self._lock:
+            self._stats['encoladas'] += 1
+            self._stats['max_pendientes'] = max(self._stats['max_pendientes'], self._queue.qsize())
+
+    def flush(self, timeout=AUDIT_FLUSH_TIMEOUT):
+        """Espera a que todo lo encolado hasta ahora esté confirmado en la BD. Retorna False si vence el plazo."""
+        if self._thread is None or not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done))
+        return done.wait(timeout)
+
+    def shutdown(self, timeout=AUDIT_FLUSH_TIMEOUT):
+        """Escribe lo pendiente y detiene el hilo (se vuelve a arrancar con el siguiente submit)."""
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put((self._STOP, None))
+        thread.join(timeout)
+        if thread.is_alive():
+            print(f"Advertencia: el escritor de auditoría no terminó en {timeout}s; quedan {self._queue.qsize()} entradas sin escribir.")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pendientes'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        while True:
+            batch, waiters, stop = [], [], False
+            item = self._queue.get()
+            deadline = time.monotonic() + AUDIT_BATCH_LINGER
+            while True:
+                if item[0] is self._FLUSH:
+                    waiters.append(item[1]); break
+                if item[0] is self._STOP:
+                    stop = True; break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= AUDIT_BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        # Agrupar por BD respetando el orden (normalmente todo va a DB_NAME)
+        groups = []
+        for db_name, row in batch:
+            if groups and groups[-1][0] == db_name:
+                groups[-1][1].append(row)
+            else:
+                groups.append((db_name, [row]))
+        for db_name, rows in groups:
+            written = 0
+            try:
+                with get_connection(db_name) as conn:
+                    conn.execute("SAVEPOINT lote")
+                    try:
+                        conn.executemany(SQL_INSERT_HISTORIAL, rows)
+                        conn.execute("RELEASE lote")
+                        written = len(rows)
+                    except sqlite3.Error:
+                        # Alguna fila inválida (p. ej. usuario_id inexistente): deshacer las filas ya
+                        # insertadas por executemany, luego insertar una a una y descartar las inválidas
+                        conn.execute("ROLLBACK TO lote")
+                        conn.execute("RELEASE lote")
+                        for row in rows:
+                            try:
+                                conn.execute(SQL_INSERT_HISTORIAL, row)
+                                written += 1
+                            except sqlite3.Error as e:
+                                print(f"!!! ERROR AL REGISTRAR ACCIÓN EN HISTORIAL ({row[2]}): {e} !!!")
+                    conn.commit()
+            except Exception as e:
+                written = 0
+                print(f"!!! ERROR AL ESCRIBIR LOTE DE HISTORIAL ({len(rows)} acciones): {e} !!!")
+                traceback.print_exc()
+            with self._lock:
+                self._stats['escritas'] += written
+                self._stats['descartadas'] += len(rows) - written
+                self._stats['lotes'] += 1
+
+AUDIT_WRITER = AuditLogWriter()
+atexit.register(AUDIT_WRITER.shutdown)
+
+def log_action(db_conn, usuario_id, tipo_accion, descripcion, tabla=None, registro_id=None, detalles=None, sincrono=False):
+    """
+    Registra una acción en HistorialAcciones.
+    - sincrono=False (por defecto): la encola para el escritor en segundo plano; db_conn no se usa.
+    - sincrono=True: la inserta con db_conn dentro de la transacción del llamador, para
+      cambios clínicos cuyo registro de auditoría debe confirmarse o revertirse con ellos.
+    """
+    if usuario_id is None or (sincrono and not db_conn):
         print("Error Log: Conexión BD o usuario_id faltante.")
         return
 
-    print(f"LOG: User {usuario_id}, Action: {tipo_accion}, Desc: {descripcion[:100]}...")
-    sql = """
-        INSERT INTO HistorialAcciones
-        (usuario_id, tipo_accion, tabla_afectada, registro_afectado_id, descripcion, detalles_json)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """
     detalles_str = json.dumps(detalles) if detalles is not None else None
+    fecha_hora = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()) # Mismo formato/zona que CURRENT_TIMESTAMP
+    row = (fecha_hora, usuario_id, tipo_accion, tabla, registro_id, descripcion, detalles_str)
+    if not sincrono:
+        AUDIT_WRITER.submit(DB_NAME, row)
+        return
     try:
         cursor = db_conn.cursor()
-        cursor.execute(sql, (usuario_id, tipo_accion, tabla, registro_id, descripcion, detalles_str))
+        cursor.execute(SQL_INSERT_HISTORIAL, row)
     except Exception as e:
         print(f"!!! ERROR AL REGISTRAR ACCIÓN EN HISTORIAL: {e} !!!")
         traceback.print_exc()
 
-# --- Funciones de Utilidad para la Base de Datos ---
-def connect_db(db_name=DB_NAME):
-    # ... (como antes) ...
+def flush_audit_log(timeout=AUDIT_FLUSH_TIMEOUT):
+    """Espera a que las acciones encoladas estén escritas (antes de leer el historial)."""
+    return AUDIT_WRITER.flush(timeout)
+
+def shutdown_audit_writer():
+    AUDIT_WRITER.shutdown()
+
+def audit_stats():
+    return AUDIT_WRITER.get_stats()
+
+# --- Columnas Cifradas ---
+# Tablas auxiliares cuyas columnas BLOB no son texto cifrado (tokens HMAC)
+NON_ENCRYPTED_BLOB_TABLES = {'PacientesNombreTokens'}
+
+def encrypted_columns(conn):
+    """{tabla: [columnas]} con todas las columnas BLOB cifradas del esquema actual."""
+    result = {}
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    # Tablas internas de las tablas virtuales (FTS5: <nombre>_data, <nombre>_docsize...)
+    virtual = [row[0] + '_' for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")]
+    for table in tables:
+        if table in NON_ENCRYPTED_BLOB_TABLES or table.startswith(tuple(virtual)): continue
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table});")
+                   if (row[2] or '').upper() == 'BLOB' and not row[1].endswith('_bidx')]
+        if columns:
+            result[table] = columns
+    return result
+
+# --- Pool de Conexiones ---
+def _open_connection(db_name, readonly=False):
+    """
+    Abre una conexión nueva ya configurada con los PRAGMAs de rendimiento.
+    Con readonly=True abre el archivo con mode=ro y query_only; si falla lanza
+    sqlite3.Error en lugar de terminar, para que el llamador recurra a la conexión normal.
+    """
     try:
-        conn = sqlite3.connect(db_name)
-        conn.execute("PRAGMA foreign_keys = 1;")
+        conn = sqlite3.connect(
+            f"{Path(db_name).absolute().as_uri()}?mode=ro" if readonly else db_name,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+            check_same_thread=False, # El pool garantiza que solo un hilo la use a la vez
+            uri=readonly
+        )
+        for pragma in READONLY_CONNECTION_PRAGMAS if readonly else CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
     except sqlite3.Error as e:
+        if readonly: raise
         print(f"Error crítico al conectar BD '{db_name}': {e}"); exit(1)
 
+
+class _TimedCursor:
+    """
+    Cursor que suma tiempo de SQL, sentencias y filas leídas a la operación instrumentada
+    en curso (metricas.py) y, con el perfil SQL activo, a la sentencia ejecutada (perfil_sql.py).
+    Sin operación activa ni perfil delega directamente sin medir.
+    """
+    __slots__ = ('_cursor', '_sql')
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_sql', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_cursor', '_sql'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value) # row_factory, arraysize...
+
+    def _record_rows(self, elapsed, rows):
+        metricas.registrar_sql(elapsed, filas=rows)
+        if perfil_sql.ACTIVO and self._sql is not None:
+            perfil_sql.registrar_lectura(self._sql, elapsed, rows)
+
+    def _timed(self, method, args, statements):
+        if perfil_sql.ACTIVO and args:
+            self._sql = args[0]
+        elif metricas.tramo_activo() is None:
+            method(*args)
+            return self
+        start = time.perf_counter()
+        try:
+            method(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            metricas.registrar_sql(elapsed, consultas=statements)
+            if perfil_sql.ACTIVO and args:
+                perfil_sql.registrar_ejecucion(args[0], elapsed)
+        return self
+
+    def execute(self, *args):
+        return self._timed(self._cursor.execute, args, 1)
+
+    def executemany(self, *args):
+        return self._timed(self._cursor.executemany, args, 1)
+
+    def _fetch(self, method, *args):
+        if metricas.tramo_activo() is None and not perfil_sql.ACTIVO:
+            return method(*args)
+        start = time.perf_counter()
+        result = method(*args)
+        self._record_rows(time.perf_counter() - start, len(result))
+        return result
+
+    def fetchone(self):
+        if metricas.tramo_activo() is None and not perfil_sql.ACTIVO:
+            return self._cursor.fetchone()
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._record_rows(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        if metricas.tramo_activo() is None and not perfil_sql.ACTIVO:
+            return iter(self._cursor)
+        return self._timed_iter()
+
+    def _timed_iter(self):
+        elapsed, rows = 0.0, 0
+        iterator = iter(self._cursor)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                rows += 1
+                yield row
+        finally:
+            self._record_rows(elapsed, rows)
+
+    def __next__(self):
+        return next(self._cursor)
+
+
+class PooledConnection:
+    """
+    Conexión prestada por el pool. Se usa igual que un sqlite3.Connection
+    (cursor, execute, commit, 'with conn:' para transacciones...), pero close()
+    la devuelve al pool en lugar de cerrarla. Si el llamador olvida cerrarla,
+    se devuelve sola cuando el objeto deja de usarse.
+    """
+    __slots__ = ('_conn', '_release', '__weakref__')
+
+    def __init__(self, pool, raw_conn):
+        object.__setattr__(self, '_conn', raw_conn)
+        object.__setattr__(self, '_release', weakref.finalize(self, pool._release, raw_conn))
+
+    def close(self):
+        self._release()
+        object.__setattr__(self, '_conn', None)
+
+    def _abierta(self):
+        """Conexión real, o el mismo error que un sqlite3.Connection cerrado."""
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._abierta(), name)
+
+    def __setattr__(self, name, value):
+        # row_factory, text_factory, etc. se aplican a la conexión real
+        setattr(self._abierta(), name, value)
+
+    # Cursores medidos para metricas.py (tiempo de SQL y filas por operación)
+    def cursor(self, *args):
+        return _TimedCursor(self._abierta().cursor(*args))
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def __enter__(self):
+        self._abierta().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        return self._abierta().__exit__(exc_type, exc_value, exc_tb)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLite de larga vida para un archivo de BD.
+    Cada hilo reutiliza preferentemente la última conexión que usó, así conserva
+    caché de páginas y sentencias preparadas calientes entre llamadas.
+    """
+    def __init__(self, db_name, max_connections=POOL_MAX_CONNECTIONS, readonly=False):
+        self.db_name = db_name
+        self.max_connections = max_connections
+        self.readonly = readonly
+        self._cond = threading.Condition()
+        self._idle = []        # Conexiones libres (la última devuelta al final)
+        self._count = 0        # Conexiones abiertas (libres + prestadas + en creación)
+        self._closed = False
+        self._local = threading.local()
+        self.stats = {
+            'hits': 0,          # Préstamos servidos con una conexión ya abierta
+            'misses': 0,        # Préstamos que tuvieron que abrir una conexión nueva
+            'waits': 0,         # Préstamos que esperaron por una conexión libre
+            'wait_time_s': 0.0,
+            'timeouts': 0,
+            'rollbacks': 0,     # Transacciones abiertas descartadas al devolver la conexión
+        }
+
+    def _take_idle(self):
+        own = getattr(self._local, 'conn', None)
+        if own is not None:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i] is own:
+                    return self._idle.pop(i)
+        return self._idle.pop()
+
+    def acquire(self, timeout=POOL_ACQUIRE_TIMEOUT):
+        raw = None
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError(f"El pool de '{self.db_name}' está cerrado.")
+            if not self._idle and self._count >= self.max_connections:
+                self.stats['waits'] += 1
+                start = time.perf_counter()
+                if not self._cond.wait_for(lambda: self._idle or self._count < self.max_connections or self._closed, timeout):
+                    self.stats['timeouts'] += 1
+                    raise sqlite3.OperationalError(
+                        f"Pool de conexiones agotado: ninguna conexión libre tras {timeout}s ({self.db_name}).")
+                self.stats['wait_time_s'] += time.perf_counter() - start
+                if self._closed:
+                    raise sqlite3.ProgrammingError(f"El pool de '{self.db_name}' está cerrado.")
+            if self._idle:
+                raw = self._take_idle()
+                self.stats['hits'] += 1
+            else:
+                self._count += 1 # Reservar el cupo; la conexión se abre fuera del lock
+                self.stats['misses'] += 1
+
+        if raw is None:
+            try:
+                raw = _open_connection(self.db_name, self.readonly)
+            except BaseException:
+                with self._cond:
+                    self._count -= 1
+                    self._cond.notify()
+                raise
+        self._local.conn = raw
+        return PooledConnection(self, raw)
+
+    def _release(self, raw):
+        try:
+            if raw.in_transaction:
+                raw.rollback() # No dejar transacciones colgando para el siguiente usuario
+                self.stats['rollbacks'] += 1
+            raw.row_factory = None
+            raw.text_factory = str
+        except sqlite3.Error as e:
+            print(f"Warning: Conexión descartada del pool por error al devolverla: {e}")
+            self._discard(raw)
+            return
+        with self._cond:
+            if self._closed:
+                self._count -= 1
+                raw.close()
+            else:
+                self._idle.append(raw)
+            self._cond.notify()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        """Cierra las conexiones libres; las prestadas se cierran al devolverse."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._cond.notify_all()
+        for raw in idle:
+            try:
+                raw.close()
+            except sqlite3.Error:
+                pass
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['open'] = self._count
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._count - len(self._idle)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else 0.0
+        return stats
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(db_name=None, readonly=False):
+    """Devuelve (creándolo si hace falta) el pool del archivo de BD indicado."""
+    db_name = db_name or DB_NAME
+    with _POOLS_LOCK:
+        pool = _POOLS.get((db_name, readonly))
+        if pool is None:
+            if readonly:
+                pool = ConnectionPool(db_name, POOL_READONLY_MAX_CONNECTIONS, readonly=True)
+            else:
+                pool = ConnectionPool(db_name)
+            _POOLS[(db_name, readonly)] = pool
+        return pool
+
+# --- Funciones de Utilidad para la Base de Datos ---
+def connect_db(db_name=None):
+    """
+    Presta una conexión del pool. El llamador la usa como siempre y al terminar
+    llama a conn.close(), que la devuelve al pool sin cerrarla realmente.
+    """
+    conn = get_pool(db_name).acquire()
+    perfil_sql.preparar_conexion(conn._conn) # Hooks de trace/progreso si el perfil SQL está activo
+    return conn
+
+def connect_db_readonly(db_name=None):
+    """
+    Presta una conexión de solo lectura (mode=ro, query_only) de su propio pool, para
+    lecturas que se reparten entre hilos. Lanza sqlite3.Error si no se puede abrir.
+    No sirve para adjuntar el archivo en frío (archivo.adjuntar crea vistas TEMP).
+    """
+    conn = get_pool(db_name, readonly=True).acquire()
+    perfil_sql.preparar_conexion(conn._conn)
+    return conn
+
+_READ_EXECUTOR = None
+_READ_EXECUTOR_LOCK = threading.Lock()
+
+def get_read_executor():
+    """Hilos compartidos para lanzar en paralelo lecturas independientes con connect_db_readonly()."""
+    global _READ_EXECUTOR
+    with _READ_EXECUTOR_LOCK:
+        if _READ_EXECUTOR is None:
+            _READ_EXECUTOR = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="lectura")
+        return _READ_EXECUTOR
+
+@contextmanager
+def get_connection(db_name=None):
+    """
+    Context manager para usar una conexión del pool:
+
+        with database.get_connection() as conn:
+            with conn:   # transacción (commit/rollback automático)
+                ...
+    """
+    conn = connect_db(db_name)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def pool_stats(db_name=None, readonly=False):
+    """Contadores del pool (hits, misses, esperas, conexiones abiertas/en uso)."""
+    return get_pool(db_name, readonly).get_stats()
+
+def close_all_connections():
+    """Cierra todos los pools (al salir de la aplicación o antes de reemplazar el archivo de BD)."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close_all()
+
 def create_tables(conn):
     # ... (como antes) ...
     if not conn: return False
@@ -373,6 +1893,9 @@ def initialize_database():
                     print("Fallo al crear/verificar tablas.")
                     # Rollback automático por el 'with conn:' si create_tables falla
 
+            if created_successfully:
+                created_successfully = apply_migrations(conn)
+
             if created_successfully:
                 print(f"Base de datos '{DB_NAME}' lista.")
 
@@ -390,6 +1913,14 @@ def initialize_database():
     if not created_successfully:
          print("Fallo al inicializar BD.")
 
-# --- Ejecución Principal (sin cambios) ---
+# --- Ejecución Principal ---
 if __name__ == "__main__":
-    initialize_database()
\ No newline at end of file
+    if "--dry-run" in sys.argv:
+        # Solo informa qué migraciones faltan y qué consultas cambiarían de plan
+        conn = connect_db()
+        try:
+            print(migration_dry_run_report(conn))
+        finally:
+            conn.close()
+    else:
+        initialize_database()
\ No newline at end of file
@@ -0,0 +1,476 @@
+# directorio_pacientes.py
+# Directorio en memoria de los pacientes, ya descifrado, para las búsquedas de recepción.
+#
+# Guarda por paciente el id, N° de historia, nombre completo, cédula, fecha de nacimiento y sexo
+# en columnas (array para los enteros, listas para el texto) y un vocabulario con las palabras
+# normalizadas de los nombres -> posiciones. Ninguna búsqueda recorre todos los pacientes:
+# - vocabulario, N° de historia y cédula normalizada se guardan ordenados y un prefijo se
+#   resuelve con bisect;
+# - la subcadena dentro de una palabra (3+ letras) se resuelve con un mapa trigrama -> palabras;
+# - la búsqueda difusa solo recorre palabras (no pacientes) con la misma inicial.
+# Los índices ordenados se construyen al terminar la carga y luego se mantienen fila a fila.
+#
+# Se carga una vez tras el login en un hilo en segundo plano, por lotes de id, y se refresca de
+# forma incremental antes de buscar: pacientes nuevos por id > máximo conocido y modificados por
+# fecha_ultima_mod. Una búsqueda que llega durante la carga espera como mucho ESPERA_CARGA_S;
+# si no terminó, PatientActions busca en SQL (índice de trigramas), que no reconoce cédulas
+# parciales ni errores de tipeo, hasta que el directorio esté listo.
+# perform_logout lo vacía: tras la sesión no quedan nombres ni cédulas descifrados en memoria.
+import bisect
+import re
+import threading
+import time
+import traceback
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import database
+
+REFRESCO_MIN_S = 2.0          # Intervalo mínimo entre refrescos incrementales al buscar
+MARGEN_MODIFICACION_S = 5     # Se releen las modificaciones de los últimos segundos (commits tardíos)
+LOTE_CARGA = 5000             # Filas por lote al cargar (keyset por id)
+MIN_LETRAS_DIFUSA = 4         # Palabras más cortas no se comparan de forma difusa
+ESPERA_CARGA_S = 0.3          # Lo que una búsqueda espera a la carga antes de usar SQL
+SEXOS = ('', 'Femenino', 'Masculino', 'Otro')
+
+# Puntuación de cada palabra del término según cómo coincide (se suman; mayor es mejor)
+PUNTOS_EXACTA, PUNTOS_PREFIJO, PUNTOS_SUBCADENA, PUNTOS_DIFUSA = 4, 3, 2, 1
+PUNTOS_HISTORIA, PUNTOS_CEDULA = 10, 10
+
+_SQL_FILAS = """SELECT id, numero_historia, nombres, apellidos, cedula, fecha_nacimiento, sexo, fecha_ultima_mod
+                FROM Pacientes"""
+
+
+def distancia_acotada(a, b, maximo):
+    """
+    Distancia de edición entre a y b contando la transposición de dos letras contiguas como un
+    solo error ('igelsia' -> 'iglesia'), o maximo + 1 en cuanto se sabe que la supera.
+    """
+    if abs(len(a) - len(b)) > maximo: return maximo + 1
+    anteanterior, anterior = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        minimo_fila = i
+        for j, cb in enumerate(b, 1):
+            valor = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                valor = min(valor, anteanterior[j - 2] + 1)
+            actual.append(valor)
+            if valor < minimo_fila: minimo_fila = valor
+        if minimo_fila > maximo: return maximo + 1
+        anteanterior, anterior = anterior, actual
+    return anterior[-1]
+
+def _tolerancia(palabra):
+    return 1 if len(palabra) < 8 else 2
+
+def _claves_historia(historia):
+    """Claves de prefijo de un N° de historia: completo y su último tramo alfanumérico ('HC-01234' -> '01234')."""
+    if not historia: return ()
+    completa = historia.lower()
+    tramo = re.split(r'[^0-9a-z]+', completa)[-1]
+    return (completa, tramo) if tramo and tramo != completa else (completa,)
+
+def _trigramas(palabra):
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+def _marca(fecha_mod):
+    """fecha_ultima_mod (con ' ' o 'T' como separador) -> datetime, o None si no se entiende."""
+    if not fecha_mod: return None
+    try: return datetime.fromisoformat(str(fecha_mod))
+    except ValueError: return None
+
+
+class _IndicePrefijos:
+    """Claves de texto ordenadas con la posición del paciente al lado (lista + array, sin tuplas)."""
+    __slots__ = ('claves', 'posiciones')
+
+    def __init__(self, pares):
+        claves, posiciones = [], []
+        for clave, pos in pares:
+            claves.append(clave); posiciones.append(pos)
+        orden = sorted(range(len(claves)), key=claves.__getitem__)
+        self.claves = [claves[i] for i in orden]
+        self.posiciones = array('q', (posiciones[i] for i in orden))
+
+    def agregar(self, clave, pos):
+        i = bisect.bisect_right(self.claves, clave)
+        self.claves.insert(i, clave); self.posiciones.insert(i, pos)
+
+    def quitar(self, clave, pos):
+        i = bisect.bisect_left(self.claves, clave)
+        while i < len(self.claves) and self.claves[i] == clave:
+            if self.posiciones[i] == pos:
+                del self.claves[i]; del self.posiciones[i]
+                return
+            i += 1
+
+    def con_prefijo(self, prefijo):
+        """[(clave, posición)] de las claves que empiezan por 'prefijo'."""
+        desde = bisect.bisect_left(self.claves, prefijo)
+        hasta = bisect.bisect_left(self.claves, prefijo + '\uffff')
+        return zip(self.claves[desde:hasta], self.posiciones[desde:hasta])
+
+
+class _Columnas:
+    """Estado de un directorio cargado. Solo se modifica bajo el lock del directorio."""
+    __slots__ = ('db_name', 'ids', 'historias', 'nombres', 'cedulas', 'cedulas_norm', 'nacimientos',
+                 'sexos', 'posicion', 'palabras', 'trigramas', 'vocabulario', 'indice_historias',
+                 'indice_cedulas', 'max_id', 'marca_mod')
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.ids = array('q')
+        self.historias = []
+        self.nombres = []
+        self.cedulas = []
+        self.cedulas_norm = []
+        self.nacimientos = array('l')   # date.toordinal(); 0 = desconocida
+        self.sexos = array('b')         # índice en SEXOS
+        self.posicion = {}              # id -> posición en las columnas
+        self.palabras = {}              # palabra normalizada -> [posiciones]
+        self.trigramas = {}             # trigrama -> {palabras del vocabulario que lo contienen}
+        # Índices ordenados: None durante la carga, los construye ordenar()
+        self.vocabulario = None         # palabras ordenadas
+        self.indice_historias = None    # _IndicePrefijos de _claves_historia
+        self.indice_cedulas = None      # _IndicePrefijos de cedulas_norm
+        self.max_id = 0
+        self.marca_mod = None           # datetime de la última modificación vista
+
+    def poner(self, fila, nombres, apellidos, cedula):
+        """Añade o actualiza un paciente a partir de una fila de _SQL_FILAS ya descifrada."""
+        paciente_id, historia, _, _, _, nacimiento, sexo, fecha_mod = fila
+        nombre = f"{nombres or ''} {apellidos or ''}".strip()
+        try: ordinal = date.fromisoformat(nacimiento).toordinal() if nacimiento else 0
+        except (ValueError, TypeError): ordinal = 0
+        codigo_sexo = SEXOS.index(sexo) if sexo in SEXOS else 0
+
+        pos = self.posicion.get(paciente_id)
+        if pos is None:
+            pos = self.posicion[paciente_id] = len(self.ids)
+            self.ids.append(paciente_id); self.historias.append(historia); self.nombres.append(nombre)
+            self.cedulas.append(cedula); self.cedulas_norm.append(database.normalize_cedula(cedula) if cedula else None)
+            self.nacimientos.append(ordinal); self.sexos.append(codigo_sexo)
+        else:
+            for palabra in set(database.normalize_name(self.nombres[pos]).split()):
+                self._quitar_palabra(palabra, pos)
+            self._indexar(pos, quitar=True)
+            self.historias[pos] = historia; self.nombres[pos] = nombre
+            self.cedulas[pos] = cedula; self.cedulas_norm[pos] = database.normalize_cedula(cedula) if cedula else None
+            self.nacimientos[pos] = ordinal; self.sexos[pos] = codigo_sexo
+
+        for palabra in set(database.normalize_name(nombre).split()):
+            self._agregar_palabra(palabra, pos)
+        self._indexar(pos)
+        if paciente_id > self.max_id: self.max_id = paciente_id
+        marca = _marca(fecha_mod)
+        if marca and (self.marca_mod is None or marca > self.marca_mod): self.marca_mod = marca
+
+    def _agregar_palabra(self, palabra, pos):
+        posiciones = self.palabras.get(palabra)
+        if posiciones is not None:
+            posiciones.append(pos); return
+        self.palabras[palabra] = [pos]
+        for trigrama in _trigramas(palabra):
+            self.trigramas.setdefault(trigrama, set()).add(palabra)
+        if self.vocabulario is not None: bisect.insort(self.vocabulario, palabra)
+
+    def _quitar_palabra(self, palabra, pos):
+        posiciones = self.palabras.get(palabra)
+        if posiciones is None: return
+        posiciones.remove(pos)
+        if posiciones: return
+        del self.palabras[palabra]
+        for trigrama in _trigramas(palabra):
+            palabras = self.trigramas[trigrama]
+            palabras.discard(palabra)
+            if not palabras: del self.trigramas[trigrama]
+        if self.vocabulario is not None:
+            del self.vocabulario[bisect.bisect_left(self.vocabulario, palabra)]
+
+    def _indexar(self, pos, quitar=False):
+        """Pone (o quita) la historia y la cédula de 'pos' en los índices ordenados, si ya existen."""
+        if self.indice_historias is None: return
+        operacion_historias = self.indice_historias.quitar if quitar else self.indice_historias.agregar
+        for clave in _claves_historia(self.historias[pos]):
+            operacion_historias(clave, pos)
+        cedula = self.cedulas_norm[pos]
+        if cedula:
+            (self.indice_cedulas.quitar if quitar else self.indice_cedulas.agregar)(cedula, pos)
+
+    def ordenar(self):
+        """Construye los índices ordenados tras la carga; desde entonces poner() los mantiene."""
+        self.vocabulario = sorted(self.palabras)
+        self.indice_historias = _IndicePrefijos((clave, pos) for pos, historia in enumerate(self.historias)
+                                                for clave in _claves_historia(historia))
+        self.indice_cedulas = _IndicePrefijos((cedula, pos) for pos, cedula in enumerate(self.cedulas_norm) if cedula)
+
+    def fila(self, pos):
+        """Paciente en el formato de PatientActions.get_list."""
+        ordinal = self.nacimientos[pos]
+        nacimiento = date.fromordinal(ordinal) if ordinal else None
+        edad = None
+        if nacimiento:
+            hoy = date.today()
+            edad = hoy.year - nacimiento.year - ((hoy.month, hoy.day) < (nacimiento.month, nacimiento.day))
+        return {
+            'id': self.ids[pos],
+            'numero_historia': self.historias[pos],
+            'nombre_completo': self.nombres[pos],
+            'cedula': self.cedulas[pos],
+            'fecha_nacimiento': nacimiento.isoformat() if nacimiento else None,
+            'sexo': SEXOS[self.sexos[pos]] or None,
+            'edad': edad,
+        }
+
+
+class DirectorioPacientes:
+    """Directorio de pacientes del proceso (ver DIRECTORIO). Seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresco_lock = threading.Lock()
+        self._estado = None
+        self._generacion = 0          # Cambia al vaciar: una carga en curso no publica su resultado
+        self._hilo = None
+        self._ultimo_refresco = 0.0
+        self._cambios_pendientes = False
+        self.cargados = 0             # Pacientes ya descifrados por la carga en curso (diagnóstico)
+        self.cargas = 0
+        self.refrescos = 0
+
+    @property
+    def listo(self):
+        estado = self._estado
+        return estado is not None and estado.db_name == database.DB_NAME
+
+    # --- Carga y refresco ---
+    @staticmethod
+    def _descifrar(filas):
+        return database.decrypt_many([fila[i] for fila in filas for i in (2, 3, 4)])
+
+    def _aplicar(self, estado, filas, descifrados=None):
+        """Descifra nombres, apellidos y cédula de las filas en un lote y las pone en 'estado'."""
+        if descifrados is None: descifrados = self._descifrar(filas)
+        for n, fila in enumerate(filas):
+            estado.poner(fila, *descifrados[n * 3:n * 3 + 3])
+
+    def cargar(self):
+        """
+        Carga completa por lotes de id. Mientras se descifra un lote se lee el siguiente, así la
+        lectura de SQLite no se suma al descifrado. Retorna el número de pacientes, o None si
+        falla o se vació.
+        """
+        generacion = self._generacion
+        estado = _Columnas(database.DB_NAME)
+        inicio = time.perf_counter()
+        self.cargados = 0
+        conn = None
+        try:
+            conn = database.connect_db()
+            leer = lambda desde_id: conn.execute(f"{_SQL_FILAS} WHERE id > ? ORDER BY id LIMIT ?",
+                                                 (desde_id, LOTE_CARGA)).fetchall()
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="directorio-descifrado") as descifrador:
+                filas = leer(0)
+                while filas:
+                    descifrando = descifrador.submit(self._descifrar, filas)
+                    siguientes = leer(filas[-1][0])
+                    self._aplicar(estado, filas, descifrando.result())
+                    self.cargados = len(estado.ids)
+                    if generacion != self._generacion: return None # Logout durante la carga
+                    filas = siguientes
+        except Exception as e:
+            print(f"DirectorioPacientes: Error cargando el directorio: {e}"); traceback.print_exc()
+            return None
+        finally:
+            if conn: conn.close()
+        estado.ordenar()
+        with self._lock:
+            if generacion != self._generacion: return None
+            self._estado = estado
+            self._ultimo_refresco = time.monotonic()
+            self._cambios_pendientes = False
+            self.cargas += 1
+        print(f"DirectorioPacientes: {len(estado.ids)} pacientes cargados en {(time.perf_counter() - inicio) * 1000:.0f} ms.")
+        return len(estado.ids)
+
+    def cargar_en_segundo_plano(self):
+        """Lanza la carga en un hilo (tras el login). No hace nada si ya hay una en curso."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive(): return
+            self._hilo = threading.Thread(target=self.cargar, name="directorio-pacientes", daemon=True)
+            self._hilo.start()
+
+    def esperar_carga(self, timeout=ESPERA_CARGA_S):
+        """
+        Lanza la carga si hace falta y espera como mucho 'timeout' a que termine (una búsqueda
+        recién iniciada la sesión no debe quedarse esperando). Retorna True si está listo.
+        """
+        if self.listo: return True
+        self.cargar_en_segundo_plano()
+        hilo = self._hilo
+        if hilo is not None and hilo is not threading.current_thread():
+            hilo.join(timeout)
+        return self.listo
+
+    def marcar_cambios(self):
+        """Un guardado de pacientes terminó: la próxima búsqueda refresca sin esperar REFRESCO_MIN_S."""
+        self._cambios_pendientes = True
+
+    def refrescar(self):
+        """
+        Trae los pacientes nuevos (id > máximo conocido) y los modificados desde la última
+        marca de fecha_ultima_mod. Retorna (nuevos, modificados), o None si no está cargado.
+        """
+        estado = self._estado
+        if estado is None or estado.db_name != database.DB_NAME: return None
+        if not self._refresco_lock.acquire(blocking=False):
+            return (0, 0) # Otro hilo ya está refrescando
+        conn = None
+        try:
+            self._cambios_pendientes = False
+            conn = database.connect_db()
+            nuevas = conn.execute(f"{_SQL_FILAS} WHERE id > ? ORDER BY id", (estado.max_id,)).fetchall()
+            modificadas = []
+            if estado.marca_mod is not None:
+                # Marca con ' ' como separador: también devuelve las fechas guardadas con 'T' de ese día
+                desde = (estado.marca_mod - timedelta(seconds=MARGEN_MODIFICACION_S)).strftime("%Y-%m-%d %H:%M:%S")
+                modificadas = conn.execute(f"{_SQL_FILAS} WHERE fecha_ultima_mod >= ? AND id <= ?",
+                                           (desde, estado.max_id)).fetchall()
+            else:
+                modificadas = conn.execute(f"{_SQL_FILAS} WHERE fecha_ultima_mod IS NOT NULL AND id <= ?",
+                                           (estado.max_id,)).fetchall()
+            total = conn.execute("SELECT COUNT(id) FROM Pacientes").fetchone()[0]
+        except Exception as e:
+            print(f"DirectorioPacientes: Error refrescando el directorio: {e}"); traceback.print_exc()
+            self._refresco_lock.release()
+            return None
+        finally:
+            if conn: conn.close()
+        try:
+            with self._lock:
+                if self._estado is not estado: return (0, 0) # Se vació o recargó mientras tanto
+                if nuevas: self._aplicar(estado, nuevas)
+                if modificadas: self._aplicar(estado, modificadas)
+                self._ultimo_refresco = time.monotonic()
+                self.refrescos += 1
+                recargar = total < len(estado.ids) # Hubo borrados: no se detectan por fecha
+        finally:
+            self._refresco_lock.release()
+        if recargar:
+            print("DirectorioPacientes: Hay menos pacientes que en el directorio, recargando.")
+            self.cargar()
+        return (len(nuevas), len(modificadas))
+
+    def _refrescar_si_toca(self):
+        if self._cambios_pendientes or time.monotonic() - self._ultimo_refresco >= REFRESCO_MIN_S:
+            self.refrescar()
+
+    def vaciar(self):
+        """Descarta todo lo descifrado (logout). Una carga en curso no llega a publicarse."""
+        with self._lock:
+            self._generacion += 1
+            self._estado = None
+            self._cambios_pendientes = False
+        print("DirectorioPacientes: Directorio vaciado.")
+
+    # --- Búsqueda ---
+    def _puntos_palabra(self, estado, palabra, difusa):
+        """{posición: puntos} de los pacientes con alguna palabra del nombre que coincide con 'palabra'."""
+        puntos = {}
+        def sumar(posiciones, valor):
+            for pos in posiciones:
+                if puntos.get(pos, 0) < valor: puntos[pos] = valor
+
+        vocabulario = estado.vocabulario
+        desde = bisect.bisect_left(vocabulario, palabra)
+        hasta = bisect.bisect_left(vocabulario, palabra + '\uffff')
+        for candidata in vocabulario[desde:hasta]:
+            sumar(estado.palabras[candidata], PUNTOS_EXACTA if candidata == palabra else PUNTOS_PREFIJO)
+        if len(palabra) >= 3:
+            # Misma regla que database.name_matches: 3+ letras coinciden en cualquier parte de la palabra.
+            # Candidatas: las palabras que contienen todos sus trigramas (empezando por el más raro).
+            conjuntos = sorted((estado.trigramas.get(t, ()) for t in _trigramas(palabra)), key=len)
+            candidatas = set(conjuntos[0]).intersection(*conjuntos[1:]) if conjuntos[0] else ()
+            for candidata in candidatas:
+                if palabra in candidata and not candidata.startswith(palabra):
+                    sumar(estado.palabras[candidata], PUNTOS_SUBCADENA)
+        if difusa and len(palabra) >= MIN_LETRAS_DIFUSA:
+            # Errores de tipeo: se compara con la palabra completa y con su inicio (búsqueda mientras
+            # se escribe). Solo palabras con la misma inicial, para no recorrer todo el vocabulario.
+            tolerancia = _tolerancia(palabra)
+            desde = bisect.bisect_left(vocabulario, palabra[0])
+            hasta = bisect.bisect_left(vocabulario, palabra[0] + '\uffff')
+            for candidata in vocabulario[desde:hasta]:
+                if candidata.startswith(palabra): continue
+                if (distancia_acotada(palabra, candidata, tolerancia) <= tolerancia or
+                        (len(candidata) > len(palabra) and
+                         distancia_acotada(palabra, candidata[:len(palabra)], tolerancia) <= tolerancia)):
+                    sumar(estado.palabras[candidata], PUNTOS_DIFUSA)
+        return puntos
+
+    def _puntos(self, estado, termino, difusa):
+        """{posición: puntos} de los pacientes que coinciden con el término completo."""
+        puntos = {}
+        # N° de historia: inicio del número completo o de su último tramo ('HC-0123' o '0123')
+        for _, pos in estado.indice_historias.con_prefijo(termino.lower()):
+            puntos[pos] = PUNTOS_HISTORIA
+        digitos = database.normalize_cedula(termino)
+        if digitos and len(digitos) >= 3:
+            for cedula, pos in estado.indice_cedulas.con_prefijo(digitos):
+                if cedula != digitos or database.same_cedula(estado.cedulas[pos], termino):
+                    puntos[pos] = puntos.get(pos, 0) + PUNTOS_CEDULA
+        if any(ch.isalpha() for ch in termino):
+            palabras = database.normalize_name(termino).split()
+            por_nombre = None
+            for palabra in palabras:
+                coincidencias = self._puntos_palabra(estado, palabra, difusa)
+                if por_nombre is None:
+                    por_nombre = coincidencias
+                else: # Todas las palabras del término deben coincidir
+                    por_nombre = {pos: p + coincidencias[pos] for pos, p in por_nombre.items() if pos in coincidencias}
+                if not por_nombre: break
+            for pos, p in (por_nombre or {}).items():
+                puntos[pos] = puntos.get(pos, 0) + p
+        return puntos
+
+    def buscar(self, termino, limite=50, difusa=True):
+        """
+        Pacientes que coinciden con el término (inicio del N° historia, inicio de la cédula o
+        palabras del nombre por prefijo/subcadena), ordenados por relevancia y luego del más reciente al más
+        antiguo. Si hay menos de 'limite' resultados y 'difusa', completa con coincidencias
+        aproximadas (errores de tipeo); con limite=None (todos) solo si no hubo ninguno exacto.
+        Retorna la lista en el formato de get_list, o None si el directorio no está cargado.
+        """
+        if not self.listo:
+            if self._estado is not None: self.cargar_en_segundo_plano() # Cambió la BD activa
+            return None
+        termino = (termino or '').strip()
+        self._refrescar_si_toca()
+        with self._lock:
+            estado = self._estado
+            if estado is None: return None
+            if not termino:
+                posiciones = sorted(range(len(estado.ids)), key=lambda pos: -estado.ids[pos])
+                return [estado.fila(pos) for pos in posiciones[:limite]]
+            puntos = self._puntos(estado, termino, difusa=False)
+            if difusa and len(puntos) < (limite or 1) and any(ch.isalpha() for ch in termino):
+                for pos, p in self._puntos(estado, termino, difusa=True).items():
+                    puntos.setdefault(pos, p)
+            posiciones = sorted(puntos, key=lambda pos: (-puntos[pos], -estado.ids[pos]))
+            return [estado.fila(pos) for pos in posiciones[:limite]]
+
+    def estadisticas(self):
+        estado = self._estado
+        return {
+            'listo': self.listo,
+            'pacientes': len(estado.ids) if estado else 0,
+            'cargados': self.cargados,
+            'palabras': len(estado.palabras) if estado else 0,
+            'cargas': self.cargas,
+            'refrescos': self.refrescos,
+        }
+
+
+DIRECTORIO = DirectorioPacientes()
@@ -0,0 +1,132 @@
+# directorio_usuarios.py
+# Directorio en memoria del personal (tabla Usuarios), ya descifrado, para resolver nombres.
+#
+# Usuarios.nombre_completo está cifrado y las mismas pocas decenas de nombres aparecen en cada
+# evolución, orden, consulta, entrada del historial y en el listado de usuarios. En lugar de unir
+# con Usuarios y descifrar fila por fila, esas rutas leen id -> nombre de usuario, nombre completo,
+# rol, especialidad y estado de aquí.
+#
+# Se carga entero la primera vez que se pide un usuario (o al cambiar de archivo de BD) y
+# MedicoActions lo refresca tras add_new, update_details y toggle_status. Un id desconocido
+# (usuario creado desde otra instancia) fuerza una recarga, como mucho cada RECARGA_MIN_S.
+# perform_logout lo vacía junto con el resto de datos descifrados.
+import threading
+import time
+import traceback
+
+import database
+
+RECARGA_MIN_S = 5.0 # Intervalo mínimo entre recargas provocadas por ids desconocidos
+
+_SQL_USUARIOS = "SELECT id, nombre_usuario, nombre_completo, rol, especialidad, activo FROM Usuarios"
+
+
+class DirectorioUsuarios:
+    """id -> {'id', 'nombre_usuario', 'nombre_completo', 'rol', 'especialidad', 'activo'}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._carga_lock = threading.Lock() # Una sola carga inicial aunque la pidan varios hilos a la vez
+        self._usuarios = None     # Diccionario publicado (se reemplaza entero, no se modifica)
+        self._db_name = None
+        self._ultima_carga = 0.0
+        self.cargas = 0
+        self.aciertos = 0
+        self.fallos = 0           # Ids que no estaban (tras recargar si correspondía)
+
+    @staticmethod
+    def _leer(conn, where="", params=()):
+        rows = conn.execute(_SQL_USUARIOS + where, params).fetchall()
+        nombres = database.decrypt_many([row[2] for row in rows])
+        return {
+            row[0]: {'id': row[0], 'nombre_usuario': row[1], 'nombre_completo': nombre,
+                     'rol': row[3], 'especialidad': row[4], 'activo': row[5]}
+            for row, nombre in zip(rows, nombres)
+        }
+
+    def cargar(self):
+        """Lee y descifra todos los usuarios. Retorna True si quedó cargado."""
+        conn = None
+        try:
+            conn = database.connect_db()
+            db_name = database.DB_NAME
+            usuarios = self._leer(conn)
+            with self._lock:
+                self._usuarios, self._db_name = usuarios, db_name
+                self._ultima_carga = time.monotonic()
+                self.cargas += 1
+            return True
+        except Exception as e:
+            print(f"DirectorioUsuarios Error al cargar: {e}"); traceback.print_exc()
+            return False
+        finally:
+            if conn: conn.close()
+
+    def refrescar(self, usuario_id=None):
+        """Relee un usuario tras escribirlo (o todos si no se indica / aún no estaba cargado)."""
+        if usuario_id is None or self._usuarios is None or self._db_name != database.DB_NAME:
+            return self.cargar()
+        conn = None
+        try:
+            conn = database.connect_db()
+            fila = self._leer(conn, " WHERE id = ?", (int(usuario_id),))
+            with self._lock:
+                usuarios = dict(self._usuarios)
+                usuarios.pop(int(usuario_id), None)
+                usuarios.update(fila)
+                self._usuarios = usuarios
+            return True
+        except Exception as e:
+            print(f"DirectorioUsuarios Error al refrescar usuario {usuario_id}: {e}"); traceback.print_exc()
+            return self.cargar()
+        finally:
+            if conn: conn.close()
+
+    def usuarios(self):
+        """Todos los usuarios {id: datos} (carga el directorio si hace falta). No modificar."""
+        if self._usuarios is None or self._db_name != database.DB_NAME:
+            with self._carga_lock:
+                if self._usuarios is None or self._db_name != database.DB_NAME:
+                    self.cargar()
+        return self._usuarios or {}
+
+    def obtener(self, usuario_id):
+        """Datos del usuario o None (id vacío, inexistente o directorio sin cargar por error)."""
+        if usuario_id is None:
+            return None
+        try: usuario_id = int(usuario_id)
+        except (TypeError, ValueError): return None
+        usuario = self.usuarios().get(usuario_id)
+        if usuario is None and time.monotonic() - self._ultima_carga >= RECARGA_MIN_S:
+            self.cargar()
+            usuario = (self._usuarios or {}).get(usuario_id)
+        if usuario is None:
+            self.fallos += 1
+        else:
+            self.aciertos += 1
+        return usuario
+
+    def nombre(self, usuario_id, por_defecto=None):
+        """Nombre completo descifrado, o el nombre de usuario si no lo tiene, o por_defecto."""
+        usuario = self.obtener(usuario_id)
+        if usuario is None:
+            return por_defecto
+        return usuario['nombre_completo'] or usuario['nombre_usuario'] or por_defecto
+
+    def vaciar(self):
+        """Descarta los nombres descifrados (logout); se vuelven a cargar al pedirlos."""
+        with self._lock:
+            self._usuarios = None
+            self._db_name = None
+        print("DirectorioUsuarios: Directorio vaciado.")
+
+    def estadisticas(self):
+        return {
+            'usuarios': len(self._usuarios) if self._usuarios is not None else 0,
+            'cargas': self.cargas,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+        }
+
+
+DIRECTORIO_USUARIOS = DirectorioUsuarios()
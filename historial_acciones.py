@@ -2,67 +2,159 @@
 import sqlite3
 import traceback
 import database # Importar para acceso a BD y desencriptación
+import archivo # Años del historial movidos al archivo en frío
+import metricas # Instrumentación de los métodos públicos
+from directorio_usuarios import DIRECTORIO_USUARIOS # Nombres del personal ya descifrados
 from datetime import datetime # Asegurar que datetime esté importado
 import json # Para parsear detalles_json si es necesario
+import threading
+from collections import OrderedDict
 
+# Conteos del historial por combinación de filtros: {clave: (min_id, max_id_contado, total)}.
+# HistorialAcciones solo crece (ids AUTOINCREMENT), así que al pedir de nuevo el mismo filtro
+# basta contar las filas con id > max_id_contado. Quien borre filas debe llamar a invalidar_conteos();
+# si las borra otro proceso (archivo.py), el cambio de MIN(id) obliga a recontar.
+CONTEOS_MAX_FILTROS = 64
+_conteos = OrderedDict()
+_conteos_lock = threading.Lock()
+
+_FTS = object() # Marca en los parámetros: expresión MATCH, repetida por cada tabla FTS consultada
+
+def invalidar_conteos():
+    with _conteos_lock:
+        _conteos.clear()
+
+@metricas.instrumentar_clase
 class HistorialActions:
 
-    def _get_patient_name(self, cursor, patient_id):
-        """Obtiene 'Nombres Apellidos (HC: XXXXXX)' para un patient_id."""
-        if not patient_id: return "Paciente ID N/A"
+    # Tipos de acción que nombran a un paciente y de dónde sale su ID (registro afectado o detalles_json)
+    _PACIENTE_EN_REGISTRO = {'CREAR_PACIENTE': 'Pacientes', 'ACTUALIZAR_PACIENTE_BASICO': 'Pacientes'}
+    _PACIENTE_EN_DETALLES = {
+        'CREAR_EVOLUCION': ('Evoluciones', 'patient_id'), 'ACTUALIZAR_EVOLUCION': ('Evoluciones', 'patient_id'),
+        'CREAR_ORDEN_MEDICA': ('OrdenesMedicas', 'paciente_id'), 'ACTUALIZAR_ORDEN_MEDICA': ('OrdenesMedicas', 'paciente_id'),
+        'ACTUALIZAR_INGRESO_Y_PACIENTE': (None, 'patient_id'),
+    }
+    LOTE_IN = 500 # IDs por consulta IN (muy por debajo del límite de parámetros de SQLite)
+
+    @staticmethod
+    def _id_entero(valor):
+        try: return int(valor)
+        except (TypeError, ValueError): return None
+
+    def _referencias(self, tipo_accion, tabla_afectada, registro_id, detalles):
+        """
+        Fase 1: (paciente_id, usuario_id) que la descripción de esta entrada va a mostrar.
+        Sigue las mismas condiciones que el enriquecimiento de get_log.
+        """
+        if self._PACIENTE_EN_REGISTRO.get(tipo_accion) == tabla_afectada and registro_id:
+            return registro_id, None
+        if tipo_accion in self._PACIENTE_EN_DETALLES:
+            tabla, clave = self._PACIENTE_EN_DETALLES[tipo_accion]
+            if tabla is None or (tabla == tabla_afectada and registro_id):
+                return detalles.get(clave), None
+        if tabla_afectada == 'Usuarios' and registro_id and (
+                tipo_accion.startswith('ADD_USUARIO') or tipo_accion.startswith('UPDATE_USUARIO') or tipo_accion == 'TOGGLE_ESTADO_USUARIO'):
+            return None, registro_id
+        return None, None
+
+    def _get_patient_names(self, cursor, patient_ids):
+        """
+        Fase 2: {id: 'Nombres Apellidos (HC: XXXXXX)'} con una consulta IN por cada LOTE_IN pacientes
+        y un único descifrado por lotes (caché compartida de database). None si la consulta falla.
+        """
+        ids = sorted({i for i in map(self._id_entero, patient_ids) if i is not None})
+        nombres = {}
         try:
-            cursor.execute("SELECT nombres, apellidos, numero_historia FROM Pacientes WHERE id = ?", (patient_id,))
-            row = cursor.fetchone()
-            if row:
-                nombres_enc, apellidos_enc, hc = row
-                nombres = database.decrypt_data(nombres_enc) or "N/D"
-                apellidos = database.decrypt_data(apellidos_enc) or ""
-                return f"{nombres} {apellidos} (HC: {hc or 'N/A'})".strip()
-            return f"Paciente ID {patient_id} (No encontrado)"
+            for inicio in range(0, len(ids), self.LOTE_IN):
+                lote = ids[inicio:inicio + self.LOTE_IN]
+                cursor.execute(f"SELECT id, nombres, apellidos, numero_historia FROM Pacientes WHERE id IN ({', '.join('?' * len(lote))})", lote)
+                rows = cursor.fetchall()
+                descifrados = database.decrypt_many([valor for row in rows for valor in (row[1], row[2])])
+                for i, (paciente_id, _, _, hc) in enumerate(rows):
+                    nombre = descifrados[2 * i] or "N/D"
+                    apellidos = descifrados[2 * i + 1] or ""
+                    nombres[paciente_id] = f"{nombre} {apellidos} (HC: {hc or 'N/A'})".strip()
+            return nombres
         except Exception as e:
-            # print(f"Error obteniendo nombre de paciente ID {patient_id}: {e}")
-            return f"Paciente ID {patient_id} (Error)"
+            # print(f"Error obteniendo nombres de pacientes {ids}: {e}")
+            return None
 
-    def _get_medico_name(self, cursor, medico_id):
-        """Obtiene 'Nombre Completo (Usuario: X)' para un medico_id."""
-        if not medico_id: return "Usuario ID N/A"
+    def _get_medico_names(self, medico_ids):
+        """Fase 2: {id: 'Nombre Completo (Usuario: X)'} desde el directorio de usuarios. None si falla."""
+        ids = sorted({i for i in map(self._id_entero, medico_ids) if i is not None})
+        nombres = {}
         try:
-            cursor.execute("SELECT nombre_completo, nombre_usuario FROM Usuarios WHERE id = ?", (medico_id,))
-            row = cursor.fetchone()
-            if row:
-                nombre_completo_enc, user_name = row
-                nombre_completo = database.decrypt_data(nombre_completo_enc) or user_name
-                return f"{nombre_completo} (Usuario: {user_name or 'N/A'})"
-            return f"Usuario ID {medico_id} (No encontrado)"
+            for medico_id in ids:
+                usuario = DIRECTORIO_USUARIOS.obtener(medico_id)
+                if usuario is None: continue
+                user_name = usuario['nombre_usuario']
+                nombres[medico_id] = f"{usuario['nombre_completo'] or user_name} (Usuario: {user_name or 'N/A'})"
+            return nombres
         except Exception as e:
-            # print(f"Error obteniendo nombre de médico ID {medico_id}: {e}")
-            return f"Usuario ID {medico_id} (Error)"
+            # print(f"Error obteniendo nombres de usuarios {ids}: {e}")
+            return None
+
+    def _patient_name(self, nombres, patient_id):
+        """Texto para un paciente ya resuelto en fase 2 (mismos textos que la consulta individual)."""
+        if not patient_id: return "Paciente ID N/A"
+        if nombres is None: return f"Paciente ID {patient_id} (Error)"
+        return nombres.get(self._id_entero(patient_id), f"Paciente ID {patient_id} (No encontrado)")
+
+    def _medico_name(self, nombres, medico_id):
+        if not medico_id: return "Usuario ID N/A"
+        if nombres is None: return f"Usuario ID {medico_id} (Error)"
+        return nombres.get(self._id_entero(medico_id), f"Usuario ID {medico_id} (No encontrado)")
+
+    def _contar(self, cursor, count_query, params, tabla, clave):
+        """Total de entradas de 'tabla' para los filtros; solo cuenta las filas nuevas desde la última vez."""
+        with _conteos_lock:
+            min_id, max_id, total = _conteos.get(clave, (0, 0, 0))
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {tabla}")
+        base, tope = (v or 0 for v in cursor.fetchone())
+        if tope < max_id or base != min_id: # Se borraron/archivaron filas (quizá desde otro proceso): recontar
+            min_id, max_id, total = base, 0, 0
+        if tope > max_id:
+            cursor.execute(count_query, list(params) + [max_id, tope])
+            total += cursor.fetchone()[0]
+            max_id = tope
+        with _conteos_lock:
+            _conteos[clave] = (min_id, max_id, total)
+            _conteos.move_to_end(clave)
+            while len(_conteos) > CONTEOS_MAX_FILTROS:
+                _conteos.popitem(last=False)
+        return total
 
     def get_log(self, page=1, per_page=50, filters=None):
         print(f"HistorialActions: Obteniendo log (page: {page}, filters: {filters})")
+        database.flush_audit_log() # Incluir las acciones aún en la cola del escritor asíncrono
         conn = None
+        adjuntos = []
         logs = []
         total_count = 0
         offset = (page - 1) * per_page
 
         select_fields = """
-            ha.id, ha.fecha_hora, ha.usuario_id, u.nombre_usuario AS actor_username,
-            u.nombre_completo AS actor_nombre_completo_enc, /* Nombre del usuario que hizo la acción */
+            ha.id, ha.fecha_hora, ha.usuario_id, /* El nombre del actor sale del directorio de usuarios */
             ha.tipo_accion, ha.tabla_afectada, ha.registro_afectado_id,
             ha.descripcion AS descripcion_original, ha.detalles_json
         """
+        # {tabla}/{fts} se completan por tramo: la BD principal, cada año archivado o la vista que los une
         base_query = f"""
             SELECT {select_fields}
-            FROM HistorialAcciones ha
-            LEFT JOIN Usuarios u ON ha.usuario_id = u.id /* Usar LEFT JOIN por si usuario_id es 0 para LOGIN_FALLIDO */
+            FROM {{tabla}} ha /*rango*/
         """
         count_query = """
             SELECT COUNT(ha.id)
-            FROM HistorialAcciones ha
-            LEFT JOIN Usuarios u ON ha.usuario_id = u.id
+            FROM {tabla} ha
         """
         params = []
         where_clauses = []
+        cursor_fecha = cursor_id = None
+        fts_match = None
+        by_relevance = False
+
+        # Años archivados que caen en el rango de fechas pedido: [(periodo, versión)] (ver archivo.py)
+        periodos = archivo.periodos_historial((filters or {}).get('fecha_desde'), (filters or {}).get('fecha_hasta'))
 
         if filters:
             # ... (tus filtros existentes) ...
@@ -80,114 +172,177 @@ class HistorialActions:
                 where_clauses.append("ha.fecha_hora <= ?")
                 params.append(filters['fecha_hasta'] + " 23:59:59") # Asumir fin del día
             if filters.get('search_term'):
-                # Buscar en la descripción original o en el nombre de usuario del actor
-                where_clauses.append("(ha.descripcion LIKE ? OR u.nombre_usuario LIKE ?)")
-                params.append(f"%{filters['search_term']}%")
-                params.append(f"%{filters['search_term']}%")
-
+                # Buscar en la descripción/tipo de acción o en el nombre de usuario del actor
+                search_term = filters['search_term']
+                if database.historial_fts_ready():
+                    fts_match = database.historial_fts_query(search_term)
+                if fts_match:
+                    where_clauses.append("(ha.id IN ({fts}) OR ha.usuario_id IN (SELECT id FROM Usuarios WHERE nombre_usuario LIKE ?))")
+                    params.append(_FTS)
+                else: # Sin FTS5 (o término sin palabras): recorrido con LIKE
+                    where_clauses.append("(ha.descripcion LIKE ? OR ha.usuario_id IN (SELECT id FROM Usuarios WHERE nombre_usuario LIKE ?))")
+                    params.append(f"%{search_term}%")
+                params.append(f"%{search_term}%")
+                by_relevance = bool(fts_match) and filters.get('orden') == 'relevancia'
+            # Paginación por cursor: la página que sigue a la última fila mostrada (fecha_hora, id)
+            if filters.get('cursor_fecha') and filters.get('cursor_id'):
+                cursor_fecha, cursor_id = filters['cursor_fecha'], int(filters['cursor_id'])
 
-        if where_clauses:
-            sql_where = " WHERE " + " AND ".join(where_clauses)
-            base_query += sql_where
-            count_query += sql_where
+        sql_where = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+        base_query += sql_where
+        count_query += sql_where + (" AND" if where_clauses else " WHERE") + " ha.id > ? AND ha.id <= ?"
+        # Relevancia o una página por OFFSET necesitan un solo SELECT sobre todos los tramos
+        single_select = by_relevance or (cursor_fecha is None and offset > 0)
+        params_key = tuple(fts_match if v is _FTS else v for v in params)
 
-        base_query += f" ORDER BY ha.fecha_hora DESC LIMIT {per_page} OFFSET {offset}"
+        def tramo(sql, esquema, fts_columns="rowid"):
+            """SQL y parámetros de un tramo: 'main', un año adjunto o None (vista que une todos)."""
+            if esquema is None:
+                fts_sql, n_match = archivo.union_fts(adjuntos, fts_columns)
+                tabla = "HistorialAcciones"
+            else:
+                fts_sql, n_match = archivo.union_fts([], fts_columns)
+                fts_sql = fts_sql.replace("FROM HistorialAccionesFTS", f"FROM {esquema}.HistorialAccionesFTS")
+                tabla = f"{esquema}.HistorialAcciones"
+            tramo_params = []
+            for v in params:
+                tramo_params.extend([fts_match] * n_match if v is _FTS else [v])
+            return sql.format(tabla=tabla, fts=fts_sql), tramo_params
 
         try:
             conn = database.connect_db()
             if not conn: raise sqlite3.Error("Fallo conexión DB")
+            adjuntos = archivo.adjuntar(conn, [p for p, _ in periodos], ['HistorialAcciones'] if single_select else [])
+            versiones = dict(periodos)
             cursor = conn.cursor()
 
-            cursor.execute(count_query, params)
-            total_count_row = cursor.fetchone()
-            total_count = total_count_row[0] if total_count_row else 0
-            
-            cursor.execute(base_query, params)
-            rows = cursor.fetchall()
+            # Total: la principal se cuenta de forma incremental; cada año archivado, una vez por versión
+            for esquema in ['main'] + [archivo.esquema(p) for p in adjuntos]:
+                periodo = esquema[len("archivo_"):] if esquema != 'main' else None
+                sql, sql_params = tramo(count_query, esquema)
+                total_count += self._contar(cursor, sql, sql_params, f"{esquema}.HistorialAcciones",
+                                            (database.DB_NAME, periodo, versiones.get(periodo), sql_where, params_key))
+
+            if single_select:
+                esquema = None if adjuntos else 'main'
+                sql, page_params = tramo(base_query, esquema)
+                if by_relevance:
+                    # Ordenar por bm25: más relevantes primero; las que solo coinciden por usuario, al final
+                    rango_sql, n_match = archivo.union_fts(adjuntos if esquema is None else [],
+                                                           "rowid AS fts_id, bm25(HistorialAccionesFTS) AS rango")
+                    sql = sql.replace("/*rango*/", f"LEFT JOIN ({rango_sql}) f ON f.fts_id = ha.id", 1)
+                    page_params = [fts_match] * n_match + page_params
+                    sql += f" ORDER BY f.rango IS NULL, f.rango, ha.fecha_hora DESC, ha.id DESC LIMIT {per_page} OFFSET {offset}"
+                else:
+                    sql += f" ORDER BY ha.fecha_hora DESC, ha.id DESC LIMIT {per_page} OFFSET {offset}"
+                cursor.execute(sql, page_params)
+                rows = cursor.fetchall()
+            else:
+                # Por fecha (primera página o desde el cursor): la principal tiene las acciones más
+                # recientes y cada año archivado las anteriores, así que basta seguir tramo a tramo
+                # hasta llenar la página; con cursor, la página N cuesta lo mismo que la 1 (sin OFFSET).
+                rows = []
+                for esquema in ['main'] + [archivo.esquema(p) for p in adjuntos]:
+                    if len(rows) >= per_page: break
+                    sql, page_params = tramo(base_query, esquema)
+                    if cursor_fecha is not None:
+                        sql += (" AND" if where_clauses else " WHERE") + " (ha.fecha_hora, ha.id) < (?, ?)"
+                        page_params += [cursor_fecha, cursor_id]
+                    sql += f" ORDER BY ha.fecha_hora DESC, ha.id DESC LIMIT {per_page - len(rows)}"
+                    cursor.execute(sql, page_params)
+                    rows.extend(cursor.fetchall())
             colnames = [desc[0] for desc in cursor.description]
             
+            # Fase 1: parsear las filas y reunir los pacientes/usuarios que mencionan sus descripciones
+            entradas = []
+            pacientes_ref, usuarios_ref = set(), set()
             for row in rows:
                 log_entry = dict(zip(colnames, row))
-                
+                detalles = {}
+                if log_entry.get('detalles_json'):
+                    try: detalles = json.loads(log_entry['detalles_json'])
+                    except: detalles = {}
+                paciente_ref, usuario_ref = self._referencias(log_entry['tipo_accion'], log_entry['tabla_afectada'],
+                                                              log_entry['registro_afectado_id'], detalles)
+                if paciente_ref: pacientes_ref.add(paciente_ref)
+                if usuario_ref: usuarios_ref.add(usuario_ref)
+                entradas.append((log_entry, detalles))
+
+            # Fase 2: una consulta IN por lote de pacientes y un descifrado por lotes para toda la página;
+            # los usuarios (referidos y actores) salen del directorio ya descifrado
+            nombres_pacientes = self._get_patient_names(cursor, pacientes_ref)
+            nombres_medicos = self._get_medico_names(usuarios_ref)
+
+            for log_entry, detalles in entradas:
                 # Formatear fecha
                 try:
                     dt_obj = datetime.fromisoformat(log_entry['fecha_hora'])
                     log_entry['fecha_hora_formateada'] = dt_obj.strftime('%d/%m/%Y %I:%M:%S %p') # Con AM/PM
                 except: log_entry['fecha_hora_formateada'] = log_entry['fecha_hora']
 
-                # Nombre del actor (usuario que realizó la acción)
-                actor_nombre_completo = "Sistema/N/A"
-                if log_entry.get('actor_nombre_completo_enc'):
-                    try:
-                        actor_nombre_completo = database.decrypt_data(log_entry['actor_nombre_completo_enc']) or log_entry.get('actor_username', 'N/D')
-                    except: actor_nombre_completo = log_entry.get('actor_username', '[Err Decrypt]')
-                elif log_entry.get('actor_username'): # Si no hay nombre completo encriptado, usa el username
-                     actor_nombre_completo = log_entry.get('actor_username')
-
-                log_entry['actor_display_name'] = actor_nombre_completo
+                # Nombre del actor (usuario que realizó la acción; usuario_id 0 en LOGIN_FALLIDO)
+                actor = DIRECTORIO_USUARIOS.obtener(log_entry.get('usuario_id') or None) or {}
+                log_entry['actor_username'] = actor.get('nombre_usuario')
+                log_entry['actor_display_name'] = actor.get('nombre_completo') or actor.get('nombre_usuario') or "Sistema/N/A"
 
                 # Enriquecer descripción
                 tipo_accion = log_entry['tipo_accion']
                 tabla_afectada = log_entry['tabla_afectada']
                 registro_id = log_entry['registro_afectado_id']
                 descripcion_original = log_entry['descripcion_original']
-                detalles = {}
-                if log_entry.get('detalles_json'):
-                    try: detalles = json.loads(log_entry['detalles_json'])
-                    except: detalles = {}
 
                 desc_entendible = descripcion_original # Empezar con la original
 
                 if tipo_accion == 'CREAR_PACIENTE' and tabla_afectada == 'Pacientes' and registro_id:
-                    paciente_nombre = self._get_patient_name(cursor, registro_id)
+                    paciente_nombre = self._patient_name(nombres_pacientes, registro_id)
                     desc_entendible = f"Registró nuevo paciente: {paciente_nombre}."
                     if detalles.get('consulta_id'):
                         desc_entendible += f" Consulta inicial ID: {detalles['consulta_id']}."
 
                 elif tipo_accion == 'ACTUALIZAR_PACIENTE_BASICO' and tabla_afectada == 'Pacientes' and registro_id:
-                    paciente_nombre = self._get_patient_name(cursor, registro_id)
+                    paciente_nombre = self._patient_name(nombres_pacientes, registro_id)
                     desc_entendible = f"Actualizó datos demográficos de: {paciente_nombre}."
 
                 elif tipo_accion == 'CREAR_EVOLUCION' and tabla_afectada == 'Evoluciones' and registro_id:
                     paciente_id_evo = detalles.get('patient_id') # El patient_id se guarda en detalles
                     consulta_id_evo = detalles.get('consulta_id') # Asumiendo que también guardas esto
-                    paciente_nombre_evo = self._get_patient_name(cursor, paciente_id_evo)
+                    paciente_nombre_evo = self._patient_name(nombres_pacientes, paciente_id_evo)
                     desc_entendible = f"Creó evolución ID {registro_id} para {paciente_nombre_evo} (Consulta ID: {consulta_id_evo or 'N/A'})."
                 
                 elif tipo_accion == 'ACTUALIZAR_EVOLUCION' and tabla_afectada == 'Evoluciones' and registro_id:
                     paciente_id_evo_upd = detalles.get('patient_id')
                     consulta_id_evo_upd = detalles.get('consulta_id')
-                    paciente_nombre_evo_upd = self._get_patient_name(cursor, paciente_id_evo_upd)
+                    paciente_nombre_evo_upd = self._patient_name(nombres_pacientes, paciente_id_evo_upd)
                     desc_entendible = f"Actualizó evolución ID {registro_id} para {paciente_nombre_evo_upd} (Consulta ID: {consulta_id_evo_upd or 'N/A'})."
 
                 elif tipo_accion == 'CREAR_ORDEN_MEDICA' and tabla_afectada == 'OrdenesMedicas' and registro_id:
                     paciente_id_om = detalles.get('paciente_id')
                     consulta_id_om = detalles.get('consulta_id')
-                    paciente_nombre_om = self._get_patient_name(cursor, paciente_id_om)
+                    paciente_nombre_om = self._patient_name(nombres_pacientes, paciente_id_om)
                     desc_entendible = f"Creó orden médica ID {registro_id} para {paciente_nombre_om} (Consulta ID: {consulta_id_om or 'N/A'})."
 
                 elif tipo_accion == 'ACTUALIZAR_ORDEN_MEDICA' and tabla_afectada == 'OrdenesMedicas' and registro_id:
                     paciente_id_om_upd = detalles.get('paciente_id')
                     # consulta_id_om_upd = detalles.get('consulta_id') # No siempre está en detalles de update
-                    paciente_nombre_om_upd = self._get_patient_name(cursor, paciente_id_om_upd)
+                    paciente_nombre_om_upd = self._patient_name(nombres_pacientes, paciente_id_om_upd)
                     desc_entendible = f"Actualizó orden médica ID {registro_id} para {paciente_nombre_om_upd}."
                 
                 elif tipo_accion == 'ACTUALIZAR_INGRESO_Y_PACIENTE': # Este afecta múltiples tablas
                     paciente_id_ing = detalles.get('patient_id')
                     consulta_id_ing = detalles.get('consulta_id')
-                    paciente_nombre_ing = self._get_patient_name(cursor, paciente_id_ing)
+                    paciente_nombre_ing = self._patient_name(nombres_pacientes, paciente_id_ing)
                     desc_entendible = f"Actualizó datos de ingreso/antecedentes para {paciente_nombre_ing} (Consulta ID: {consulta_id_ing or 'N/A'})."
 
                 elif tipo_accion.startswith('ADD_USUARIO') and tabla_afectada == 'Usuarios' and registro_id:
-                    medico_afectado = self._get_medico_name(cursor, registro_id)
+                    medico_afectado = self._medico_name(nombres_medicos, registro_id)
                     desc_entendible = f"Añadió nuevo usuario: {medico_afectado}."
                 
                 elif tipo_accion.startswith('UPDATE_USUARIO') and tabla_afectada == 'Usuarios' and registro_id:
-                    medico_afectado_upd = self._get_medico_name(cursor, registro_id)
+                    medico_afectado_upd = self._medico_name(nombres_medicos, registro_id)
                     desc_entendible = f"Actualizó datos del usuario: {medico_afectado_upd}."
                 
                 elif tipo_accion == 'TOGGLE_ESTADO_USUARIO' and tabla_afectada == 'Usuarios' and registro_id:
-                    medico_afectado_toggle = self._get_medico_name(cursor, registro_id)
+                    medico_afectado_toggle = self._medico_name(nombres_medicos, registro_id)
                     nuevo_estado = "Activado" if detalles.get('nuevo_estado') == 1 else "Desactivado"
                     desc_entendible = f"Cambió estado a '{nuevo_estado}' para el usuario: {medico_afectado_toggle}."
                 
@@ -213,4 +368,6 @@ class HistorialActions:
             print(f"HistorialActions Error: {e}"); traceback.print_exc()
             return None, 0
         finally:
-            if conn: conn.close()
\ No newline at end of file
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
\ No newline at end of file
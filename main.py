@@ -15,6 +15,8 @@ import http.server
 import socketserver
 from urllib.parse import urlparse, parse_qs
 import shutil
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 
 # --- IMPORTANTE: Configuración de Renderizado QtWebEngine ---
@@ -50,6 +52,12 @@ from PyQt6.QtGui import QTextDocument
 
 # Importar módulos locales
 import database
+import metricas # Histogramas de tiempos por slot (vista de diagnóstico)
+import perfil_sql # Perfil de sentencias SQL (solo con PERFIL_SQL=1)
+import directorio_pacientes # Directorio de pacientes descifrado en memoria (se vacía en el logout)
+import cache_historias # Historias abiertas recientemente, ya descifradas (se vacía en el logout)
+import directorio_usuarios # Nombres del personal ya descifrados (se vacía en el logout)
+import vistas_cache # Fragmentos HTML de las vistas en memoria (invalidación por mtime)
 import auth
 # Importar la nueva clase de acciones de paciente
 from paciente_acciones import PatientActions
@@ -330,7 +338,108 @@ class MobileUploadHandler(http.server.SimpleHTTPRequestHandler):
             response_data = {'success': False, 'message': f'Error en el servidor al guardar: {str(e)}'}
             self.wfile.write(json.dumps(response_data).encode('utf-8'))
 
+# --- Trabajos del BackendBridge fuera del hilo de la GUI ---
+BRIDGE_WORKERS = 4 # Hilos para SQL, Fernet, bcrypt y archivos de los slots
+
+class DespachadorTrabajos(QObject):
+    """
+    Ejecuta en un pool de hilos la parte pesada de los slots (SQL, descifrado, bcrypt, archivos)
+    y llama a 'entregar' con el resultado en el hilo de la GUI, donde se emiten las señales de
+    siempre. Si 'trabajo' lanza una excepción se entrega error(excepción) en su lugar, así la
+    página que espera la señal siempre recibe respuesta. No se publica en el QWebChannel.
+
+    Cada petición recibe un número. Si llega otra con la misma 'clave' antes de que termine, el
+    resultado de la anterior se descarta al entregar; 'vigente' (opcional) se evalúa también al
+    entregar (p. ej. que siga seleccionado el mismo paciente). invalidar() descarta todo lo
+    pendiente (logout).
+    """
+    _terminado = pyqtSignal(object)
+
+    def __init__(self, parent=None, max_workers=BRIDGE_WORKERS):
+        super().__init__(parent)
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bridge")
+        self._numeros = itertools.count(1)
+        self._ultimas = {}      # clave -> número de la última petición con esa clave
+        self._generacion = 0    # Sube con cada invalidar()
+        self.pendientes = 0
+        self.entregados = 0
+        self.descartados = 0
+        self._terminado.connect(self._entregar, QtCoreQt.ConnectionType.QueuedConnection)
+
+    def despachar(self, nombre, trabajo, entregar, error, clave=None, vigente=None):
+        """
+        Llamar desde el hilo de la GUI. 'trabajo' no debe tocar estado del BackendBridge.
+        'error' recibe la excepción y retorna el resultado a entregar (lo mismo que retornaría
+        'trabajo' al fallar).
+        """
+        numero = next(self._numeros)
+        if clave is not None:
+            self._ultimas[clave] = numero
+        paquete = [nombre, clave, numero, self._generacion, entregar, vigente, None]
+        trabajo_medido = metricas.instrumentado(trabajo, nombre=f"{nombre}:trabajo")
+
+        def ejecutar():
+            try:
+                paquete[6] = trabajo_medido()
+            except Exception as e:
+                print(f"DespachadorTrabajos Error en '{nombre}': {e}"); traceback.print_exc()
+                try:
+                    paquete[6] = error(e)
+                except Exception as e_error:
+                    print(f"DespachadorTrabajos Error armando la respuesta de error de '{nombre}': {e_error}")
+                    paquete[4] = None # Sin resultado que entregar
+            self._terminado.emit(paquete)
+
+        self.pendientes += 1
+        self._executor.submit(ejecutar)
+        return numero
+
+    @pyqtSlot(object)
+    def _entregar(self, paquete):
+        nombre, clave, numero, generacion, entregar, vigente, resultado = paquete
+        self.pendientes -= 1
+        if generacion != self._generacion:
+            self.descartados += 1
+            print(f"DespachadorTrabajos: Resultado de '{nombre}' descartado (sesión cerrada).")
+            return
+        if clave is not None and self._ultimas.get(clave) == numero:
+            del self._ultimas[clave]
+        elif clave is not None:
+            self.descartados += 1
+            print(f"DespachadorTrabajos: Resultado de '{nombre}' descartado (hay una petición más reciente).")
+            return
+        if vigente is not None and not vigente():
+            self.descartados += 1
+            print(f"DespachadorTrabajos: Resultado de '{nombre}' descartado (ya no corresponde).")
+            return
+        if entregar is None:
+            return
+        self.entregados += 1
+        try:
+            metricas.instrumentado(entregar, nombre=f"{nombre}:entrega")(resultado)
+        except Exception as e:
+            print(f"DespachadorTrabajos Error entregando '{nombre}': {e}"); traceback.print_exc()
+
+    def invalidar(self):
+        """Descarta los resultados de todo lo despachado hasta ahora."""
+        self._generacion += 1
+        self._ultimas.clear()
+
+    def cerrar(self):
+        self.invalidar()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def estadisticas(self):
+        return {
+            'hilos': self.max_workers,
+            'pendientes': self.pendientes,
+            'entregados': self.entregados,
+            'descartados': self.descartados,
+        }
+
 # --- Backend Bridge Object ---
+@metricas.medir_senales # Bytes emitidos por QWebChannel en cada señal
 class BackendBridge(QObject):
     # Señales existentes
     login_success = pyqtSignal(dict)
@@ -340,11 +449,12 @@ class BackendBridge(QObject):
     # Señal para el resultado del guardado de paciente
     patientSaveResult = pyqtSignal(bool, str, str)
     nextHistoriaReady = pyqtSignal(str)
-    patientListResult = pyqtSignal(list, int)
+    patientListResult = pyqtSignal(list, int, int, int) # ventana de pacientes, total (-1: sin recontar), offset, n° de petición
     actionLogResult = pyqtSignal(list, int) # log_list (o None), total_count
     medicoListResult = pyqtSignal(list, int) # Lista de médicos, total
     medicoAddResult = pyqtSignal(bool, str)  # success, message
     patientDetailsResult = pyqtSignal(str) # <<<--- AÑADIR ESTA LÍNEA
+    patientSectionResult = pyqtSignal(str) # JSON de una página de una sección de la historia (request_patient_section)
     selected_medico_id_to_edit = None # Variable para guardar el ID
     medicoDetailsResult = pyqtSignal(str)   # AHORA: Envía un string JSON
     medicoUpdateResult = pyqtSignal(bool, str)
@@ -387,6 +497,7 @@ class BackendBridge(QObject):
         self.selected_complemento_id_for_view_edit = None
         self.selected_orden_id_for_view_edit = None
         self.active_mobile_server_port = None # Para evitar múltiples servidores en el mismo puerto
+        self.trabajos = DespachadorTrabajos(self) # SQL/cifrado/bcrypt de los slots pesados fuera del hilo de la GUI
 
     # --- Funciones de utilidad interna ---
     def get_base_path(self):
@@ -415,15 +526,18 @@ class BackendBridge(QObject):
         return base_path
     
     @pyqtSlot(int)
+    @metricas.instrumentado
     def set_selected_orden(self, orden_id: int):
         print(f"BackendBridge: Orden seleccionada para ver/editar ID: {orden_id}")
         self.selected_orden_id_for_view_edit = orden_id
     @pyqtSlot(int)
+    @metricas.instrumentado
     def set_selected_complemento(self, complemento_id: int):
         print(f"BackendBridge: Complemento seleccionado para ver/editar ID: {complemento_id}")
         self.selected_complemento_id_for_view_edit = complemento_id
 
     @pyqtSlot(str)
+    @metricas.instrumentado
     def abrir_archivo_sistema(self, path_relativo_o_absoluto_archivo: str):
         print(f"BackendBridge: Solicitud para abrir archivo en sistema: '{path_relativo_o_absoluto_archivo}'")
 
@@ -549,6 +663,7 @@ class BackendBridge(QObject):
         return None # No se encontró puerto disponible
 
     @pyqtSlot()
+    @metricas.instrumentado
     def start_mobile_upload_session(self):
         print("BackendBridge: Solicitud para iniciar sesión de subida móvil.")
         try:
@@ -572,7 +687,7 @@ class BackendBridge(QObject):
             
             port = self.find_available_port(start_port=8081) # Empezar desde 8081
             if port is None:
-                self.mobileUploadUrlReady.emit(json.dumps({'error': 'No hay puertos disponibles para el servidor móvil.'}))
+                self.mobileUploadUrlReady.emit(metricas.json_dumps({'error': 'No hay puertos disponibles para el servidor móvil.'}))
                 return
 
             token = uuid.uuid4().hex
@@ -610,20 +725,21 @@ class BackendBridge(QObject):
             server_thread.start()
             
             self.active_mobile_server_port = port
-            self.mobileUploadUrlReady.emit(json.dumps({'url': upload_page_url, 'token': token}))
+            self.mobileUploadUrlReady.emit(metricas.json_dumps({'url': upload_page_url, 'token': token}))
 
         except Exception as e:
             print(f"Error en start_mobile_upload_session: {e}")
             traceback.print_exc()
-            self.mobileUploadUrlReady.emit(json.dumps({'error': str(e)}))
+            self.mobileUploadUrlReady.emit(metricas.json_dumps({'error': str(e)}))
 
     @pyqtSlot(str)
+    @metricas.instrumentado
     def check_mobile_upload_status(self, token):
         # print(f"BackendBridge: Verificando estado para token {token}")
         if token in mobile_upload_sessions:
             session = mobile_upload_sessions[token]
             if session['status'] == 'uploaded':
-                self.mobileUploadStatus.emit(json.dumps({
+                self.mobileUploadStatus.emit(metricas.json_dumps({
                     'token': token,
                     'uploaded': True,
                     'filePath': session['file_path'], # Enviar la ruta del servidor
@@ -632,16 +748,16 @@ class BackendBridge(QObject):
                 # Considerar limpiar la sesión aquí o después de que el formulario principal se guarde
                 # self.cleanup_mobile_session(token) # Ejemplo
             elif session['status'] == 'error':
-                 self.mobileUploadStatus.emit(json.dumps({
+                 self.mobileUploadStatus.emit(metricas.json_dumps({
                     'token': token,
                     'uploaded': False,
                     'error': session.get('error_message', 'Error desconocido durante la subida.')
                 }))
                  self.cleanup_mobile_session(token) # Limpiar en error
             else: # pending, qr_scanned_page_loaded, etc.
-                self.mobileUploadStatus.emit(json.dumps({'token': token, 'uploaded': False, 'message': 'Esperando subida...'}))
+                self.mobileUploadStatus.emit(metricas.json_dumps({'token': token, 'uploaded': False, 'message': 'Esperando subida...'}))
         else:
-            self.mobileUploadStatus.emit(json.dumps({'token': token, 'uploaded': False, 'error': 'Token no encontrado o sesión expirada.'}))
+            self.mobileUploadStatus.emit(metricas.json_dumps({'token': token, 'uploaded': False, 'error': 'Token no encontrado o sesión expirada.'}))
 
     def cleanup_mobile_session(self, token):
         if token in mobile_upload_sessions:
@@ -672,6 +788,7 @@ class BackendBridge(QObject):
 
     # Modificar save_new_complemento para manejar archivo de móvil
     @pyqtSlot(QVariant)
+    @metricas.instrumentado
     def save_new_complemento(self, datos_complemento_qvariant):
         print("BackendBridge: Solicitud save_new_complemento")
         # ... (verificación de usuario como antes) ...
@@ -682,7 +799,19 @@ class BackendBridge(QObject):
 
         try:
             datos_comp = self._convert_qvariant_to_dict(datos_complemento_qvariant, "datos de nuevo complemento")
-            
+        except Exception as e:
+            print(f"Error general en save_new_complemento: {e}"); traceback.print_exc()
+            self.complementoSaveResult.emit(False, f"Error al guardar: {e}", 0)
+            return
+        # Decodificar/mover el archivo, cifrar e insertar se hace en el despachador
+        self.trabajos.despachar("BackendBridge.save_new_complemento",
+                                lambda: self._guardar_complemento_nuevo(datos_comp, current_user_id),
+                                lambda resultado: self.complementoSaveResult.emit(*resultado),
+                                lambda e: (False, f"Error interno guardando complemento: {e}", 0))
+
+    def _guardar_complemento_nuevo(self, datos_comp, current_user_id):
+        """Trabajo de save_new_complemento (hilo del despachador). Retorna (éxito, mensaje, id)."""
+        try:
             paciente_id = datos_comp.get('paciente_id')
             # ... (validación de paciente_id como antes) ...
 
@@ -712,11 +841,10 @@ class BackendBridge(QObject):
                     if not any(file_name_lower.endswith(ext) for ext in allowed_extensions):
                         # Si el tipo no es permitido, no lo procesamos. Informamos error.
                         # También deberíamos limpiar el archivo temporal.
-                        self.complementoSaveResult.emit(False, "Error: Tipo de archivo móvil no permitido.", 0)
                         if os.path.exists(temp_server_path): os.remove(temp_server_path) # Limpiar
                         # También limpiar la sesión del token si aún existe
                         # (Necesitaríamos el token aquí o una forma de buscarlo por temp_server_path)
-                        return
+                        return (False, "Error: Tipo de archivo móvil no permitido.", 0)
 
                     final_upload_dir = self.get_absolute_path(os.path.join('uploads', 'complementarios', str(paciente_id)))
                     os.makedirs(final_upload_dir, exist_ok=True)
@@ -739,8 +867,7 @@ class BackendBridge(QObject):
                             os.remove(temp_server_path) # Eliminar el original si la copia fue exitosa
                             print(f"Archivo móvil copiado y original eliminado.")
                         except Exception as e_copy_del:
-                            self.complementoSaveResult.emit(False, f"Error crítico al manejar archivo móvil: {e_copy_del}", 0)
-                            return
+                            return (False, f"Error crítico al manejar archivo móvil: {e_copy_del}", 0)
 
                     final_archivo_path_relativo = os.path.join('uploads', 'complementarios', str(paciente_id), unique_final_filename).replace('\\', '/')
                     archivo_path_guardado_enc = self.db_manager.encrypt_data(final_archivo_path_relativo)
@@ -781,8 +908,7 @@ class BackendBridge(QObject):
                                         ]
                     file_name_lower = file_data['name'].lower()
                     if not any(file_name_lower.endswith(ext) for ext in allowed_extensions):
-                        self.complementoSaveResult.emit(False, "Error: Tipo de archivo (PC) no permitido.", 0)
-                        return
+                        return (False, "Error: Tipo de archivo (PC) no permitido.", 0)
                     decoded_content = base64.b64decode(file_data['base64'])
                     upload_dir = self.get_absolute_path(os.path.join('uploads', 'complementarios', str(paciente_id)))
                     os.makedirs(upload_dir, exist_ok=True)
@@ -798,7 +924,7 @@ class BackendBridge(QObject):
                     archivo_path_relativo = os.path.join('uploads', 'complementarios', str(paciente_id), unique_filename).replace('\\', '/')
                     archivo_path_guardado_enc = self.db_manager.encrypt_data(archivo_path_relativo)
                 except Exception as e_file_pc:
-                    self.complementoSaveResult.emit(False, f"Error al procesar archivo de PC: {e_file_pc}", 0); return
+                    return (False, f"Error al procesar archivo de PC: {e_file_pc}", 0)
 
 
             # ... (resto de la lógica para insertar en BD con archivo_path_guardado_enc) ...
@@ -838,15 +964,16 @@ class BackendBridge(QObject):
                 )
                 cursor.execute(sql, valores_insert)
                 new_id = cursor.lastrowid
-                self.db_manager.log_action(conn, current_user_id, 'CREAR_COMPLEMENTARIO', f"Complementario ID {new_id} creado.", 'Complementarios', new_id)
+                self.db_manager.log_action(conn, current_user_id, 'CREAR_COMPLEMENTARIO', f"Complementario ID {new_id} creado.", 'Complementarios', new_id, sincrono=True)
 
-            self.complementoSaveResult.emit(True, "Estudio complementario guardado exitosamente.", new_id)
+            return (True, "Estudio complementario guardado exitosamente.", new_id)
 
         except Exception as e:
             print(f"Error general en save_new_complemento: {e}"); traceback.print_exc()
-            self.complementoSaveResult.emit(False, f"Error al guardar: {e}", 0)
+            return (False, f"Error al guardar: {e}", 0)
 
     @pyqtSlot(int, QVariant)
+    @metricas.instrumentado
     def update_complemento_data(self, complemento_id: int, datos_complemento_qvariant):
         print(f"BackendBridge: Solicitud update_complemento_data para ID: {complemento_id}")
         if not self.current_user_data or 'id' not in self.current_user_data:
@@ -856,15 +983,26 @@ class BackendBridge(QObject):
 
         try:
             datos_comp = self._convert_qvariant_to_dict(datos_complemento_qvariant, "datos de complemento a actualizar")
-            
+        except Exception as e:
+            print(f"Error general en update_complemento_data: {e}"); traceback.print_exc()
+            self.complementoSaveResult.emit(False, f"Error al actualizar: {e}", complemento_id)
+            return
+        self.trabajos.despachar("BackendBridge.update_complemento_data",
+                                lambda: self._actualizar_complemento(complemento_id, datos_comp, current_user_id),
+                                lambda resultado: self.complementoSaveResult.emit(*resultado),
+                                lambda e: (False, f"Error interno actualizando complemento: {e}", complemento_id))
+
+    def _actualizar_complemento(self, complemento_id, datos_comp, current_user_id):
+        """Trabajo de update_complemento_data (hilo del despachador). Retorna (éxito, mensaje, id)."""
+        try:
             paciente_id_update = datos_comp.get('paciente_id')
             if not paciente_id_update: # paciente_id es NOT NULL en la tabla
                 try:
                     paciente_id_update = int(paciente_id_update)
                 except (ValueError, TypeError): # Si no se puede convertir, algo anda mal con los datos del form
-                    self.complementoSaveResult.emit(False, "Error: ID de paciente inválido para actualizar.", complemento_id); return
+                    return (False, "Error: ID de paciente inválido para actualizar.", complemento_id)
             elif not paciente_id_update:
-                 self.complementoSaveResult.emit(False, "Error: ID de paciente es requerido para actualizar.", complemento_id); return
+                 return (False, "Error: ID de paciente es requerido para actualizar.", complemento_id)
 
 
             archivo_path_final_enc = None # Se determinará a continuación
@@ -905,8 +1043,7 @@ class BackendBridge(QObject):
                                         ]
                     file_name_lower = file_data['name'].lower()
                     if not any(file_name_lower.endswith(ext) for ext in allowed_extensions):
-                        self.complementoSaveResult.emit(False, "Error: Tipo de archivo no permitido. Solo imágenes o documentos.", 0 if is_new else complemento_id)
-                        return
+                        return (False, "Error: Tipo de archivo no permitido. Solo imágenes o documentos.", complemento_id)
                     decoded_content = base64.b64decode(file_data['base64'])
                     upload_dir = self.get_absolute_path(os.path.join('uploads', 'complementarios', str(paciente_id_update)))
                     os.makedirs(upload_dir, exist_ok=True)
@@ -918,7 +1055,7 @@ class BackendBridge(QObject):
                     archivo_path_relativo = os.path.join('uploads', 'complementarios', str(paciente_id_update), unique_filename).replace('\\', '/')
                     archivo_path_final_enc = self.db_manager.encrypt_data(archivo_path_relativo)
                 except Exception as e_file:
-                    self.complementoSaveResult.emit(False, f"Error al procesar nuevo archivo: {e_file}", complemento_id); return
+                    return (False, f"Error al procesar nuevo archivo: {e_file}", complemento_id)
             elif path_actual_enc_db: # No se borró y no hay nuevo, mantener el actual
                 archivo_path_final_enc = path_actual_enc_db
             # Si no había, no se borró y no hay nuevo, archivo_path_final_enc sigue siendo None
@@ -964,28 +1101,29 @@ class BackendBridge(QObject):
                 
                 cursor.execute(sql, valores_update)
                 if cursor.rowcount == 0:
-                     self.complementoSaveResult.emit(False, "Error: Estudio no encontrado o datos sin cambios.", complemento_id); return
+                     return (False, "Error: Estudio no encontrado o datos sin cambios.", complemento_id)
                 
-                self.db_manager.log_action(conn, current_user_id, 'ACTUALIZAR_COMPLEMENTARIO', f"Complementario ID {complemento_id} actualizado.", 'Complementarios', complemento_id)
+                self.db_manager.log_action(conn, current_user_id, 'ACTUALIZAR_COMPLEMENTARIO', f"Complementario ID {complemento_id} actualizado.", 'Complementarios', complemento_id, sincrono=True)
             
-            self.complementoSaveResult.emit(True, "Estudio complementario actualizado exitosamente.", complemento_id)
+            return (True, "Estudio complementario actualizado exitosamente.", complemento_id)
 
         except sqlite3.ProgrammingError as prog_err:
             print(f"ERROR DE PROGRAMACIÓN SQL en update_complemento_data: {prog_err}"); traceback.print_exc()
-            self.complementoSaveResult.emit(False, f"Error de BD (bindings): {prog_err}", complemento_id)
+            return (False, f"Error de BD (bindings): {prog_err}", complemento_id)
         except Exception as e:
             print(f"Error general en update_complemento_data: {e}"); traceback.print_exc()
-            self.complementoSaveResult.emit(False, f"Error al actualizar: {e}", complemento_id)
+            return (False, f"Error al actualizar: {e}", complemento_id)
 
     # request_complemento_details (como lo tenías, asegurando que las claves devueltas coincidan con lo que JS espera)
     @pyqtSlot()
+    @metricas.instrumentado
     def request_complemento_details(self):
         # ... (tu código para request_complemento_details sin cambios significativos,
         # solo asegúrate que incluya 'estado' y que los campos desencriptados
         # tengan sufijos _dec si el JS los espera así) ...
         print(f"BackendBridge: Solicitud detalles para Complemento ID: {self.selected_complemento_id_for_view_edit}")
         if self.selected_complemento_id_for_view_edit is None:
-            self.complementoDetailsResult.emit(json.dumps({'error_fetch': 'No se seleccionó ningún complemento para ver.'}))
+            self.complementoDetailsResult.emit(metricas.json_dumps({'error_fetch': 'No se seleccionó ningún complemento para ver.'}))
             return
 
         conn = None
@@ -1008,7 +1146,7 @@ class BackendBridge(QObject):
             row = cursor.fetchone()
 
             if not row:
-                self.complementoDetailsResult.emit(json.dumps({'error_fetch': f'Complemento con ID {self.selected_complemento_id_for_view_edit} no encontrado.'}))
+                self.complementoDetailsResult.emit(metricas.json_dumps({'error_fetch': f'Complemento con ID {self.selected_complemento_id_for_view_edit} no encontrado.'}))
                 return
 
             colnames = [desc[0] for desc in cursor.description]
@@ -1074,14 +1212,15 @@ class BackendBridge(QObject):
                 processed_data['usuario_registrador_nombre_dec'] = self.db_manager.decrypt_data(nombre_reg_enc) if nombre_reg_enc else data_from_db.get('usuario_registrador_username', 'N/D')
             except: processed_data['usuario_registrador_nombre_dec'] = data_from_db.get('usuario_registrador_username', '[Err Usuario]')
 
-            self.complementoDetailsResult.emit(json.dumps(processed_data, default=str))
+            self.complementoDetailsResult.emit(metricas.json_dumps(processed_data, default=str))
         except Exception as e:
             print(f"Error en request_complemento_details: {e}"); traceback.print_exc()
-            self.complementoDetailsResult.emit(json.dumps({'error_fetch': f'Error: {e}'}))
+            self.complementoDetailsResult.emit(metricas.json_dumps({'error_fetch': f'Error: {e}'}))
         finally:
             if conn: conn.close()
 
     @pyqtSlot(int, QVariant) # orden_id, datos_actualizados_qvariant
+    @metricas.instrumentado
     def update_orden_data(self, orden_id: int, orden_data_qvariant):
         print(f"BackendBridge: Solicitud update_orden_data para Orden ID: {orden_id}")
 
@@ -1101,7 +1240,7 @@ class BackendBridge(QObject):
 
             # Encriptar el objeto JSON completo
             # El diccionario ya debería tener el campo fecha_modificacion_orden actualizado por el JS
-            json_string_to_encrypt = json.dumps(orden_actualizada_dict)
+            json_string_to_encrypt = metricas.json_dumps(orden_actualizada_dict)
             encrypted_new_orden_json_blob = self.db_manager.encrypt_data(json_string_to_encrypt)
 
             # También actualizaremos la fecha_hora principal de la OrdenMedica para reflejar la edición
@@ -1151,7 +1290,8 @@ class BackendBridge(QObject):
                     conn, current_user_id, 'ACTUALIZAR_ORDEN_MEDICA',
                     f"Orden médica ID {orden_id} actualizada para Paciente ID {paciente_id_para_log}.",
                     tabla='OrdenesMedicas', registro_id=orden_id,
-                    detalles={'paciente_id': paciente_id_para_log, 'orden_id': orden_id}
+                    detalles={'paciente_id': paciente_id_para_log, 'orden_id': orden_id},
+                    sincrono=True
                 )
             
             self.ordenUpdateResult.emit(True, f'Orden médica ID {orden_id} actualizada exitosamente.')
@@ -1174,6 +1314,7 @@ class BackendBridge(QObject):
                 conn.close()
 
     @pyqtSlot(QVariant, int) 
+    @metricas.instrumentado
     def request_action_log_with_filters(self, filters_qvariant, page_number=1): # page_number con default
         filters = {}
         if isinstance(filters_qvariant, QVariant):
@@ -1198,21 +1339,18 @@ class BackendBridge(QObject):
             page = 1
 
         print(f"BackendBridge: Solicitud historial con filtros: {filters}, página: {page}")
-        try:
-            # Asegúrate que self.historial_manager.get_log espera 'page' y 'filters'
-            logs, total_count = self.historial_manager.get_log(page=page, filters=filters)
-            # La señal actionLogResult ya está definida para (list, int)
-            self.actionLogResult.emit(logs or [], total_count or 0) 
-        except Exception as e:
-            print(f"BackendBridge Error: Excepción al obtener historial con filtros: {e}")
-            traceback.print_exc()
-            self.actionLogResult.emit([], 0)
+        self.trabajos.despachar("BackendBridge.request_action_log_with_filters",
+                                lambda: self._leer_historial(page=page, filters=filters),
+                                lambda resultado: self.actionLogResult.emit(*resultado),
+                                lambda e: ([], 0),
+                                clave='historial')
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_orden_details(self):
         print(f"BackendBridge: Solicitud de detalles para Orden ID: {self.selected_orden_id_for_view_edit}")
         if self.selected_orden_id_for_view_edit is None:
-            error_response = json.dumps({'error_fetch': 'No se seleccionó ninguna orden para ver.'})
+            error_response = metricas.json_dumps({'error_fetch': 'No se seleccionó ninguna orden para ver.'})
             self.ordenDetailsResult.emit(error_response)
             return
 
@@ -1247,7 +1385,7 @@ class BackendBridge(QObject):
             row = cursor.fetchone()
 
             if not row:
-                error_response = json.dumps({'error_fetch': f'Orden con ID {self.selected_orden_id_for_view_edit} no encontrada.'})
+                error_response = metricas.json_dumps({'error_fetch': f'Orden con ID {self.selected_orden_id_for_view_edit} no encontrada.'})
                 self.ordenDetailsResult.emit(error_response)
                 return
 
@@ -1274,7 +1412,7 @@ class BackendBridge(QObject):
                     orden_data['orden_json_blob'] = decrypted_blob_string if decrypted_blob_string else "{}"
                 except Exception as e_blob:
                     print(f"Error desencriptando orden_json_blob en request_orden_details: {e_blob}")
-                    orden_data['orden_json_blob'] = json.dumps({"error_desencriptacion": str(e_blob)})
+                    orden_data['orden_json_blob'] = metricas.json_dumps({"error_desencriptacion": str(e_blob)})
             else:
                 orden_data['orden_json_blob'] = "{}" # String JSON vacío
 
@@ -1283,21 +1421,22 @@ class BackendBridge(QObject):
                 del orden_data['username_creador']
 
             print(f"BackendBridge: Detalles de orden ID {self.selected_orden_id_for_view_edit} listos para emitir.")
-            self.ordenDetailsResult.emit(json.dumps(orden_data, default=str))
+            self.ordenDetailsResult.emit(metricas.json_dumps(orden_data, default=str))
 
         except sqlite3.Error as db_err:
             print(f"DB Error en request_orden_details: {db_err}")
             traceback.print_exc()
-            self.ordenDetailsResult.emit(json.dumps({'error_fetch': f'Error de base de datos: {db_err}'}))
+            self.ordenDetailsResult.emit(metricas.json_dumps({'error_fetch': f'Error de base de datos: {db_err}'}))
         except Exception as e:
             print(f"Error general en request_orden_details: {e}")
             traceback.print_exc()
-            self.ordenDetailsResult.emit(json.dumps({'error_fetch': f'Error inesperado: {e}'}))
+            self.ordenDetailsResult.emit(metricas.json_dumps({'error_fetch': f'Error inesperado: {e}'}))
         finally:
             if conn:
                 conn.close()
 
     @pyqtSlot(QVariant) # Mantenemos QVariant para flexibilidad, pero verificamos el tipo
+    @metricas.instrumentado
     def guardar_nueva_orden_medica(self, orden_data_param): # Renombrado para claridad
         print("BackendBridge: Solicitud guardar_nueva_orden_medica recibida.")
         if not self.current_user_data or 'id' not in self.current_user_data:
@@ -1338,7 +1477,7 @@ class BackendBridge(QObject):
             
             print(f"BackendBridge: Datos de orden listos (primeras claves): {list(orden_data_json_obj.keys())[:5]}")
 
-            json_string_to_encrypt = json.dumps(orden_data_json_obj)
+            json_string_to_encrypt = metricas.json_dumps(orden_data_json_obj)
             encrypted_orden_json_blob = self.db_manager.encrypt_data(json_string_to_encrypt)
 
             conn = self.db_manager.connect_db()
@@ -1360,7 +1499,8 @@ class BackendBridge(QObject):
                     conn, current_user_id, 'CREAR_ORDEN_MEDICA',
                     f"Orden médica ID {orden_id} creada para Paciente ID {self.selected_patient_id}, Consulta ID {active_consulta_id}",
                     tabla='OrdenesMedicas', registro_id=orden_id,
-                    detalles={'paciente_id': self.selected_patient_id, 'consulta_id': active_consulta_id}
+                    detalles={'paciente_id': self.selected_patient_id, 'consulta_id': active_consulta_id},
+                    sincrono=True
                 )
             self.ordenMedicaSaveResult.emit(True, f'Órdenes médicas guardadas exitosamente (ID: {orden_id}).')
             print(f"BackendBridge: Orden médica {orden_id} guardada para consulta {active_consulta_id}")
@@ -1451,6 +1591,7 @@ class BackendBridge(QObject):
     # --- Slots expuestos a JavaScript ---
 
     @pyqtSlot(str)
+    @metricas.instrumentado
     def handle_print_request(self, html_content):
         print(f"BackendBridge: Recibida solicitud de impresión con HTML (longitud: {len(html_content)})")
 
@@ -1475,83 +1616,71 @@ class BackendBridge(QObject):
             traceback.print_exc()
 
     @pyqtSlot(str, str)
+    @metricas.instrumentado
     def attempt_login(self, username, password):
         print(f"BackendBridge: Recibido intento de login para usuario: {username}")
-        user_data = auth.verify_user_login(username, password)
-        
+        # bcrypt (12 rondas) en el despachador; un segundo intento reemplaza al anterior
+        self.trabajos.despachar("BackendBridge.attempt_login",
+                                lambda: auth.verify_user_login(username, password),
+                                lambda user_data: self._entregar_login(username, user_data),
+                                lambda e: None, # Igual que verify_user_login al fallar: login rechazado
+                                clave='login')
+
+    def _entregar_login(self, username, user_data):
         if user_data:
             print(f"BackendBridge: Login exitoso para: {user_data.get('username')}")
             self.current_user_data = user_data
 
             # --- Registrar acción de LOGIN EXITOSO ---
-            conn_log = None
+            # Asíncrono: lo escribe el hilo de auditoría, el login no espera al commit
             try:
                 logged_in_user_id = user_data.get('id')
                 if logged_in_user_id is not None:
-                    conn_log = database.connect_db()
-                    if conn_log:
-                        descripcion = f"Inicio de sesión exitoso para el usuario: {user_data.get('username', 'Desconocido')}."
-                        database.log_action(
-                            db_conn=conn_log,
-                            usuario_id=logged_in_user_id,
-                            tipo_accion="LOGIN_EXITOSO",
-                            descripcion=descripcion,
-                            # ***** CORRECCIÓN DE NOMBRES DE ARGUMENTOS AQUÍ *****
-                            tabla=None,                 # Antes era tabla_afectada
-                            registro_id=None,           # Antes era registro_afectado_id
-                            detalles={'username': user_data.get('username')} # 'detalles' ya era correcto
-                        )
-                        conn_log.commit() 
-                        print(f"BackendBridge: Acción de login para user_id {logged_in_user_id} registrada.")
-                    # ... (resto del try-except-finally como antes) ...
-            except sqlite3.Error as e_sql:
-                print(f"BackendBridge: Error de SQLite al registrar log de login: {e_sql}")
-                if conn_log:
-                    conn_log.rollback() 
-                traceback.print_exc()
+                    descripcion = f"Inicio de sesión exitoso para el usuario: {user_data.get('username', 'Desconocido')}."
+                    database.log_action(
+                        db_conn=None,
+                        usuario_id=logged_in_user_id,
+                        tipo_accion="LOGIN_EXITOSO",
+                        descripcion=descripcion,
+                        tabla=None,
+                        registro_id=None,
+                        detalles={'username': user_data.get('username')}
+                    )
             except Exception as e:
                 print(f"BackendBridge: Error general al registrar log de login: {e}")
-                if conn_log:
-                    conn_log.rollback()
                 traceback.print_exc()
-            finally:
-                if conn_log:
-                    conn_log.close()
             # --- Fin de registrar acción ---
 
+            directorio_pacientes.DIRECTORIO.cargar_en_segundo_plano() # Búsquedas de pacientes en memoria
+            vistas_cache.CACHE_VISTAS.precargar_en_segundo_plano(self.get_absolute_path("html_files"))
             self.login_success.emit(user_data)
         else:
             print("BackendBridge: Login fallido.")
             # --- Registrar acción de LOGIN FALLIDO ---
-            conn_log_fail = None
+            # HistorialAcciones.usuario_id es NOT NULL con FK a Usuarios: solo se registra si el
+            # nombre de usuario existe (contraseña errónea o cuenta inactiva)
             try:
-                conn_log_fail = database.connect_db()
-                if conn_log_fail:
+                usuario_intentado_id = auth.get_user_id(username)
+                if usuario_intentado_id is None:
+                    print(f"BackendBridge: Login fallido para usuario inexistente '{username}', no se registra en historial.")
+                else:
                     descripcion_fallo = f"Intento de login fallido para el nombre de usuario: {username}."
                     database.log_action(
-                        db_conn=conn_log_fail,
-                        usuario_id=0, 
+                        db_conn=None,
+                        usuario_id=usuario_intentado_id,
                         tipo_accion="LOGIN_FALLIDO",
                         descripcion=descripcion_fallo,
-                        # ***** CORRECCIÓN DE NOMBRES DE ARGUMENTOS AQUÍ *****
-                        tabla=None,                 # Si no aplica, puedes omitirlo ya que tiene default
-                        registro_id=None,           # Si no aplica, puedes omitirlo ya que tiene default
+                        tabla=None,
+                        registro_id=None,
                         detalles={'username_intentado': username}
                     )
-                    conn_log_fail.commit()
-                    print(f"BackendBridge: Acción de login fallido para '{username}' registrada.")
-                # ... (resto del try-except-finally como antes) ...
             except Exception as e_fail:
                 print(f"BackendBridge: Error al registrar log de login fallido: {e_fail}")
-                if conn_log_fail:
-                    conn_log_fail.rollback()
-            finally:
-                if conn_log_fail:
-                    conn_log_fail.close()
             # --- Fin de registrar acción de LOGIN FALLIDO ---
             self.login_failed.emit("Usuario o contraseña incorrectos.")
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_initial_data(self):
         print("BackendBridge: Solicitud de datos iniciales.")
         
@@ -1575,7 +1704,8 @@ class BackendBridge(QObject):
         
         initial_user_info = {
             'username': username_to_send,
-            'patientCount': patient_count_to_send # Dashboard podría usar esto
+            'patientCount': patient_count_to_send, # Dashboard podría usar esto
+            'rol': self.current_user_data.get('role') if self.current_user_data else None # Menú de administración
         }
         print(f"BackendBridge: Emitiendo userDataLoaded con: {initial_user_info}")
         self.userDataLoaded.emit(QVariant(initial_user_info)) # Asumiendo que QVariant funcionó
@@ -1586,6 +1716,7 @@ class BackendBridge(QObject):
         self.request_view_content("dashboard")
 
     @pyqtSlot(str)
+    @metricas.instrumentado
     def request_view_content(self, view_name_with_separator_and_params): # Cambiado el nombre del parámetro
         print(f"BackendBridge: Solicitud recibida para vista: '{view_name_with_separator_and_params}'")
 
@@ -1637,9 +1768,9 @@ class BackendBridge(QObject):
                 self.viewContentLoaded.emit("<p style='color:red;'>Error de seguridad.</p>", view_name_with_separator_and_params + "_error_security")
                 return
 
-            if os.path.exists(target_file_path) and os.path.isfile(target_file_path):
-                with open(target_file_path, 'r', encoding='utf-8') as f:
-                    html_content = f.read()
+            # Desde memoria si el archivo no cambió desde la última lectura (o la precarga del login)
+            html_content = vistas_cache.CACHE_VISTAS.obtener("__".join(sane_path_components), target_file_path_abs)
+            if html_content is not None:
                 print(f"BackendBridge: Contenido de '{relative_fragment_path}' leído. Enviando a JS...")
                 # Emitir con el nombre original COMPLETO para que JS lo use para inicializar (JS leerá los params del hash)
                 self.viewContentLoaded.emit(html_content, view_name_with_separator_and_params)
@@ -1654,6 +1785,7 @@ class BackendBridge(QObject):
 
 
     @pyqtSlot(QVariant)
+    @metricas.instrumentado
     def save_new_patient(self, patient_data_qvariant):
         """Recibe datos de JS, convierte y delega el guardado."""
         print("BackendBridge: Recibida solicitud para guardar nuevo paciente...")
@@ -1693,6 +1825,7 @@ class BackendBridge(QObject):
         self.patientSaveResult.emit(success, message, new_historia)
 
     @pyqtSlot()
+    @metricas.instrumentado
     def get_next_historia_number(self):
         """Obtiene y formatea el próximo N° de Historia potencial."""
         print("BackendBridge: Solicitud para próximo N° Historia recibida.")
@@ -1725,53 +1858,80 @@ class BackendBridge(QObject):
             print("BackendBridge: No se pudo determinar próximo N° Historia.")
             self.nextHistoriaReady.emit("(Error)")
     
-    @pyqtSlot(str)
-    def request_patient_list(self, search_term=''):
-        print(f"BackendBridge: Solicitud recibida para lista COMPLETA. Búsqueda: '{search_term}'")
+    @pyqtSlot(str, int, int, str, str, int)
+    @metricas.instrumentado
+    def request_patient_list(self, search_term='', offset=0, limit=50, sort_by='id', sort_dir='desc', request_seq=0):
+        # El listado es virtual: pide ventanas según el scroll y solo recuenta el total con la primera.
+        # 'request_seq' vuelve tal cual para que la vista descarte respuestas de búsquedas/órdenes anteriores.
+        print(f"BackendBridge: Solicitud de ventana de pacientes. Búsqueda: '{search_term}', offset {offset}, limit {limit}, orden {sort_by} {sort_dir}")
+        self.trabajos.despachar("BackendBridge.request_patient_list",
+                                lambda: self._leer_lista_pacientes(search_term, offset, limit, sort_by, sort_dir),
+                                lambda resultado: self.patientListResult.emit(*resultado, offset, request_seq),
+                                lambda e: ([], 0),
+                                clave=('lista_pacientes', offset))
+
+    def _leer_lista_pacientes(self, search_term, offset, limit, sort_by, sort_dir):
+        """Trabajo de request_patient_list. Retorna (pacientes, total)."""
         try:
-            patients, total_count = self.patient_manager.get_list(search_term=search_term)
+            patients, total_count = self.patient_manager.get_list(
+                search_term=search_term, offset=offset, limit=limit,
+                sort_by=sort_by, sort_dir=sort_dir, with_total=(offset == 0))
             if patients is None:
                  print("BackendBridge Error: patient_manager.get_list devolvió error.")
-                 self.patientListResult.emit([], 0)
-            else:
-                 print(f"BackendBridge: Enviando {len(patients)} pacientes (Total: {total_count})")
-                 self.patientListResult.emit(patients, total_count)
+                 return [], 0
+            print(f"BackendBridge: Enviando {len(patients)} pacientes (Total: {total_count})")
+            return patients, total_count
         except Exception as e:
             print(f"BackendBridge Error: Excepción al obtener lista de pacientes: {e}")
             traceback.print_exc()
-            self.patientListResult.emit([], 0)
+            return [], 0
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_action_log(self):
         print(f"BackendBridge: Solicitud recibida para historial de acciones.")
+        self.trabajos.despachar("BackendBridge.request_action_log", self._leer_historial,
+                                lambda resultado: self.actionLogResult.emit(*resultado),
+                                lambda e: ([], 0),
+                                clave='historial')
+
+    def _leer_historial(self, page=1, filters=None):
+        """Trabajo de request_action_log(_with_filters). Retorna (entradas, total)."""
         try:
-            logs, total_count = self.historial_manager.get_log()
+            logs, total_count = self.historial_manager.get_log(page=page, filters=filters)
             if logs is None:
                  print("BackendBridge Error: historial_manager.get_log devolvió error.")
-                 self.actionLogResult.emit([], 0)
-            else:
-                 print(f"BackendBridge: Enviando {len(logs)} entradas de log (Total: {total_count})")
-                 self.actionLogResult.emit(logs, total_count)
+                 return [], 0
+            print(f"BackendBridge: Enviando {len(logs)} entradas de log (Total: {total_count})")
+            return logs, total_count or 0
         except Exception as e:
             print(f"BackendBridge Error: Excepción al obtener historial: {e}")
             traceback.print_exc()
-            self.actionLogResult.emit([], 0)
+            return [], 0
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_medico_list(self):
         print("BackendBridge: Solicitud recibida para lista de médicos/usuarios.")
+        self.trabajos.despachar("BackendBridge.request_medico_list", self._leer_lista_medicos,
+                                lambda resultado: self.medicoListResult.emit(*resultado),
+                                lambda e: ([], 0),
+                                clave='medicos')
+
+    def _leer_lista_medicos(self):
+        """Trabajo de request_medico_list. Retorna (médicos, total)."""
         try:
             medicos, total_count = self.medico_manager.get_list()
             if medicos is None:
-                 self.medicoListResult.emit([], 0)
-            else:
-                 print(f"BackendBridge: Enviando {len(medicos)} médicos/usuarios.")
-                 self.medicoListResult.emit(medicos, total_count)
+                 return [], 0
+            print(f"BackendBridge: Enviando {len(medicos)} médicos/usuarios.")
+            return medicos, total_count
         except Exception as e:
             print(f"BackendBridge Error obteniendo lista médicos: {e}"); traceback.print_exc()
-            self.medicoListResult.emit([], 0)
+            return [], 0
 
     @pyqtSlot(QVariant)
+    @metricas.instrumentado
     def add_new_medico(self, medico_data_qvariant):
         print("BackendBridge: Solicitud para guardar nuevo médico/usuario...")
         if not self.current_user_data or 'id' not in self.current_user_data:
@@ -1807,6 +1967,7 @@ class BackendBridge(QObject):
         self.medicoAddResult.emit(success, message)
 
     @pyqtSlot(int)
+    @metricas.instrumentado
     def set_selected_patient(self, patient_id):
         print(f"BackendBridge: set_selected_patient ID: {patient_id}")
         try:
@@ -1816,6 +1977,7 @@ class BackendBridge(QObject):
             self.selected_patient_id = None
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_patient_info_for_add_evolucion(self):
         """Solicita la info básica del paciente actualmente seleccionado."""
         print("BackendBridge: Recibida solicitud de info básica para 'Agregar Evolución'")
@@ -1823,15 +1985,16 @@ class BackendBridge(QObject):
             print(f"BackendBridge: Buscando info para ID: {self.selected_patient_id}")
             basic_info = self.patient_actions.get_patient_basic_info(self.selected_patient_id)
             # Convertir fechas/datetimes si las hubiera (aunque aquí no hay)
-            json_data = json.dumps(basic_info, default=str)
+            json_data = metricas.json_dumps(basic_info, default=str)
             print(f"BackendBridge: Enviando info básica: {json_data}")
             self.sendPatientInfoForAddEvolucion.emit(json_data)
         else:
             print("BackendBridge Error: No hay paciente seleccionado para obtener info básica.")
             error_info = {"error": "No hay paciente seleccionado en el backend."}
-            self.sendPatientInfoForAddEvolucion.emit(json.dumps(error_info))
+            self.sendPatientInfoForAddEvolucion.emit(metricas.json_dumps(error_info))
 
     @pyqtSlot(QVariant)
+    @metricas.instrumentado
     def update_patient_basic_data(self, patient_data_qvariant):
         print(f"--- BackendBridge: Recibida solicitud update_patient_basic_data ---")
         
@@ -1889,24 +2052,42 @@ class BackendBridge(QObject):
             self.updatePatientBasicDataResult.emit(False, f"Error inesperado al guardar cambios: {e}")
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_patient_details(self):
         print(f"BackendBridge: Solicitud detalles paciente ID: {self.selected_patient_id}")
         if self.selected_patient_id is None:
             print("BackendBridge Error: No hay paciente seleccionado.")
-            self.patientDetailsResult.emit(json.dumps({'error': 'No se seleccionó paciente'}))
+            self.patientDetailsResult.emit(metricas.json_dumps({'error': 'No se seleccionó paciente'}))
             return
-
+        # Lectura, descifrado y JSON en el despachador. Si el usuario ya pasó a otro paciente (o pidió
+        # otra vez la historia) cuando termina, el resultado se descarta.
+        patient_id = self.selected_patient_id
+        self.trabajos.despachar("BackendBridge.request_patient_details",
+                                lambda: self._leer_historia_completa(patient_id),
+                                lambda resultado: self._entregar_historia(patient_id, *resultado),
+                                lambda e: (metricas.json_dumps({'error': f'Error interno: {e}'}),),
+                                clave='historia',
+                                vigente=lambda: self.selected_patient_id == patient_id)
+
+    def _entregar_historia(self, patient_id, json_string, consulta_id=None, ok=False):
+        """Entrega de request_patient_details / request_patient_header (hilo de la GUI)."""
+        if ok:
+            self.current_consulta_id = consulta_id
+            print(f"BackendBridge: Consulta actual establecida a ID: {self.current_consulta_id} para Paciente ID: {patient_id}")
+        self.patientDetailsResult.emit(json_string)
+
+    def _leer_historia_completa(self, patient_id):
+        """Trabajo de request_patient_details. Retorna (json, id de la consulta más reciente, ok)."""
         details = None
         try:
             # Llama a patient_manager.get_details, que debería devolver un dict
             # ya con todos los campos desencriptados y listos para ser serializados.
-            details = self.patient_manager.get_details(self.selected_patient_id)
+            details = self.patient_manager.get_details(patient_id)
 
             if details is None or details.get("error"): # Si get_details devuelve None o un dict con error
                 error_msg = details.get("error") if isinstance(details, dict) else "No se encontraron detalles del paciente."
                 print(f"BackendBridge: get_details devolvió error o None: {error_msg}")
-                self.patientDetailsResult.emit(json.dumps({'error': error_msg}))
-                return
+                return (metricas.json_dumps({'error': error_msg}),)
 
             # ---- INICIO DE LA SECCIÓN CRÍTICA PARA ÓRDENES ----
             # Ahora, 'details' ya tiene 'ordenes_medicas_todas'
@@ -1925,46 +2106,112 @@ class BackendBridge(QObject):
                                 orden_item['orden_json_blob'] = decrypted_str if decrypted_str else "{}"
                             except Exception as e_dec_bridge:
                                 print(f"ERROR en BackendBridge al intentar desencriptar blob tardíamente: {e_dec_bridge}")
-                                orden_item['orden_json_blob'] = json.dumps({"error_desencriptacion_tardia": str(e_dec_bridge)})
+                                orden_item['orden_json_blob'] = metricas.json_dumps({"error_desencriptacion_tardia": str(e_dec_bridge)})
                         elif not isinstance(blob_content, str):
                              # Si no es string ni bytes (ej. ya es un dict parseado), convertirlo a string JSON
                              print(f"WARN: orden_json_blob (ID: {orden_item.get('id')}) no es string. Convirtiendo a string JSON.")
                              try:
-                                 orden_item['orden_json_blob'] = json.dumps(blob_content)
+                                 orden_item['orden_json_blob'] = metricas.json_dumps(blob_content)
                              except Exception as e_dump_bridge:
                                  print(f"ERROR en BackendBridge al intentar json.dumps de blob no string: {e_dump_bridge}")
-                                 orden_item['orden_json_blob'] = json.dumps({"error_conversion_a_string_json": str(e_dump_bridge)})
+                                 orden_item['orden_json_blob'] = metricas.json_dumps({"error_conversion_a_string_json": str(e_dump_bridge)})
                         # Si ya es un string, se asume que es el string JSON correcto.
             # ---- FIN DE LA SECCIÓN CRÍTICA PARA ÓRDENES ----
 
 
-            # Guardar el ID de la consulta más reciente si existe
+            # ID de la consulta más reciente (se guarda como consulta actual al entregar)
+            consulta_id = None
             if 'consultas_info' in details and details['consultas_info']:
-                self.current_consulta_id = details['consultas_info'][0].get('id')
-                print(f"BackendBridge: Consulta actual establecida a ID: {self.current_consulta_id} para Paciente ID: {self.selected_patient_id}")
+                consulta_id = details['consultas_info'][0].get('id')
             else:
-                self.current_consulta_id = None
-                print(f"BackendBridge: No se pudo establecer consulta actual para Paciente ID: {self.selected_patient_id}.")
+                print(f"BackendBridge: No se pudo establecer consulta actual para Paciente ID: {patient_id}.")
 
 
             # Serializar el diccionario 'details' completo a un string JSON
             print(f"BackendBridge: Serializando detalles del paciente a JSON...")
-            json_string = json.dumps(details, default=str) # default=str para manejar tipos no serializables
+            json_string = metricas.json_dumps(details, default=str) # default=str para manejar tipos no serializables
             print(f"BackendBridge: Emitiendo detalles JSON (primeros 500 chars): {json_string[:500]}...")
-            self.patientDetailsResult.emit(json_string)
+            return json_string, consulta_id, True
 
         except Exception as e:
             print(f"BackendBridge Error: Excepción al obtener/procesar detalles: {e}")
             traceback.print_exc()
-            self.patientDetailsResult.emit(json.dumps({'error': f'Error interno: {e}'}))
+            return (metricas.json_dumps({'error': f'Error interno: {e}'}),)
+
+    @pyqtSlot()
+    @metricas.instrumentado
+    def request_patient_header(self):
+        # Apertura de la historia: solo la cabecera (datos, consultas, examen inicial) por patientDetailsResult.
+        # Cada pestaña pide después su sección con request_patient_section.
+        print(f"BackendBridge: Solicitud cabecera de historia, paciente ID: {self.selected_patient_id}")
+        if self.selected_patient_id is None:
+            self.patientDetailsResult.emit(metricas.json_dumps({'error': 'No se seleccionó paciente'}))
+            return
+        patient_id = self.selected_patient_id
+        self.trabajos.despachar("BackendBridge.request_patient_header",
+                                lambda: self._leer_cabecera_historia(patient_id),
+                                lambda resultado: self._entregar_historia(patient_id, *resultado),
+                                lambda e: (metricas.json_dumps({'error': f'Error interno: {e}'}),),
+                                clave='historia',
+                                vigente=lambda: self.selected_patient_id == patient_id)
+
+    def _leer_cabecera_historia(self, patient_id):
+        """Trabajo de request_patient_header. Retorna (json, id de la consulta más reciente, ok)."""
+        try:
+            header = self.patient_manager.get_header(patient_id)
+            if header is None:
+                return (metricas.json_dumps({'error': "No se encontraron detalles del paciente."}),)
+            consulta_id = header['consultas_info'][0].get('id') if header['consultas_info'] else None
+            header['secciones_diferidas'] = True # La vista debe pedir cada sección al abrir su pestaña
+            return metricas.json_dumps(header, default=str), consulta_id, True
+        except Exception as e:
+            print(f"BackendBridge Error: Excepción al obtener cabecera de historia: {e}")
+            traceback.print_exc()
+            return (metricas.json_dumps({'error': f'Error interno: {e}'}),)
+
+    @pyqtSlot(str, str, int)
+    @metricas.instrumentado
+    def request_patient_section(self, section, cursor='', limit=0):
+        # limit: 0 = tamaño de página por defecto, -1 = sección completa (impresión)
+        print(f"BackendBridge: Solicitud sección '{section}' (cursor: '{cursor}', límite: {limit}) paciente ID: {self.selected_patient_id}")
+        if self.selected_patient_id is None:
+            self.patientSectionResult.emit(metricas.json_dumps({'section': section, 'patient_id': None,
+                                                                'error': 'No se seleccionó paciente'}))
+            return
+        patient_id = self.selected_patient_id
+        self.trabajos.despachar("BackendBridge.request_patient_section",
+                                lambda: self._leer_seccion_historia(patient_id, section, cursor, limit),
+                                self.patientSectionResult.emit,
+                                lambda e: metricas.json_dumps({'section': section, 'patient_id': patient_id,
+                                                               'error': f'Error interno: {e}'}),
+                                clave=('seccion', section, cursor, limit),
+                                vigente=lambda: self.selected_patient_id == patient_id)
+
+    def _leer_seccion_historia(self, patient_id, section, cursor, limit):
+        """Trabajo de request_patient_section. Retorna el JSON de la página."""
+        try:
+            page = self.patient_manager.get_section(patient_id, section, cursor or None,
+                                                    None if limit == 0 else limit)
+            if page is None:
+                return metricas.json_dumps({'section': section, 'patient_id': patient_id,
+                                            'error': 'No se pudo cargar la sección.'})
+            page['cursor'] = cursor or None # La vista distingue primera página de "cargar más"
+            page['patient_id'] = patient_id # Para descartar respuestas de un paciente anterior
+            return metricas.json_dumps(page, default=str)
+        except Exception as e:
+            print(f"BackendBridge Error: Excepción al obtener sección '{section}': {e}")
+            traceback.print_exc()
+            return metricas.json_dumps({'section': section, 'patient_id': patient_id, 'error': f'Error interno: {e}'})
 
     @pyqtSlot(int)
+    @metricas.instrumentado
     def set_selected_medico_for_edit(self, medico_id):
         print(f"BackendBridge: Médico seleccionado para editar ID: {medico_id}")
         print(f"--- SETTING selected_medico_id_to_edit: ID={medico_id} (Tipo: {type(medico_id)}) ---")
         self.selected_medico_id_to_edit = medico_id
 
     @pyqtSlot() # Sigue emitiendo señal, no devuelve resultado directo
+    @metricas.instrumentado
     def get_ing_test(self): # O renómbralo a request_ingreso_details si pruebas
         # El nombre que uses aquí debe coincidir con la llamada en JavaScript
         print(f"PYTHON: {self.get_ing_test.__name__} (CON LÓGICA REAL) FUE LLAMADO") # Usar __name__ para que el log se actualice si renombras
@@ -1973,7 +2220,7 @@ class BackendBridge(QObject):
         if not self.selected_patient_id or not self.selected_consulta_id_for_edit:
             error_msg = "No se ha seleccionado un paciente o una consulta válidos para editar."
             print(f"PYTHON Error en {self.get_ing_test.__name__}: {error_msg}")
-            self.ingresoDetailsResult.emit(json.dumps({"error": error_msg}))
+            self.ingresoDetailsResult.emit(metricas.json_dumps({"error": error_msg}))
             return
         
         try:
@@ -1985,30 +2232,31 @@ class BackendBridge(QObject):
             
             if ingreso_data and not ingreso_data.get("error"):
                 print(f"PYTHON ({self.get_ing_test.__name__}): Detalles de ingreso obtenidos de patient_manager. Emitiendo...")
-                self.ingresoDetailsResult.emit(json.dumps(ingreso_data, default=str)) # default=str por si hay fechas u otros tipos
+                self.ingresoDetailsResult.emit(metricas.json_dumps(ingreso_data, default=str)) # default=str por si hay fechas u otros tipos
             else:
                 error_detail = ingreso_data.get("error", "No se pudieron obtener los datos de ingreso desde patient_manager.")
                 print(f"PYTHON Error en {self.get_ing_test.__name__}: {error_detail}")
-                self.ingresoDetailsResult.emit(json.dumps({"error": error_detail}))
+                self.ingresoDetailsResult.emit(metricas.json_dumps({"error": error_detail}))
         except AttributeError as ae:
             # Esto podría pasar si patient_manager no está instanciado o no tiene get_ingreso_details
             print(f"PYTHON Error (AttributeError) en {self.get_ing_test.__name__}: {ae}")
             traceback.print_exc()
-            self.ingresoDetailsResult.emit(json.dumps({"error": f"Error interno del servidor (atributo): {str(ae)}"}))
+            self.ingresoDetailsResult.emit(metricas.json_dumps({"error": f"Error interno del servidor (atributo): {str(ae)}"}))
         except Exception as e:
             print(f"PYTHON Error (Excepción general) en {self.get_ing_test.__name__}: {e}")
             traceback.print_exc()
-            self.ingresoDetailsResult.emit(json.dumps({"error": f"Error interno obteniendo datos de ingreso: {str(e)}"}))
+            self.ingresoDetailsResult.emit(metricas.json_dumps({"error": f"Error interno obteniendo datos de ingreso: {str(e)}"}))
 
         
     # --- NUEVO SLOT para solicitar detalles del médico ---
     @pyqtSlot()
+    @metricas.instrumentado
     def request_medico_details(self):
         print(f"BackendBridge: Solicitud detalles médico ID: {self.selected_medico_id_to_edit}")
         # (Verificación de ID como antes)
         if self.selected_medico_id_to_edit is None:
             # Emitir error como JSON string también
-            error_msg = json.dumps({'error': 'No se seleccionó médico para editar'})
+            error_msg = metricas.json_dumps({'error': 'No se seleccionó médico para editar'})
             self.medicoDetailsResult.emit(error_msg)
             return
 
@@ -2019,37 +2267,38 @@ class BackendBridge(QObject):
 
             if details is None:
                 print(f"DEBUG: Emitiendo medicoDetailsResult con error (None) como JSON string.")
-                error_msg = json.dumps({'error': 'No se encontraron detalles del médico.'})
+                error_msg = metricas.json_dumps({'error': 'No se encontraron detalles del médico.'})
                 self.medicoDetailsResult.emit(error_msg)
             elif isinstance(details, dict):
                 # ***** 2. SERIALIZAR A JSON ANTES DE EMITIR *****
                 json_string = ""
                 try:
                     # Usar default=str por si acaso hay tipos no serializables por defecto (aunque get_details ya debería limpiarlos)
-                    json_string = json.dumps(details, default=str) 
+                    json_string = metricas.json_dumps(details, default=str) 
                     print(f"DEBUG: Emitiendo medicoDetailsResult como JSON string (primeros 200 chars): {json_string[:200]}")
                     self.medicoDetailsResult.emit(json_string) # Emitir el string
                 except Exception as json_e:
                     print(f"!!!!!!!!!! ERROR CRÍTICO: Fallo al serializar detalles a JSON antes de emitir: {json_e} !!!!!!!!!!")
                     traceback.print_exc()
-                    error_msg = json.dumps({'error': f'Error interno de serialización: {json_e}'})
+                    error_msg = metricas.json_dumps({'error': f'Error interno de serialización: {json_e}'})
                     self.medicoDetailsResult.emit(error_msg)
             else:
                 # Si get_details devuelve algo que no es ni dict ni None
                 print(f"DEBUG: Emitiendo medicoDetailsResult con error (Tipo inesperado) como JSON string.")
-                error_msg = json.dumps({'error': f'Error interno: tipo de datos inesperado ({type(details).__name__})'})
+                error_msg = metricas.json_dumps({'error': f'Error interno: tipo de datos inesperado ({type(details).__name__})'})
                 self.medicoDetailsResult.emit(error_msg)
 
         except Exception as e:
             print(f"BackendBridge Error: Excepción general al obtener/procesar detalles: {e}")
             traceback.print_exc()
-            error_msg = json.dumps({'error': f'Error interno general: {e}'})
+            error_msg = metricas.json_dumps({'error': f'Error interno general: {e}'})
             self.medicoDetailsResult.emit(error_msg)
         # finally: (sin cambios)
         #     pass
 
     # --- NUEVO SLOT para actualizar médico ---
     @pyqtSlot(int, QVariant)
+    @metricas.instrumentado
     def update_medico(self, medico_id, medico_data_qvariant):
         """Recibe datos del form JS, convierte, procesa foto y delega la actualización."""
         print(f"BackendBridge: Solicitud para ACTUALIZAR médico ID: {medico_id}...")
@@ -2094,12 +2343,14 @@ class BackendBridge(QObject):
             self.medicoUpdateResult.emit(False, f"Error interno durante la actualización: {e}")
 
     @pyqtSlot(result=QVariant) # ASEGÚRATE QUE ESTO ESTÁ
+    @metricas.instrumentado
     def get_selected_medico_id(self):
         print(f"BackendBridge: Devolviendo ID médico para edición: {self.selected_medico_id_to_edit}")
         print(f"--- GETTING selected_medico_id_to_edit: Value={self.selected_medico_id_to_edit} (Tipo: {type(self.selected_medico_id_to_edit)}) ---")
         return QVariant(self.selected_medico_id_to_edit)
 
     @pyqtSlot(int, int)
+    @metricas.instrumentado
     def set_selected_patient_and_consulta(self, p_id, c_id): # Nombres de argumentos diferentes
         print(f"PYTHON: set_selected_patient_and_consulta LLAMADO con P={p_id}, C={c_id}")
         self.selected_patient_id = p_id
@@ -2107,6 +2358,7 @@ class BackendBridge(QObject):
 
 
     @pyqtSlot() # <<<< CAMBIO: Esto es un slot, no un método de MainWindow
+    @metricas.instrumentado
     def perform_logout(self):
         print("BackendBridge: Solicitud de logout recibida.")
         logout_user_id = None
@@ -2120,42 +2372,39 @@ class BackendBridge(QObject):
             print("BackendBridge: Logout solicitado, pero no había usuario activo.")
             logout_user_id = 0 # Usar ID sistema si no había sesión
 
-        # Registrar acción de Logout
-        conn_log = None
+        # Registrar acción de Logout (asíncrono, lo escribe el hilo de auditoría)
         try:
-            conn_log = database.connect_db()
-            if conn_log:
-                with conn_log: # Usar transacción automática
-                    descripcion = f"Cierre de sesión para usuario: {logout_username}."
-                    # Asegurar que logout_user_id no sea None antes de llamar a log_action si es NOT NULL
-                    if logout_user_id is None: logout_user_id = 0 # Fallback a sistema si algo raro pasó
-
-                    database.log_action(
-                        db_conn=conn_log,
-                        usuario_id=logout_user_id, # ID del usuario que cierra sesión (o 0)
-                        tipo_accion="LOGOUT",
-                        descripcion=descripcion,
-                        detalles={'username': logout_username if logout_username != "(Desconocido)" else None}
-                    )
-                    print(f"BackendBridge: Acción de logout registrada.")
-            else:
-                 print("BackendBridge Error: No se pudo conectar a BD para registrar log de logout.")
+            descripcion = f"Cierre de sesión para usuario: {logout_username}."
+            # Asegurar que logout_user_id no sea None antes de llamar a log_action si es NOT NULL
+            if logout_user_id is None: logout_user_id = 0 # Fallback a sistema si algo raro pasó
+
+            database.log_action(
+                db_conn=None,
+                usuario_id=logout_user_id, # ID del usuario que cierra sesión (o 0)
+                tipo_accion="LOGOUT",
+                descripcion=descripcion,
+                detalles={'username': logout_username if logout_username != "(Desconocido)" else None}
+            )
         except Exception as e:
             print(f"BackendBridge: Error general al registrar log de logout: {e}")
             traceback.print_exc()
-        finally:
-            if conn_log: conn_log.close()
 
         # Limpiar estado de sesión en el backend
+        self.trabajos.invalidar() # Lo que aún esté en curso no se entrega a la página de login
         self.current_user_data = None
         self.selected_patient_id = None
         self.selected_medico_id_to_edit = None
+        database.clear_decrypted_cache() # No dejar datos de pacientes descifrados en memoria
+        directorio_pacientes.DIRECTORIO.vaciar()
+        cache_historias.CACHE_HISTORIAS.vaciar()
+        directorio_usuarios.DIRECTORIO_USUARIOS.vaciar()
         print("BackendBridge: Estado de sesión limpiado.")
 
         # Emitir señal para que el frontend recargue la página de login
         self.logoutComplete.emit()
 
     @pyqtSlot(int) # El ID del médico a cambiar de estado
+    @metricas.instrumentado
     def toggle_medico_status(self, medico_id: int):
         print(f"--- BackendBridge: Solicitud toggle_medico_status para ID: {medico_id} ---")
         if not self.current_user_data or 'id' not in self.current_user_data:
@@ -2183,6 +2432,7 @@ class BackendBridge(QObject):
             self.medicoStatusToggleResult.emit(False, f"Error inesperado al cambiar estado: {e}", medico_id, -1)
 
     @pyqtSlot(QVariant)
+    @metricas.instrumentado
     def update_ingreso_data(self, ingreso_data_qvariant):
         """Actualiza los datos de un ingreso (Consulta y ExamenFisico asociado)."""
         print("BackendBridge: Recibida solicitud para actualizar datos de ingreso...")
@@ -2244,12 +2494,14 @@ class BackendBridge(QObject):
             self.updateIngresoDataResult.emit(False, f"Error inesperado al guardar cambios de ingreso: {e}")
 
     @pyqtSlot(int, int) # paciente_id, consulta_id (esta es la consulta a la que se asocia la nueva evolución)
+    @metricas.instrumentado
     def set_context_for_new_evolucion(self, patient_id, consulta_id):
         print(f"BackendBridge: Contexto para nueva evolución: Paciente ID {patient_id}, Consulta ID {consulta_id}")
         self.selected_patient_id = patient_id # Ya lo usas
         self.selected_consulta_id_for_evolucion = consulta_id # Nuevo para saber a qué consulta pertenece la nueva evo
 
     @pyqtSlot(QVariant) # Recibe el diccionario de datos del formulario
+    @metricas.instrumentado
     def save_new_evolucion(self, evolucion_data_qvariant):
         print("BackendBridge: Recibida solicitud para guardar NUEVA EVOLUCION...")
 
@@ -2320,6 +2572,7 @@ class BackendBridge(QObject):
 
 
     @pyqtSlot(int) # evolucion_id
+    @metricas.instrumentado
     def set_selected_evolucion(self, evolucion_id):
         print(f"BackendBridge: Evolución seleccionada para ver/editar ID: {evolucion_id}")
         self.selected_evolucion_id_for_view_edit = evolucion_id
@@ -2328,16 +2581,18 @@ class BackendBridge(QObject):
         # El patient_id se pasa al JS de ver/editar evolución usualmente como parámetro de URL/estado.
 
     @pyqtSlot()
+    @metricas.instrumentado
     def request_evolucion_details(self):
         print(f"BackendBridge: Solicitud detalles para Evolución ID: {self.selected_evolucion_id_for_view_edit}")
         if self.selected_evolucion_id_for_view_edit is None:
-            self.evolucionDetailsResult.emit(json.dumps({'error': 'No se seleccionó evolución.'}))
+            self.evolucionDetailsResult.emit(metricas.json_dumps({'error': 'No se seleccionó evolución.'}))
             return
         
         details = self.patient_manager.get_evolucion_details(self.selected_evolucion_id_for_view_edit)
-        self.evolucionDetailsResult.emit(json.dumps(details, default=str)) # default=str para fechas
+        self.evolucionDetailsResult.emit(metricas.json_dumps(details, default=str)) # default=str para fechas
 
     @pyqtSlot(QVariant) # evolucion_id se obtiene de self.selected_evolucion_id_for_view_edit
+    @metricas.instrumentado
     def update_evolucion_data(self, evolucion_data_qvariant):
         print(f"BackendBridge: Recibida solicitud para ACTUALIZAR EVOLUCION ID: {self.selected_evolucion_id_for_view_edit}")
         if not self.current_user_data or 'id' not in self.current_user_data:
@@ -2361,6 +2616,41 @@ class BackendBridge(QObject):
         )
         self.evolucionUpdateResult.emit(success, message)
 
+    # --- Diagnóstico de rendimiento (solo administradores) ---
+    def _is_admin(self):
+        return bool(self.current_user_data) and self.current_user_data.get('role') == 'administrador'
+
+    @pyqtSlot(result=str)
+    def get_performance_metrics(self):
+        """JSON con los histogramas de metricas.py y el estado del pool, la caché de descifrado y la auditoría."""
+        if not self._is_admin():
+            return json.dumps({'error': 'Acceso restringido a administradores.'})
+        try:
+            return json.dumps({
+                'operaciones': metricas.resumen(),
+                'ventana_minutos': metricas.VENTANA_SEGUNDOS * metricas.NUM_VENTANAS // 60,
+                'pool': database.pool_stats(),
+                'cache_descifrado': database.decrypt_cache_stats(),
+                'directorio_pacientes': directorio_pacientes.DIRECTORIO.estadisticas(),
+                'cache_historias': cache_historias.CACHE_HISTORIAS.estadisticas(),
+                'directorio_usuarios': directorio_usuarios.DIRECTORIO_USUARIOS.estadisticas(),
+                'cache_vistas': vistas_cache.CACHE_VISTAS.estadisticas(),
+                'trabajos_bridge': self.trabajos.estadisticas(),
+                'auditoria': database.audit_stats(),
+            }, default=str)
+        except Exception as e:
+            print(f"ERROR BackendBridge: Excepción obteniendo métricas de rendimiento: {e}")
+            traceback.print_exc()
+            return json.dumps({'error': str(e)})
+
+    @pyqtSlot(result=bool)
+    def reset_performance_metrics(self):
+        if not self._is_admin():
+            return False
+        metricas.reiniciar()
+        print("BackendBridge: Métricas de rendimiento reiniciadas.")
+        return True
+
 
 
 
@@ -2522,4 +2812,8 @@ if __name__ == "__main__":
     main_window.showMaximized()
     print("-" * 40 + "\nAplicación iniciada. Bucle de eventos corriendo...")
     print("Para depurar JS, abre Chrome/Edge y navega a http://localhost:9223\n" + "-" * 40)
+    app.aboutToQuit.connect(main_window.backend_bridge.trabajos.cerrar) # No entregar resultados durante el cierre
+    app.aboutToQuit.connect(perfil_sql.escribir_informe_si_activo) # Solo con PERFIL_SQL=1
+    app.aboutToQuit.connect(database.shutdown_audit_writer) # Escribir el historial pendiente antes de cerrar
+    app.aboutToQuit.connect(database.close_all_connections) # Cerrar el pool de conexiones al salir
     sys.exit(app.exec())
\ No newline at end of file
@@ -3,10 +3,13 @@ import sqlite3
 import traceback
 import os # Necesario para manejar rutas de fotos
 import database
+import metricas # Instrumentación de los métodos públicos
+from directorio_usuarios import DIRECTORIO_USUARIOS # Nombres del personal ya descifrados
 from auth import hash_password # Reutilizamos la función de hash
 from database import log_action # Para auditoría
 from datetime import datetime # Para futura lógica de modificación
 
+@metricas.instrumentar_clase
 class MedicoActions:
 
     def _generate_username(self, nombre_completo, cedula):
@@ -97,6 +100,9 @@ class MedicoActions:
                 cursor = conn.cursor()
 
                 print(f"MedicoActions: Preparando INSERT para Usuario: {username}")
+
+                if database.find_ids_by_cedula(cursor, 'Usuarios', cedula):
+                    return False, f"Error: La cédula '{cedula}' ya está registrada para otro usuario."
                 
                 # Encriptar datos sensibles
                 nombre_completo_enc = database.encrypt_data(nombre_completo)
@@ -105,14 +111,14 @@ class MedicoActions:
                 sql = """
                     INSERT INTO Usuarios (
                         nombre_usuario, hash_contrasena, nombre_completo, 
-                        cedula, mpps, especialidad, ruta_foto_perfil, 
+                        cedula, cedula_bidx, mpps, especialidad, ruta_foto_perfil, 
                         rol, activo 
                         -- fecha_creacion es DEFAULT
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """
                 values = (
                     username, hashed_pw, nombre_completo_enc,
-                    cedula_enc, mpps, especialidad, ruta_foto_perfil,
+                    cedula_enc, database.blind_index('cedula', cedula), mpps, especialidad, ruta_foto_perfil,
                     rol, activo
                 )
 
@@ -124,11 +130,13 @@ class MedicoActions:
                 log_descripcion = f"Usuario ID {current_user_id} creó nuevo usuario '{username}' (ID: {new_user_id}, Rol: {rol})."
                 log_action(conn, current_user_id, 'CREAR_USUARIO', log_descripcion,
                            tabla='Usuarios', registro_id=new_user_id, 
-                           detalles={'nombre_completo': nombre_completo, 'cedula': cedula, 'rol': rol}) # Añadir más detalles
+                           detalles={'nombre_completo': nombre_completo, 'cedula': cedula, 'rol': rol}, # Añadir más detalles
+                           sincrono=True)
 
                 # Commit es automático al salir del 'with conn:' si no hay excepciones
                 
             print("MedicoActions: Transacción completada.")
+            DIRECTORIO_USUARIOS.refrescar(new_user_id)
             # No retornar contraseña en mensaje de éxito por seguridad
             return True, f"Usuario '{username}' creado exitosamente."
 
@@ -171,20 +179,15 @@ class MedicoActions:
             colnames = [desc[0] for desc in cursor.description]
             cursor.close()
             print(f"MedicoActions: {len(rows)} usuarios encontrados. Desencriptando...")
+            # El nombre completo sale del directorio de usuarios; las cédulas, en un solo lote
+            cedulas = database.decrypt_many([row[colnames.index('cedula')] for row in rows])
             
-            for row in rows:
+            for row, cedula_dec in zip(rows, cedulas):
                  user_dict = dict(zip(colnames, row))
-                 try:
-                     # Desencriptar campos necesarios
-                     user_dict['nombre_completo_dec'] = database.decrypt_data(user_dict.get('nombre_completo'))
-                     user_dict['cedula_dec'] = database.decrypt_data(user_dict.get('cedula'))
-                     # Los demás campos (mpps, especialidad, ruta_foto_perfil, rol, activo, nombre_usuario) no están encriptados
-                     
-                 except Exception as e:
-                     print(f"Warn: Error desencriptando datos para ID {user_dict.get('id', '??')}: {e}")
-                     # Poner placeholders si falla la desencriptación
-                     user_dict['nombre_completo_dec'] = user_dict.get('nombre_completo_dec', "[Error Desenc.]")
-                     user_dict['cedula_dec'] = user_dict.get('cedula_dec', "[Error Desenc.]")
+                 usuario = DIRECTORIO_USUARIOS.obtener(user_dict['id']) or {}
+                 user_dict['nombre_completo_dec'] = usuario.get('nombre_completo')
+                 user_dict['cedula_dec'] = cedula_dec
+                 # Los demás campos (mpps, especialidad, ruta_foto_perfil, rol, activo, nombre_usuario) no están encriptados
                      
                  # Formatear fecha para visualización (opcional, pero útil)
                  try:
@@ -307,6 +310,9 @@ class MedicoActions:
             with conn: # Transacción automática
                 cursor = conn.cursor()
 
+                if database.find_ids_by_cedula(cursor, 'Usuarios', cedula, exclude_id=medico_id_to_update):
+                    return False, f"Error: La cédula '{cedula}' ya está registrada para otro usuario."
+
                 # Encriptar datos sensibles que se van a actualizar
                 nombre_completo_enc = database.encrypt_data(nombre_completo)
                 cedula_enc = database.encrypt_data(cedula)
@@ -317,14 +323,14 @@ class MedicoActions:
 
                 # Campos que siempre se intentan actualizar (el frontend los envía)
                 set_clauses.extend([
-                    "nombre_usuario = ?", "nombre_completo = ?", "cedula = ?",
+                    "nombre_usuario = ?", "nombre_completo = ?", "cedula = ?", "cedula_bidx = ?",
                     "mpps = ?", "especialidad = ?", 
                     # ruta_foto_perfil se maneja si se sube una nueva foto, el frontend enviará la nueva ruta
                     "ruta_foto_perfil = ?", 
                     "rol = ?", "activo = ?"
                 ])
                 values_for_update.extend([
-                    nombre_usuario.strip().lower(), nombre_completo_enc, cedula_enc,
+                    nombre_usuario.strip().lower(), nombre_completo_enc, cedula_enc, database.blind_index('cedula', cedula),
                     mpps, especialidad, ruta_foto_perfil,
                     rol, activo
                 ])
@@ -358,9 +364,11 @@ class MedicoActions:
                 
                 log_action(conn, current_user_id, 'ACTUALIZAR_USUARIO', log_descripcion,
                            tabla='Usuarios', registro_id=medico_id_to_update,
-                           detalles=log_detalles)
+                           detalles=log_detalles,
+                           sincrono=True)
 
             print("MedicoActions: Transacción de actualización completada.")
+            DIRECTORIO_USUARIOS.refrescar(medico_id_to_update)
             return True, f"Datos del usuario '{nombre_usuario}' actualizados exitosamente."
 
         except sqlite3.IntegrityError as e:
@@ -416,11 +424,13 @@ class MedicoActions:
                 descripcion=descripcion_log,
                 tabla="usuarios",
                 registro_id=medico_id_to_toggle,
-                detalles={'nuevo_estado': nuevo_estado, 'estado_anterior': estado_actual}
+                detalles={'nuevo_estado': nuevo_estado, 'estado_anterior': estado_actual},
+                sincrono=True
             )
             # ----------------------------------------------
             
             conn.commit()
+            DIRECTORIO_USUARIOS.refrescar(medico_id_to_toggle)
             mensaje_exito = f"Usuario '{nombre_usuario_afectado}' ha sido {'activado' if nuevo_estado == 1 else 'desactivado'} correctamente."
             print(f"MedicoActions: {mensaje_exito}")
             return True, mensaje_exito, nuevo_estado
@@ -0,0 +1,273 @@
+# metricas.py
+# Instrumentación ligera de los slots de BackendBridge y de los métodos públicos de las
+# clases *Actions. Por cada operación se registra el tiempo total desglosado en SQL,
+# descifrado y serialización JSON, las filas leídas y los bytes emitidos por QWebChannel.
+# Los valores van a histogramas móviles (última hora por defecto) que el administrador
+# consulta desde la vista de diagnóstico (slot get_performance_metrics).
+#
+# El coste por llamada es de unos pocos microsegundos: las consultas y el descifrado solo se
+# cronometran si hay una operación instrumentada en curso en el hilo actual.
+import bisect
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+METRICAS_ACTIVAS = True
+VENTANA_SEGUNDOS = 300  # Duración de cada sub-ventana del histograma móvil
+NUM_VENTANAS = 12       # Sub-ventanas conservadas (12 x 5 min = última hora)
+
+# Límites superiores de los cubos: escala logarítmica x1.5 desde 0.05 ms hasta ~110 s
+LIMITES_MS = tuple(round(0.05 * 1.5 ** i, 4) for i in range(37))
+# Para cantidades (filas, bytes, consultas): potencias de 2 hasta ~1e9
+LIMITES_CANTIDAD = tuple(2 ** i for i in range(31))
+
+class HistogramaMovil:
+    """
+    Histograma de cubos fijos sobre una ventana deslizante de NUM_VENTANAS sub-ventanas.
+    registrar() es O(log cubos); los percentiles se estiman con el límite superior del cubo.
+    """
+    __slots__ = ('limites', 'ventana', 'num_ventanas', '_ventanas')
+
+    def __init__(self, limites=LIMITES_MS, ventana=VENTANA_SEGUNDOS, num_ventanas=NUM_VENTANAS):
+        self.limites = limites
+        self.ventana = ventana
+        self.num_ventanas = num_ventanas
+        self._ventanas = deque(maxlen=num_ventanas) # [id_ventana, cubos, n, suma, maximo]
+
+    def registrar(self, valor, ahora=None):
+        id_ventana = int((ahora if ahora is not None else time.time()) // self.ventana)
+        if not self._ventanas or self._ventanas[-1][0] != id_ventana:
+            self._ventanas.append([id_ventana, [0] * (len(self.limites) + 1), 0, 0.0, 0.0])
+        actual = self._ventanas[-1]
+        actual[1][bisect.bisect_left(self.limites, valor)] += 1
+        actual[2] += 1
+        actual[3] += valor
+        if valor > actual[4]: actual[4] = valor
+
+    def resumen(self, ahora=None):
+        id_minimo = int((ahora if ahora is not None else time.time()) // self.ventana) - self.num_ventanas + 1
+        cubos = [0] * (len(self.limites) + 1)
+        n, suma, maximo = 0, 0.0, 0.0
+        for id_ventana, cubos_v, n_v, suma_v, maximo_v in self._ventanas:
+            if id_ventana < id_minimo: continue
+            for i, c in enumerate(cubos_v):
+                if c: cubos[i] += c
+            n += n_v; suma += suma_v; maximo = max(maximo, maximo_v)
+        if not n:
+            return {'n': 0, 'suma': 0, 'media': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+        return {
+            'n': n, 'suma': round(suma, 3), 'media': round(suma / n, 3),
+            'p50': self._percentil(cubos, n, 0.50, maximo),
+            'p95': self._percentil(cubos, n, 0.95, maximo),
+            'p99': self._percentil(cubos, n, 0.99, maximo),
+            'max': round(maximo, 3),
+        }
+
+    def _percentil(self, cubos, n, p, maximo):
+        objetivo = p * n
+        acumulado = 0
+        for i, c in enumerate(cubos):
+            acumulado += c
+            if acumulado >= objetivo:
+                limite = self.limites[i] if i < len(self.limites) else maximo
+                return round(min(limite, maximo), 3)
+        return round(maximo, 3)
+
+class _Tramo:
+    """Acumuladores de la operación instrumentada en curso (uno por nivel de anidamiento)."""
+    __slots__ = ('inicio', 'sql', 'descifrado', 'json', 'filas', 'consultas', 'bytes_emitidos')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.sql = self.descifrado = self.json = 0.0
+        self.filas = self.consultas = self.bytes_emitidos = 0
+
+    def acumular(self, hijo):
+        self.sql += hijo.sql; self.descifrado += hijo.descifrado; self.json += hijo.json
+        self.filas += hijo.filas; self.consultas += hijo.consultas; self.bytes_emitidos += hijo.bytes_emitidos
+
+_HISTOGRAMAS_OPERACION = (
+    ('total_ms', LIMITES_MS), ('sql_ms', LIMITES_MS), ('descifrado_ms', LIMITES_MS), ('json_ms', LIMITES_MS),
+    ('filas', LIMITES_CANTIDAD), ('consultas', LIMITES_CANTIDAD), ('bytes_emitidos', LIMITES_CANTIDAD),
+)
+
+class _EstadisticasOperacion:
+    __slots__ = ('llamadas', 'errores', 'histogramas')
+
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.histogramas = {nombre: HistogramaMovil(limites) for nombre, limites in _HISTOGRAMAS_OPERACION}
+
+_local = threading.local()
+_lock = threading.Lock()
+_operaciones = {}
+
+def _pila():
+    pila = getattr(_local, 'pila', None)
+    if pila is None:
+        pila = _local.pila = []
+    return pila
+
+def tramo_activo():
+    """Operación instrumentada en curso en este hilo, o None (entonces no hace falta medir nada)."""
+    pila = getattr(_local, 'pila', None)
+    return pila[-1] if pila else None
+
+def registrar_sql(segundos, filas=0, consultas=0):
+    tramo = tramo_activo()
+    if tramo is not None:
+        tramo.sql += segundos; tramo.filas += filas; tramo.consultas += consultas
+
+def registrar_descifrado(segundos):
+    tramo = tramo_activo()
+    if tramo is not None:
+        tramo.descifrado += segundos
+
+def registrar_payload(n_bytes):
+    tramo = tramo_activo()
+    if tramo is not None:
+        tramo.bytes_emitidos += n_bytes
+
+def _registrar_operacion(nombre, tramo, total, error):
+    ahora = time.time()
+    with _lock:
+        stats = _operaciones.get(nombre)
+        if stats is None:
+            stats = _operaciones[nombre] = _EstadisticasOperacion()
+        stats.llamadas += 1
+        if error: stats.errores += 1
+        h = stats.histogramas
+        h['total_ms'].registrar(total * 1000.0, ahora)
+        h['sql_ms'].registrar(tramo.sql * 1000.0, ahora)
+        h['descifrado_ms'].registrar(tramo.descifrado * 1000.0, ahora)
+        h['json_ms'].registrar(tramo.json * 1000.0, ahora)
+        h['filas'].registrar(tramo.filas, ahora)
+        h['consultas'].registrar(tramo.consultas, ahora)
+        h['bytes_emitidos'].registrar(tramo.bytes_emitidos, ahora)
+
+def instrumentado(func=None, *, nombre=None):
+    """
+    Decorador: registra cada llamada como una operación. Se coloca justo encima del 'def'
+    (debajo de @pyqtSlot). Las operaciones anidadas suman sus tiempos también a la exterior.
+    """
+    if func is None:
+        return lambda f: instrumentado(f, nombre=nombre)
+    etiqueta = nombre or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not METRICAS_ACTIVAS:
+            return func(*args, **kwargs)
+        pila = _pila()
+        tramo = _Tramo()
+        pila.append(tramo)
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            pila.pop()
+            total = time.perf_counter() - tramo.inicio
+            if pila: pila[-1].acumular(tramo)
+            _registrar_operacion(etiqueta, tramo, total, error)
+    return wrapper
+
+def instrumentar_clase(cls=None, *, excluir=()):
+    """
+    Decorador de clase: instrumenta todos sus métodos públicos (para las clases *Actions).
+    'excluir' deja fuera utilidades baratas que se llaman por fila (p. ej. calculate_age).
+    """
+    if cls is None:
+        return lambda c: instrumentar_clase(c, excluir=excluir)
+    for nombre, atributo in list(vars(cls).items()):
+        if nombre.startswith('_') or nombre in excluir: continue
+        etiqueta = f"{cls.__name__}.{nombre}"
+        if isinstance(atributo, staticmethod):
+            setattr(cls, nombre, staticmethod(instrumentado(atributo.__func__, nombre=etiqueta)))
+        elif isinstance(atributo, classmethod):
+            setattr(cls, nombre, classmethod(instrumentado(atributo.__func__, nombre=etiqueta)))
+        elif callable(atributo):
+            setattr(cls, nombre, instrumentado(atributo, nombre=etiqueta))
+    return cls
+
+def json_dumps(obj, **kwargs):
+    """json.dumps() que suma su tiempo a la operación en curso."""
+    tramo = tramo_activo()
+    if tramo is None:
+        return json.dumps(obj, **kwargs)
+    inicio = time.perf_counter()
+    try:
+        return json.dumps(obj, **kwargs)
+    finally:
+        tramo.json += time.perf_counter() - inicio
+
+def tamano_payload(args):
+    """Bytes aproximados que QWebChannel serializa para los argumentos de una señal."""
+    total = 0
+    for arg in args:
+        if isinstance(arg, str):
+            total += len(arg.encode('utf-8'))
+        elif isinstance(arg, (bytes, bytearray)):
+            total += len(arg)
+        elif arg is None or isinstance(arg, (bool, int, float)):
+            total += 8
+        else:
+            try:
+                total += len(json.dumps(arg, default=str, ensure_ascii=False).encode('utf-8'))
+            except Exception:
+                pass
+    return total
+
+class _EmisorMedido:
+    """Envuelve una señal ligada: mide los bytes de cada emit() y delega el resto (connect, etc.)."""
+    __slots__ = ('_senal',)
+
+    def __init__(self, senal):
+        self._senal = senal
+
+    def emit(self, *args):
+        if METRICAS_ACTIVAS and tramo_activo() is not None:
+            registrar_payload(tamano_payload(args))
+        self._senal.emit(*args)
+
+    def __getattr__(self, nombre):
+        return getattr(self._senal, nombre)
+
+class _SenalMedida:
+    """Descriptor que sustituye a un pyqtSignal de la clase; el meta-objeto de Qt no cambia."""
+    def __init__(self, senal):
+        self._senal = senal
+
+    def __get__(self, obj, tipo=None):
+        if obj is None:
+            return self._senal
+        return _EmisorMedido(self._senal.__get__(obj, tipo))
+
+def medir_senales(cls):
+    """Decorador de clase (BackendBridge): cuenta los bytes emitidos por todas sus señales."""
+    for nombre, atributo in list(vars(cls).items()):
+        if type(atributo).__name__ == 'pyqtSignal':
+            setattr(cls, nombre, _SenalMedida(atributo))
+    return cls
+
+def resumen():
+    """{operacion: {...}} ordenado por tiempo total acumulado, para la vista de diagnóstico."""
+    ahora = time.time()
+    with _lock:
+        datos = {
+            nombre: {
+                'llamadas': stats.llamadas,
+                'errores': stats.errores,
+                **{clave: h.resumen(ahora) for clave, h in stats.histogramas.items()},
+            } for nombre, stats in _operaciones.items()
+        }
+    return dict(sorted(datos.items(), key=lambda item: item[1]['total_ms']['suma'], reverse=True))
+
+def reiniciar():
+    with _lock:
+        _operaciones.clear()
@@ -7,15 +7,32 @@ import json
 from datetime import date, datetime
 # Importar módulo database completo o funciones específicas
 import database
+import archivo # Episodios cerrados movidos al archivo en frío
+import directorio_pacientes # Pacientes descifrados en memoria para las búsquedas
+from cache_historias import CACHE_HISTORIAS # Historias ya descifradas, invalidadas por versión
+from directorio_usuarios import DIRECTORIO_USUARIOS # Nombres del personal ya descifrados
+import metricas # Instrumentación de los métodos públicos
 # Importar función de log (asumiendo que está en database.py)
 from database import log_action
 
+@metricas.instrumentar_clase(excluir=('calculate_age',))
 class PatientActions:
     """
     Clase para encapsular las acciones relacionadas con los pacientes
     (Guardar, consultar, actualizar, etc.).
     """
 
+    # Ordenaciones del listado: clave pedida por la vista -> (columna en claro, sentido invertido).
+    # La edad crece al retroceder la fecha de nacimiento, de ahí la inversión.
+    LIST_SORT_COLUMNS = {
+        'id': ('id', False),
+        'numero_historia': ('numero_historia', False),
+        'edad': ('fecha_nacimiento', True),
+        'sexo': ('sexo', False),
+    }
+    # Máximo de filas por ventana del listado (limita el trabajo de descifrado por petición)
+    LIST_MAX_WINDOW = 200
+
     def __init__(self):
         # No necesita inicialización especial por ahora
         pass
@@ -84,6 +101,11 @@ class PatientActions:
             cursor = conn.cursor()
             print("PatientActions: Transacción iniciada.")
 
+            # La columna cédula está cifrada: la unicidad se verifica con el índice ciego
+            if patient_data.get('cedula') and database.find_ids_by_cedula(cursor, 'Pacientes', patient_data['cedula']):
+                conn.rollback()
+                return False, f"Error: La cédula '{patient_data['cedula']}' ya está registrada para otro paciente.", None
+
             # Obtener próximo ID y generar N° Historia
             next_id_estimated = self._get_next_patient_id(cursor)
             generated_historia = self._format_historia_numero(next_id_estimated)
@@ -104,6 +126,9 @@ class PatientActions:
                 "telefono_habitacion": database.encrypt_data(patient_data.get('telefono_habitacion')),
                 "telefono_movil": database.encrypt_data(patient_data.get('telefono_movil')),
                 "email": database.encrypt_data(patient_data.get('email')),
+                "cedula_bidx": database.blind_index('cedula', patient_data.get('cedula')),
+                "telefono_movil_bidx": database.blind_index('telefono_movil', patient_data.get('telefono_movil')),
+                "email_bidx": database.blind_index('email', patient_data.get('email')),
                 "direccion": database.encrypt_data(patient_data.get('direccion')),
                 "profesion_oficio": database.encrypt_data(patient_data.get('profesion_oficio')),
                 "emerg_telefono": database.encrypt_data(patient_data.get('emerg_telefono')),
@@ -139,6 +164,7 @@ class PatientActions:
             cursor.execute(paciente_sql, paciente_values)
             assigned_id = cursor.lastrowid
             print(f"PatientActions: Paciente insertado con ID real: {assigned_id}")
+            database.index_patient_name(cursor, assigned_id, patient_data['nombres'], patient_data['apellidos'])
 
             # --- 2. Insertar en Consultas ---
             print("PatientActions: Preparando datos para Consultas...")
@@ -178,10 +204,12 @@ class PatientActions:
             log_descripcion = f"Creó paciente '{generated_historia}' ({patient_data.get('nombres','')} {patient_data.get('apellidos','')}). Consulta inicial ID: {new_consulta_id}."
             # No incluir patient_data directamente en detalles por seguridad/tamaño, quizás solo IDs o resumen
             log_action(conn, current_user_id, 'CREAR_PACIENTE', log_descripcion,
-                       tabla='Pacientes', registro_id=assigned_id)
+                       tabla='Pacientes', registro_id=assigned_id,
+                       sincrono=True)
 
             # Commit
             conn.commit()
+            directorio_pacientes.DIRECTORIO.marcar_cambios()
             print("PatientActions: Transacción completada exitosamente.")
             return True, f"Paciente registrado con N° Historia: {generated_historia}", generated_historia
 
@@ -205,8 +233,159 @@ class PatientActions:
             return age
         except (ValueError, TypeError): return None
 
-    def get_list(self, search_term=None):
-        print(f"PatientActions: get_list REAL (search: '{search_term}')")
+    def _build_patient_list(self, rows, colnames):
+        """Convierte filas (id, numero_historia, nombres, apellidos, cedula, ...) en los dicts del listado."""
+        patients = []
+        # Descifrar nombres, apellidos y cédula de todas las filas en un solo lote
+        idx_nom, idx_ape, idx_ced = colnames.index('nombres'), colnames.index('apellidos'), colnames.index('cedula')
+        decrypted = database.decrypt_many([row[i] for row in rows for i in (idx_nom, idx_ape, idx_ced)])
+
+        for row_num, row in enumerate(rows):
+            patient_dict = dict(zip(colnames, row))
+            try:
+                nombres_dec, apellidos_dec, cedula_dec = decrypted[row_num * 3:row_num * 3 + 3]
+                patient_dict['nombre_completo'] = f"{nombres_dec or ''} {apellidos_dec or ''}".strip()
+                patient_dict['cedula'] = cedula_dec
+                patient_dict['edad'] = self.calculate_age(patient_dict.get('fecha_nacimiento'))
+            except Exception as decrypt_error:
+                 print(f"Warn: Error procesando ID {patient_dict.get('id')}: {decrypt_error}")
+                 patient_dict['nombre_completo'] = "[Error]"
+                 patient_dict['cedula'] = "[Error]"
+                 patient_dict['edad'] = '??'
+            patients.append(patient_dict)
+        return patients
+
+    def _sort_window(self, patients, offset, limit, sort_by, sort_dir, with_total):
+        """
+        Orden y ventana en memoria con las mismas reglas que la consulta SQL de get_list.
+        sort_by=None conserva el orden recibido (relevancia del directorio de pacientes).
+        """
+        if sort_by is not None:
+            column, inverted = self.LIST_SORT_COLUMNS.get(sort_by, ('id', False))
+            descending = (str(sort_dir).lower() != 'asc') != inverted
+            patients.sort(key=lambda p: p['id'], reverse=descending)
+            if column != 'id': # Orden estable: el id queda como desempate; NULL primero en ASC como en SQLite
+                patients.sort(key=lambda p: (p.get(column) is not None, p.get(column) or ''), reverse=descending)
+        total_count = len(patients) if with_total or limit is None else -1
+        if limit is not None:
+            limit = max(1, min(int(limit), self.LIST_MAX_WINDOW))
+            offset = max(0, int(offset or 0))
+            patients = patients[offset:offset + limit]
+        return patients, total_count
+
+    def find_by_blind_index(self, field, value):
+        """
+        Búsqueda exacta de pacientes por 'cedula', 'telefono_movil' o 'email' usando el
+        índice ciego (una búsqueda indexada, sin descifrar la tabla completa).
+        Retorna: tuple (list: pacientes con el formato de get_list, int: total) o (None, 0) si falla.
+        """
+        if field not in database.BLIND_INDEX_NORMALIZERS:
+            print(f"PatientActions Error: Campo de búsqueda exacta no soportado: {field}")
+            return None, 0
+        token = database.blind_index(field, value)
+        if token is None:
+            return [], 0
+        conn = None
+        try:
+            conn = database.connect_db()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT id, numero_historia, nombres, apellidos, cedula, fecha_nacimiento, sexo
+                FROM Pacientes WHERE {field}_bidx = ? ORDER BY id DESC
+            """, (token,))
+            rows = cursor.fetchall()
+            colnames = [desc[0] for desc in cursor.description]
+            cursor.close()
+
+            patients = self._build_patient_list(rows, colnames)
+            if field == 'cedula':
+                # El índice solo usa los dígitos: descartar V/E distintos a los pedidos
+                patients = [p for p in patients if database.same_cedula(p['cedula'], value)]
+            return patients, len(patients)
+        except sqlite3.Error as db_err:
+            print(f"DB Error find_by_blind_index: {db_err}"); traceback.print_exc(); return None, 0
+        except Exception as e:
+            print(f"Error find_by_blind_index: {e}"); traceback.print_exc(); return None, 0
+        finally:
+            if conn: conn.close()
+
+    def search_by_name(self, query, limit=100):
+        """
+        Busca pacientes cuyo nombre completo contenga el término (subcadena para palabras de
+        3+ letras, inicio de palabra para 1-2 letras), sin acentos ni mayúsculas.
+        Usa el índice de trigramas y solo descifra a los candidatos necesarios para llenar 'limit'.
+        Retorna: tuple (list: pacientes con el formato de get_list, int: total) o (None, 0) si falla.
+        Si hay más candidatos que 'limit', el total es el número de candidatos (cota superior).
+        """
+        candidates = database.name_candidates_sql(query)
+        if not candidates:
+            return [], 0
+        conn = None
+        try:
+            conn = database.connect_db()
+            cursor = conn.cursor()
+            cursor.execute(f"{candidates[0]} ORDER BY paciente_id DESC", candidates[1])
+            candidate_ids = [row[0] for row in cursor.fetchall()]
+
+            # Descifrar candidatos por tandas hasta completar 'limit' coincidencias verificadas
+            patients = []
+            checked = 0
+            while checked < len(candidate_ids) and len(patients) < limit:
+                chunk = candidate_ids[checked:checked + max(limit, 50)]
+                checked += len(chunk)
+                cursor.execute(f"""
+                    SELECT id, numero_historia, nombres, apellidos, cedula, fecha_nacimiento, sexo
+                    FROM Pacientes WHERE id IN ({", ".join("?" * len(chunk))}) ORDER BY id DESC
+                """, chunk)
+                rows = cursor.fetchall()
+                colnames = [desc[0] for desc in cursor.description]
+                patients.extend(p for p in self._build_patient_list(rows, colnames)
+                                if database.name_matches(query, p['nombre_completo']))
+            cursor.close()
+
+            # Si no se verificaron todos los candidatos, el total es una cota superior
+            total = len(patients) if checked >= len(candidate_ids) else len(candidate_ids)
+            return patients[:limit], total
+        except sqlite3.Error as db_err:
+            print(f"DB Error search_by_name: {db_err}"); traceback.print_exc(); return None, 0
+        except Exception as e:
+            print(f"Error search_by_name: {e}"); traceback.print_exc(); return None, 0
+        finally:
+            if conn: conn.close()
+
+    def find_by_cedula(self, cedula):
+        return self.find_by_blind_index('cedula', cedula)
+
+    def find_by_telefono(self, telefono_movil):
+        return self.find_by_blind_index('telefono_movil', telefono_movil)
+
+    def find_by_email(self, email):
+        return self.find_by_blind_index('email', email)
+
+    def get_list(self, search_term=None, offset=0, limit=None, sort_by='id', sort_dir='desc', with_total=True):
+        """
+        Lista de pacientes, opcionalmente filtrada por 'search_term'.
+        Con 'limit' devuelve solo la ventana [offset, offset+limit) en el orden pedido y
+        descifra únicamente esas filas; sin 'limit' devuelve la lista completa (comportamiento anterior).
+        Solo se ordena por columnas en claro (ver LIST_SORT_COLUMNS); nombres y cédula van cifrados.
+        Retorna: tuple (list: pacientes, int: total) o (None, 0) si falla. Con with_total=False el
+        total es -1 (el listado virtual solo lo pide con la primera ventana).
+        Las búsquedas usan el directorio de pacientes en memoria: inicio del N° de historia, inicio
+        de la cédula (3+ dígitos), palabras del nombre y errores de tipeo. Con el orden por defecto
+        (id desc) los resultados van por relevancia. Mientras el directorio carga (se espera como
+        mucho directorio_pacientes.ESPERA_CARGA_S) o si falló, se busca en SQL, que reconoce menos:
+        cédula exacta (5+ dígitos) y nombres por el índice de trigramas, sin búsqueda difusa. En ese
+        caso el total con búsqueda por nombre es una cota superior (los candidatos se verifican al
+        descifrar).
+        """
+        print(f"PatientActions: get_list REAL (search: '{search_term}', offset: {offset}, limit: {limit}, orden: {sort_by} {sort_dir})")
+        if search_term and directorio_pacientes.DIRECTORIO.esperar_carga():
+            # Con el directorio en memoria la búsqueda no consulta ni descifra nada
+            found = directorio_pacientes.DIRECTORIO.buscar(search_term, limite=None)
+            if found is not None:
+                by_relevance = sort_by == 'id' and str(sort_dir).lower() != 'asc'
+                return self._sort_window(found, offset, limit, None if by_relevance else sort_by,
+                                         sort_dir, with_total)
         conn = None
         patients = []
         total_count = 0
@@ -216,48 +395,69 @@ class PatientActions:
         params = []
         where_clauses = []
 
+        name_candidates = None
         if search_term:
             search_like = f"%{search_term}%"
-            where_clauses.append("numero_historia LIKE ?")
+            search_clauses = ["numero_historia LIKE ?"]
             params.append(search_like)
+            cedula_digits = database.normalize_cedula(search_term)
+            if cedula_digits and len(cedula_digits) >= 5:
+                # El término parece una cédula: buscar también coincidencia exacta por índice ciego
+                search_clauses.append("cedula_bidx = ?")
+                params.append(database.blind_index('cedula', search_term))
+            if any(ch.isalpha() for ch in search_term):
+                # Nombres/apellidos: candidatos por el índice de trigramas, verificados tras descifrar
+                name_candidates = database.name_candidates_sql(search_term)
+                if name_candidates:
+                    search_clauses.append(f"id IN ({name_candidates[0]})")
+                    params.extend(name_candidates[1])
+            where_clauses.append("(" + " OR ".join(search_clauses) + ")")
 
         if where_clauses:
             sql_where = " WHERE " + " AND ".join(where_clauses)
             base_query += sql_where
             count_query += sql_where
 
-        base_query += " ORDER BY id DESC"
+        # Orden: columna en claro + id como desempate para que las ventanas sean estables
+        column, inverted = self.LIST_SORT_COLUMNS.get(sort_by, ('id', False))
+        descending = (str(sort_dir).lower() != 'asc') != inverted
+        direction = "DESC" if descending else "ASC"
+        base_query += f" ORDER BY {column} {direction}" if column == 'id' else f" ORDER BY {column} {direction}, id {direction}"
+        query_params = list(params)
+        if limit is not None:
+            limit = max(1, min(int(limit), self.LIST_MAX_WINDOW))
+            offset = max(0, int(offset or 0))
+            base_query += " LIMIT ? OFFSET ?"
+            query_params += [limit, offset]
 
         try:
             conn = database.connect_db()
             if not conn: raise sqlite3.Error("Fallo conexión DB")
             cursor = conn.cursor()
 
-            cursor.execute(count_query, params)
-            total_count = cursor.fetchone()[0]
+            total_count = -1
+            if with_total or limit is None:
+                cursor.execute(count_query, params)
+                total_count = cursor.fetchone()[0]
 
-            cursor.execute(base_query, params)
+            cursor.execute(base_query, query_params)
             rows = cursor.fetchall()
             colnames = [desc[0] for desc in cursor.description]
             cursor.close() # Cerrar cursor aquí
 
-            for row in rows:
-                patient_dict = dict(zip(colnames, row))
-                try:
-                    nombres_dec = database.decrypt_data(patient_dict.get('nombres')) or ''
-                    apellidos_dec = database.decrypt_data(patient_dict.get('apellidos')) or ''
-                    patient_dict['nombre_completo'] = f"{nombres_dec} {apellidos_dec}".strip()
-                    patient_dict['cedula'] = database.decrypt_data(patient_dict.get('cedula'))
-                    patient_dict['edad'] = self.calculate_age(patient_dict.get('fecha_nacimiento'))
-                except Exception as decrypt_error:
-                     print(f"Warn: Error procesando ID {patient_dict.get('id')}: {decrypt_error}")
-                     patient_dict['nombre_completo'] = "[Error]"
-                     patient_dict['cedula'] = "[Error]"
-                     patient_dict['edad'] = '??'
-                patients.append(patient_dict)
+            patients = self._build_patient_list(rows, colnames)
+            if name_candidates:
+                # Descartar falsos positivos del índice de nombres (colisiones de tokens)
+                term_lower = search_term.lower()
+                patients = [p for p in patients
+                            if term_lower in (p.get('numero_historia') or '').lower()
+                            or database.same_cedula(p.get('cedula'), search_term)
+                            or database.name_matches(search_term, p.get('nombre_completo'))]
+                if limit is None:
+                    total_count = len(patients)
 
             print(f"PatientActions: Devolviendo {len(patients)} pacientes filtrados.")
-            return patients, total_count # Devolver total_count original para posible paginación futura
+            return patients, total_count
 
         except sqlite3.Error as db_err:
             print(f"DB Error get_list: {db_err}"); traceback.print_exc(); return None, 0
@@ -266,357 +466,492 @@ class PatientActions:
         finally:
             if conn: conn.close()
 
-    def get_details(self, patient_id):
-        print(f"PatientActions: Obteniendo TODOS los detalles para paciente ID: {patient_id}")
-        conn = None
-        patient_details = { # Diccionario principal a devolver
-            "info": None,
-            "consultas_info": [], # Lista con info básica de cada consulta
-            "evoluciones_todas": [],
-            "ordenes_medicas_todas": [],
-            "complementarios_todos": [],
-            "interconsultas_todas": [],
-            "informes_medicos_todos": [],
-            "recipes_todos": [],
-            "examen_fisico_inicial": None # Para la pestaña Resumen Ingreso
-        }
-
-        try:
-            conn = database.connect_db()
-            if not conn: raise sqlite3.Error("Fallo conexión DB")
-            cursor = conn.cursor()
-
-            # --- 1. Obtener Datos del Paciente (Como antes, pero simplificado) ---
-            print("PatientActions: Obteniendo datos básicos del paciente...")
-            cursor.execute("SELECT * FROM Pacientes WHERE id = ?", (patient_id,))
-            patient_row = cursor.fetchone()
-            if not patient_row:
-                print(f"PatientActions Error: Paciente ID {patient_id} no encontrado."); return None # Retorna None si no existe
-
-            patient_cols = [desc[0] for desc in cursor.description]
-            patient_info_raw = dict(zip(patient_cols, patient_row))
-            patient_info_processed = {'id': patient_info_raw['id']}
-            for key, value in patient_info_raw.items():
-                if key == 'id': continue
-                excluded_keys = ['fecha_nacimiento', 'fecha_registro', 'sexo', 'numero_historia',
-                                 'ap_asma', 'ap_hta', 'ap_dm', 'ap_otros', # Estos son flags 0/1
-                                 'usuario_registro_id', 'fecha_ultima_mod', 'usuario_ultima_mod_id']
-                if isinstance(value, bytes) and key not in excluded_keys:
-                    try: patient_info_processed[key] = database.decrypt_data(value)
-                    except Exception as e: patient_info_processed[key] = "[Error Decrypt]"
-                else: patient_info_processed[key] = value # Copiar flags y no-blobs
-
-            # Añadir campos de flags explícitos si no existen (por si acaso)
-            patient_info_processed['ap_asma'] = patient_info_raw.get('ap_asma', 0)
-            patient_info_processed['ap_hta'] = patient_info_raw.get('ap_hta', 0)
-            patient_info_processed['ap_dm'] = patient_info_raw.get('ap_dm', 0)
-            patient_info_processed['ap_otros'] = patient_info_raw.get('ap_otros', 0)
-
-
-            if patient_info_processed.get('fecha_nacimiento'):
-                patient_info_processed['edad_calculada'] = self.calculate_age(patient_info_processed['fecha_nacimiento'])
-
-            patient_details['info'] = patient_info_processed # Asignar datos del paciente
-
-            print("PatientActions: Obteniendo info básica de consultas...")
-            cursor.execute("""
-                SELECT c.id, c.paciente_id, c.usuario_id, c.fecha_hora_ingreso, c.fecha_hora_egreso,
-                       c.usuario_cierre_id, c.motivo_consulta, c.historia_enfermedad_actual, c.diagnostico_ingreso,
-                       COALESCE(u_inicio.nombre_completo, u_inicio.nombre_usuario) as usuario_inicio_nombre, 
-                       COALESCE(u_cierre.nombre_completo, u_cierre.nombre_usuario) as usuario_cierre_nombre
-                FROM Consultas c
-                LEFT JOIN Usuarios u_inicio ON c.usuario_id = u_inicio.id
-                LEFT JOIN Usuarios u_cierre ON c.usuario_cierre_id = u_cierre.id
-                WHERE c.paciente_id = ? ORDER BY c.fecha_hora_ingreso DESC
-            """, (patient_id,))
-            consulta_rows = cursor.fetchall()
-            consulta_cols = [desc[0] for desc in cursor.description]
-            initial_consultation_id = None 
-
-            for i, consulta_row in enumerate(consulta_rows):
-                consulta_info_raw = dict(zip(consulta_cols, consulta_row))
-                consulta_id = consulta_info_raw['id'] # <--- Obtienes el ID de la consulta
-
-                if i == 0: 
-                    initial_consultation_id = consulta_id # Guardas el ID de la primera (más reciente)
-
-                # Creas el diccionario procesado INCLUYENDO el 'id'
-                consulta_info_processed = {'id': consulta_id, 'paciente_id': consulta_info_raw['paciente_id']} 
-                
-                for key, value in consulta_info_raw.items():
-                    if key in ['id', 'paciente_id']: continue 
-
-                    excluded_keys_consulta = ['usuario_id', 'usuario_cierre_id', 'fecha_hora_ingreso', 'fecha_hora_egreso']
-
-                    # Si nombre_completo de Usuarios es BLOB, necesitas desencriptarlo aquí también.
-                    # La consulta SQL ya intenta con COALESCE, pero si el nombre_completo es un BLOB, 
-                    # el COALESCE devolverá el BLOB o el nombre_usuario (texto).
-                    # Necesitas manejar la desencriptación del nombre_completo si es BLOB.
-
-                    if key in ['usuario_inicio_nombre', 'usuario_cierre_nombre']:
-                        # Si estos campos pueden ser BLOB (porque nombre_completo en Usuarios es BLOB)
-                        if isinstance(value, bytes):
-                            try:
-                                consulta_info_processed[key] = database.decrypt_data(value)
-                            except Exception:
-                                consulta_info_processed[key] = "[Error Decrypt Nombre]"
-                        else: # Es texto (probablemente el nombre_usuario del COALESCE)
-                            consulta_info_processed[key] = value
-                    elif isinstance(value, bytes) and key not in excluded_keys_consulta:
-                        try:
-                            consulta_info_processed[key] = database.decrypt_data(value)
-                        except Exception:
-                            consulta_info_processed[key] = "[Error Decrypt]"
-                    elif key not in excluded_keys_consulta:
-                        consulta_info_processed[key] = value
-                
-                patient_details['consultas_info'].append(consulta_info_processed) # <<<--- AQUÍ SE AÑADE A LA LISTA
-
-
-            # --- 3. Obtener Examen Físico INICIAL (si existe) ---
-            if initial_consultation_id:
-                print(f"PatientActions: Obteniendo examen físico inicial (Consulta ID: {initial_consultation_id})...")
-                cursor.execute("SELECT * FROM ExamenesFisicos WHERE consulta_id = ?", (initial_consultation_id,))
-                examen_row = cursor.fetchone()
-                if examen_row:
-                    examen_cols = [d[0] for d in cursor.description]
-                    examen_info_raw = dict(zip(examen_cols, examen_row))
-                    ef_inicial_proc = {'id': examen_info_raw['id']}
-                    for key, value in examen_info_raw.items():
-                        if key in ['id', 'consulta_id']: continue
-                        excluded_keys_ef = ['fecha_hora', 'ef_fr', 'ef_fc', 'ef_sato2', 'ef_glic']
-                        if isinstance(value, bytes) and key not in excluded_keys_ef:
-                            try: ef_inicial_proc[key] = database.decrypt_data(value)
-                            except Exception: ef_inicial_proc[key] = "[Error Decrypt]"
-                        else: ef_inicial_proc[key] = value
-                    patient_details['examen_fisico_inicial'] = ef_inicial_proc
-
-            # --- 4. Obtener TODAS las Evoluciones del Paciente ---
-            print("PatientActions: Obteniendo todas las evoluciones...")
-            cursor.execute("""
-                SELECT e.*, 
-                       u_creador.nombre_usuario as u_creador_username,
-                       u_creador.nombre_completo as u_creador_fullname_enc,
-                       u_mod.nombre_usuario as u_mod_username,
-                       u_mod.nombre_completo as u_mod_fullname_enc
+    # --- Historia del paciente por secciones ---
+    # get_details arma la historia completa (impresión, edición de datos, compatibilidad);
+    # paciente_detalle.html abre con get_header y pide cada pestaña con get_section al abrirla.
+    # sección -> (clave en get_details, SQL con {keyset}, columna de orden, columna id, campo de fecha en el dict)
+    # El orden es (fecha DESC, id DESC) para que el cursor de página (fecha|id) sea estable.
+    PATIENT_SECTIONS = {
+        'evoluciones': ('evoluciones_todas', """
+                SELECT e.*
                 FROM Evoluciones e
                 JOIN Consultas c ON e.consulta_id = c.id
-                JOIN Usuarios u_creador ON e.usuario_id = u_creador.id
-                LEFT JOIN Usuarios u_mod ON e.usuario_ultima_mod_id = u_mod.id
-                WHERE c.paciente_id = ?
-                ORDER BY e.fecha_hora DESC
-            """, (patient_id,))
-            evo_rows = cursor.fetchall()
-            evo_cols = [d[0] for d in cursor.description]
-            for evo_row in evo_rows:
-                evo_info_raw = dict(zip(evo_cols, evo_row))
-                evo_info_processed = {'id': evo_info_raw['id']}
-
-                # Desencriptar nombre_completo para creador
-                creador_fullname_dec = None
-                if evo_info_raw.get('u_creador_fullname_enc'):
-                    try:
-                        creador_fullname_dec = database.decrypt_data(evo_info_raw['u_creador_fullname_enc'])
-                    except Exception:
-                        creador_fullname_dec = "[Err Fullname]"
-                evo_info_processed['usuario_creador_nombre_completo'] = creador_fullname_dec or evo_info_raw.get('u_creador_username') or "N/D"
-                # Mantener username por si se usa como fallback o para logs internos
-                evo_info_processed['usuario_creador_username'] = evo_info_raw.get('u_creador_username') 
-
-
-                # Desencriptar nombre_completo para modificador
-                mod_fullname_dec = None
-                if evo_info_raw.get('u_mod_fullname_enc'):
-                    try:
-                        mod_fullname_dec = database.decrypt_data(evo_info_raw['u_mod_fullname_enc'])
-                    except Exception:
-                        mod_fullname_dec = "[Err Fullname]"
-                evo_info_processed['usuario_modificador_nombre_completo'] = mod_fullname_dec or evo_info_raw.get('u_mod_username') or "N/D"
-                evo_info_processed['usuario_modificador_username'] = evo_info_raw.get('u_mod_username')
-
-
-                # Procesar otros campos de la evolución
-                for key, value in evo_info_raw.items():
-                    if key in ['id', 'u_creador_username', 'u_creador_fullname_enc', 'u_mod_username', 'u_mod_fullname_enc']: continue
-                    
-                    blob_fields_evo = ['ev_subjetivo', 'ev_objetivo', 'ev_ta', 'ev_temp', 'ev_piel', 'ev_respiratorio', 'ev_cardiovascular', 'ev_abdomen', 'ev_extremidades', 'ev_neurologico', 'ev_otros', 'ev_diagnosticos', 'ev_tratamiento_plan', 'ev_comentario']
-                    excluded_keys_evo = ['consulta_id', 'usuario_id', 'fecha_hora', 'dias_hospitalizacion', 'ev_fc', 'ev_fr', 'ev_sato2', 'fecha_ultima_mod', 'usuario_ultima_mod_id']
-
-                    if key in blob_fields_evo and isinstance(value, bytes):
-                        try: evo_info_processed[key] = database.decrypt_data(value)
-                        except Exception: evo_info_processed[key] = "[Error Decrypt]"
-                    elif key not in excluded_keys_evo:
-                        evo_info_processed[key] = value
-                    elif key in ['fecha_hora', 'fecha_ultima_mod']: # Copiar fechas importantes
-                        evo_info_processed[key] = value
-                
-                patient_details['evoluciones_todas'].append(evo_info_processed)
-
-
-            # --- 5. Obtener TODAS las Órdenes Médicas ---
-            # --- 5. Obtener TODAS las Órdenes Médicas ---
-            print("PatientActions: Obteniendo todas las órdenes médicas...")
-            cursor.execute("""
-                SELECT om.id, om.consulta_id, om.evolucion_id, om.usuario_id, om.fecha_hora, 
-                       om.orden_json_blob, om.estado,
-                       COALESCE(u.nombre_completo, u.nombre_usuario) as usuario_orden_nombre_enc
+                WHERE c.paciente_id = ? {keyset}
+                ORDER BY e.fecha_hora DESC, e.id DESC
+            """, 'e.fecha_hora', 'e.id', 'fecha_hora'),
+        'ordenes': ('ordenes_medicas_todas', """
+                SELECT om.id, om.consulta_id, om.evolucion_id, om.usuario_id, om.fecha_hora,
+                       om.orden_json_blob, om.estado
                 FROM OrdenesMedicas om
-                JOIN Usuarios u ON om.usuario_id = u.id
                 JOIN Consultas c ON om.consulta_id = c.id -- Asegurar que la consulta pertenezca al paciente
-                WHERE c.paciente_id = ? 
-                ORDER BY om.fecha_hora DESC
-            """, (patient_id,)) # Filtrar por patient_id a través de la consulta
-            om_rows = cursor.fetchall()
-            om_cols = [d[0] for d in cursor.description]
-            
-            for om_row in om_rows:
-                om_info_raw = dict(zip(om_cols, om_row))
-                om_info_proc = {'id': om_info_raw['id']}
-
-                # Procesar campos no blob o que no son el json principal
-                for key, value in om_info_raw.items():
-                    if key in ['id', 'orden_json_blob', 'usuario_orden_nombre_enc']: # Excluir estos por ahora
-                        continue
-                    om_info_proc[key] = value
-
-                # Desencriptar nombre del usuario que ordenó
-                nombre_usuario_enc = om_info_raw.get('usuario_orden_nombre_enc')
-                if nombre_usuario_enc and isinstance(nombre_usuario_enc, bytes):
-                    try:
-                        om_info_proc['usuario_orden_nombre'] = database.decrypt_data(nombre_usuario_enc)
-                    except:
-                        om_info_proc['usuario_orden_nombre'] = "[Error Decrypt Nombre]"
-                elif nombre_usuario_enc: # Ya es texto
-                    om_info_proc['usuario_orden_nombre'] = nombre_usuario_enc
-                else:
-                    om_info_proc['usuario_orden_nombre'] = "N/D"
-
-
-                # ---- PROCESAMIENTO DE orden_json_blob ----
-                blob_original = om_info_raw.get('orden_json_blob')
-                if blob_original and isinstance(blob_original, bytes):
-                    try:
-                        decrypted_json_string = database.decrypt_data(blob_original)
-                        # El resultado de decrypt_data DEBE SER un string JSON
-                        om_info_proc['orden_json_blob'] = decrypted_json_string if decrypted_json_string else "{}"
-                        # Log para verificar
-                        print(f"   Orden ID {om_info_proc['id']}: orden_json_blob desencriptado a string: '{str(om_info_proc['orden_json_blob'])[:100]}...'")
-                    except Exception as e_decrypt_om:
-                        print(f"   ERROR desencriptando orden_json_blob para orden ID {om_info_proc['id']}: {e_decrypt_om}")
-                        om_info_proc['orden_json_blob'] = json.dumps({"error_desencriptacion": f"Fallo al desencriptar blob: {str(e_decrypt_om)}"})
-                elif blob_original: # Si no es bytes pero existe (ej. ya es un string, aunque no debería ser si viene de la BD)
-                    print(f"   WARN: orden_json_blob para orden ID {om_info_proc['id']} no era bytes, sino {type(blob_original)}. Usando tal cual.")
-                    om_info_proc['orden_json_blob'] = str(blob_original) # Asegurar que sea string
-                else: # Si es None o vacío
-                    print(f"   Orden ID {om_info_proc['id']}: orden_json_blob es None o vacío. Se usará '{{}}'.")
-                    om_info_proc['orden_json_blob'] = "{}" # String de JSON vacío
-                # ---- FIN PROCESAMIENTO DE orden_json_blob ----
-                
-                patient_details['ordenes_medicas_todas'].append(om_info_proc)
-
-
-            # --- 6. Obtener TODOS los Complementarios ---
-            print("PatientActions: Obteniendo todos los complementarios...")
-            cursor.execute("""
+                WHERE c.paciente_id = ? {keyset}
+                ORDER BY om.fecha_hora DESC, om.id DESC
+            """, 'om.fecha_hora', 'om.id', 'fecha_hora'),
+        'complementarios': ('complementarios_todos', """
                 SELECT comp.*, u.nombre_usuario as usuario_registrador_nombre
                 FROM Complementarios comp
                 LEFT JOIN Usuarios u ON comp.usuario_registrador_id = u.id
-                WHERE comp.paciente_id = ?
-                ORDER BY comp.fecha_registro DESC
-            """, (patient_id,))
-            comp_rows = cursor.fetchall()
-            comp_cols = [d[0] for d in cursor.description]
-            for comp_row in comp_rows:
-                comp_info_raw = dict(zip(comp_cols, comp_row))
-                comp_info_proc = {'id': comp_info_raw['id']}
-                blob_fields_comp = ['nombre_estudio', 'resultado_informe', 'archivo_adjunto_path']
-                excluded_keys_comp = ['id', 'paciente_id', 'consulta_id', 'orden_medica_id', 'usuario_registrador_id', 'fecha_registro', 'tipo_complementario', 'fecha_realizacion', 'usuario_registrador_nombre']
-                for key, value in comp_info_raw.items():
-                     if key in blob_fields_comp and isinstance(value, bytes):
-                         try: comp_info_proc[key] = database.decrypt_data(value)
-                         except Exception: comp_info_proc[key] = "[Error Decrypt]"
-                     elif key not in excluded_keys_comp: comp_info_proc[key] = value
-                     elif key in ['usuario_registrador_nombre', 'fecha_registro', 'fecha_realizacion', 'tipo_complementario']: comp_info_proc[key] = value # Copiar campos importantes
-                patient_details['complementarios_todos'].append(comp_info_proc)
-
-            # --- 7. Obtener TODAS las Interconsultas ---
-            print("PatientActions: Obteniendo todas las interconsultas...")
-            cursor.execute("""
+                WHERE comp.paciente_id = ? {keyset}
+                ORDER BY comp.fecha_registro DESC, comp.id DESC
+            """, 'comp.fecha_registro', 'comp.id', 'fecha_registro'),
+        'interconsultas': ('interconsultas_todas', """
                  SELECT ic.*, u_sol.nombre_usuario as usuario_solicitante_nombre,
                         u_resp.nombre_usuario as usuario_respuesta_nombre
                  FROM Interconsultas ic
                  JOIN Usuarios u_sol ON ic.usuario_solicitante_id = u_sol.id
                  LEFT JOIN Usuarios u_resp ON ic.usuario_respuesta_id = u_resp.id
-                 WHERE ic.paciente_id = ?
-                 ORDER BY ic.fecha_solicitud DESC
-            """, (patient_id,))
-            ic_rows = cursor.fetchall()
-            ic_cols = [d[0] for d in cursor.description]
-            for ic_row in ic_rows:
-                ic_info_raw = dict(zip(ic_cols, ic_row))
-                ic_info_proc = {'id': ic_info_raw['id']}
-                blob_fields_ic = ['servicio_consultado', 'motivo_consulta', 'respuesta_texto']
-                excluded_keys_ic = ['id', 'paciente_id', 'consulta_id', 'orden_medica_id', 'usuario_solicitante_id', 'fecha_solicitud', 'fecha_respuesta', 'usuario_respuesta_id', 'estado', 'usuario_solicitante_nombre', 'usuario_respuesta_nombre']
-                for key, value in ic_info_raw.items():
-                    if key in blob_fields_ic and isinstance(value, bytes):
-                         try: ic_info_proc[key] = database.decrypt_data(value)
-                         except Exception: ic_info_proc[key] = "[Error Decrypt]"
-                    elif key not in excluded_keys_ic: ic_info_proc[key] = value
-                    elif key in ['usuario_solicitante_nombre', 'usuario_respuesta_nombre', 'fecha_solicitud', 'fecha_respuesta', 'estado']: ic_info_proc[key] = value # Copiar
-                patient_details['interconsultas_todas'].append(ic_info_proc)
-
-
-            # --- 8. Obtener TODOS los Informes Médicos ---
-            print("PatientActions: Obteniendo todos los informes médicos...")
-            cursor.execute("""
+                 WHERE ic.paciente_id = ? {keyset}
+                 ORDER BY ic.fecha_solicitud DESC, ic.id DESC
+            """, 'ic.fecha_solicitud', 'ic.id', 'fecha_solicitud'),
+        'informes': ('informes_medicos_todos', """
                  SELECT im.*, u.nombre_usuario as usuario_creador_nombre
                  FROM InformesMedicos im
                  JOIN Usuarios u ON im.usuario_id = u.id
-                 WHERE im.paciente_id = ?
-                 ORDER BY im.fecha_creacion DESC
-            """, (patient_id,))
-            im_rows = cursor.fetchall()
-            im_cols = [d[0] for d in cursor.description]
-            for im_row in im_rows:
-                im_info_raw = dict(zip(im_cols, im_row))
-                im_info_proc = {'id': im_info_raw['id']}
-                blob_fields_im = ['contenido_texto', 'archivo_generado_path']
-                excluded_keys_im = ['id', 'paciente_id', 'consulta_id', 'usuario_id', 'fecha_creacion', 'tipo_informe', 'usuario_creador_nombre']
-                for key, value in im_info_raw.items():
-                     if key in blob_fields_im and isinstance(value, bytes):
-                         try: im_info_proc[key] = database.decrypt_data(value)
-                         except Exception: im_info_proc[key] = "[Error Decrypt]"
-                     elif key not in excluded_keys_im: im_info_proc[key] = value
-                     elif key in ['usuario_creador_nombre', 'fecha_creacion', 'tipo_informe']: im_info_proc[key] = value # Copiar
-                patient_details['informes_medicos_todos'].append(im_info_proc)
-
-
-            # --- 9. Obtener TODOS los Recipes ---
-            print("PatientActions: Obteniendo todos los récipes...")
-            cursor.execute("""
+                 WHERE im.paciente_id = ? {keyset}
+                 ORDER BY im.fecha_creacion DESC, im.id DESC
+            """, 'im.fecha_creacion', 'im.id', 'fecha_creacion'),
+        'recipes': ('recipes_todos', """
                  SELECT r.*, u.nombre_usuario as usuario_emisor_nombre
                  FROM Recipes r
                  JOIN Usuarios u ON r.usuario_id = u.id
-                 WHERE r.paciente_id = ?
-                 ORDER BY r.fecha_emision DESC
-            """, (patient_id,))
-            r_rows = cursor.fetchall()
-            r_cols = [d[0] for d in cursor.description]
-            for r_row in r_rows:
-                r_info_raw = dict(zip(r_cols, r_row))
-                r_info_proc = {'id': r_info_raw['id']}
-                blob_fields_r = ['recipe_texto']
-                excluded_keys_r = ['id', 'paciente_id', 'consulta_id', 'evolucion_id', 'usuario_id', 'fecha_emision', 'tipo', 'usuario_emisor_nombre']
-                for key, value in r_info_raw.items():
-                     if key in blob_fields_r and isinstance(value, bytes):
-                          try: r_info_proc[key] = database.decrypt_data(value)
-                          except Exception: r_info_proc[key] = "[Error Decrypt]"
-                     elif key not in excluded_keys_r: r_info_proc[key] = value
-                     elif key in ['usuario_emisor_nombre', 'fecha_emision', 'tipo']: r_info_proc[key] = value # Copiar
-                patient_details['recipes_todos'].append(r_info_proc)
+                 WHERE r.paciente_id = ? {keyset}
+                 ORDER BY r.fecha_emision DESC, r.id DESC
+            """, 'r.fecha_emision', 'r.id', 'fecha_emision'),
+    }
+    # Filas por página de una sección cuando la vista no indica otra cosa
+    SECTION_PAGE_SIZE = 20
+
+    def _fetch_patient_info(self, cursor, patient_id):
+        """Datos del paciente descifrados, o None si no existe."""
+        cursor.execute("SELECT * FROM Pacientes WHERE id = ?", (patient_id,))
+        patient_row = cursor.fetchone()
+        if not patient_row:
+            return None
+
+        patient_cols = [desc[0] for desc in cursor.description]
+        patient_info_raw = dict(zip(patient_cols, patient_row))
+        patient_info_processed = {'id': patient_info_raw['id']}
+        for key, value in patient_info_raw.items():
+            if key == 'id' or key.endswith('_bidx'): continue # Índices ciegos: no se descifran ni se envían a la vista
+            excluded_keys = ['fecha_nacimiento', 'fecha_registro', 'sexo', 'numero_historia',
+                             'ap_asma', 'ap_hta', 'ap_dm', 'ap_otros', # Estos son flags 0/1
+                             'usuario_registro_id', 'fecha_ultima_mod', 'usuario_ultima_mod_id']
+            if isinstance(value, bytes) and key not in excluded_keys:
+                try: patient_info_processed[key] = database.decrypt_data(value)
+                except Exception as e: patient_info_processed[key] = "[Error Decrypt]"
+            else: patient_info_processed[key] = value # Copiar flags y no-blobs
+
+        # Añadir campos de flags explícitos si no existen (por si acaso)
+        patient_info_processed['ap_asma'] = patient_info_raw.get('ap_asma', 0)
+        patient_info_processed['ap_hta'] = patient_info_raw.get('ap_hta', 0)
+        patient_info_processed['ap_dm'] = patient_info_raw.get('ap_dm', 0)
+        patient_info_processed['ap_otros'] = patient_info_raw.get('ap_otros', 0)
+
+        if patient_info_processed.get('fecha_nacimiento'):
+            patient_info_processed['edad_calculada'] = self.calculate_age(patient_info_processed['fecha_nacimiento'])
+        return patient_info_processed
+
+    def _fetch_consultas(self, cursor, patient_id):
+        """Info básica de cada consulta del paciente, de la más reciente a la más antigua."""
+        cursor.execute("""
+            SELECT c.id, c.paciente_id, c.usuario_id, c.fecha_hora_ingreso, c.fecha_hora_egreso,
+                   c.usuario_cierre_id, c.motivo_consulta, c.historia_enfermedad_actual, c.diagnostico_ingreso
+            FROM Consultas c
+            WHERE c.paciente_id = ? ORDER BY c.fecha_hora_ingreso DESC
+        """, (patient_id,))
+        consulta_rows = cursor.fetchall()
+        consulta_cols = [desc[0] for desc in cursor.description]
+        consultas = []
+
+        for consulta_row in consulta_rows:
+            consulta_info_raw = dict(zip(consulta_cols, consulta_row))
+            consulta_id = consulta_info_raw['id']
+
+            # Creas el diccionario procesado INCLUYENDO el 'id'
+            consulta_info_processed = {'id': consulta_id, 'paciente_id': consulta_info_raw['paciente_id']}
+
+            for key, value in consulta_info_raw.items():
+                if key in ['id', 'paciente_id']: continue
+
+                excluded_keys_consulta = ['usuario_id', 'usuario_cierre_id', 'fecha_hora_ingreso', 'fecha_hora_egreso']
+
+                if isinstance(value, bytes) and key not in excluded_keys_consulta:
+                    try:
+                        consulta_info_processed[key] = database.decrypt_data(value)
+                    except Exception:
+                        consulta_info_processed[key] = "[Error Decrypt]"
+                elif key not in excluded_keys_consulta:
+                    consulta_info_processed[key] = value
+
+            # Quién abrió y quién cerró la consulta, desde el directorio de usuarios
+            consulta_info_processed['usuario_inicio_nombre'] = DIRECTORIO_USUARIOS.nombre(consulta_info_raw['usuario_id'])
+            consulta_info_processed['usuario_cierre_nombre'] = DIRECTORIO_USUARIOS.nombre(consulta_info_raw['usuario_cierre_id'])
+            consultas.append(consulta_info_processed)
+        return consultas
+
+    def _fetch_examen_fisico(self, cursor, consulta_id):
+        """Examen físico de la consulta (pestaña Resumen Ingreso), o None."""
+        cursor.execute("SELECT * FROM ExamenesFisicos WHERE consulta_id = ?", (consulta_id,))
+        examen_row = cursor.fetchone()
+        if not examen_row:
+            return None
+        examen_cols = [d[0] for d in cursor.description]
+        examen_info_raw = dict(zip(examen_cols, examen_row))
+        ef_inicial_proc = {'id': examen_info_raw['id']}
+        for key, value in examen_info_raw.items():
+            if key in ['id', 'consulta_id']: continue
+            excluded_keys_ef = ['fecha_hora', 'ef_fr', 'ef_fc', 'ef_sato2', 'ef_glic']
+            if isinstance(value, bytes) and key not in excluded_keys_ef:
+                try: ef_inicial_proc[key] = database.decrypt_data(value)
+                except Exception: ef_inicial_proc[key] = "[Error Decrypt]"
+            else: ef_inicial_proc[key] = value
+        return ef_inicial_proc
+
+    def _fetch_section(self, cursor, patient_id, section, after=None, limit=None):
+        """
+        Filas procesadas de una sección. 'after' = (fecha, id) de la última fila ya mostrada
+        (página siguiente); limit=None trae la sección completa.
+        """
+        _, sql, order_col, id_col, _ = self.PATIENT_SECTIONS[section]
+        params = [patient_id]
+        keyset = ""
+        if after:
+            keyset = f"AND ({order_col}, {id_col}) < (?, ?)"
+            params.extend(after)
+        sql = sql.format(keyset=keyset)
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cols = [d[0] for d in cursor.description]
+        return getattr(self, f"_process_{section}")(rows, cols)
+
+    def _count_section(self, cursor, patient_id, section):
+        _, sql, _, _, _ = self.PATIENT_SECTIONS[section]
+        cursor.execute(f"SELECT COUNT(*) FROM ({sql.format(keyset='')})", (patient_id,))
+        return cursor.fetchone()[0]
+
+    def _process_evoluciones(self, evo_rows, evo_cols):
+        evoluciones = []
+        blob_fields_evo = ['ev_subjetivo', 'ev_objetivo', 'ev_ta', 'ev_temp', 'ev_piel', 'ev_respiratorio', 'ev_cardiovascular', 'ev_abdomen', 'ev_extremidades', 'ev_neurologico', 'ev_otros', 'ev_diagnosticos', 'ev_tratamiento_plan', 'ev_comentario']
+        # Descifrar de una vez todos los campos BLOB de todas las evoluciones
+        evo_blob_idx = [evo_cols.index(f) for f in blob_fields_evo]
+        evo_decrypted = database.decrypt_many(
+            [evo_row[i] if isinstance(evo_row[i], bytes) else None for evo_row in evo_rows for i in evo_blob_idx]
+        )
+        for evo_num, evo_row in enumerate(evo_rows):
+            evo_info_raw = dict(zip(evo_cols, evo_row))
+            evo_info_processed = {'id': evo_info_raw['id']}
+            evo_dec_row = dict(zip(blob_fields_evo, evo_decrypted[evo_num * len(blob_fields_evo):(evo_num + 1) * len(blob_fields_evo)]))
+
+            # Nombres del creador y del último modificador, desde el directorio de usuarios
+            creador = DIRECTORIO_USUARIOS.obtener(evo_info_raw['usuario_id']) or {}
+            evo_info_processed['usuario_creador_nombre_completo'] = creador.get('nombre_completo') or creador.get('nombre_usuario') or "N/D"
+            # Mantener username por si se usa como fallback o para logs internos
+            evo_info_processed['usuario_creador_username'] = creador.get('nombre_usuario')
+
+            modificador = DIRECTORIO_USUARIOS.obtener(evo_info_raw.get('usuario_ultima_mod_id')) or {}
+            evo_info_processed['usuario_modificador_nombre_completo'] = modificador.get('nombre_completo') or modificador.get('nombre_usuario') or "N/D"
+            evo_info_processed['usuario_modificador_username'] = modificador.get('nombre_usuario')
+
+
+            # Procesar otros campos de la evolución
+            for key, value in evo_info_raw.items():
+                if key == 'id': continue
+
+                excluded_keys_evo = ['consulta_id', 'usuario_id', 'fecha_hora', 'dias_hospitalizacion', 'ev_fc', 'ev_fr', 'ev_sato2', 'fecha_ultima_mod', 'usuario_ultima_mod_id']
+
+                if key in blob_fields_evo and isinstance(value, bytes):
+                    evo_info_processed[key] = evo_dec_row[key]
+                elif key not in excluded_keys_evo:
+                    evo_info_processed[key] = value
+                elif key in ['fecha_hora', 'fecha_ultima_mod']: # Copiar fechas importantes
+                    evo_info_processed[key] = value
+
+            evoluciones.append(evo_info_processed)
+        return evoluciones
+
+    def _process_ordenes(self, om_rows, om_cols):
+        ordenes = []
+        for om_row in om_rows:
+            om_info_raw = dict(zip(om_cols, om_row))
+            om_info_proc = {'id': om_info_raw['id']}
 
+            # Procesar campos no blob o que no son el json principal
+            for key, value in om_info_raw.items():
+                if key in ['id', 'orden_json_blob']: # Excluir estos por ahora
+                    continue
+                om_info_proc[key] = value
 
+            # Nombre del usuario que ordenó, desde el directorio de usuarios
+            om_info_proc['usuario_orden_nombre'] = DIRECTORIO_USUARIOS.nombre(om_info_raw['usuario_id'], "N/D")
+
+
+            # ---- PROCESAMIENTO DE orden_json_blob ----
+            blob_original = om_info_raw.get('orden_json_blob')
+            if blob_original and isinstance(blob_original, bytes):
+                try:
+                    decrypted_json_string = database.decrypt_data(blob_original)
+                    # El resultado de decrypt_data DEBE SER un string JSON
+                    om_info_proc['orden_json_blob'] = decrypted_json_string if decrypted_json_string else "{}"
+                    # Log para verificar
+                    print(f"   Orden ID {om_info_proc['id']}: orden_json_blob desencriptado a string: '{str(om_info_proc['orden_json_blob'])[:100]}...'")
+                except Exception as e_decrypt_om:
+                    print(f"   ERROR desencriptando orden_json_blob para orden ID {om_info_proc['id']}: {e_decrypt_om}")
+                    om_info_proc['orden_json_blob'] = json.dumps({"error_desencriptacion": f"Fallo al desencriptar blob: {str(e_decrypt_om)}"})
+            elif blob_original: # Si no es bytes pero existe (ej. ya es un string, aunque no debería ser si viene de la BD)
+                print(f"   WARN: orden_json_blob para orden ID {om_info_proc['id']} no era bytes, sino {type(blob_original)}. Usando tal cual.")
+                om_info_proc['orden_json_blob'] = str(blob_original) # Asegurar que sea string
+            else: # Si es None o vacío
+                print(f"   Orden ID {om_info_proc['id']}: orden_json_blob es None o vacío. Se usará '{{}}'.")
+                om_info_proc['orden_json_blob'] = "{}" # String de JSON vacío
+            # ---- FIN PROCESAMIENTO DE orden_json_blob ----
+
+            ordenes.append(om_info_proc)
+        return ordenes
+
+    def _process_complementarios(self, comp_rows, comp_cols):
+        complementarios = []
+        for comp_row in comp_rows:
+            comp_info_raw = dict(zip(comp_cols, comp_row))
+            comp_info_proc = {'id': comp_info_raw['id']}
+            blob_fields_comp = ['nombre_estudio', 'resultado_informe', 'archivo_adjunto_path']
+            excluded_keys_comp = ['id', 'paciente_id', 'consulta_id', 'orden_medica_id', 'usuario_registrador_id', 'fecha_registro', 'tipo_complementario', 'fecha_realizacion', 'usuario_registrador_nombre']
+            for key, value in comp_info_raw.items():
+                 if key in blob_fields_comp and isinstance(value, bytes):
+                     try: comp_info_proc[key] = database.decrypt_data(value)
+                     except Exception: comp_info_proc[key] = "[Error Decrypt]"
+                 elif key not in excluded_keys_comp: comp_info_proc[key] = value
+                 elif key in ['usuario_registrador_nombre', 'fecha_registro', 'fecha_realizacion', 'tipo_complementario']: comp_info_proc[key] = value # Copiar campos importantes
+            complementarios.append(comp_info_proc)
+        return complementarios
+
+    def _process_interconsultas(self, ic_rows, ic_cols):
+        interconsultas = []
+        for ic_row in ic_rows:
+            ic_info_raw = dict(zip(ic_cols, ic_row))
+            ic_info_proc = {'id': ic_info_raw['id']}
+            blob_fields_ic = ['servicio_consultado', 'motivo_consulta', 'respuesta_texto']
+            excluded_keys_ic = ['id', 'paciente_id', 'consulta_id', 'orden_medica_id', 'usuario_solicitante_id', 'fecha_solicitud', 'fecha_respuesta', 'usuario_respuesta_id', 'estado', 'usuario_solicitante_nombre', 'usuario_respuesta_nombre']
+            for key, value in ic_info_raw.items():
+                if key in blob_fields_ic and isinstance(value, bytes):
+                     try: ic_info_proc[key] = database.decrypt_data(value)
+                     except Exception: ic_info_proc[key] = "[Error Decrypt]"
+                elif key not in excluded_keys_ic: ic_info_proc[key] = value
+                elif key in ['usuario_solicitante_nombre', 'usuario_respuesta_nombre', 'fecha_solicitud', 'fecha_respuesta', 'estado']: ic_info_proc[key] = value # Copiar
+            interconsultas.append(ic_info_proc)
+        return interconsultas
+
+    def _process_informes(self, im_rows, im_cols):
+        informes = []
+        for im_row in im_rows:
+            im_info_raw = dict(zip(im_cols, im_row))
+            im_info_proc = {'id': im_info_raw['id']}
+            blob_fields_im = ['contenido_texto', 'archivo_generado_path']
+            excluded_keys_im = ['id', 'paciente_id', 'consulta_id', 'usuario_id', 'fecha_creacion', 'tipo_informe', 'usuario_creador_nombre']
+            for key, value in im_info_raw.items():
+                 if key in blob_fields_im and isinstance(value, bytes):
+                     try: im_info_proc[key] = database.decrypt_data(value)
+                     except Exception: im_info_proc[key] = "[Error Decrypt]"
+                 elif key not in excluded_keys_im: im_info_proc[key] = value
+                 elif key in ['usuario_creador_nombre', 'fecha_creacion', 'tipo_informe']: im_info_proc[key] = value # Copiar
+            informes.append(im_info_proc)
+        return informes
+
+    def _process_recipes(self, r_rows, r_cols):
+        recipes = []
+        for r_row in r_rows:
+            r_info_raw = dict(zip(r_cols, r_row))
+            r_info_proc = {'id': r_info_raw['id']}
+            blob_fields_r = ['recipe_texto']
+            excluded_keys_r = ['id', 'paciente_id', 'consulta_id', 'evolucion_id', 'usuario_id', 'fecha_emision', 'tipo', 'usuario_emisor_nombre']
+            for key, value in r_info_raw.items():
+                 if key in blob_fields_r and isinstance(value, bytes):
+                      try: r_info_proc[key] = database.decrypt_data(value)
+                      except Exception: r_info_proc[key] = "[Error Decrypt]"
+                 elif key not in excluded_keys_r: r_info_proc[key] = value
+                 elif key in ['usuario_emisor_nombre', 'fecha_emision', 'tipo']: r_info_proc[key] = value # Copiar
+            recipes.append(r_info_proc)
+        return recipes
+
+    def _fetch_header(self, cursor, patient_id):
+        """Cabecera de la historia: datos del paciente, consultas y examen físico inicial."""
+        info = self._fetch_patient_info(cursor, patient_id)
+        if info is None:
+            return None
+        consultas = self._fetch_consultas(cursor, patient_id)
+        examen = self._fetch_examen_fisico(cursor, consultas[0]['id']) if consultas else None
+        return {"info": info, "consultas_info": consultas, "examen_fisico_inicial": examen}
+
+    def get_header(self, patient_id):
+        """
+        Cabecera de la historia (lo que se muestra al abrir al paciente), sin las secciones:
+        dict {'info', 'consultas_info', 'examen_fisico_inicial'} o None si no existe o falla.
+        No depende de cuántas evoluciones/órdenes tenga el paciente.
+        """
+        print(f"PatientActions: Obteniendo cabecera de la historia para paciente ID: {patient_id}")
+        conn = None
+        adjuntos = []
+        try:
+            conn = database.connect_db()
+            if not conn: raise sqlite3.Error("Fallo conexión DB")
+            version = database.historia_version(conn, patient_id)
+            cached = CACHE_HISTORIAS.obtener(patient_id, version, ('cabecera',))
+            if cached:
+                return dict(cached['cabecera'])
+            cursor = conn.cursor()
+            adjuntos = archivo.adjuntar_paciente(conn, patient_id) # Solo si tiene episodios archivados
+            header = self._fetch_header(cursor, patient_id)
+            if header is None:
+                print(f"PatientActions Error: Paciente ID {patient_id} no encontrado.")
+            else:
+                CACHE_HISTORIAS.guardar(patient_id, version, {'cabecera': header})
+                header = dict(header)
             cursor.close()
+            return header
+        except sqlite3.Error as db_err:
+            print(f"DB Error get_header: {db_err}"); traceback.print_exc(); return None
+        except Exception as e:
+            print(f"Error get_header: {e}"); traceback.print_exc(); return None
+        finally:
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
+
+    def _page_from_items(self, section, items, after, limit):
+        """Página de una sección completa ya leída, con el mismo corte que el keyset de _fetch_section."""
+        date_key = self.PATIENT_SECTIONS[section][4]
+        if after is not None:
+            items = [item for item in items if (item[date_key], item['id']) < after]
+        next_cursor = None
+        if limit and len(items) > limit:
+            items = items[:limit]
+            next_cursor = f"{items[-1][date_key]}|{items[-1]['id']}"
+        return items, next_cursor
+
+    def get_section(self, patient_id, section, cursor=None, limit=None):
+        """
+        Una página de una sección de la historia ('evoluciones', 'ordenes', 'complementarios',
+        'interconsultas', 'informes', 'recipes'), de la más reciente a la más antigua.
+        'cursor' es el 'next_cursor' de la página anterior ('' o None = primera página);
+        limit=None usa SECTION_PAGE_SIZE y limit <= 0 trae la sección completa.
+        Retorna: dict {'section', 'items', 'next_cursor' (None si no hay más), 'total' (solo en
+        la primera página)} o None si falla.
+        """
+        if section not in self.PATIENT_SECTIONS:
+            print(f"PatientActions Error: Sección de historia desconocida: {section}")
+            return None
+        if limit is None: limit = self.SECTION_PAGE_SIZE
+        limit = limit if limit > 0 else None
+        after = None
+        if cursor:
+            fecha, _, last_id = str(cursor).rpartition('|')
+            try: after = (fecha, int(last_id))
+            except ValueError:
+                print(f"PatientActions Error: Cursor de sección inválido: {cursor}"); return None
+        print(f"PatientActions: Sección '{section}' del paciente ID {patient_id} (cursor: {cursor or '-'}, límite: {limit})")
+        conn = None
+        adjuntos = []
+        try:
+            conn = database.connect_db()
+            if not conn: raise sqlite3.Error("Fallo conexión DB")
+            # Desde la caché: la sección completa si ya se leyó entera, si no la misma página
+            version = database.historia_version(conn, patient_id)
+            page_key = ('pagina', section, after, limit)
+            cached = CACHE_HISTORIAS.obtener_alguna(patient_id, version, (section, page_key))
+            if cached and cached[0] == section:
+                items, next_cursor = self._page_from_items(section, cached[1], after, limit)
+                total = len(cached[1]) if after is None else None
+                return {'section': section, 'items': list(items), 'next_cursor': next_cursor, 'total': total}
+            if cached:
+                return dict(cached[1], items=list(cached[1]['items']))
+
+            db_cursor = conn.cursor()
+            adjuntos = archivo.adjuntar_paciente(conn, patient_id)
+            # Se pide una fila de más para saber si hay página siguiente sin contar
+            items = self._fetch_section(db_cursor, patient_id, section, after, limit + 1 if limit else None)
+            if limit is None and after is None:
+                CACHE_HISTORIAS.guardar(patient_id, version, {section: items})
+            items, next_cursor = self._page_from_items(section, items, None, limit)
+            total = None
+            if after is None:
+                total = len(items) if next_cursor is None else self._count_section(db_cursor, patient_id, section)
+            db_cursor.close()
+            page = {'section': section, 'items': items, 'next_cursor': next_cursor, 'total': total}
+            if limit is not None:
+                CACHE_HISTORIAS.guardar(patient_id, version, {page_key: page})
+            return dict(page, items=list(items))
+        except sqlite3.Error as db_err:
+            print(f"DB Error get_section: {db_err}"); traceback.print_exc(); return None
+        except Exception as e:
+            print(f"Error get_section: {e}"); traceback.print_exc(); return None
+        finally:
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
+
+    def _fetch_section_readonly(self, patient_id, section):
+        """Sección completa en una conexión de solo lectura propia (se ejecuta en un hilo de lectura)."""
+        conn = database.connect_db_readonly()
+        try:
+            cursor = conn.cursor()
+            items = self._fetch_section(cursor, patient_id, section) # El descifrado también ocurre en este hilo
+            cursor.close()
+            return items
+        finally:
+            conn.close()
+
+    def get_details(self, patient_id, parallel=True):
+        """
+        Historia completa: la cabecera de get_header más todas las secciones sin paginar.
+        Con parallel=True cada sección se lee y descifra en un hilo de lectura con su propia
+        conexión de solo lectura mientras este hilo arma la cabecera. Los pacientes con episodios
+        archivados van por el camino secuencial (adjuntar el archivo necesita vistas TEMP).
+        Si la historia no cambió desde la última lectura se arma desde CACHE_HISTORIAS.
+        """
+        print(f"PatientActions: Obteniendo TODOS los detalles para paciente ID: {patient_id}")
+        conn = None
+        adjuntos = []
+        futures = {}
+        try:
+            conn = database.connect_db()
+            if not conn: raise sqlite3.Error("Fallo conexión DB")
+            version = database.historia_version(conn, patient_id)
+            cached = CACHE_HISTORIAS.obtener(patient_id, version, ('cabecera', *self.PATIENT_SECTIONS))
+            if cached:
+                patient_details = dict(cached['cabecera'])
+                for section, (key, *_) in self.PATIENT_SECTIONS.items():
+                    patient_details[key] = list(cached[section])
+                return patient_details
+
+            cursor = conn.cursor()
+            if parallel and not archivo.periodos_paciente(conn, patient_id):
+                executor = database.get_read_executor()
+                futures = {section: executor.submit(self._fetch_section_readonly, patient_id, section)
+                           for section in self.PATIENT_SECTIONS}
+            else:
+                adjuntos = archivo.adjuntar_paciente(conn, patient_id) # Solo si tiene episodios archivados
+
+            header = self._fetch_header(cursor, patient_id)
+            if header is None:
+                print(f"PatientActions Error: Paciente ID {patient_id} no encontrado."); return None # Retorna None si no existe
+            sections = {}
+            for section in self.PATIENT_SECTIONS:
+                future = futures.get(section)
+                if future is not None:
+                    try:
+                        sections[section] = future.result()
+                        continue
+                    except sqlite3.Error as ro_err: # Sin conexión de solo lectura: leer la sección aquí
+                        print(f"PatientActions WARN: Sección '{section}' en paralelo falló ({ro_err}); se lee en secuencia.")
+                sections[section] = self._fetch_section(cursor, patient_id, section)
+            cursor.close()
+            CACHE_HISTORIAS.guardar(patient_id, version, {'cabecera': header, **sections})
+
+            patient_details = dict(header)
+            for section, (key, *_) in self.PATIENT_SECTIONS.items():
+                patient_details[key] = list(sections[section])
             print(f"PatientActions: Detalles completos recuperados para ID: {patient_id}. Estructura lista para pestañas.")
             return patient_details # Devolver el diccionario completo
 
@@ -625,7 +960,11 @@ class PatientActions:
         except Exception as e:
             print(f"Error get_details: {e}"); traceback.print_exc(); return None
         finally:
-            if conn: conn.close()
+            for future in futures.values():
+                future.cancel() # Las que aún no empezaron (retorno temprano); las demás terminan solas
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
 
     def update_basic_data(self, patient_data: dict, current_user_id: int):
         """
@@ -684,6 +1023,9 @@ class PatientActions:
             with conn: # Transacción automática
                 cursor = conn.cursor()
 
+                if database.find_ids_by_cedula(cursor, 'Pacientes', cedula, exclude_id=patient_id):
+                    return False, f"Error: La cédula '{cedula}' ya está registrada para otro paciente."
+
                 # --- Encriptar datos ---
                 # ... (encriptar todos los campos necesarios como antes) ...
                 nombres_enc = database.encrypt_data(nombres)
@@ -713,6 +1055,7 @@ class PatientActions:
                         direccion = ?, profesion_oficio = ?, 
                         emerg_nombre = ?, emerg_telefono = ?, emerg_parentesco = ?, emerg_direccion = ?,
                         notas_adicionales = ?,
+                        cedula_bidx = ?, telefono_movil_bidx = ?, email_bidx = ?,
                         fecha_ultima_mod = ?, usuario_ultima_mod_id = ? 
                     WHERE id = ?
                 """
@@ -722,6 +1065,9 @@ class PatientActions:
                     direccion_enc, profesion_enc,
                     emerg_nombre_enc, emerg_tel_enc, emerg_parent_enc, emerg_dir_enc,
                     notas_enc,
+                    database.blind_index('cedula', cedula),
+                    database.blind_index('telefono_movil', telefono_movil),
+                    database.blind_index('email', email),
                     fecha_modificacion, current_user_id, 
                     patient_id # <<< Usar el ID convertido a entero
                 )
@@ -731,6 +1077,7 @@ class PatientActions:
                      print(f"PacienteActions WARN: No se encontró Paciente ID {patient_id} para actualizar.")
                      return False, f"Error: Paciente con ID {patient_id} no encontrado."
 
+                database.index_patient_name(cursor, patient_id, nombres, apellidos)
                 print(f"PacienteActions: Datos básicos del Paciente ID {patient_id} actualizados.")
 
                 # --- Registrar Acción en Historial ---
@@ -739,9 +1086,11 @@ class PatientActions:
                 database.log_action(
                     db_conn=conn, usuario_id=current_user_id, tipo_accion="ACTUALIZAR_PACIENTE_BASICO",
                     descripcion=log_descripcion, tabla="Pacientes", registro_id=patient_id,
-                    detalles={'campos_modificados': list(patient_data.keys())} 
+                    detalles={'campos_modificados': list(patient_data.keys())},
+                    sincrono=True
                 )
 
+            directorio_pacientes.DIRECTORIO.marcar_cambios()
             print("PacienteActions: Transacción de actualización completada.")
             return True, "Datos del paciente actualizados exitosamente."
 
@@ -761,6 +1110,7 @@ class PatientActions:
     def get_ingreso_details(self, patient_id: int, consulta_id: int):
         print(f"PatientActions: Obteniendo detalles de INGRESO Y ANTECEDENTES para Paciente ID: {patient_id}, Consulta ID: {consulta_id}")
         conn = None
+        adjuntos = []
         # Estructura de datos más completa
         full_details = {
             "paciente_id_original": patient_id,
@@ -832,6 +1182,7 @@ class PatientActions:
 
 
             # 2. Obtener datos de la Consulta (como antes)
+            adjuntos = archivo.adjuntar_paciente(conn, patient_id) # La consulta puede estar archivada
             cursor.execute("SELECT * FROM Consultas WHERE id = ? AND paciente_id = ?", (consulta_id, patient_id))
             consulta_row = cursor.fetchone()
             if consulta_row:
@@ -876,7 +1227,9 @@ class PatientActions:
             full_details["error"] = f"Error inesperado: {e}"
             print(f"Error get_ingreso_details_COMPLETO: {e}"); traceback.print_exc()
         finally:
-            if conn: conn.close()
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
         
         return full_details
 
@@ -1004,7 +1357,8 @@ class PatientActions:
                 log_action(
                     db_conn=conn, usuario_id=current_user_id, tipo_accion="ACTUALIZAR_INGRESO_Y_PACIENTE",
                     descripcion=log_descripcion, tabla="Pacientes, Consultas, ExamenesFisicos", registro_id=patient_id,
-                    detalles={'consulta_id': consulta_id, 'patient_id': patient_id}
+                    detalles={'consulta_id': consulta_id, 'patient_id': patient_id},
+                    sincrono=True
                 )
 
             print("PatientActions: Transacción de actualización (ingreso y antecedentes) completada.")
@@ -1090,7 +1444,8 @@ class PatientActions:
 
                 log_action(conn, current_user_id, 'CREAR_EVOLUCION',
                            f"Nueva evolución ID {new_evolucion_id} para Consulta ID {consulta_id} (Paciente ID {patient_id}).", # Mantenemos patient_id en el log para contexto
-                           tabla='Evoluciones', registro_id=new_evolucion_id)
+                           tabla='Evoluciones', registro_id=new_evolucion_id,
+                           sincrono=True)
 
             return True, "Evolución médica guardada exitosamente.", new_evolucion_id
         except sqlite3.Error as db_err:
@@ -1105,10 +1460,12 @@ class PatientActions:
     def get_evolucion_details(self, evolucion_id: int):
         print(f"PatientActions: Obteniendo detalles para Evolución ID: {evolucion_id}")
         conn = None
+        adjuntos = []
         evolucion_details_dict = {"error": None} 
 
         try:
             conn = database.connect_db()
+            adjuntos = archivo.adjuntar_si_falta(conn, 'Evoluciones', evolucion_id)
             cursor = conn.cursor()
             # La tabla Evoluciones no tiene paciente_id directamente según tu CREATE.
             # La relación es Evoluciones -> Consultas -> Pacientes
@@ -1188,7 +1545,9 @@ class PatientActions:
         except Exception as e:
             evolucion_details_dict["error"] = f"Error inesperado: {e}"
         finally:
-            if conn: conn.close()
+            if conn:
+                archivo.soltar(conn, adjuntos)
+                conn.close()
         return evolucion_details_dict
 
     def update_evolucion(self, evolucion_id: int, evolucion_data: dict, current_user_id: int):
@@ -1246,7 +1605,8 @@ class PatientActions:
                 print(f"PatientActions: Evolución ID {evolucion_id} actualizada.")
                 log_action(conn, current_user_id, 'ACTUALIZAR_EVOLUCION',
                            f"Actualizada evolución ID {evolucion_id}.",
-                           tabla='Evoluciones', registro_id=evolucion_id)
+                           tabla='Evoluciones', registro_id=evolucion_id,
+                           sincrono=True)
             
             return True, "Evolución médica actualizada exitosamente."
         except sqlite3.Error as db_err:
@@ -1388,7 +1748,8 @@ class PatientActions:
                     db_conn=conn, usuario_id=current_user_id, tipo_accion="ACTUALIZAR_INGRESO_Y_PACIENTE",
                     descripcion=f"Actualizó datos de ingreso y/o antecedentes del paciente. Consulta ID {consulta_id} (Paciente ID {patient_id}).", 
                     tabla="Pacientes, Consultas, ExamenesFisicos", registro_id=patient_id,
-                    detalles={'consulta_id': consulta_id, 'patient_id': patient_id}
+                    detalles={'consulta_id': consulta_id, 'patient_id': patient_id},
+                    sincrono=True
                 )
 
             print("PatientActions: Transacción de actualización (ingreso y antecedentes) completada.")
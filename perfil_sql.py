@@ -0,0 +1,297 @@
+# perfil_sql.py
+# Perfilador de sentencias SQL. Con el perfil activo, cada conexión que presta
+# database.connect_db() lleva:
+#   - set_trace_callback: cuenta cada ejecución (incluidos BEGIN/COMMIT implícitos y
+#     sentencias de triggers) bajo su texto normalizado (literales -> ?).
+#   - set_progress_handler: cada PASOS_VM instrucciones de la VM de SQLite suma trabajo a
+#     la sentencia en curso (coste real, independiente de la latencia de Python).
+#   - los cursores del pool (database._TimedCursor) suman latencia y filas devueltas.
+# escribir_informe() añade EXPLAIN QUERY PLAN de cada sentencia, marca los SCAN sobre
+# tablas grandes y los patrones N+1, y guarda un informe ordenado por latencia acumulada.
+#
+# Activación: variable de entorno PERFIL_SQL=1 al arrancar la aplicación (el informe se
+# escribe al cerrar), perfil_sql.activar() desde código, o este script como sesión simulada:
+#     python perfil_sql.py [--pacientes 20] [--salida perfil_sql.txt]
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+ACTIVO = os.environ.get('PERFIL_SQL') == '1'
+PASOS_VM = 1000              # Granularidad del progress handler (instrucciones de VM)
+UMBRAL_TABLA_GRANDE = 1000   # Filas a partir de las que un SCAN completo se marca
+UMBRAL_N_MAS_1 = 50          # Ejecuciones de una sentencia de <=1 fila para sospechar N+1
+MAX_SENTENCIAS_INFORME = 60
+
+_RE_CADENA = re.compile(r"'(?:[^']|'')*'")
+_RE_BLOB = re.compile(r"\b[xX]'[0-9a-fA-F]*'")
+_RE_NUMERO = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_RE_LISTA_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+_RE_COMENTARIO = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+_RE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)(?:\s+(?:AS\s+)?([A-Za-z_][A-Za-z0-9_]*))?", re.I)
+_PALABRAS_NO_ALIAS = {'WHERE', 'LEFT', 'INNER', 'JOIN', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'USING', 'CROSS', 'NATURAL', 'OUTER', 'UNION', 'SET', 'VALUES'}
+
+def normalizar(sql):
+    """Texto canónico de una sentencia: sin comentarios ni literales y con espacios simples."""
+    sql = _RE_BLOB.sub('?', sql)
+    sql = _RE_CADENA.sub('?', sql)
+    sql = _RE_COMENTARIO.sub(' ', sql)
+    sql = _RE_NUMERO.sub('?', sql)
+    sql = _RE_ESPACIOS.sub(' ', sql).strip().rstrip(';').strip()
+    return _RE_LISTA_IN.sub('(?...)', sql)
+
+class _Sentencia:
+    __slots__ = ('ejecuciones', 'medidas', 'segundos', 'filas', 'pasos_vm', 'ejemplo', 'ejemplo_expandido')
+
+    def __init__(self):
+        self.ejecuciones = self.medidas = self.filas = self.pasos_vm = 0
+        self.segundos = 0.0
+        self.ejemplo = None           # Texto con '?' tal como lo ejecutó la aplicación
+        self.ejemplo_expandido = None # Texto con valores (del trace callback)
+
+_lock = threading.Lock()
+_sentencias = {}
+_conexiones_con_hooks = set() # id() de las conexiones sqlite3 con trace/progress instalados
+_inicio_perfil = time.time()
+
+def _stats(clave):
+    stats = _sentencias.get(clave)
+    if stats is None:
+        with _lock:
+            stats = _sentencias.setdefault(clave, _Sentencia())
+    return stats
+
+class _EstadoConexion:
+    __slots__ = ('actual',)
+
+    def __init__(self):
+        self.actual = None
+
+def _crear_hooks():
+    estado = _EstadoConexion()
+
+    def trace(sql_expandido):
+        stats = _stats(normalizar(sql_expandido))
+        stats.ejecuciones += 1
+        if stats.ejemplo_expandido is None:
+            stats.ejemplo_expandido = sql_expandido
+        estado.actual = stats
+
+    def progreso():
+        if estado.actual is not None:
+            estado.actual.pasos_vm += PASOS_VM
+        return 0 # 0 = continuar la sentencia
+    return trace, progreso
+
+def preparar_conexion(raw_conn):
+    """Instala o retira los hooks según ACTIVO. database.connect_db() lo llama al prestar cada conexión."""
+    clave = id(raw_conn)
+    if ACTIVO:
+        if clave not in _conexiones_con_hooks:
+            trace, progreso = _crear_hooks()
+            raw_conn.set_trace_callback(trace)
+            raw_conn.set_progress_handler(progreso, PASOS_VM)
+            _conexiones_con_hooks.add(clave)
+    elif clave in _conexiones_con_hooks:
+        raw_conn.set_trace_callback(None)
+        raw_conn.set_progress_handler(None, 0)
+        _conexiones_con_hooks.discard(clave)
+
+def registrar_ejecucion(sql, segundos):
+    """Latencia de execute()/executemany() medida por el cursor del pool."""
+    stats = _stats(normalizar(sql))
+    stats.medidas += 1
+    stats.segundos += segundos
+    if stats.ejemplo is None:
+        stats.ejemplo = sql
+
+def registrar_lectura(sql, segundos, filas):
+    """Latencia y filas de fetch*/iteración, atribuidas a la última sentencia del cursor."""
+    stats = _stats(normalizar(sql))
+    stats.segundos += segundos
+    stats.filas += filas
+
+def activar():
+    global ACTIVO
+    ACTIVO = True
+
+def desactivar():
+    global ACTIVO
+    ACTIVO = False
+
+def reiniciar():
+    global _inicio_perfil
+    with _lock:
+        _sentencias.clear()
+    _inicio_perfil = time.time()
+
+def _tablas_y_alias(sql):
+    mapa = {}
+    for tabla, alias in _RE_ALIAS.findall(sql):
+        mapa[tabla] = tabla
+        if alias and alias.upper() not in _PALABRAS_NO_ALIAS:
+            mapa[alias] = tabla
+    return mapa
+
+def _plan(conn, stats):
+    sql = stats.ejemplo or stats.ejemplo_expandido
+    if not sql or not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+        return None
+    try:
+        # Los valores no cambian el plan en este esquema: basta con enlazar NULL
+        filas = conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count('?')).fetchall()
+        return [fila[3] for fila in filas]
+    except Exception as e:
+        return [f"(sin plan: {e})"]
+
+def _filas_tabla(conn, tabla, cache):
+    if tabla not in cache:
+        try:
+            cache[tabla] = conn.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0]
+        except Exception:
+            cache[tabla] = None
+    return cache[tabla]
+
+def _marcas(conn, stats, plan, cache_tamanos):
+    marcas = []
+    alias = _tablas_y_alias(stats.ejemplo or stats.ejemplo_expandido or '')
+    for detalle in plan or []:
+        partes = detalle.split()
+        if len(partes) >= 2 and partes[0] == 'SCAN':
+            tabla = alias.get(partes[1], partes[1])
+            filas = _filas_tabla(conn, tabla, cache_tamanos)
+            if filas is not None and filas >= UMBRAL_TABLA_GRANDE:
+                if 'USING' in partes:
+                    marcas.append(f"SCAN-INDICE {tabla} ({filas} filas)")
+                else:
+                    marcas.append(f"SCAN {tabla} ({filas} filas)")
+        elif 'USE TEMP B-TREE' in detalle:
+            marcas.append("ORDEN-TEMPORAL")
+    if stats.ejecuciones >= UMBRAL_N_MAS_1 and stats.filas <= stats.ejecuciones:
+        marcas.append("N+1? (muchas ejecuciones de <=1 fila)")
+    return marcas
+
+def generar_informe(conn, limite=MAX_SENTENCIAS_INFORME):
+    """Lista de dicts por sentencia ordenada por latencia acumulada, con plan y marcas."""
+    with _lock:
+        items = list(_sentencias.items())
+    total_segundos = sum(s.segundos for _, s in items) or 1e-9
+    items.sort(key=lambda kv: (kv[1].segundos, kv[1].pasos_vm), reverse=True)
+    cache_tamanos = {}
+    informe = []
+    for posicion, (clave, stats) in enumerate(items[:limite], start=1):
+        plan = _plan(conn, stats)
+        llamadas = max(stats.ejecuciones, stats.medidas)
+        informe.append({
+            'posicion': posicion,
+            'sql': clave,
+            'llamadas': llamadas,
+            'total_ms': round(stats.segundos * 1000, 2),
+            'media_ms': round(stats.segundos * 1000 / llamadas, 3) if llamadas else 0,
+            'porcentaje': round(100 * stats.segundos / total_segundos, 1),
+            'filas': stats.filas,
+            'filas_por_llamada': round(stats.filas / llamadas, 1) if llamadas else 0,
+            'pasos_vm': stats.pasos_vm,
+            'plan': plan,
+            'marcas': _marcas(conn, stats, plan, cache_tamanos),
+        })
+    return informe
+
+def escribir_informe(ruta=None, conn=None):
+    """Escribe el informe en texto (y JSON junto a él). Retorna la ruta del informe."""
+    import database # Import diferido: database importa este módulo
+    ruta = ruta or f"perfil_sql_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    propia = conn is None
+    conn = conn or database.connect_db()
+    estaba_activo = ACTIVO
+    desactivar() # Que los EXPLAIN y COUNT del informe no se perfilen a sí mismos
+    try:
+        preparar_conexion(conn._conn if hasattr(conn, '_conn') else conn)
+        informe = generar_informe(conn)
+    finally:
+        if estaba_activo: activar()
+        if propia: conn.close()
+
+    duracion = time.time() - _inicio_perfil
+    lineas = [
+        f"Perfil SQL - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {duracion:.0f}s de sesión perfilada",
+        f"{len(_sentencias)} sentencias distintas; se muestran las {len(informe)} con más latencia acumulada.",
+        "Marcas: SCAN = recorrido completo de tabla grande, SCAN-INDICE = recorrido completo de un índice,",
+        "ORDEN-TEMPORAL = ordenación sin índice, N+1? = sentencia ejecutada por fila desde un bucle.",
+        "",
+    ]
+    for e in informe:
+        lineas.append(f"#{e['posicion']:>3}  {e['total_ms']:>10.2f} ms ({e['porcentaje']:>5.1f}%)  "
+                      f"{e['llamadas']:>7} llamadas  {e['media_ms']:>8.3f} ms/llamada  "
+                      f"{e['filas']:>8} filas ({e['filas_por_llamada']}/llamada)  {e['pasos_vm']:>10} pasos VM")
+        if e['marcas']:
+            lineas.append("      !! " + "; ".join(e['marcas']))
+        lineas.append(f"      {e['sql'][:400]}")
+        for detalle in e['plan'] or []:
+            lineas.append(f"        plan: {detalle}")
+        lineas.append("")
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("\n".join(lineas))
+    with open(os.path.splitext(ruta)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Perfil SQL: informe escrito en {ruta}")
+    return ruta
+
+def escribir_informe_si_activo():
+    """Para aboutToQuit: escribe el informe solo si se perfiló la sesión."""
+    if ACTIVO and _sentencias:
+        try:
+            escribir_informe()
+        except Exception as e:
+            print(f"Perfil SQL: no se pudo escribir el informe: {e}")
+
+def _sesion_simulada(n_pacientes):
+    """Recorrido típico de un médico: listado, búsquedas, fichas completas e historial."""
+    import io
+    from contextlib import redirect_stdout
+    import database
+    from paciente_acciones import PatientActions
+    from historial_acciones import HistorialActions
+    from medico_acciones import MedicoActions
+
+    pacientes, historial, medicos = PatientActions(), HistorialActions(), MedicoActions()
+    with database.get_connection() as conn:
+        ids = [fila[0] for fila in conn.execute("SELECT id FROM Pacientes ORDER BY id DESC LIMIT ?", (n_pacientes,))]
+    with redirect_stdout(io.StringIO()):
+        pacientes.get_list()
+        for termino in ("gar", "maria", "12345"):
+            pacientes.get_list(termino)
+        for paciente_id in ids:
+            pacientes.get_details(paciente_id)
+            consulta_id = pacientes.get_latest_consulta_id_for_patient(paciente_id)
+            if consulta_id:
+                pacientes.get_ingreso_details(paciente_id, consulta_id)
+        for pagina in (1, 2, 3):
+            historial.get_log(pagina, 50)
+        medicos.get_list()
+    return len(ids)
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil SQL de una sesión clínica simulada")
+    parser.add_argument("--pacientes", type=int, default=20, help="Fichas de paciente a abrir")
+    parser.add_argument("--salida", help="Ruta del informe (por defecto perfil_sql_<fecha>.txt)")
+    args = parser.parse_args()
+
+    import database
+    activar()
+    reiniciar()
+    database.close_all_connections() # Conexiones nuevas, ya con los hooks
+    n = _sesion_simulada(args.pacientes)
+    print(f"Sesión simulada completada ({n} pacientes).")
+    escribir_informe(args.salida)
+    database.shutdown_audit_writer()
+    database.close_all_connections()
+
+if __name__ == "__main__":
+    # database importa 'perfil_sql': usar ese módulo y no esta copia '__main__'
+    import perfil_sql
+    perfil_sql.main()
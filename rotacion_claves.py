@@ -0,0 +1,268 @@
+# rotacion_claves.py
+# Rotación de la clave de cifrado y re-cifrado de todas las columnas BLOB cifradas.
+#
+# 1. Genera secret.key.new (si no existe). Desde ese momento las instancias abiertas de la
+#    aplicación, al recargar sus claves (database.reload_keys_if_changed), cifran con la nueva
+#    y siguen leyendo con ambas (semántica de MultiFernet).
+# 2. Recorre cada tabla por rowid en lotes, re-cifra en un pool de hilos y confirma cada lote
+#    junto con su punto de control en la tabla RotacionClaves. Si se interrumpe, volver a
+#    ejecutar el script continúa desde el último lote confirmado.
+# 3. Repite pasadas de barrido hasta que no quede ningún valor con la clave anterior y
+#    sustituye secret.key por la nueva (la anterior se conserva como secret.key.old-<fecha>).
+#    Los archivos en frío del catálogo (archivo.py) se re-cifran igual, antes de sustituir la clave.
+#
+# Con --migrar-formato no cambia la clave: guarda el formato de escritura elegido con --formato
+# (por defecto 'aead') en database.FORMAT_FILE, así las instancias abiertas cifran ya en ese
+# formato, y re-cifra los valores que aún estén en el otro. Mientras no se ejecute, la aplicación
+# sigue escribiendo Fernet: hacerlo solo cuando todas las instancias y herramientas que leen la BD
+# entiendan el formato 'aead' (volver con --migrar-formato --formato fernet).
+#
+# Uso: python rotacion_claves.py [--lote 500] [--hilos 4] [--estado] [--migrar-formato [--formato aead|fernet]]
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cryptography.fernet import Fernet, InvalidToken
+
+import archivo
+import database
+
+SQL_CREATE_ROTACION = """
+CREATE TABLE IF NOT EXISTS RotacionClaves (
+    tabla TEXT PRIMARY KEY,
+    pasada INTEGER NOT NULL DEFAULT 1,
+    ultimo_rowid INTEGER NOT NULL DEFAULT 0,
+    recifrados INTEGER NOT NULL DEFAULT 0,
+    ilegibles INTEGER NOT NULL DEFAULT 0,
+    huella_clave TEXT NOT NULL,
+    actualizado TEXT NOT NULL
+);
+"""
+MAX_PASADAS = 5
+
+def _huella(key):
+    """Identificador corto de clave y formato destino, para no mezclar puntos de control de re-cifrados distintos."""
+    return f"{database.ENCRYPTION_FORMAT}:{hashlib.sha256(key).hexdigest()[:16]}"
+
+def _ahora():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _preparar_clave_nueva():
+    """Crea secret.key.new si hace falta y espera a que las instancias abiertas la carguen."""
+    if os.path.exists(database.NEW_KEY_FILE):
+        print(f"Reanudando rotación con la clave existente en {database.NEW_KEY_FILE}.")
+    else:
+        key = Fernet.generate_key()
+        tmp_path = database.NEW_KEY_FILE + ".tmp"
+        with open(tmp_path, "wb") as key_file: key_file.write(key)
+        os.replace(tmp_path, database.NEW_KEY_FILE)
+        espera = 2 * database.KEY_RELOAD_INTERVAL
+        print(f"Nueva clave generada en {database.NEW_KEY_FILE}. Esperando {espera:.0f}s a que las instancias abiertas la carguen...")
+        time.sleep(espera)
+    database.reload_keys_if_changed(force=True)
+    if len(database.ENCRYPTION_KEYS) != 2:
+        raise RuntimeError("No se pudieron cargar la clave actual y la nueva.")
+    return _huella(database.ENCRYPTION_KEYS[0])
+
+def _cargar_puntos_control(conn, huella):
+    conn.execute(SQL_CREATE_ROTACION)
+    filas = conn.execute("SELECT tabla, pasada, ultimo_rowid, recifrados, ilegibles, huella_clave FROM RotacionClaves").fetchall()
+    if any(f[5] != huella for f in filas):
+        print("Los puntos de control pertenecen a otra clave nueva; se reinicia la rotación.")
+        with conn: conn.execute("DELETE FROM RotacionClaves")
+        return {}
+    return {f[0]: {'pasada': f[1], 'ultimo_rowid': f[2], 'recifrados': f[3], 'ilegibles': f[4]} for f in filas}
+
+def _recifrar_filas(codec, filas):
+    """Devuelve ([(columna_idx, rowid, nuevo, anterior)], ilegibles) para un grupo de filas."""
+    cambios, ilegibles = [], 0
+    for fila in filas:
+        rowid = fila[0]
+        for idx, valor in enumerate(fila[1:]):
+            if not isinstance(valor, (bytes, bytearray)): continue
+            try:
+                nuevo = codec.reencrypt(bytes(valor))
+            except (ValueError, InvalidToken):
+                ilegibles += 1 # Ninguna clave lo descifra: se deja tal cual
+                continue
+            if nuevo is not None:
+                cambios.append((idx, rowid, nuevo, valor))
+    return cambios, ilegibles
+
+def _rotar_tabla(conn, executor, n_hilos, tabla, columnas, estado, tamano_lote, huella):
+    """Una pasada completa de la tabla desde su punto de control. Retorna los valores re-cifrados en la pasada."""
+    cols_sql = ", ".join(columnas)
+    updates = [f"UPDATE {tabla} SET {col} = ? WHERE rowid = ? AND {col} IS ?" for col in columnas]
+    recifrados_pasada = 0
+    while True:
+        filas = conn.execute(
+            f"SELECT rowid, {cols_sql} FROM {tabla} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (estado['ultimo_rowid'], tamano_lote)).fetchall()
+        if not filas:
+            break
+        codec = database.BATCH_CODEC
+        paso = max(1, -(-len(filas) // n_hilos))
+        grupos = [filas[i:i + paso] for i in range(0, len(filas), paso)]
+        cambios, ilegibles = [], 0
+        for c, i in executor.map(lambda g: _recifrar_filas(codec, g), grupos):
+            cambios.extend(c); ilegibles += i
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE;")
+        try:
+            aplicados = 0
+            for idx, rowid, nuevo, anterior in cambios:
+                # Si la aplicación modificó la celda mientras tanto, ya está cifrada con la clave nueva
+                cursor.execute(updates[idx], (nuevo, rowid, anterior))
+                aplicados += cursor.rowcount
+            estado['ultimo_rowid'] = filas[-1][0]
+            estado['recifrados'] += aplicados
+            estado['ilegibles'] += ilegibles
+            cursor.execute("""
+                INSERT OR REPLACE INTO RotacionClaves (tabla, pasada, ultimo_rowid, recifrados, ilegibles, huella_clave, actualizado)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (tabla, estado['pasada'], estado['ultimo_rowid'], estado['recifrados'], estado['ilegibles'], huella, _ahora()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        recifrados_pasada += aplicados
+    return recifrados_pasada
+
+def _finalizar(conn):
+    """Sustituye secret.key por la clave nueva (conservando la anterior) y borra los puntos de control."""
+    respaldo = f"{database.KEY_FILE}.old-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    shutil.copy2(database.KEY_FILE, respaldo)
+    os.replace(database.NEW_KEY_FILE, database.KEY_FILE) # Atómico: secret.key nunca falta
+    with conn: conn.execute("DROP TABLE IF EXISTS RotacionClaves")
+    database.reload_keys_if_changed(force=True)
+    print(f"Rotación completada. Clave anterior guardada en {respaldo}; bórrela cuando verifique las copias de seguridad.")
+
+def _recifrar_todo(conn, huella, tamano_lote, n_hilos):
+    """Re-cifra todas las tablas con pasadas de barrido. Retorna False si hay que volver a ejecutar."""
+    estados = _cargar_puntos_control(conn, huella)
+    tablas = database.encrypted_columns(conn)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_hilos, thread_name_prefix="rotacion") as executor:
+        for tabla, columnas in tablas.items():
+            estado = estados.setdefault(tabla, {'pasada': 1, 'ultimo_rowid': 0, 'recifrados': 0, 'ilegibles': 0})
+            while True:
+                recifrados = _rotar_tabla(conn, executor, n_hilos, tabla, columnas, estado, tamano_lote, huella)
+                print(f"  {tabla}: pasada {estado['pasada']}, {recifrados} valores re-cifrados "
+                      f"(total {estado['recifrados']}, ilegibles {estado['ilegibles']})")
+                # Una pasada sin cambios confirma que no quedan valores por convertir
+                # (p. ej. escritos por una instancia que aún no había recargado las claves)
+                if recifrados == 0 and estado['pasada'] > 1:
+                    break
+                if estado['pasada'] >= MAX_PASADAS:
+                    print(f"Aviso: {tabla} sigue recibiendo valores sin convertir tras {MAX_PASADAS} pasadas. "
+                          "Cierre las instancias antiguas de la aplicación y vuelva a ejecutar el script.")
+                    return False
+                estado['pasada'] += 1
+                estado['ultimo_rowid'] = 0
+    print(f"Re-cifrado terminado en {time.perf_counter() - inicio:.1f}s.")
+    return True
+
+def _recifrar_archivos(conn, huella, tamano_lote, n_hilos):
+    """Re-cifra también los archivos en frío del catálogo (archivo.py), cada uno con sus puntos de control."""
+    for ruta in archivo.rutas_archivo(conn):
+        print(f"Archivo {os.path.basename(ruta)}:")
+        conn_archivo = database.connect_db(ruta)
+        try:
+            if not _recifrar_todo(conn_archivo, huella, tamano_lote, n_hilos):
+                return False
+            with conn_archivo: conn_archivo.execute("DROP TABLE IF EXISTS RotacionClaves")
+        finally:
+            conn_archivo.close()
+    return True
+
+def rotar(tamano_lote=500, n_hilos=None):
+    n_hilos = n_hilos or database.CRYPTO_WORKERS
+    huella = _preparar_clave_nueva()
+    conn = database.connect_db()
+    try:
+        if not _recifrar_todo(conn, huella, tamano_lote, n_hilos) or not _recifrar_archivos(conn, huella, tamano_lote, n_hilos):
+            return False
+        _finalizar(conn)
+        return True
+    finally:
+        conn.close()
+
+def migrar_formato(tamano_lote=500, n_hilos=None):
+    """Convierte en línea todos los valores cifrados al formato database.ENCRYPTION_FORMAT, sin cambiar la clave."""
+    if os.path.exists(database.NEW_KEY_FILE):
+        print("Hay una rotación de clave en curso; termínela primero (la rotación también convierte el formato).")
+        return False
+    n_hilos = n_hilos or database.CRYPTO_WORKERS
+    database.reload_keys_if_changed(force=True)
+    print(f"Migrando valores cifrados al formato '{database.ENCRYPTION_FORMAT}'...")
+    conn = database.connect_db()
+    try:
+        huella = _huella(database.ENCRYPTION_KEYS[0])
+        if not _recifrar_todo(conn, huella, tamano_lote, n_hilos) or not _recifrar_archivos(conn, huella, tamano_lote, n_hilos):
+            return False
+        with conn: conn.execute("DROP TABLE IF EXISTS RotacionClaves")
+        print("Migración de formato completada. Ejecute VACUUM para recuperar el espacio liberado.")
+        return True
+    finally:
+        conn.close()
+
+def mostrar_estado():
+    conn = database.connect_db()
+    try:
+        try:
+            filas = conn.execute("SELECT tabla, pasada, ultimo_rowid, recifrados, ilegibles, actualizado FROM RotacionClaves ORDER BY tabla").fetchall()
+        except sqlite3.OperationalError:
+            filas = []
+        if os.path.exists(database.NEW_KEY_FILE):
+            print(f"Rotación en curso (clave nueva {database.NEW_KEY_FILE}).")
+        elif filas:
+            print(f"Migración de formato en curso (destino '{database.ENCRYPTION_FORMAT}').")
+        else:
+            print("No hay ninguna rotación de clave ni migración de formato en curso.")
+            return
+        for tabla, pasada, ultimo_rowid, recifrados, ilegibles, actualizado in filas:
+            maximo = conn.execute(f"SELECT MAX(rowid) FROM {tabla}").fetchone()[0] or 0
+            print(f"  {tabla:22} pasada {pasada}  rowid {ultimo_rowid}/{maximo}  re-cifrados {recifrados}  ilegibles {ilegibles}  ({actualizado})")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotación de la clave de cifrado con re-cifrado reanudable")
+    parser.add_argument("--lote", type=int, default=500, help="Filas por lote/transacción")
+    parser.add_argument("--hilos", type=int, default=None, help=f"Hilos de re-cifrado (por defecto {database.CRYPTO_WORKERS})")
+    parser.add_argument("--estado", action="store_true", help="Mostrar el progreso de la rotación en curso y salir")
+    parser.add_argument("--migrar-formato", action="store_true",
+                        help="No rotar la clave: guardar el formato de --formato y convertir los valores a él")
+    parser.add_argument("--formato", choices=database.ENCRYPTION_FORMATS, default='aead',
+                        help="Formato de almacenamiento destino de --migrar-formato (por defecto aead)")
+    args = parser.parse_args()
+
+    if args.estado:
+        mostrar_estado()
+        return
+    try:
+        if args.migrar_formato:
+            if os.path.exists(database.NEW_KEY_FILE):
+                print("Hay una rotación de clave en curso; termínela primero (la rotación también convierte el formato).")
+                return
+            database.save_encryption_format(args.formato)
+            migrar_formato(args.lote, args.hilos)
+        else:
+            rotar(args.lote, args.hilos)
+    except KeyboardInterrupt:
+        print("\nRotación interrumpida. Vuelva a ejecutar el script para continuar desde el último lote confirmado.")
+    except Exception as e:
+        print(f"Error durante la rotación de claves: {e}")
+        traceback.print_exc()
+    finally:
+        database.close_all_connections()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# vistas_cache.py
+# Caché en memoria de los fragmentos HTML de html_files que sirve request_view_content.
+#
+# Cada navegación leía el fragmento del disco, y algunos son grandes (paciente_detalle.html pasa
+# de 160 KB). Aquí se guardan por nombre de vista saneado ('pacientes__paciente_detalle') junto
+# con la ruta, el mtime y el tamaño del archivo: un acierto cuesta un os.stat() y si el archivo
+# cambió (edición durante el desarrollo, actualización de la app) se vuelve a leer.
+#
+# Tras el login se precargan en un hilo las vistas más usadas (VISTAS_PRECARGA). Los tiempos de
+# las navegaciones en frío (lectura del disco) y en caliente (desde memoria) se guardan por
+# separado para la vista de diagnóstico. Los fragmentos no contienen datos de pacientes, así que
+# la caché no se vacía en el logout.
+import os
+import stat
+import threading
+import time
+import traceback
+
+import metricas
+
+VISTAS_PRECARGA = (
+    'dashboard',
+    'pacientes__listado_pacientes',
+    'pacientes__paciente_detalle',
+    'historial__historial_acciones',
+)
+
+
+def ruta_fragmento(dir_html, vista):
+    """Ruta absoluta del fragmento de una vista saneada ('carpeta__nombre' -> carpeta/nombre.html)."""
+    return os.path.abspath(os.path.join(dir_html, *vista.split('__')) + ".html")
+
+
+class CacheVistas:
+    """vista -> (ruta, mtime_ns, tamaño, html)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vistas = {}
+        self._hilo = None
+        self.hits = 0
+        self.misses = 0
+        self.recargas = 0      # Fragmentos releídos porque cambiaron en disco
+        self.precargadas = 0
+        self._ms_frio = metricas.HistogramaMovil()
+        self._ms_caliente = metricas.HistogramaMovil()
+
+    def _leer(self, vista, ruta):
+        """(html, desde_memoria), o (None, False) si el archivo no existe."""
+        try:
+            st = os.stat(ruta)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            with self._lock:
+                self._vistas.pop(vista, None)
+            return None, False
+        entrada = self._vistas.get(vista)
+        if entrada is not None and entrada[:3] == (ruta, st.st_mtime_ns, st.st_size):
+            return entrada[3], True
+        with open(ruta, 'r', encoding='utf-8') as f:
+            html = f.read()
+        with self._lock:
+            if entrada is not None: self.recargas += 1
+            self._vistas[vista] = (ruta, st.st_mtime_ns, st.st_size, html)
+        return html, False
+
+    def obtener(self, vista, ruta):
+        """HTML del fragmento (ruta ya validada por quien llama), o None si el archivo no existe."""
+        inicio = time.perf_counter()
+        html, desde_memoria = self._leer(vista, ruta)
+        ms = (time.perf_counter() - inicio) * 1000.0
+        if html is not None:
+            with self._lock:
+                if desde_memoria:
+                    self.hits += 1
+                    self._ms_caliente.registrar(ms)
+                else:
+                    self.misses += 1
+                    self._ms_frio.registrar(ms)
+        return html
+
+    def precargar(self, dir_html, vistas=VISTAS_PRECARGA):
+        """Lee las vistas indicadas que aún no estén en memoria. Retorna cuántas quedaron cargadas."""
+        cargadas = 0
+        for vista in vistas:
+            try:
+                html, _ = self._leer(vista, ruta_fragmento(dir_html, vista))
+                if html is not None: cargadas += 1
+            except Exception as e:
+                print(f"CacheVistas Error precargando '{vista}': {e}"); traceback.print_exc()
+        with self._lock:
+            self.precargadas += cargadas
+        print(f"CacheVistas: {cargadas} de {len(vistas)} vistas precargadas.")
+        return cargadas
+
+    def precargar_en_segundo_plano(self, dir_html, vistas=VISTAS_PRECARGA):
+        """Lanza la precarga en un hilo (tras el login). No hace nada si ya hay una en curso."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive(): return
+            self._hilo = threading.Thread(target=self.precargar, args=(dir_html, vistas),
+                                          name="precarga-vistas", daemon=True)
+            self._hilo.start()
+
+    def vaciar(self):
+        with self._lock:
+            self._vistas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'vistas': len(self._vistas),
+                'bytes': sum(len(entrada[3]) for entrada in self._vistas.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'recargas': self.recargas,
+                'precargadas': self.precargadas,
+                'frio_ms': self._ms_frio.resumen(),
+                'caliente_ms': self._ms_caliente.resumen(),
+            }
+
+
+CACHE_VISTAS = CacheVistas()